@@ -70,6 +70,89 @@ FRONTEND_URL = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
 # Generate with: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
 ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY', None)
 
+# Optional shared cache tier, e.g. redis://localhost:6379/0 (needs the `redis` package)
+REDIS_URL = os.environ.get('REDIS_URL', '')
+
+# Auth user cache - slim user docs resolved from JWTs
+USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', '15'))
+USER_CACHE_SHARED_TTL_SECONDS = int(os.environ.get('USER_CACHE_SHARED_TTL_SECONDS', '60'))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '10000'))
+
+# Password hashing runs in a bounded thread pool so bcrypt never blocks the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+
+# Auth rate limits (attempts per window)
+AUTH_RATE_LIMIT_WINDOW_SECONDS = int(os.environ.get('AUTH_RATE_LIMIT_WINDOW_SECONDS', '60'))
+AUTH_RATE_LIMIT_PER_IP = int(os.environ.get('AUTH_RATE_LIMIT_PER_IP', '20'))
+AUTH_RATE_LIMIT_PER_EMAIL = int(os.environ.get('AUTH_RATE_LIMIT_PER_EMAIL', '5'))
+
+# Decrypted BYO API keys are cached briefly to skip Fernet + Mongo per generation
+BYO_KEY_CACHE_TTL_SECONDS = int(os.environ.get('BYO_KEY_CACHE_TTL_SECONDS', '60'))
+
+# LLM gateway: pooled provider connections, in-flight requests per provider, and
+# identical temperature-0 calls by the same user answered from cache for
+# LLM_CACHE_TTL_SECONDS (0 disables)
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', '180'))
+LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', '100'))
+LLM_MAX_CONCURRENCY_PER_PROVIDER = int(os.environ.get('LLM_MAX_CONCURRENCY_PER_PROVIDER', '32'))
+LLM_DEFAULT_MAX_TOKENS = int(os.environ.get('LLM_DEFAULT_MAX_TOKENS', '16000'))
+LLM_CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL_SECONDS', '300'))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '500'))
+# Admin provider enable/block flags are re-read at most this often
+PROVIDER_HEALTH_TTL_SECONDS = int(os.environ.get('PROVIDER_HEALTH_TTL_SECONDS', '30'))
+
+# Pricing: the active price table is re-read this often; per-user daily usage
+# rollups are kept this long
+PRICE_TABLE_CACHE_SECONDS = int(os.environ.get('PRICE_TABLE_CACHE_SECONDS', '300'))
+USAGE_ROLLUP_RETENTION_DAYS = int(os.environ.get('USAGE_ROLLUP_RETENTION_DAYS', '400'))
+
+# Project chat history is shown to users, so it is kept unless this is set (days; 0 = forever)
+CHAT_MESSAGE_RETENTION_DAYS = int(os.environ.get('CHAT_MESSAGE_RETENTION_DAYS', '0'))
+
+# Planner steps without pending dependencies run concurrently, at most this many per user
+PLAN_STEP_CONCURRENCY = int(os.environ.get('PLAN_STEP_CONCURRENCY', '3'))
+
+# Agent jobs run detached from requests: concurrent jobs per user, and how often
+# each worker heartbeats its running jobs (and picks up stop requests)
+AGENT_MAX_JOBS_PER_USER = int(os.environ.get('AGENT_MAX_JOBS_PER_USER', '2'))
+AGENT_JOB_HEARTBEAT_SECONDS = float(os.environ.get('AGENT_JOB_HEARTBEAT_SECONDS', '5'))
+
+# Agent conversation memory (tokens are estimated at ~4 characters each)
+AGENT_MEMORY_TOKEN_BUDGET = int(os.environ.get('AGENT_MEMORY_TOKEN_BUDGET', '3000'))
+AGENT_MEMORY_SUMMARY_TOKENS = int(os.environ.get('AGENT_MEMORY_SUMMARY_TOKENS', '500'))
+AGENT_MEMORY_TURN_MAX_TOKENS = int(os.environ.get('AGENT_MEMORY_TURN_MAX_TOKENS', '1000'))
+AGENT_MEMORY_MAX_CONVERSATIONS = int(os.environ.get('AGENT_MEMORY_MAX_CONVERSATIONS', '1000'))
+AGENT_MEMORY_IDLE_SECONDS = int(os.environ.get('AGENT_MEMORY_IDLE_SECONDS', '1800'))
+
+# Browser agent research: search backend ("searxng", "fixture" or empty to disable)
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'searxng' if os.environ.get('SEARXNG_URL') else '')
+SEARXNG_URL = os.environ.get('SEARXNG_URL', '')
+# JSON file of canned results for SEARCH_BACKEND=fixture (local development and tests)
+SEARCH_FIXTURE_PATH = os.environ.get('SEARCH_FIXTURE_PATH', '')
+
+# Browser agent page fetching
+WEB_FETCH_TIMEOUT_SECONDS = float(os.environ.get('WEB_FETCH_TIMEOUT_SECONDS', '10'))
+WEB_FETCH_MAX_CONCURRENCY = int(os.environ.get('WEB_FETCH_MAX_CONCURRENCY', '10'))
+WEB_FETCH_PER_HOST = int(os.environ.get('WEB_FETCH_PER_HOST', '2'))
+WEB_FETCH_CACHE_TTL_SECONDS = int(os.environ.get('WEB_FETCH_CACHE_TTL_SECONDS', '900'))
+WEB_FETCH_USER_AGENT = os.environ.get('WEB_FETCH_USER_AGENT', 'NirmanBot/1.0')
+
+# Coder agent code execution: runs generated code as local subprocesses, so it is opt-in
+CODE_EXEC_ENABLED = os.environ.get('CODE_EXEC_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+CODE_EXEC_WORKERS = int(os.environ.get('CODE_EXEC_WORKERS', '4'))
+CODE_EXEC_WARM_PYTHON = int(os.environ.get('CODE_EXEC_WARM_PYTHON', '2'))
+CODE_EXEC_PER_USER = int(os.environ.get('CODE_EXEC_PER_USER', '1'))
+CODE_EXEC_MAX_QUEUED_PER_USER = int(os.environ.get('CODE_EXEC_MAX_QUEUED_PER_USER', '5'))
+# Limits per run (wall clock, CPU, memory); compiling go/rust gets its own wall clock
+CODE_EXEC_TIMEOUT_SECONDS = float(os.environ.get('CODE_EXEC_TIMEOUT_SECONDS', '10'))
+CODE_EXEC_CPU_SECONDS = int(os.environ.get('CODE_EXEC_CPU_SECONDS', '5'))
+CODE_EXEC_MEMORY_MB = int(os.environ.get('CODE_EXEC_MEMORY_MB', '256'))
+CODE_EXEC_COMPILE_TIMEOUT_SECONDS = float(os.environ.get('CODE_EXEC_COMPILE_TIMEOUT_SECONDS', '60'))
+# Scratch directories for runs (default: the system temp dir)
+CODE_EXEC_WORKDIR = os.environ.get('CODE_EXEC_WORKDIR', '')
+# Unprivileged user (name or uid) runs execute as; required, and the API must start as root to switch to it
+CODE_EXEC_USER = os.environ.get('CODE_EXEC_USER', '')
+
 # Plans Configuration
 PLANS = {
     "free": {
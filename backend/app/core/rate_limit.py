@@ -0,0 +1,61 @@
+"""
+In-process sliding-window rate limiter
+
+Used to cap expensive unauthenticated endpoints (login/register run bcrypt).
+Limits are per worker process; behind N workers the effective limit is N times
+the configured value, which is fine for the CPU-abuse case this guards.
+"""
+
+import time
+from collections import deque
+from typing import Dict, Deque
+
+from fastapi import HTTPException, status
+
+
+class SlidingWindowRateLimiter:
+    """Allow at most `max_attempts` hits per key within `window_seconds`."""
+
+    def __init__(self, max_attempts: int, window_seconds: int, max_keys: int = 100_000):
+        self.max_attempts = max_attempts
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._hits: Dict[str, Deque[float]] = {}
+
+    def _prune(self, key: str, now: float) -> Deque[float]:
+        hits = self._hits.get(key)
+        if hits is None:
+            if len(self._hits) >= self.max_keys:
+                self._evict_idle(now)
+            hits = self._hits[key] = deque()
+        cutoff = now - self.window_seconds
+        while hits and hits[0] <= cutoff:
+            hits.popleft()
+        return hits
+
+    def _evict_idle(self, now: float):
+        """Drop keys with no hits inside the window to bound memory."""
+        cutoff = now - self.window_seconds
+        for key in [k for k, hits in self._hits.items() if not hits or hits[-1] <= cutoff]:
+            del self._hits[key]
+
+    def hit(self, key: str):
+        """
+        Record an attempt for `key`, raising 429 if the window is full.
+        Rejected attempts are not recorded, so a blocked client recovers
+        as soon as its oldest attempt leaves the window.
+        """
+        now = time.monotonic()
+        hits = self._prune(key, now)
+        if len(hits) >= self.max_attempts:
+            retry_after = max(1, int(hits[0] + self.window_seconds - now) + 1)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many attempts, please try again later",
+                headers={"Retry-After": str(retry_after)},
+            )
+        hits.append(now)
+
+    def reset(self, key: str):
+        """Forget a key (e.g. after a successful login)."""
+        self._hits.pop(key, None)
@@ -1,12 +1,14 @@
 from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import jwt
 import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
 
-from app.core.config import JWT_SECRET, JWT_ALGORITHM, JWT_EXPIRATION_HOURS
-from app.db.mongo import db
+from app.core.config import JWT_SECRET, JWT_ALGORITHM, JWT_EXPIRATION_HOURS, PASSWORD_HASH_WORKERS
+from app.core.user_cache import get_cached_user
 
 security = HTTPBearer(auto_error=False)
 
@@ -16,10 +18,23 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
-def create_access_token(user_id: str) -> str:
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event
+# loop while capping how many cores login/register can burn at once.
+_password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+async def hash_password_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_pool, hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_pool, verify_password, plain_password, hashed_password)
+
+def create_access_token(user_id: str, session_version: int = 0) -> str:
     expire = datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
     payload = {
         "sub": user_id,
+        "sv": session_version,
         "exp": expire,
         "iat": datetime.now(timezone.utc)
     }
@@ -33,7 +48,10 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         user_id = payload.get("sub")
         if not user_id:
             return None
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        user = await get_cached_user(user_id)
+        # Tokens issued before an admin force-logout carry an older version
+        if user and payload.get("sv", 0) != user.get("session_version", 0):
+            return None
         return user
     except jwt.ExpiredSignatureError:
         return None
@@ -0,0 +1,161 @@
+"""
+Auth user cache
+
+Every authenticated request resolves its JWT to a user document. This keeps
+a slim projection of recently seen users in process memory (short TTL) and,
+when REDIS_URL is set and the `redis` package is installed, in a shared tier
+so all workers benefit. Writes that change what auth exposes must call
+`invalidate_user`; with the shared tier the invalidation is broadcast so
+other workers drop their local copy too.
+"""
+
+import asyncio
+import json
+from typing import Optional, Dict, Any
+
+from cachetools import TTLCache
+
+from app.core.config import (
+    REDIS_URL, USER_CACHE_TTL_SECONDS, USER_CACHE_SHARED_TTL_SECONDS, USER_CACHE_MAX_ENTRIES
+)
+from app.db.mongo import db
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # optional shared tier
+    redis_asyncio = None
+
+
+# Fields request handlers read from the authenticated user. Everything else
+# (password_hash, bank details, ...) stays in Mongo.
+AUTH_USER_FIELDS = (
+    "id", "email", "name", "avatar_url", "is_admin", "role",
+    "plan", "plan_expiry", "wallet_balance", "referral_code", "referred_by",
+    "generations_used", "generations_limit", "max_projects",
+    "is_banned", "session_version",
+    "personalization_enabled", "global_learning_enabled",
+    "created_at",
+)
+AUTH_USER_PROJECTION = {"_id": 0, **{field: 1 for field in AUTH_USER_FIELDS}}
+
+_SHARED_KEY_PREFIX = "nirman:auth-user:"
+_INVALIDATE_CHANNEL = "nirman:auth-user:invalidate"
+
+_local: TTLCache = TTLCache(maxsize=USER_CACHE_MAX_ENTRIES, ttl=USER_CACHE_TTL_SECONDS)
+_shared = None
+_listener_task: Optional[asyncio.Task] = None
+
+
+def _shared_client():
+    """Lazily connect the shared tier, or return None when it is disabled."""
+    global _shared
+    if _shared is None and REDIS_URL and redis_asyncio is not None:
+        _shared = redis_asyncio.from_url(REDIS_URL, decode_responses=True)
+    return _shared
+
+
+# =============================================================================
+# READ PATH
+# =============================================================================
+
+async def get_cached_user(user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Return the slim user doc for `user_id`, checking local memory, then the
+    shared tier, then Mongo. Callers get a copy they are free to mutate.
+    """
+    user = _local.get(user_id)
+    if user is not None:
+        return dict(user)
+
+    shared = _shared_client()
+    if shared is not None:
+        try:
+            raw = await shared.get(_SHARED_KEY_PREFIX + user_id)
+            if raw:
+                user = json.loads(raw)
+                _local[user_id] = user
+                return dict(user)
+        except Exception as e:
+            print(f"[UserCache] Shared tier read failed: {e}")
+
+    user = await db.users.find_one({"id": user_id}, AUTH_USER_PROJECTION)
+    if not user:
+        return None
+
+    _local[user_id] = user
+    if shared is not None:
+        try:
+            await shared.set(
+                _SHARED_KEY_PREFIX + user_id,
+                json.dumps(user, default=str),
+                ex=USER_CACHE_SHARED_TTL_SECONDS,
+            )
+        except Exception as e:
+            print(f"[UserCache] Shared tier write failed: {e}")
+    return dict(user)
+
+
+# =============================================================================
+# INVALIDATION
+# =============================================================================
+
+async def invalidate_user(user_id: str):
+    """Drop a user from every cache tier after a write to their document."""
+    _local.pop(user_id, None)
+
+    shared = _shared_client()
+    if shared is not None:
+        try:
+            await shared.delete(_SHARED_KEY_PREFIX + user_id)
+            await shared.publish(_INVALIDATE_CHANNEL, user_id)
+        except Exception as e:
+            print(f"[UserCache] Shared tier invalidation failed: {e}")
+
+
+def clear_user_cache():
+    """Drop every locally cached user (tests, admin bulk edits)."""
+    _local.clear()
+
+
+async def start_user_cache_listener():
+    """
+    Subscribe to invalidations from other workers. No-op without the shared
+    tier, in which case local entries simply age out after the TTL.
+    """
+    global _listener_task
+
+    shared = _shared_client()
+    if shared is None or _listener_task is not None:
+        return
+
+    async def listen():
+        pubsub = shared.pubsub()
+        await pubsub.subscribe(_INVALIDATE_CHANNEL)
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _local.pop(message["data"], None)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await pubsub.unsubscribe(_INVALIDATE_CHANNEL)
+
+    _listener_task = asyncio.create_task(listen())
+    print("[UserCache] Listening for shared invalidations")
+
+
+async def stop_user_cache_listener():
+    """Stop the invalidation listener and close the shared client."""
+    global _listener_task, _shared
+
+    if _listener_task:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
+
+    if _shared is not None:
+        await _shared.aclose()
+        _shared = None
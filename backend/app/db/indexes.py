@@ -0,0 +1,317 @@
+"""
+Index manifest and bootstrapper
+
+Declares the indexes behind every hot query shape in the app and creates
+them idempotently. Runs from the FastAPI lifespan, or by hand:
+
+    python -m app.db.indexes            # create missing indexes
+    python -m app.db.indexes --report   # list missing / unused / unmanaged
+"""
+
+import asyncio
+import sys
+from typing import Dict, List, Any
+
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from app.db.mongo import db
+from app.services.retention import RETENTION_POLICIES, RETENTION_DATE_FIELD, ensure_ttl_indexes
+
+
+def _idx(name: str, keys, **options) -> IndexModel:
+    """Build an IndexModel with an explicit, stable name."""
+    if isinstance(keys, str):
+        keys = [(keys, ASCENDING)]
+    return IndexModel(keys, name=name, **options)
+
+
+# =============================================================================
+# MANIFEST
+# =============================================================================
+# One entry per query shape that runs on a request path. Names are stable so
+# re-running the bootstrapper is a no-op.
+
+INDEX_MANIFEST: Dict[str, List[IndexModel]] = {
+    "users": [
+        _idx("id_unique", "id", unique=True),
+        _idx("email_unique", "email", unique=True),
+        _idx("referral_code", "referral_code", sparse=True),
+        _idx("plan_created_id", [("plan", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        _idx("created_id", [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "projects": [
+        _idx("id_unique", "id", unique=True),
+        _idx("user_updated_id", [("user_id", ASCENDING), ("updated_at", DESCENDING), ("id", DESCENDING)]),
+        _idx("updated_id", [("updated_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "project_files": [
+        _idx("project_path_unique", [("project_id", ASCENDING), ("path", ASCENDING)], unique=True),
+        _idx("project_revision", [("project_id", ASCENDING), ("revision", ASCENDING)]),
+    ],
+    "project_versions": [
+        _idx("project_version_unique", [("project_id", ASCENDING), ("version", DESCENDING)], unique=True),
+        _idx("project_kind_version", [("project_id", ASCENDING), ("kind", ASCENDING), ("version", DESCENDING)]),
+    ],
+    "chat_messages": [
+        _idx("project_created_id", [("project_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+        _idx("user_timestamp_id", [("user_id", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "build_jobs": [
+        _idx("id_unique", "id", unique=True),
+        _idx("user_created", [("user_id", ASCENDING), ("created_at", DESCENDING)]),
+        _idx("project_created", [("project_id", ASCENDING), ("created_at", DESCENDING)]),
+        _idx("status", "status"),
+    ],
+    "running_jobs": [
+        _idx("job_unique", "job_id", unique=True),
+        _idx("user_slot_unique", [("user_id", ASCENDING), ("slot", ASCENDING)], unique=True),
+        _idx("expires_at_ttl", "expires_at", expireAfterSeconds=0),
+    ],
+    "build_events": [
+        _idx("job_seq", [("job_id", ASCENDING), ("seq", ASCENDING)]),
+        _idx("job_timestamp", [("job_id", ASCENDING), ("timestamp", ASCENDING)]),
+    ],
+    "job_previews": [
+        _idx("job_unique", "job_id", unique=True),
+    ],
+    "jobs": [
+        _idx("id_unique", "id", unique=True),
+        _idx("status_created_id", [("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        _idx("created_id", [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "ai_runs": [
+        _idx("user_created", [("user_id", ASCENDING), ("created_at", DESCENDING)]),
+        # (created_at, id) doubles as the keyset-pagination order for /admin/ai-usage
+        _idx("created_id", [("created_at", DESCENDING), ("id", DESCENDING)]),
+        _idx("provider_created_id", [("provider", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "error_logs": [
+        _idx("created_id", [("created_at", DESCENDING), ("id", DESCENDING)]),
+        _idx("type_created_id", [("error_type", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "user_ai_keys": [
+        _idx("user_provider_unique", [("user_id", ASCENDING), ("provider", ASCENDING)], unique=True),
+    ],
+    "project_events": [
+        _idx("user_type_created", [("user_id", ASCENDING), ("event_type", ASCENDING), ("created_at", DESCENDING)]),
+        _idx("project_type_created", [("project_id", ASCENDING), ("event_type", ASCENDING), ("created_at", DESCENDING)]),
+        _idx("type_created", [("event_type", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    "spec_versions": [
+        _idx("project_version", [("project_id", ASCENDING), ("version", DESCENDING)]),
+    ],
+    "pattern_library": [
+        _idx("id_unique", "id", unique=True),
+        _idx("category_score", [("category", ASCENDING), ("success_score", DESCENDING)]),
+        _idx("updated_score", [("updated_at", ASCENDING), ("success_score", ASCENDING)]),
+    ],
+    "error_signatures": [
+        _idx("signature_unique", "signature_hash", unique=True),
+        _idx("occurrences", [("occurrence_count", DESCENDING)]),
+    ],
+    "user_preferences": [
+        _idx("user_unique", "user_id", unique=True),
+    ],
+    "deployments": [
+        _idx("project_created", [("project_id", ASCENDING), ("created_at", DESCENDING)]),
+        _idx("user_id", "user_id"),
+    ],
+    "purchases": [
+        _idx("id_unique", "id", unique=True),
+        _idx("user_status", [("user_id", ASCENDING), ("status", ASCENDING)]),
+        _idx("status_created_id", [("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        _idx("created_id", [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "wallet_transactions": [
+        _idx("user_created_id", [("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        _idx("user_type_created_id", [("user_id", ASCENDING), ("type", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        _idx("created_id", [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "withdrawals": [
+        _idx("id_unique", "id", unique=True),
+        _idx("user_status", [("user_id", ASCENDING), ("status", ASCENDING)]),
+        _idx("status_created_id", [("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        _idx("created_id", [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "pending_orders": [
+        _idx("order_user", [("order_id", ASCENDING), ("user_id", ASCENDING)]),
+    ],
+    "referrals": [
+        _idx("referrer_referee", [("referrer_id", ASCENDING), ("referee_id", ASCENDING)]),
+    ],
+    "llm_keys": [
+        _idx("id_unique", "id", unique=True),
+        _idx("user_id", "user_id"),
+    ],
+    "llm_key_usage": [
+        _idx("key_created", [("key_id", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    "credit_transactions": [
+        _idx("key_created", [("key_id", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    "support_tickets": [
+        _idx("id_unique", "id", unique=True),
+        _idx("user_created", [("user_id", ASCENDING), ("created_at", DESCENDING)]),
+        _idx("status_priority", [("status", ASCENDING), ("priority", DESCENDING), ("created_at", ASCENDING)]),
+    ],
+    "audit_logs": [
+        _idx("created_id", [("created_at", DESCENDING), ("id", DESCENDING)]),
+        _idx("action_created_id", [("action", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        _idx("admin_created_id", [("admin_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "user_integrations": [
+        _idx("user_type", [("user_id", ASCENDING), ("integration_type", ASCENDING)]),
+    ],
+    "agent_conversations": [
+        _idx("id_unique", "id", unique=True),
+        _idx("user_updated_id", [("user_id", ASCENDING), ("updated_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "conversations": [
+        _idx("id_unique", "id", unique=True),
+        _idx("user_updated_id", [("user_id", ASCENDING), ("updated_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "coupons": [
+        _idx("code_unique", "code", unique=True),
+        _idx("id_unique", "id", unique=True),
+    ],
+    "plans": [
+        _idx("id_unique", "id", unique=True),
+    ],
+    "oauth_states": [
+        _idx("state", "state"),
+    ],
+    "usage_quotas": [
+        _idx("expires_at_ttl", "expires_at", expireAfterSeconds=0),
+    ],
+    "usage_rollups": [
+        _idx("user_day", [("user_id", ASCENDING), ("day", ASCENDING)]),
+        _idx("expires_at_ttl", "expires_at", expireAfterSeconds=0),
+    ],
+    "price_tables": [
+        _idx("version_unique", "version", unique=True),
+        _idx("effective_at", [("effective_at", DESCENDING)]),
+    ],
+    "admin_rollups": [
+        _idx("period_bucket", [("period", ASCENDING), ("bucket", ASCENDING)]),
+        _idx("expires_at_ttl", "expires_at", expireAfterSeconds=0),
+    ],
+    "daily_summaries": [
+        _idx("collection_day", [("collection", ASCENDING), ("day", ASCENDING)]),
+    ],
+}
+
+
+def _managed_names(collection: str) -> set:
+    """Index names the app owns on a collection (manifest + TTL + _id)."""
+    names = {model.document["name"] for model in INDEX_MANIFEST.get(collection, [])}
+    names.add("_id_")
+    if collection in RETENTION_POLICIES:
+        names.add(f"ttl_{RETENTION_DATE_FIELD}")
+    return names
+
+
+# =============================================================================
+# BOOTSTRAP
+# =============================================================================
+
+async def ensure_indexes(database=None, manifest: Dict[str, List[IndexModel]] = None) -> Dict[str, Any]:
+    """
+    Create every index in the manifest that does not exist yet.
+
+    Safe to run on every startup: existing indexes with the same name are
+    skipped, and a failure on one index (e.g. duplicates blocking a unique
+    index) is reported without stopping the rest.
+    """
+    database = database if database is not None else db
+    manifest = manifest or INDEX_MANIFEST
+    report: Dict[str, Any] = {"created": [], "existing": [], "failed": []}
+
+    for collection, models in manifest.items():
+        existing = await database[collection].index_information()
+
+        for model in models:
+            name = model.document["name"]
+            label = f"{collection}.{name}"
+
+            if name in existing:
+                wanted = [(field, int(direction)) for field, direction in model.document["key"].items()]
+                live = [(field, int(direction)) for field, direction in existing[name]["key"]]
+                if live != wanted:
+                    report["failed"].append({"index": label, "error": "key mismatch with existing index"})
+                else:
+                    report["existing"].append(label)
+                continue
+
+            try:
+                await database[collection].create_indexes([model])
+                report["created"].append(label)
+            except OperationFailure as e:
+                report["failed"].append({"index": label, "error": str(e)})
+
+    if database is db:
+        await ensure_ttl_indexes()
+
+    if report["created"]:
+        print(f"[Indexes] Created {len(report['created'])} indexes")
+    for failure in report["failed"]:
+        print(f"[Indexes] Could not create {failure['index']}: {failure['error']}")
+    return report
+
+
+async def report_indexes(database=None) -> Dict[str, Any]:
+    """
+    Compare the live indexes with the manifest.
+
+    - missing:   in the manifest but not on the server
+    - unused:    on the server with zero accesses since the last restart
+    - unmanaged: on the server but not declared anywhere in the app
+    """
+    database = database if database is not None else db
+    report: Dict[str, Any] = {"missing": [], "unused": [], "unmanaged": []}
+
+    existing_collections = set(await database.list_collection_names())
+
+    for collection in sorted(set(INDEX_MANIFEST) | existing_collections):
+        if collection.startswith("system."):
+            continue
+
+        managed = _managed_names(collection)
+        live = await database[collection].index_information() if collection in existing_collections else {}
+
+        for name in sorted(managed - set(live) - {"_id_"}):
+            report["missing"].append(f"{collection}.{name}")
+
+        for name in sorted(set(live) - managed):
+            report["unmanaged"].append(f"{collection}.{name}")
+
+        if not live:
+            continue
+
+        stats = await database[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+        for stat in stats:
+            if stat["name"] != "_id_" and stat.get("accesses", {}).get("ops", 0) == 0:
+                report["unused"].append(f"{collection}.{stat['name']}")
+
+    return report
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+async def _main(argv: List[str]):
+    if "--report" in argv:
+        report = await report_indexes()
+        for section in ("missing", "unused", "unmanaged"):
+            print(f"{section.upper()} ({len(report[section])})")
+            for name in report[section]:
+                print(f"  {name}")
+        return
+
+    report = await ensure_indexes()
+    print(f"created={len(report['created'])} existing={len(report['existing'])} failed={len(report['failed'])}")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
@@ -18,6 +18,13 @@ from app.core.config import APP_VERSION, APP_NAME, FRONTEND_URL
 
 # Import aggregator for background jobs
 from app.services.aggregator_jobs import start_aggregator_scheduler, stop_aggregator_scheduler
+from app.db.indexes import ensure_indexes
+from app.services.pagination import NEXT_CURSOR_HEADER
+from app.core.user_cache import start_user_cache_listener, stop_user_cache_listener
+from app.services.web_research import close_client as close_web_client
+from app.services.code_runner import start_code_runner, stop_code_runner
+from app.services.job_registry import start_job_watcher, stop_job_watcher
+from app.services.ai_router import close_llm_client
 
 
 # Lifespan for startup/shutdown events
@@ -25,11 +32,23 @@ from app.services.aggregator_jobs import start_aggregator_scheduler, stop_aggreg
 async def lifespan(app: FastAPI):
     # Startup: Start background learning jobs
     print(f"🚀 Starting {APP_NAME} API v{APP_VERSION} with Self-Learning System...")
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        print(f"[Indexes] Index bootstrap failed: {e}")
     await start_aggregator_scheduler()
+    await start_user_cache_listener()
+    await start_code_runner()
+    await start_job_watcher()
     yield
     # Shutdown: Stop background jobs
     print(f"🛑 Shutting down {APP_NAME} API...")
+    await stop_job_watcher()
     await stop_aggregator_scheduler()
+    await stop_user_cache_listener()
+    await close_web_client()
+    await close_llm_client()
+    await stop_code_runner()
 
 
 # Create app
@@ -52,6 +71,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # Include routers with /api prefix
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, ConfigDict
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional, List, Dict
 from datetime import datetime
 
 class AIRun(BaseModel):
@@ -16,7 +16,9 @@ class AIRun(BaseModel):
     status: str = "success"  # success, failed
     error_message: Optional[str] = None
     cost_estimate: float = 0.0
+    price_version: Optional[str] = None
     is_byo_key: bool = False
+    llm_key_id: Optional[str] = None
     created_at: str
 
 class AIProviderConfig(BaseModel):
@@ -44,3 +46,12 @@ class UserAIKey(BaseModel):
 class UserAIKeyCreate(BaseModel):
     provider: str
     api_key: str
+
+class ModelPrice(BaseModel):
+    input: float = Field(ge=0)  # USD per 1K tokens
+    output: float = Field(ge=0)
+
+class PriceTableCreate(BaseModel):
+    prices: Dict[str, Dict[str, ModelPrice]]  # provider -> model -> price; "*" matches any
+    version: Optional[str] = None
+    effective_at: Optional[str] = None  # ISO timestamp, default now
@@ -12,6 +12,7 @@ class BuildStatus(str, Enum):
     """Status of a build job"""
     QUEUED = "queued"
     PLANNING = "planning"
+    RUNNING = "running"
     EXECUTING = "executing"
     COMPLETED = "completed"
     FAILED = "failed"
@@ -40,6 +41,7 @@ class EventType(str, Enum):
     AGENT_SELECTED = "agent_selected"
     AGENT_THINKING = "agent_thinking"
     AGENT_RESPONSE = "agent_response"
+    AI_MESSAGE = "ai_message"
     
     # Planning events
     PLAN_CREATED = "plan_created"
@@ -69,6 +69,7 @@ class BuildEventType(str, Enum):
     JOB_STARTED = "job_started"
     JOB_COMPLETED = "job_completed"
     JOB_FAILED = "job_failed"
+    JOB_CANCELLED = "job_cancelled"
     
     # Agent events
     AGENT_SELECTED = "agent_selected"
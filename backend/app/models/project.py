@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 from app.core.config import DEFAULT_AI_PROVIDER
 
@@ -13,6 +13,23 @@ class Project(BaseModel):
     html_code: Optional[str] = None
     css_code: Optional[str] = None
     js_code: Optional[str] = None
+    code_size: Optional[int] = None
+    code_hash: Optional[str] = None
+    version: int = 0
+    created_at: str
+    updated_at: str
+
+class ProjectSummary(BaseModel):
+    """List view of a project - metadata only, code is fetched per project"""
+    model_config = ConfigDict(populate_by_name=True)
+    id: str
+    user_id: str
+    name: str
+    description: Optional[str] = None
+    framework: str = "react"
+    code_size: Optional[int] = None
+    code_hash: Optional[str] = None
+    version: int = 0
     created_at: str
     updated_at: str
 
@@ -28,6 +45,10 @@ class ProjectUpdate(BaseModel):
     css_code: Optional[str] = None
     js_code: Optional[str] = None
 
+class ProjectFilesUpdate(BaseModel):
+    """Batch of file changes: path -> new content, or null to delete"""
+    files: Dict[str, Optional[str]]
+
 class ChatMessage(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
     id: str
@@ -1,15 +1,28 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
 from datetime import datetime, timezone, timedelta
 from typing import List, Optional
+import time
 import uuid
 
+from pymongo.errors import DuplicateKeyError
+
 from app.core.security import require_admin, require_auth
 from app.db.mongo import db
+from app.core.user_cache import invalidate_user
 from app.models.user import AdminUserUpdate
 from app.models.coupon import CouponCreate, CouponUpdate
 from app.models.plan import PlanCreate, PlanUpdate
+from app.models.ai_usage import PriceTableCreate
 from app.core.config import PLANS
 from app.services.utils import get_user_generations_limit
+from app.services.admin_rollups import get_dashboard_stats, record_refund
+from app.services.pagination import fetch_page, keyset_filter, keyset_sort, page_from_rows
+from app.services.ai_router import get_llm_metrics, invalidate_provider_health
+from app.services.pricing import get_price_table, list_price_tables, publish_price_table
+from app.services.admin_enrichment import enrich_users, attach_users, docs_by_id, latest_by
+from app.services.retention import RETENTION_DATE_FIELD
+from app.services.project_store import PROJECT_SUMMARY_PROJECTION
+from app.services.csv_export import csv_export_response, DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_DAYS
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -36,113 +49,8 @@ async def create_audit_log(admin: dict, action: str, target_type: str, target_id
 # ==================== DASHBOARD STATS ====================
 @router.get("/stats")
 async def get_admin_stats(admin: dict = Depends(require_admin)):
-    now = datetime.now(timezone.utc)
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    week_ago = now - timedelta(days=7)
-    month_ago = now - timedelta(days=30)
-    day_ago = now - timedelta(hours=24)
-    
-    # User stats
-    total_users = await db.users.count_documents({})
-    pro_users = await db.users.count_documents({"plan": {"$in": ["pro", "enterprise"]}})
-    today_signups = await db.users.count_documents({"created_at": {"$gte": today_start.isoformat()}})
-    week_signups = await db.users.count_documents({"created_at": {"$gte": week_ago.isoformat()}})
-    month_signups = await db.users.count_documents({"created_at": {"$gte": month_ago.isoformat()}})
-    
-    # Revenue stats
-    purchases = await db.purchases.find({"status": "completed"}, {"_id": 0}).to_list(10000)
-    total_revenue = sum(p.get('amount', 0) for p in purchases)
-    
-    # MRR calculation (active pro/enterprise users)
-    active_subscriptions = await db.users.find({
-        "plan": {"$in": ["pro", "enterprise"]},
-        "plan_expiry": {"$gte": now.isoformat()}
-    }).to_list(10000)
-    mrr = sum(
-        PLANS.get(u.get('plan', 'free'), {}).get('price_monthly', 0) 
-        for u in active_subscriptions
-    )
-    
-    # Churn (cancelled in last 30 days)
-    churned = await db.purchases.count_documents({
-        "status": "cancelled",
-        "created_at": {"$gte": month_ago.isoformat()}
-    })
-    
-    # Project stats
-    total_projects = await db.projects.count_documents({})
-    total_deployments = await db.deployments.count_documents({})
-    
-    # AI Jobs stats
-    ai_jobs_running = await db.jobs.count_documents({"status": "running"})
-    ai_jobs_failed = await db.jobs.count_documents({"status": "failed"})
-    ai_jobs_queued = await db.jobs.count_documents({"status": "queued"})
-    
-    # AI Usage stats (last 24h)
-    ai_runs_24h = await db.ai_runs.find({"created_at": {"$gte": day_ago.isoformat()}}).to_list(10000)
-    total_ai_runs = len(ai_runs_24h)
-    failed_ai_runs = len([r for r in ai_runs_24h if r.get("status") == "failed"])
-    ai_error_rate = (failed_ai_runs / total_ai_runs * 100) if total_ai_runs > 0 else 0
-    total_ai_cost = sum(r.get('cost_estimate', 0) for r in ai_runs_24h)
-    
-    # Error stats (last 24h)
-    errors_24h = await db.error_logs.find({"created_at": {"$gte": day_ago.isoformat()}}).to_list(1000)
-    error_count = len(errors_24h)
-    
-    # Top errors
-    error_types = {}
-    for e in errors_24h:
-        err_type = e.get('error_type', 'Unknown')
-        error_types[err_type] = error_types.get(err_type, 0) + 1
-    top_errors = sorted(error_types.items(), key=lambda x: x[1], reverse=True)[:5]
-    
-    # Plan distribution
-    plan_distribution = {
-        "free": await db.users.count_documents({"plan": "free"}),
-        "pro": await db.users.count_documents({"plan": "pro"}),
-        "enterprise": await db.users.count_documents({"plan": "enterprise"})
-    }
-    
-    # Support tickets
-    open_tickets = await db.support_tickets.count_documents({"status": {"$in": ["open", "in_progress"]}})
-    
-    return {
-        "users": {
-            "total": total_users,
-            "pro": pro_users,
-            "today_signups": today_signups,
-            "week_signups": week_signups,
-            "month_signups": month_signups,
-            "plan_distribution": plan_distribution
-        },
-        "revenue": {
-            "total": total_revenue,
-            "mrr": mrr,
-            "churned_30d": churned
-        },
-        "projects": {
-            "total": total_projects,
-            "deployments": total_deployments
-        },
-        "ai_jobs": {
-            "running": ai_jobs_running,
-            "failed": ai_jobs_failed,
-            "queued": ai_jobs_queued
-        },
-        "ai_usage_24h": {
-            "total_runs": total_ai_runs,
-            "failed_runs": failed_ai_runs,
-            "error_rate": round(ai_error_rate, 2),
-            "total_cost": round(total_ai_cost, 4)
-        },
-        "errors_24h": {
-            "count": error_count,
-            "top_errors": [{"type": t, "count": c} for t, c in top_errors]
-        },
-        "support": {
-            "open_tickets": open_tickets
-        }
-    }
+    # Served from materialized rollups - see app/services/admin_rollups.py
+    return await get_dashboard_stats()
 
 # ==================== USERS MANAGEMENT ====================
 @router.get("/users")
@@ -150,7 +58,7 @@ async def get_admin_users(
     admin: dict = Depends(require_admin),
     search: str = None,
     plan: str = None,
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 50
 ):
     query = {}
@@ -162,21 +70,17 @@ async def get_admin_users(
         ]
     if plan:
         query["plan"] = plan
+    limit = max(1, min(limit, 200))
     
-    users = await db.users.find(
-        query,
-        {"_id": 0, "password_hash": 0}
-    ).skip(skip).limit(limit).to_list(limit)
+    users, next_cursor = await fetch_page(db.users, query, cursor, limit, {"_id": 0, "password_hash": 0})
     
-    # Enrich with additional data
-    for user in users:
-        user["projects_count"] = await db.projects.count_documents({"user_id": user["id"]})
-        user["deployments_count"] = await db.deployments.count_documents({"user_id": user["id"]})
-        # Calculate total revenue from user
-        purchases = await db.purchases.find({"user_id": user["id"], "status": "completed"}).to_list(100)
-        user["total_revenue"] = sum(p.get("amount", 0) for p in purchases)
+    # Counts and revenue for the whole page in one aggregation each
+    await enrich_users(users)
     
-    return {"users": users, "total": await db.users.count_documents(query)}
+    response = {"users": users, "next_cursor": next_cursor}
+    if not cursor:
+        response["total"] = await db.users.count_documents(query)
+    return response
 
 @router.get("/users/{user_id}")
 async def get_admin_user_detail(user_id: str, admin: dict = Depends(require_admin)):
@@ -185,7 +89,7 @@ async def get_admin_user_detail(user_id: str, admin: dict = Depends(require_admi
         raise HTTPException(status_code=404, detail="User not found")
     
     # Get related data
-    user["projects"] = await db.projects.find({"user_id": user_id}, {"_id": 0}).to_list(100)
+    user["projects"] = await db.projects.find({"user_id": user_id}, PROJECT_SUMMARY_PROJECTION).to_list(100)
     user["deployments"] = await db.deployments.find({"user_id": user_id}, {"_id": 0}).to_list(100)
     user["purchases"] = await db.purchases.find({"user_id": user_id}, {"_id": 0}).to_list(100)
     user["wallet_transactions"] = await db.wallet_transactions.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(50)
@@ -228,6 +132,7 @@ async def update_admin_user(
     )
     
     await db.users.update_one({"id": user_id}, {"$set": update_dict})
+    await invalidate_user(user_id)
     return {"message": "User updated successfully"}
 
 @router.post("/users/{user_id}/ban")
@@ -237,6 +142,7 @@ async def ban_user(user_id: str, reason: str = None, request: Request = None, ad
         raise HTTPException(status_code=404, detail="User not found")
     
     await db.users.update_one({"id": user_id}, {"$set": {"is_banned": True, "banned_reason": reason}})
+    await invalidate_user(user_id)
     
     await create_audit_log(admin, "user_ban", "user", user_id, {"is_banned": False}, {"is_banned": True}, reason, request.client.host if request else None)
     
@@ -245,6 +151,7 @@ async def ban_user(user_id: str, reason: str = None, request: Request = None, ad
 @router.post("/users/{user_id}/unban")
 async def unban_user(user_id: str, request: Request = None, admin: dict = Depends(require_admin)):
     await db.users.update_one({"id": user_id}, {"$set": {"is_banned": False, "banned_reason": None}})
+    await invalidate_user(user_id)
     await create_audit_log(admin, "user_unban", "user", user_id, ip_address=request.client.host if request else None)
     return {"message": "User unbanned successfully"}
 
@@ -252,6 +159,7 @@ async def unban_user(user_id: str, request: Request = None, admin: dict = Depend
 async def force_logout_user(user_id: str, admin: dict = Depends(require_admin)):
     # Invalidate sessions by updating a session_version field
     await db.users.update_one({"id": user_id}, {"$inc": {"session_version": 1}})
+    await invalidate_user(user_id)
     await create_audit_log(admin, "force_logout", "user", user_id)
     return {"message": "User sessions invalidated"}
 
@@ -291,6 +199,7 @@ async def set_user_limits(
     
     if update:
         await db.users.update_one({"id": user_id}, {"$set": update})
+        await invalidate_user(user_id)
         await create_audit_log(admin, "set_limits", "user", user_id, new_value=update)
     
     return {"message": "User limits updated"}
@@ -312,6 +221,7 @@ async def extend_user_plan(user_id: str, days: int = 7, admin: dict = Depends(re
     
     new_expiry = (expiry_dt + timedelta(days=days)).isoformat()
     await db.users.update_one({"id": user_id}, {"$set": {"plan_expiry": new_expiry}})
+    await invalidate_user(user_id)
     
     await create_audit_log(admin, "extend_plan", "user", user_id, 
                           {"plan_expiry": current_expiry}, {"plan_expiry": new_expiry})
@@ -323,15 +233,19 @@ async def extend_user_plan(user_id: str, days: int = 7, admin: dict = Depends(re
 async def get_admin_purchases(
     admin: dict = Depends(require_admin),
     status: str = None,
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 50
 ):
     query = {}
     if status:
         query["status"] = status
+    limit = max(1, min(limit, 200))
     
-    purchases = await db.purchases.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    return {"purchases": purchases, "total": await db.purchases.count_documents(query)}
+    purchases, next_cursor = await fetch_page(db.purchases, query, cursor, limit)
+    response = {"purchases": purchases, "next_cursor": next_cursor}
+    if not cursor:
+        response["total"] = await db.purchases.count_documents(query)
+    return response
 
 @router.post("/purchases/{purchase_id}/refund")
 async def refund_purchase(purchase_id: str, reason: str = None, admin: dict = Depends(require_admin)):
@@ -344,9 +258,11 @@ async def refund_purchase(purchase_id: str, reason: str = None, admin: dict = De
         {"id": purchase["user_id"]},
         {"$inc": {"wallet_balance": purchase["amount"]}}
     )
+    await invalidate_user(purchase["user_id"])
     
     # Update purchase status
     await db.purchases.update_one({"id": purchase_id}, {"$set": {"status": "refunded", "refund_reason": reason}})
+    await record_refund(purchase["amount"])
     
     # Record transaction
     await db.wallet_transactions.insert_one({
@@ -366,25 +282,26 @@ async def refund_purchase(purchase_id: str, reason: str = None, admin: dict = De
 async def export_invoices(
     start_date: str = None,
     end_date: str = None,
+    gzip: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    chunk_days: int = DEFAULT_CHUNK_DAYS,
     admin: dict = Depends(require_admin)
 ):
-    query = {"status": "completed"}
-    if start_date:
-        query["created_at"] = {"$gte": start_date}
-    if end_date:
-        if "created_at" in query:
-            query["created_at"]["$lte"] = end_date
-        else:
-            query["created_at"] = {"$lte": end_date}
-    
-    purchases = await db.purchases.find(query, {"_id": 0}).to_list(10000)
-    
-    # Format as CSV
-    csv_lines = ["id,user_email,plan,billing_cycle,amount,coupon_code,coupon_discount,created_at"]
-    for p in purchases:
-        csv_lines.append(f"{p.get('id')},{p.get('user_email')},{p.get('plan')},{p.get('billing_cycle')},{p.get('amount')},{p.get('coupon_code','')},{p.get('coupon_discount',0)},{p.get('created_at')}")
-    
-    return {"csv_data": "\n".join(csv_lines), "total_records": len(purchases)}
+    """Completed purchases as a streamed CSV download (no row cap)."""
+    return csv_export_response("invoices", start_date, end_date, gzip, batch_size, chunk_days)
+
+@router.get("/export/{dataset}")
+async def export_dataset(
+    dataset: str,
+    start_date: str = None,
+    end_date: str = None,
+    gzip: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    chunk_days: int = DEFAULT_CHUNK_DAYS,
+    admin: dict = Depends(require_admin)
+):
+    """Streamed CSV export of invoices, ai_runs, wallet_transactions or audit_logs."""
+    return csv_export_response(dataset, start_date, end_date, gzip, batch_size, chunk_days)
 
 # ==================== COUPONS ====================
 @router.get("/coupons")
@@ -499,63 +416,151 @@ async def update_admin_plan(plan_id: str, update_data: PlanUpdate, admin: dict =
     return {"message": "Plan updated"}
 
 # ==================== AI USAGE & COSTS ====================
+# Bucket length of the ISO created_at string: "YYYY-MM-DDTHH" / "YYYY-MM-DD"
+AI_USAGE_SERIES_BUCKETS = {"hour": 13, "day": 10}
+
+
+def _ai_usage_pipeline(query: dict, bucket_len: int) -> list:
+    """One pass over the matching runs; every stat is a $facet branch."""
+    return [
+        {"$match": query},
+        {"$facet": {
+            "by_provider": [
+                {"$group": {"_id": {"$ifNull": ["$provider", "unknown"]}, "count": {"$sum": 1}}},
+            ],
+            "by_model": [
+                {"$group": {"_id": {"$ifNull": ["$model", "unknown"]}, "count": {"$sum": 1}}},
+            ],
+            "totals": [
+                {"$group": {
+                    "_id": None,
+                    "count": {"$sum": 1},
+                    "cost": {"$sum": {"$ifNull": ["$cost_estimate", 0]}},
+                    "tokens": {"$sum": {"$add": [
+                        {"$ifNull": ["$tokens_in", 0]},
+                        {"$ifNull": ["$tokens_out", 0]},
+                    ]}},
+                    "success": {"$sum": {"$cond": [{"$eq": ["$status", "success"]}, 1, 0]}},
+                    "byo": {"$sum": {"$cond": [{"$eq": ["$is_byo_key", True]}, 1, 0]}},
+                }},
+            ],
+            "series": [
+                {"$group": {
+                    "_id": {"$substrBytes": ["$created_at", 0, bucket_len]},
+                    "runs": {"$sum": 1},
+                    "cost": {"$sum": {"$ifNull": ["$cost_estimate", 0]}},
+                    "tokens": {"$sum": {"$add": [
+                        {"$ifNull": ["$tokens_in", 0]},
+                        {"$ifNull": ["$tokens_out", 0]},
+                    ]}},
+                    "failed": {"$sum": {"$cond": [{"$eq": ["$status", "success"]}, 0, 1]}},
+                }},
+                {"$sort": {"_id": 1}},
+            ],
+        }},
+    ]
+
+
 @router.get("/ai-usage")
 async def get_ai_usage(
     admin: dict = Depends(require_admin),
     provider: str = None,
     start_date: str = None,
-    skip: int = 0,
-    limit: int = 100
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    granularity: str = "day",
+    explain: bool = False
 ):
+    """
+    AI run log with aggregate stats.
+
+    `runs` is keyset-paginated on (created_at, id): pass the returned
+    `next_cursor` back as `cursor` for the next page. Stats are computed in
+    a single $facet aggregation so nothing but the result leaves Mongo.
+    `explain=true` adds pipeline timing and the query planner's summary.
+    """
+    if granularity not in AI_USAGE_SERIES_BUCKETS:
+        raise HTTPException(status_code=400, detail="granularity must be 'hour' or 'day'")
+    limit = max(1, min(limit, 500))
+
     query = {}
     if provider:
         query["provider"] = provider
     if start_date:
         query["created_at"] = {"$gte": start_date}
-    
-    runs = await db.ai_runs.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    # Aggregate stats
-    all_runs = await db.ai_runs.find(query, {"_id": 0}).to_list(100000)
-    
-    by_provider = {}
-    by_model = {}
-    total_cost = 0
-    total_tokens = 0
-    success_count = 0
-    fail_count = 0
-    byo_count = 0
-    
-    for r in all_runs:
-        prov = r.get("provider", "unknown")
-        model = r.get("model", "unknown")
-        
-        by_provider[prov] = by_provider.get(prov, 0) + 1
-        by_model[model] = by_model.get(model, 0) + 1
-        
-        total_cost += r.get("cost_estimate", 0)
-        total_tokens += r.get("tokens_in", 0) + r.get("tokens_out", 0)
-        
-        if r.get("status") == "success":
-            success_count += 1
-        else:
-            fail_count += 1
-        
-        if r.get("is_byo_key"):
-            byo_count += 1
-    
-    return {
+
+    runs, next_cursor = await fetch_page(db.ai_runs, query, cursor, limit, {"_id": 0, RETENTION_DATE_FIELD: 0})
+
+    pipeline = _ai_usage_pipeline(query, AI_USAGE_SERIES_BUCKETS[granularity])
+    started = time.perf_counter()
+    facets = (await db.ai_runs.aggregate(pipeline).to_list(1))[0]
+    aggregate_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    totals = facets["totals"][0] if facets["totals"] else {}
+    count = totals.get("count", 0)
+    success_count = totals.get("success", 0)
+
+    response = {
         "runs": runs,
-        "total": len(all_runs),
+        "next_cursor": next_cursor,
+        "total": count,
         "stats": {
-            "by_provider": by_provider,
-            "by_model": by_model,
-            "total_cost": round(total_cost, 4),
-            "total_tokens": total_tokens,
+            "by_provider": {row["_id"]: row["count"] for row in facets["by_provider"]},
+            "by_model": {row["_id"]: row["count"] for row in facets["by_model"]},
+            "total_cost": round(totals.get("cost", 0), 4),
+            "total_tokens": totals.get("tokens", 0),
             "success_count": success_count,
-            "fail_count": fail_count,
-            "byo_key_count": byo_count
+            "fail_count": count - success_count,
+            "byo_key_count": totals.get("byo", 0)
+        },
+        "series": [
+            {
+                "bucket": row["_id"],
+                "runs": row["runs"],
+                "cost": round(row["cost"], 4),
+                "tokens": row["tokens"],
+                "failed": row["failed"]
+            }
+            for row in facets["series"]
+        ],
+        "granularity": granularity
+    }
+
+    if explain:
+        plan = await db.command(
+            "explain",
+            {"aggregate": "ai_runs", "pipeline": pipeline, "cursor": {}},
+            verbosity="executionStats",
+        )
+        response["explain"] = {
+            "aggregate_ms": aggregate_ms,
+            "match_stage": _summarize_explain(plan),
         }
+
+    return response
+
+
+def _summarize_explain(plan: dict) -> dict:
+    """Pull the bits worth looking at out of an aggregate explain."""
+    stages = plan.get("stages") or []
+    cursor_stage = stages[0].get("$cursor", {}) if stages else plan
+    planner = cursor_stage.get("queryPlanner", {})
+    stats = cursor_stage.get("executionStats", {})
+
+    winning = planner.get("winningPlan", {})
+    index_names = []
+    node = winning.get("queryPlan", winning)
+    while node:
+        if node.get("indexName"):
+            index_names.append(node["indexName"])
+        node = node.get("inputStage")
+
+    return {
+        "indexes_used": index_names,
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+        "execution_ms": stats.get("executionTimeMillis"),
     }
 
 @router.get("/ai-providers")
@@ -576,7 +581,8 @@ async def get_ai_providers(admin: dict = Depends(require_admin)):
                 "is_blocked": False
             })
     
-    return {"providers": providers}
+    # Gateway counters (requests, cache hits, errors, tokens, cost, latency) of this worker
+    return {"providers": providers, "gateway": get_llm_metrics()}
 
 @router.put("/ai-providers/{provider}")
 async def update_ai_provider(
@@ -602,23 +608,57 @@ async def update_ai_provider(
         upsert=True
     )
     
+    invalidate_provider_health(provider)
+    
     await create_audit_log(admin, "ai_provider_update", "ai_provider", provider, new_value=update)
     return {"message": "Provider updated"}
 
+# ==================== PRICING ====================
+@router.get("/pricing")
+async def get_pricing(admin: dict = Depends(require_admin)):
+    """The active model price table and the published versions"""
+    table = await get_price_table()
+    return {
+        "active": {"version": table.version, "effective_at": table.effective_at, "prices": table.prices},
+        "versions": await list_price_tables(),
+    }
+
+@router.post("/pricing")
+async def create_price_table(data: PriceTableCreate, admin: dict = Depends(require_admin)):
+    """Publish a new price table version; runs logged from `effective_at` on are priced with it"""
+    prices = {
+        provider: {model: price.model_dump() for model, price in models.items()}
+        for provider, models in data.prices.items()
+    }
+    try:
+        table = await publish_price_table(prices, data.version, data.effective_at, admin["id"])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="effective_at must be an ISO timestamp")
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Price table version already exists")
+    
+    await create_audit_log(admin, "price_table_publish", "price_table", table["version"],
+                           new_value={"effective_at": table["effective_at"], "models": len(table["prices"])})
+    return {"message": "Price table published", "version": table["version"], "effective_at": table["effective_at"]}
+
 # ==================== ERRORS ====================
 @router.get("/errors")
 async def get_admin_errors(
     admin: dict = Depends(require_admin),
     error_type: str = None,
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 50
 ):
     query = {}
     if error_type:
         query["error_type"] = error_type
+    limit = max(1, min(limit, 200))
     
-    errors = await db.error_logs.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    return {"errors": errors, "total": await db.error_logs.count_documents(query)}
+    errors, next_cursor = await fetch_page(db.error_logs, query, cursor, limit, {"_id": 0, RETENTION_DATE_FIELD: 0})
+    response = {"errors": errors, "next_cursor": next_cursor}
+    if not cursor:
+        response["total"] = await db.error_logs.count_documents(query)
+    return response
 
 # ==================== AUDIT LOGS ====================
 @router.get("/audit-logs")
@@ -626,7 +666,7 @@ async def get_audit_logs(
     admin: dict = Depends(require_admin),
     action: str = None,
     admin_id: str = None,
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 100
 ):
     query = {}
@@ -634,9 +674,13 @@ async def get_audit_logs(
         query["action"] = action
     if admin_id:
         query["admin_id"] = admin_id
+    limit = max(1, min(limit, 500))
     
-    logs = await db.audit_logs.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    return {"logs": logs, "total": await db.audit_logs.count_documents(query)}
+    logs, next_cursor = await fetch_page(db.audit_logs, query, cursor, limit)
+    response = {"logs": logs, "next_cursor": next_cursor}
+    if not cursor:
+        response["total"] = await db.audit_logs.count_documents(query)
+    return response
 
 
 # ==================== PROJECTS MANAGEMENT ====================
@@ -645,34 +689,52 @@ async def get_admin_projects(
     admin: dict = Depends(require_admin),
     plan: str = None,
     status: str = None,
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 50
 ):
     query = {}
     
-    # Filter by user plan
-    if plan:
-        plan_users = await db.users.find({"plan": plan}, {"id": 1}).to_list(10000)
-        user_ids = [u["id"] for u in plan_users]
-        query["user_id"] = {"$in": user_ids}
-    
     # Filter by project status
     if status == "frozen":
         query["is_frozen"] = True
     elif status == "active":
         query["is_frozen"] = {"$ne": True}
+    limit = max(1, min(limit, 200))
+    
+    # Filter by owner plan: joined per project while paging, so the set of
+    # matching users is never materialized
+    plan_stages = [
+        {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "id", "as": "owner"}},
+        {"$match": {"owner.plan": plan}},
+    ] if plan else []
+    
+    if plan_stages:
+        rows = await db.projects.aggregate([
+            {"$match": keyset_filter(query, cursor, "updated_at")},
+            {"$sort": dict(keyset_sort("updated_at"))},
+            *plan_stages,
+            {"$limit": limit + 1},
+            {"$project": PROJECT_SUMMARY_PROJECTION},
+        ]).to_list(limit + 1)
+        projects, next_cursor = page_from_rows(rows, limit, "updated_at")
+    else:
+        projects, next_cursor = await fetch_page(
+            db.projects, query, cursor, limit, PROJECT_SUMMARY_PROJECTION, sort_field="updated_at"
+        )
     
-    projects = await db.projects.find(query, {"_id": 0}).sort("updated_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    # Enrich with user data
+    # Owners and latest deployment for the whole page
+    await attach_users(projects, key="owner", projection={"plan": 1})
+    deployments = await latest_by(db.deployments, "project_id", [p["id"] for p in projects])
     for project in projects:
-        user = await db.users.find_one({"id": project["user_id"]}, {"_id": 0, "name": 1, "email": 1, "plan": 1})
-        project["owner"] = user
-        # Get deployment info
-        deployment = await db.deployments.find_one({"project_id": project["id"]}, {"_id": 0})
-        project["deployment"] = deployment
+        project["deployment"] = deployments.get(project["id"])
     
-    return {"projects": projects, "total": await db.projects.count_documents(query)}
+    response = {"projects": projects, "next_cursor": next_cursor}
+    if not cursor and plan_stages:
+        counted = await db.projects.aggregate([{"$match": query}, *plan_stages, {"$count": "total"}]).to_list(1)
+        response["total"] = counted[0]["total"] if counted else 0
+    elif not cursor:
+        response["total"] = await db.projects.count_documents(query)
+    return response
 
 @router.get("/projects/{project_id}")
 async def get_admin_project_detail(project_id: str, admin: dict = Depends(require_admin)):
@@ -868,32 +930,40 @@ async def update_feature_flags(
 async def get_admin_jobs(
     admin: dict = Depends(require_admin),
     status: str = None,
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 50
 ):
     query = {}
     if status:
         query["status"] = status
+    limit = max(1, min(limit, 200))
     
-    jobs = await db.jobs.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    jobs, next_cursor = await fetch_page(db.jobs, query, cursor, limit)
     
-    # Enrich with user and project data
+    # Enrich with user and project data for the whole page
+    await attach_users(jobs)
+    projects = await docs_by_id(db.projects, [j.get("project_id") for j in jobs], {"name": 1})
     for job in jobs:
-        user = await db.users.find_one({"id": job["user_id"]}, {"_id": 0, "name": 1, "email": 1})
-        job["user"] = user
-        project = await db.projects.find_one({"id": job["project_id"]}, {"_id": 0, "name": 1})
-        job["project"] = project
+        job["project"] = projects.get(job.get("project_id"))
     
-    return {
+    status_counts = {
+        row["_id"]: row["count"]
+        for row in await db.jobs.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(50)
+    }
+    
+    response = {
         "jobs": jobs,
-        "total": await db.jobs.count_documents(query),
+        "next_cursor": next_cursor,
         "counts": {
-            "queued": await db.jobs.count_documents({"status": "queued"}),
-            "running": await db.jobs.count_documents({"status": "running"}),
-            "completed": await db.jobs.count_documents({"status": "completed"}),
-            "failed": await db.jobs.count_documents({"status": "failed"})
+            name: status_counts.get(name, 0)
+            for name in ("queued", "running", "completed", "failed")
         }
     }
+    if not cursor:
+        response["total"] = await db.jobs.count_documents(query)
+    return response
 
 @router.get("/jobs/{job_id}")
 async def get_admin_job_detail(job_id: str, admin: dict = Depends(require_admin)):
@@ -3,7 +3,7 @@ Agent Routes - Build Jobs + SSE Stream + Chat
 Single chat interface API
 """
 
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Header, Response
 from fastapi.responses import StreamingResponse
 from datetime import datetime, timezone
 from typing import Optional
@@ -13,11 +13,14 @@ import uuid
 
 from app.core.security import require_auth
 from app.db.mongo import db
+from app.services.retention import RETENTION_DATE_FIELD
 from app.models.build import (
     StartBuildRequest, ChatRequest, StopBuildRequest,
     BuildJob, BuildStatus, ChatMessage, Conversation
 )
-from app.services.agent_system import orchestrator, AgentRouter
+from app.services.agent_system import orchestrator, AgentRouter, hydrate_event_payloads
+from app.services.preview_cache import get_preview_files
+from app.services.job_registry import count_running_jobs
 
 
 router = APIRouter(prefix="/agent", tags=["agent"])
@@ -27,14 +30,8 @@ router = APIRouter(prefix="/agent", tags=["agent"])
 # SSE STREAM - Real-time job events
 # =============================================================================
 
-@router.get("/jobs/{job_id}/stream")
-async def stream_job_events(job_id: str, user: dict = Depends(require_auth)):
-    """Stream job events via Server-Sent Events"""
-    
-    # Verify job belongs to user
-    job = await db.build_jobs.find_one({"id": job_id, "user_id": user['id']})
-    if not job:
-        raise HTTPException(status_code=404, detail="Job not found")
+def job_event_stream(job_id: str) -> StreamingResponse:
+    """SSE response that follows a job's stored events until it finishes"""
     
     async def event_generator():
         """Generate SSE events"""
@@ -44,17 +41,17 @@ async def stream_job_events(job_id: str, user: dict = Depends(require_auth)):
             # Get new events
             events = await db.build_events.find(
                 {"job_id": job_id},
-                {"_id": 0}
+                {"_id": 0, RETENTION_DATE_FIELD: 0}
             ).sort("timestamp", 1).to_list(1000)
             
             # Send new events
-            for event in events[last_event_count:]:
+            for event in await hydrate_event_payloads(events[last_event_count:]):
                 yield f"data: {json.dumps(event)}\n\n"
             
             last_event_count = len(events)
             
             # Check if job is complete
-            job = await db.build_jobs.find_one({"id": job_id})
+            job = await db.build_jobs.find_one({"id": job_id}, {"_id": 0, "status": 1})
             if job and job.get("status") in ["completed", "failed", "cancelled"]:
                 yield f"data: {json.dumps({'type': 'stream_end', 'status': job['status']})}\n\n"
                 break
@@ -72,32 +69,47 @@ async def stream_job_events(job_id: str, user: dict = Depends(require_auth)):
     )
 
 
+@router.get("/jobs/{job_id}/stream")
+async def stream_job_events(job_id: str, user: dict = Depends(require_auth)):
+    """Stream job events via Server-Sent Events"""
+    
+    # Verify job belongs to user
+    job = await db.build_jobs.find_one({"id": job_id, "user_id": user['id']}, {"_id": 1})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return job_event_stream(job_id)
+
+
 # =============================================================================
 # BUILD JOBS
 # =============================================================================
 
+async def _start(user: dict, prompt: str, project_id: Optional[str] = None, model: str = "auto", provider: str = "auto") -> str:
+    job_id = await orchestrator.start_job(
+        prompt=prompt,
+        user_id=user['id'],
+        project_id=project_id,
+        model=model,
+        provider=provider
+    )
+    if job_id is None:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many jobs running. Wait for one to finish or stop it."
+        )
+    return job_id
+
+
 @router.post("/build")
 async def start_build(request: StartBuildRequest, user: dict = Depends(require_auth)):
-    """Start a new build job"""
-    
-    job_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc).isoformat()
-    
-    # Start job and collect initial events
-    events = []
-    async for event in orchestrator.start_job(
-        prompt=request.prompt,
-        user_id=user['id'],
-        project_id=request.project_id,
-        model=request.model,
-        provider=request.provider
-    ):
-        events.append(event.dict())
+    """Start a new build job (it keeps running if the client goes away)"""
     
+    job_id = await _start(user, request.prompt, request.project_id, request.model, request.provider)
     return {
-        "job_id": events[0]["job_id"] if events else job_id,
+        "job_id": job_id,
         "status": "started",
-        "events": events
+        "stream_url": f"/api/agent/jobs/{job_id}/stream"
     }
 
 
@@ -105,25 +117,8 @@ async def start_build(request: StartBuildRequest, user: dict = Depends(require_a
 async def start_build_stream(request: StartBuildRequest, user: dict = Depends(require_auth)):
     """Start build and stream events in real-time"""
     
-    async def event_generator():
-        async for event in orchestrator.start_job(
-            prompt=request.prompt,
-            user_id=user['id'],
-            project_id=request.project_id,
-            model=request.model,
-            provider=request.provider
-        ):
-            yield f"data: {json.dumps(event.dict())}\n\n"
-    
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
-        }
-    )
+    job_id = await _start(user, request.prompt, request.project_id, request.model, request.provider)
+    return job_event_stream(job_id)
 
 
 @router.post("/build/stop")
@@ -134,9 +129,8 @@ async def stop_build(request: StopBuildRequest, user: dict = Depends(require_aut
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    success = await orchestrator.stop_job(request.job_id)
-    
-    return {"success": success, "message": "Job stopped"}
+    was_running = await orchestrator.stop_job(request.job_id)
+    return {"success": True, "message": "Job stop requested" if was_running else "Job stopped"}
 
 
 @router.get("/jobs")
@@ -232,14 +226,10 @@ async def chat(request: ChatRequest, user: dict = Depends(require_auth)):
     # Determine agent type
     intent = AgentRouter.classify_intent(request.message)
     
-    # Start build job
-    events = []
-    async for event in orchestrator.start_job(
-        prompt=request.message,
-        user_id=user['id'],
-        project_id=request.project_id or conversation.get("project_id")
-    ):
-        events.append(event.dict())
+    # Run a build job; it finishes (and is saved) even if this request goes away
+    job_id = await _start(user, request.message, request.project_id or conversation.get("project_id"))
+    await orchestrator.wait_job(job_id)
+    events = await orchestrator.get_job_events(job_id)
     
     # Extract AI response
     ai_content = ""
@@ -256,7 +246,7 @@ async def chat(request: ChatRequest, user: dict = Depends(require_auth)):
     # Save AI message
     ai_message = ChatMessage(
         id=str(uuid.uuid4()),
-        job_id=events[0]["job_id"] if events else None,
+        job_id=job_id,
         role="assistant",
         content=ai_content,
         agent=intent,
@@ -289,22 +279,8 @@ async def chat(request: ChatRequest, user: dict = Depends(require_auth)):
 async def chat_stream(request: ChatRequest, user: dict = Depends(require_auth)):
     """Chat with streaming response"""
     
-    async def event_generator():
-        async for event in orchestrator.start_job(
-            prompt=request.message,
-            user_id=user['id'],
-            project_id=request.project_id
-        ):
-            yield f"data: {json.dumps(event.dict())}\n\n"
-    
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive"
-        }
-    )
+    job_id = await _start(user, request.message, request.project_id)
+    return job_event_stream(job_id)
 
 
 @router.get("/conversations")
@@ -359,11 +335,8 @@ async def delete_conversation(conversation_id: str, user: dict = Depends(require
 async def get_agent_status(user: dict = Depends(require_auth)):
     """Get agent system status"""
     
-    # Count active jobs
-    active_jobs = await db.build_jobs.count_documents({
-        "user_id": user['id'],
-        "status": {"$in": ["queued", "planning", "running"]}
-    })
+    # Count active jobs (across all workers)
+    active_jobs = await count_running_jobs(user['id'])
     
     # Recent jobs
     recent_jobs = await db.build_jobs.find(
@@ -468,29 +441,26 @@ async def get_agents_info(user: dict = Depends(require_auth)):
 # =============================================================================
 
 @router.get("/preview/{job_id}")
-async def get_preview(job_id: str, user: dict = Depends(require_auth)):
+async def get_preview(
+    job_id: str,
+    response: Response,
+    user: dict = Depends(require_auth),
+    if_none_match: Optional[str] = Header(None),
+):
     """Get preview data for a job"""
     
     job = await db.build_jobs.find_one(
         {"id": job_id, "user_id": user['id']},
-        {"_id": 0}
+        {"_id": 0, "id": 1, "user_id": 1, "status": 1, "code_blocks": 1}
     )
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    # Get file events
-    events = await db.build_events.find(
-        {"job_id": job_id, "type": "file_created"},
-        {"_id": 0}
-    ).to_list(100)
-    
-    files = {}
-    for event in events:
-        if event.get("data"):
-            filename = event["data"].get("filename")
-            code = event["data"].get("code")
-            if filename and code:
-                files[filename] = code
+    files, etag = await get_preview_files(job, if_none_match)
+    if files is None:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
     
     # Check if it's a web project
     has_html = any(f.endswith('.html') for f in files.keys())
@@ -3,7 +3,7 @@ Agent Chat Routes - Single Chat Interface
 SSE Streaming for live progress updates
 """
 
-from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, Query, Header
 from fastapi.responses import StreamingResponse
 from datetime import datetime, timezone
 from typing import Optional, AsyncGenerator
@@ -13,6 +13,15 @@ import asyncio
 
 from app.core.security import require_auth
 from app.db.mongo import db
+from app.services.retention import with_retention_date, RETENTION_DATE_FIELD
+from app.services.pagination import fetch_page
+from app.services.blob_store import externalize, hydrate_refs
+from app.services.intent_router import analyze_query
+from app.services.code_fences import FenceParser, extract_code_blocks
+from app.services.code_runner import run_code, runnable_blocks
+from app.services.preview_cache import add_preview_file, add_preview_blocks, finish_preview, render_preview
+from app.services.project_files import context_for_turn, owns_project, save_blocks
+from app.services.job_registry import reserve_job, run_job, cancel_job
 from app.models.jobs import BuildJob, BuildEvent, BuildEventType, BuildJobStatus, AgentType
 from app.services.ai_router import generate_code
 
@@ -44,6 +53,9 @@ class EventManager:
 
 event_manager = EventManager()
 
+# Events after which a job's stream ends
+JOB_END_EVENTS = ['job_completed', 'job_failed', 'job_cancelled', 'error']
+
 
 async def create_event(
     job_id: str, 
@@ -70,7 +82,7 @@ async def create_event(
     }
     
     # Store in database
-    await db.build_events.insert_one(event)
+    await db.build_events.insert_one(with_retention_date(event))
     
     # Push to SSE queue
     await event_manager.push_event(job_id, event)
@@ -91,55 +103,7 @@ async def create_event(
 
 def classify_query(query: str) -> AgentType:
     """Classify query to determine which agent to use"""
-    query_lower = query.lower()
-    
-    # Code-related patterns
-    code_patterns = [
-        "write", "create", "build", "code", "program", "script", "function",
-        "class", "api", "website", "app", "application", "html", "css", "js",
-        "python", "javascript", "react", "node", "flask", "django", "fastapi",
-        "database", "sql", "mongodb", "component", "page", "implement",
-        "generate code", "make a", "develop", "frontend", "backend"
-    ]
-    
-    # Browser-related patterns
-    browser_patterns = [
-        "search", "browse", "find out", "look up", "google", "web search",
-        "latest news", "research", "check website", "visit", "open url",
-        "navigate to", "who is", "what is the latest"
-    ]
-    
-    # File-related patterns
-    file_patterns = [
-        "file", "folder", "directory", "organize", "move", "copy", "delete",
-        "rename", "find file", "locate", "create folder", "list files"
-    ]
-    
-    # MCP-related patterns
-    mcp_patterns = [
-        "mcp", "tool", "use mcp", "calendar", "contacts", "stock",
-        "market", "weather", "external tool"
-    ]
-    
-    # Planning patterns (complex multi-step tasks)
-    planning_patterns = [
-        "plan", "step by step", "multiple", "and then", "first", "after that",
-        "complex", "comprehensive", "full", "complete project", "entire"
-    ]
-    
-    # Check patterns
-    if any(p in query_lower for p in planning_patterns):
-        return AgentType.PLANNER
-    if any(p in query_lower for p in code_patterns):
-        return AgentType.CODER
-    if any(p in query_lower for p in browser_patterns):
-        return AgentType.BROWSER
-    if any(p in query_lower for p in file_patterns):
-        return AgentType.FILE
-    if any(p in query_lower for p in mcp_patterns):
-        return AgentType.MCP
-    
-    return AgentType.CASUAL
+    return AgentType(analyze_query(query).agent_or(AgentType.CASUAL.value))
 
 
 async def process_job(job_id: str, user: dict, query: str, project_id: str = None):
@@ -192,21 +156,24 @@ async def process_job(job_id: str, user: dict, query: str, project_id: str = Non
         elif agent_type == AgentType.BROWSER:
             response = await process_browser_task(job_id, user, query)
         elif agent_type == AgentType.FILE:
-            response = await process_file_task(job_id, user, query)
+            response = await process_file_task(job_id, user, query, project_id)
         elif agent_type == AgentType.MCP:
-            response = await process_mcp_task(job_id, user, query)
+            response = await process_mcp_task(job_id, user, query, project_id)
         elif agent_type == AgentType.PLANNER:
             response, code_blocks = await process_planner_task(job_id, user, query, project_id)
         else:
             response = await process_casual_task(job_id, user, query)
         
+        # Named files from the job join the project's tree
+        await save_blocks(project_id, code_blocks, source=agent_type.value)
+        
         # Job completed
         await db.build_jobs.update_one(
             {"id": job_id},
             {"$set": {
                 "status": BuildJobStatus.SUCCESS.value,
                 "response": response,
-                "code_blocks": code_blocks,
+                "code_blocks": await externalize(code_blocks, {"code": "code_ref"}),
                 "has_preview": has_preview,
                 "preview_url": preview_url,
                 "completed_at": datetime.now(timezone.utc).isoformat(),
@@ -222,7 +189,13 @@ async def process_job(job_id: str, user: dict, query: str, project_id: str = Non
             payload={"response": response[:500] if response else None},
             progress=100
         )
+        await finish_preview(job_id)
         
+    except asyncio.CancelledError:
+        # Stopped: the in-flight LLM request was aborted with the task
+        await mark_cancelled(job_id)
+        raise
+    
     except Exception as e:
         error_msg = str(e)
         await db.build_jobs.update_one(
@@ -239,11 +212,25 @@ async def process_job(job_id: str, user: dict, query: str, project_id: str = Non
             f"Job failed: {error_msg}",
             payload={"error": error_msg}
         )
+        await finish_preview(job_id)
     
     finally:
-        # Cleanup after delay
-        await asyncio.sleep(30)
-        event_manager.cleanup(job_id)
+        # Cleanup after delay (without holding the job's slot)
+        asyncio.get_running_loop().call_later(30, event_manager.cleanup, job_id)
+
+
+async def mark_cancelled(job_id: str):
+    """Mark a job cancelled unless it already ended."""
+    result = await db.build_jobs.update_one(
+        {"id": job_id, "status": {"$in": [BuildJobStatus.QUEUED.value, BuildJobStatus.RUNNING.value]}},
+        {"$set": {
+            "status": BuildJobStatus.CANCELLED.value,
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }}
+    )
+    if result.modified_count:
+        await create_event(job_id, BuildEventType.JOB_CANCELLED, "Job cancelled by user")
+        await finish_preview(job_id)
 
 
 async def process_coder_task(job_id: str, user: dict, query: str, project_id: str = None):
@@ -269,6 +256,9 @@ Always wrap code in appropriate markdown code blocks with language tags."""
     try:
         # Call AI with Gemini as default
         full_prompt = f"{system_prompt}\n\nUser request: {query}"
+        files_context = await context_for_turn(project_id)
+        if files_context:
+            full_prompt = f"{system_prompt}\n\n{files_context}\n\nUser request: {query}"
         response_text = await generate_code(
             prompt=full_prompt,
             ai_provider="gemini",
@@ -277,27 +267,52 @@ Always wrap code in appropriate markdown code blocks with language tags."""
         
         await create_event(job_id, BuildEventType.CODEGEN_PROGRESS, "Code generated", progress=60)
         
-        # Extract code blocks from response
-        import re
-        code_pattern = r'```(\w+)?\n(.*?)```'
-        matches = re.findall(code_pattern, response_text, re.DOTALL)
-        
-        for i, (lang, code) in enumerate(matches):
-            block = {
-                "id": str(uuid.uuid4()),
-                "language": lang or "text",
-                "code": code.strip(),
-                "filename": f"file_{i+1}.{lang or 'txt'}"
-            }
+        # Extract code blocks - each file is announced as soon as its fence closes
+        parser = FenceParser()
+        for block in parser.feed(response_text) + parser.close():
+            block = {"id": str(uuid.uuid4()), **block}
             code_blocks.append(block)
+            await add_preview_file(job_id, user['id'], block['filename'], block['language'], block['code'])
             
             await create_event(
                 job_id, 
                 BuildEventType.FILE_CREATED, 
                 f"Created {block['filename']}",
-                payload={"file": block['filename'], "language": lang},
-                progress=60 + (i * 5)
+                payload={"file": block['filename'], "language": block['language'], "truncated": block['truncated']},
+                progress=min(60 + (len(code_blocks) - 1) * 5, 85)
+            )
+        
+        # Run programs (not web pages), streaming their output as events
+        for block in runnable_blocks(code_blocks):
+            filename = block['filename']
+            await create_event(
+                job_id,
+                BuildEventType.CODE_EXECUTION,
+                f"Running {filename}...",
+                payload={"file": filename, "language": block['language']},
             )
+            
+            async def on_output(stream: str, text: str, filename: str = filename):
+                await create_event(
+                    job_id,
+                    BuildEventType.CODE_EXECUTION,
+                    text,
+                    payload={"file": filename, "stream": stream},
+                )
+            
+            run = await run_code(block['code'], block['language'], user['id'], on_output=on_output)
+            payload = {
+                "file": filename,
+                "exit_code": run.exit_code,
+                "duration_ms": run.duration_ms,
+                "timed_out": run.timed_out,
+                "truncated": run.truncated,
+            }
+            if run.success:
+                await create_event(job_id, BuildEventType.CODE_SUCCESS, f"{filename} ran in {run.duration_ms} ms", payload=payload)
+            else:
+                reason = run.error or ("timed out" if run.timed_out else f"exited with code {run.exit_code}")
+                await create_event(job_id, BuildEventType.CODE_ERROR, f"{filename}: {reason}", payload=payload)
         
         # Check if web preview is possible
         has_html = any(b['language'] in ['html', 'htm'] for b in code_blocks)
@@ -347,7 +362,7 @@ If you don't know something, say so honestly."""
         return f"Search error: {str(e)}"
 
 
-async def process_file_task(job_id: str, user: dict, query: str):
+async def process_file_task(job_id: str, user: dict, query: str, project_id: str = None):
     """Process file management task"""
     await create_event(job_id, BuildEventType.INFO, "Processing file operation...", progress=30)
     
@@ -356,6 +371,9 @@ Describe the steps needed or provide guidance for file management tasks."""
     
     try:
         full_prompt = f"{system_prompt}\n\nUser request: {query}"
+        files_context = await context_for_turn(project_id)
+        if files_context:
+            full_prompt = f"{system_prompt}\n\n{files_context}\n\nUser request: {query}"
         response_text = await generate_code(
             prompt=full_prompt,
             ai_provider="gemini",
@@ -369,7 +387,7 @@ Describe the steps needed or provide guidance for file management tasks."""
         return f"File operation error: {str(e)}"
 
 
-async def process_mcp_task(job_id: str, user: dict, query: str):
+async def process_mcp_task(job_id: str, user: dict, query: str, project_id: str = None):
     """Process MCP tool task"""
     await create_event(job_id, BuildEventType.MCP_TOOL_CALL, "Calling MCP tool...", progress=30)
     
@@ -381,6 +399,9 @@ Help users understand what tools are available and how to use them."""
     
     try:
         full_prompt = f"{system_prompt}\n\nUser request: {query}"
+        files_context = await context_for_turn(project_id)
+        if files_context:
+            full_prompt = f"{system_prompt}\n\n{files_context}\n\nUser request: {query}"
         response_text = await generate_code(
             prompt=full_prompt,
             ai_provider="gemini",
@@ -419,7 +440,8 @@ Return a JSON plan like:
             prompt=plan_prompt_full,
             ai_provider="gemini",
             user_id=user['id'],
-            is_planner=True
+            is_planner=True,
+            temperature=0
         )
         
         await create_event(
@@ -441,18 +463,9 @@ Return a JSON plan like:
         )
         
         # Extract code blocks
-        import re
-        code_pattern = r'```(\w+)?\n(.*?)```'
-        matches = re.findall(code_pattern, main_response or '', re.DOTALL)
-        
-        for i, (lang, code) in enumerate(matches):
-            block = {
-                "id": str(uuid.uuid4()),
-                "language": lang or "text",
-                "code": code.strip(),
-                "filename": f"file_{i+1}.{lang or 'txt'}"
-            }
-            code_blocks.append(block)
+        for block in extract_code_blocks(main_response or ''):
+            code_blocks.append({"id": str(uuid.uuid4()), **block})
+        await add_preview_blocks(job_id, user['id'], code_blocks)
         
         await create_event(job_id, BuildEventType.CODEGEN_DONE, "Plan executed", progress=90)
         
@@ -490,16 +503,21 @@ async def process_casual_task(job_id: str, user: dict, query: str):
 async def agent_chat(
     message: str,
     project_id: Optional[str] = None,
-    background_tasks: BackgroundTasks = None,
     user: dict = Depends(require_auth)
 ):
     """
     Main chat endpoint - Routes to appropriate agent
     Returns job_id for SSE streaming
     """
+    if project_id and not await owns_project(project_id, user['id']):
+        raise HTTPException(status_code=404, detail="Project not found")
+    
     now = datetime.now(timezone.utc).isoformat()
     job_id = str(uuid.uuid4())
     
+    if not await reserve_job(job_id, user['id'], kind="chat"):
+        raise HTTPException(status_code=429, detail="Too many jobs running. Wait for one to finish or stop it.")
+    
     # Create job
     job = {
         "id": job_id,
@@ -528,10 +546,10 @@ async def agent_chat(
         "content": message,
         "timestamp": now
     }
-    await db.chat_messages.insert_one(chat_message)
+    await db.chat_messages.insert_one(with_retention_date(chat_message))
     
-    # Start background processing
-    background_tasks.add_task(process_job, job_id, user, message, project_id)
+    # Run detached from this request; POST /jobs/{id}/stop cancels it
+    run_job(job_id, process_job(job_id, user, message, project_id))
     
     return {
         "job_id": job_id,
@@ -560,13 +578,19 @@ async def stream_job_events(
         
         # Send existing events first
         existing_events = await db.build_events.find(
-            {"job_id": job_id}
+            {"job_id": job_id},
+            {RETENTION_DATE_FIELD: 0}
         ).sort("seq", 1).to_list(100)
         
         for event in existing_events:
             event.pop('_id', None)
             yield f"data: {json.dumps(event)}\n\n"
         
+        # Already over (e.g. stopped before the client connected)
+        if existing_events and existing_events[-1].get('type') in JOB_END_EVENTS:
+            yield f"data: {json.dumps({'type': 'stream_end'})}\n\n"
+            return
+        
         # Stream new events
         while True:
             try:
@@ -575,7 +599,7 @@ async def stream_job_events(
                 yield f"data: {json.dumps(event)}\n\n"
                 
                 # Check if job is complete
-                if event.get('type') in ['job_completed', 'job_failed', 'error']:
+                if event.get('type') in JOB_END_EVENTS:
                     yield f"data: {json.dumps({'type': 'stream_end'})}\n\n"
                     break
                     
@@ -603,6 +627,7 @@ async def get_job(job_id: str, user: dict = Depends(require_auth)):
     )
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+    await hydrate_refs(job.get("code_blocks") or [], {"code_ref": "code"})
     
     # Get events
     events = await db.build_events.find(
@@ -645,31 +670,26 @@ async def stop_job(job_id: str, user: dict = Depends(require_auth)):
     if job['status'] not in ['queued', 'running']:
         raise HTTPException(status_code=400, detail="Job is not running")
     
-    await db.build_jobs.update_one(
-        {"id": job_id},
-        {"$set": {
-            "status": BuildJobStatus.CANCELLED.value,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
-    
-    await create_event(job_id, BuildEventType.INFO, "Job cancelled by user")
+    # The job's task marks itself cancelled; one no worker runs any more is marked here
+    if not await cancel_job(job_id):
+        await mark_cancelled(job_id)
     
     return {"message": "Job stop requested"}
 
 
 @router.get("/agent/history")
 async def get_chat_history(
-    limit: int = Query(50, le=200),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
     user: dict = Depends(require_auth)
 ):
-    """Get user's chat history"""
-    messages = await db.chat_messages.find(
-        {"user_id": user['id']},
-        {"_id": 0}
-    ).sort("timestamp", -1).limit(limit).to_list(limit)
+    """Get user's chat history (next_cursor pages further back in time)"""
+    messages, next_cursor = await fetch_page(
+        db.chat_messages, {"user_id": user['id']}, cursor, limit,
+        {"_id": 0, RETENTION_DATE_FIELD: 0}, sort_field="timestamp"
+    )
     
-    return {"messages": list(reversed(messages))}
+    return {"messages": list(reversed(messages)), "next_cursor": next_cursor}
 
 
 @router.get("/agent/jobs")
@@ -687,45 +707,24 @@ async def get_user_jobs(
         query,
         {"_id": 0}
     ).sort("created_at", -1).limit(limit).to_list(limit)
+    await hydrate_refs([b for j in jobs for b in j.get("code_blocks") or []], {"code_ref": "code"})
     
     return {"jobs": jobs}
 
 
 @router.get("/preview/{job_id}")
-async def get_preview(job_id: str, user: dict = Depends(require_auth)):
-    """Get preview HTML for a job"""
+async def get_preview(
+    job_id: str,
+    user: dict = Depends(require_auth),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+):
+    """Get preview HTML for a job (materialized, cached by content hash)"""
     job = await db.build_jobs.find_one(
         {"id": job_id, "user_id": user['id']},
-        {"_id": 0}
+        {"_id": 0, "id": 1, "user_id": 1, "status": 1, "code_blocks": 1}
     )
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    if not job.get('has_preview'):
-        raise HTTPException(status_code=404, detail="No preview available")
-    
-    # Find HTML code block
-    html_content = ""
-    css_content = ""
-    js_content = ""
-    
-    for block in job.get('code_blocks', []):
-        if block.get('language') in ['html', 'htm']:
-            html_content = block.get('code', '')
-        elif block.get('language') == 'css':
-            css_content = block.get('code', '')
-        elif block.get('language') in ['javascript', 'js']:
-            js_content = block.get('code', '')
-    
-    # Combine into full HTML
-    if not html_content:
-        raise HTTPException(status_code=404, detail="No HTML content found")
-    
-    # Inject CSS and JS if HTML doesn't have them
-    if css_content and '<style>' not in html_content:
-        html_content = html_content.replace('</head>', f'<style>{css_content}</style></head>')
-    if js_content and '<script>' not in html_content:
-        html_content = html_content.replace('</body>', f'<script>{js_content}</script></body>')
-    
-    from fastapi.responses import HTMLResponse
-    return HTMLResponse(content=html_content)
+    return await render_preview(job, if_none_match, accept_encoding)
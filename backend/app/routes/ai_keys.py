@@ -4,7 +4,7 @@ import uuid
 
 from app.core.security import require_auth
 from app.db.mongo import db
-from app.services.ai_router import encrypt_api_key, get_key_hint
+from app.services.ai_router import encrypt_api_key, get_key_hint, invalidate_user_ai_key
 
 router = APIRouter(prefix="/ai-keys", tags=["ai-keys"])
 
@@ -43,6 +43,8 @@ async def add_user_ai_key(provider: str, api_key: str, user: dict = Depends(requ
         "last_used_at": None
     }
     
+    invalidate_user_ai_key(user["id"], provider)
+    
     if existing:
         await db.user_ai_keys.update_one(
             {"id": existing["id"]},
@@ -59,6 +61,7 @@ async def add_user_ai_key(provider: str, api_key: str, user: dict = Depends(requ
 async def delete_user_ai_key(provider: str, user: dict = Depends(require_auth)):
     """Delete user's AI API key"""
     result = await db.user_ai_keys.delete_one({"user_id": user["id"], "provider": provider})
+    invalidate_user_ai_key(user["id"], provider)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Key not found")
     return {"message": f"{provider.capitalize()} key deleted"}
@@ -70,6 +73,7 @@ async def toggle_user_ai_key(provider: str, is_active: bool, user: dict = Depend
         {"user_id": user["id"], "provider": provider},
         {"$set": {"is_active": is_active}}
     )
+    invalidate_user_ai_key(user["id"], provider)
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Key not found")
     return {"message": f"{provider.capitalize()} key {'enabled' if is_active else 'disabled'}"}
@@ -1,21 +1,39 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Request, status
 from datetime import datetime, timezone, timedelta
 import uuid
 import random
 import string
 
-from app.core.security import hash_password, verify_password, create_access_token, require_auth
+from app.core.security import hash_password_async, verify_password_async, create_access_token, require_auth
+from app.core.rate_limit import SlidingWindowRateLimiter
+from app.core.config import AUTH_RATE_LIMIT_WINDOW_SECONDS, AUTH_RATE_LIMIT_PER_IP, AUTH_RATE_LIMIT_PER_EMAIL
 from app.db.mongo import db
 from app.models.user import UserCreate, UserLogin, TokenResponse, UserResponse
 from app.services.utils import format_user_response, get_user_generations_limit
+from app.services.admin_rollups import record_signup
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+# Every login/register costs a bcrypt round, so cap attempts per client IP
+# and per target email.
+ip_limiter = SlidingWindowRateLimiter(AUTH_RATE_LIMIT_PER_IP, AUTH_RATE_LIMIT_WINDOW_SECONDS)
+email_limiter = SlidingWindowRateLimiter(AUTH_RATE_LIMIT_PER_EMAIL, AUTH_RATE_LIMIT_WINDOW_SECONDS)
+
+def client_ip(request: Request) -> str:
+    # The last X-Forwarded-For hop is the one our own proxy appended; earlier
+    # hops are client-supplied and trivially spoofed.
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
 def generate_referral_code():
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
 
 @router.post("/register", response_model=TokenResponse)
-async def register(user_data: UserCreate):
+async def register(user_data: UserCreate, request: Request):
+    ip_limiter.hit(client_ip(request))
+    
     # Check if email exists
     existing_user = await db.users.find_one({"email": user_data.email})
     if existing_user:
@@ -36,7 +54,7 @@ async def register(user_data: UserCreate):
         "id": user_id,
         "email": user_data.email,
         "name": user_data.name,
-        "password_hash": hash_password(user_data.password),
+        "password_hash": await hash_password_async(user_data.password),
         "is_admin": False,
         "plan": "free",
         "plan_expiry": (now + timedelta(days=30)).isoformat(),
@@ -49,6 +67,7 @@ async def register(user_data: UserCreate):
     }
     
     await db.users.insert_one(user_doc)
+    await record_signup()
     
     # Create referral record
     if referred_by:
@@ -71,12 +90,18 @@ async def register(user_data: UserCreate):
     )
 
 @router.post("/login", response_model=TokenResponse)
-async def login(credentials: UserLogin):
+async def login(credentials: UserLogin, request: Request):
+    ip_limiter.hit(client_ip(request))
+    email_key = credentials.email.lower()
+    email_limiter.hit(email_key)
+    
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user['password_hash']):
+    if not user or not await verify_password_async(credentials.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    token = create_access_token(user['id'])
+    email_limiter.reset(email_key)
+    
+    token = create_access_token(user['id'], user.get('session_version', 0))
     return TokenResponse(
         access_token=token,
         user=format_user_response(user)
@@ -16,6 +16,9 @@ from app.services.coding_agent import (
     AgentType,
     PLAN_MODELS,
 )
+from app.services.agent_memory import forget
+from app.services.pricing import get_usage_days
+from app.services.project_files import owns_project
 
 router = APIRouter(prefix="/api/agent", tags=["coding-agent"])
 
@@ -39,6 +42,7 @@ class AgentResponse(BaseModel):
     answer: Optional[str] = None
     reasoning: Optional[str] = None
     code_blocks: List[dict] = []
+    execution_results: List[dict] = []
     tokens_used: int = 0
     cost_estimate: float = 0.0
     agent_type: Optional[str] = None
@@ -55,6 +59,7 @@ class AgentStatusResponse(BaseModel):
     allowed_providers: List[str]
     default_provider: str
     default_model: str
+    cost_today: float = 0.0
     total_tokens_used: int
     total_cost: float
     total_requests: int
@@ -108,6 +113,8 @@ async def process_agent_request(
     - casual: General conversation
     """
     user_id = current_user["id"]
+    if request.project_id and not await owns_project(request.project_id, user_id):
+        raise HTTPException(status_code=404, detail="Project not found")
     
     result = await process_coding_request(
         prompt=request.prompt,
@@ -286,13 +293,15 @@ async def conversation_interaction(
     """
     user_id = current_user["id"]
     now = datetime.now(timezone.utc).isoformat()
+    if request.project_id and not await owns_project(request.project_id, user_id):
+        raise HTTPException(status_code=404, detail="Project not found")
     
     # Get or create conversation
     if request.conversation_id:
         conversation = await db.agent_conversations.find_one({
             "id": request.conversation_id,
             "user_id": user_id,
-        })
+        }, {"_id": 0, "id": 1})
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
     else:
@@ -321,6 +330,7 @@ async def conversation_interaction(
         user_id=user_id,
         project_id=request.project_id,
         provider=request.provider,
+        conversation_id=conversation["id"],
     )
     
     # Add assistant message
@@ -330,6 +340,7 @@ async def conversation_interaction(
         "timestamp": datetime.now(timezone.utc).isoformat(),
         "agent_type": result.get("agent_type"),
         "code_blocks": result.get("code_blocks", []),
+        "execution_results": result.get("execution_results", []),
     }
     
     # Update conversation
@@ -366,7 +377,7 @@ async def get_conversation(
     conversation = await db.agent_conversations.find_one({
         "id": conversation_id,
         "user_id": user_id,
-    })
+    }, {"_id": 0, "memory": 0})
     
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
@@ -395,7 +406,7 @@ async def list_conversations(
     
     conversations = await db.agent_conversations.find(
         query,
-        {"messages": {"$slice": -1}}  # Only last message for preview
+        {"messages": {"$slice": -1}, "memory": 0}  # Only last message for preview
     ).sort("updated_at", -1).limit(limit).to_list(limit)
     
     return {
@@ -428,6 +439,7 @@ async def delete_conversation(
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Conversation not found")
+    forget(conversation_id)
     
     return {"success": True, "message": "Conversation deleted"}
 
@@ -437,68 +449,35 @@ async def get_usage_history(
     days: int = Query(default=30, le=90),
     current_user: dict = Depends(require_auth),
 ):
-    """Get usage history for the user."""
-    from datetime import timedelta
-    
-    user_id = current_user["id"]
-    start_date = (
-        datetime.now(timezone.utc) - timedelta(days=days)
-    ).isoformat()
-    
-    # Aggregate by day
-    pipeline = [
-        {
-            "$match": {
-                "user_id": user_id,
-                "created_at": {"$gte": start_date}
-            }
-        },
-        {
-            "$group": {
-                "_id": {"$substr": ["$created_at", 0, 10]},  # Group by date
-                "requests": {"$sum": 1},
-                "tokens": {"$sum": "$tokens_used"},
-                "cost": {"$sum": "$cost_estimate"},
-            }
-        },
-        {"$sort": {"_id": 1}},
-    ]
-    
-    daily_usage = await db.ai_runs.aggregate(pipeline).to_list(days)
+    """Get usage history for the user (from the per-day usage rollups)."""
+    rollups = await get_usage_days(current_user["id"], days)
     
     # By provider
-    provider_pipeline = [
-        {"$match": {"user_id": user_id, "created_at": {"$gte": start_date}}},
-        {
-            "$group": {
-                "_id": "$provider",
-                "requests": {"$sum": 1},
-                "tokens": {"$sum": "$tokens_used"},
-                "cost": {"$sum": "$cost_estimate"},
-            }
-        },
-    ]
-    
-    by_provider = await db.ai_runs.aggregate(provider_pipeline).to_list(20)
+    by_provider = {}
+    for day in rollups:
+        for provider, usage in (day.get("by_provider") or {}).items():
+            totals = by_provider.setdefault(provider, {"requests": 0, "tokens": 0, "cost": 0})
+            for field in totals:
+                totals[field] += usage.get(field, 0)
     
     return {
         "daily": [
             {
-                "date": d["_id"],
-                "requests": d["requests"],
-                "tokens": d["tokens"],
-                "cost": round(d["cost"], 4),
+                "date": d["day"],
+                "requests": d.get("requests", 0),
+                "tokens": d.get("tokens_in", 0) + d.get("tokens_out", 0),
+                "cost": round(d.get("cost", 0), 4),
             }
-            for d in daily_usage
+            for d in rollups
         ],
         "by_provider": [
             {
-                "provider": p["_id"],
+                "provider": provider,
                 "requests": p["requests"],
                 "tokens": p["tokens"],
                 "cost": round(p["cost"], 4),
             }
-            for p in by_provider
+            for provider, p in by_provider.items()
         ],
     }
 
@@ -11,6 +11,7 @@ import httpx
 
 from app.core.security import require_auth
 from app.db.mongo import db
+from app.services.project_files import read_files
 from app.services.github_service import (
     GitHubService,
     get_github_oauth_url,
@@ -445,7 +446,9 @@ async def deploy_project_to_github(
         raise HTTPException(status_code=401, detail="GitHub not connected")
     
     # Get project
-    project = await db.projects.find_one({"id": project_id, "user_id": user["id"]})
+    project = await db.projects.find_one(
+        {"id": project_id, "user_id": user["id"]}, {"_id": 0, "id": 1, "name": 1, "description": 1}
+    )
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
@@ -473,15 +476,10 @@ async def deploy_project_to_github(
                 if e.response.status_code != 422:  # 422 = already exists
                     raise
         
-        # Prepare files to push
-        html_content = project.get("html_code", "")
-        
-        files = [
-            {
-                "path": "index.html",
-                "content": html_content
-            },
-            {
+        # Prepare files to push: the project's file tree, plus a README if it has none
+        files = [{"path": path, "content": content} for path, content in (await read_files(project_id)).items()]
+        if not any(f["path"].lower() == "readme.md" for f in files):
+            files.append({
                 "path": "README.md",
                 "content": f"""# {project['name']}
 
@@ -496,8 +494,7 @@ This project is automatically deployed to GitHub Pages.
 ---
 *Generated by Nirman AI - सोच लो, बना दो*
 """
-            }
-        ]
+            })
         
         # Push files
         result = await github.push_multiple_files(
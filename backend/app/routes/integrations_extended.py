@@ -10,6 +10,7 @@ import os
 
 from app.core.security import require_auth
 from app.db.mongo import db
+from app.services.project_files import read_files
 
 # Import integration services
 from app.services.integrations.vercel_service import (
@@ -178,18 +179,13 @@ async def deploy_to_vercel(
     if not vercel:
         raise HTTPException(status_code=401, detail="Vercel not connected")
     
-    project = await db.projects.find_one({"id": project_id, "user_id": user["id"]})
+    project = await db.projects.find_one({"id": project_id, "user_id": user["id"]}, {"_id": 0, "id": 1, "name": 1})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    code = project.get("code", {})
-    files = []
-    
-    if isinstance(code, dict):
-        for path, content in code.items():
-            files.append({"file": path, "data": content})
-    elif isinstance(code, str):
-        files.append({"file": "index.html", "data": code})
+    files = [{"file": path, "data": content} for path, content in (await read_files(project_id)).items()]
+    if not files:
+        raise HTTPException(status_code=400, detail="Project has no files to deploy")
     
     deployment = await vercel.create_deployment(
         name=project.get("name", "nirman-project").lower().replace(" ", "-"),
@@ -353,17 +349,13 @@ async def deploy_to_firebase(
     if not firebase:
         raise HTTPException(status_code=401, detail="Firebase not connected")
     
-    project = await db.projects.find_one({"id": project_id, "user_id": user["id"]})
+    project = await db.projects.find_one({"id": project_id, "user_id": user["id"]}, {"_id": 0, "id": 1, "name": 1})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    code = project.get("code", {})
-    files = {}
-    
-    if isinstance(code, dict):
-        files = code
-    elif isinstance(code, str):
-        files = {"index.html": code}
+    files = await read_files(project_id)
+    if not files:
+        raise HTTPException(status_code=400, detail="Project has no files to deploy")
     
     integration = await get_firebase_integration(user["id"])
     site_id = integration.get("project_id")
@@ -8,6 +8,7 @@ from typing import Optional, List
 from datetime import datetime, timezone
 
 from app.db.mongo import db
+from app.core.user_cache import invalidate_user
 from app.core.security import require_auth
 from app.models.learning import (
     EventType, UserPreferences, ThemePreference,
@@ -108,6 +109,7 @@ async def update_privacy_settings(
             "global_learning_enabled": global_learning_enabled
         }}
     )
+    await invalidate_user(user_id)
     
     return {
         "success": True,
@@ -9,6 +9,8 @@ from fastapi import APIRouter, HTTPException, Depends, Query
 
 from app.core.security import require_auth
 from app.db.mongo import db
+from app.services.utils import adjust_wallet_balance
+from app.services.pricing import get_price_table
 from app.models.llm_keys import (
     LLMKey, LLMKeyCreate, LLMKeyUpdate, LLMKeyResponse,
     AddCreditsRequest, CreditTransaction, LLMKeyUsageStats
@@ -212,19 +214,11 @@ async def add_credits(key_id: str, data: AddCreditsRequest, user: dict = Depends
     
     # Handle wallet payment
     if data.payment_method == "wallet":
-        # Check wallet balance
-        user_doc = await db.users.find_one({"id": user["id"]})
-        wallet_balance = user_doc.get("wallet_balance", 0)
-        
-        if wallet_balance < data.amount:
+        # Deduct from wallet (atomic - fails if the balance does not cover it)
+        wallet_balance = await adjust_wallet_balance(user["id"], -data.amount, require_funds=True)
+        if wallet_balance is None:
             raise HTTPException(status_code=400, detail="Insufficient wallet balance")
         
-        # Deduct from wallet
-        await db.users.update_one(
-            {"id": user["id"]},
-            {"$inc": {"wallet_balance": -data.amount}}
-        )
-        
         # Add to key credits
         await db.llm_keys.update_one(
             {"id": key_id},
@@ -408,35 +402,13 @@ async def get_overview_stats(user: dict = Depends(require_auth)):
 
 @router.get("/pricing/info")
 async def get_pricing_info():
-    """Get pricing information for all supported models"""
+    """Get pricing information for all supported models (the active price table)"""
+    table = await get_price_table()
     return {
         "currency": "USD",
+        "price_version": table.version,
         "pricing_per_1k_tokens": {
-            "openai": {
-                "gpt-5.2": {"input": 0.002, "output": 0.008},
-                "gpt-4o": {"input": 0.005, "output": 0.015},
-                "gpt-4o-mini": {"input": 0.00015, "output": 0.0006}
-            },
-            "gemini": {
-                "gemini-2.5-flash": {"input": 0.0001, "output": 0.0004},
-                "gemini-2.5-pro": {"input": 0.00125, "output": 0.005}
-            },
-            "claude": {
-                "claude-sonnet-4": {"input": 0.003, "output": 0.015},
-                "claude-3.5-sonnet": {"input": 0.003, "output": 0.015}
-            },
-            "deepseek": {
-                "deepseek-chat": {"input": 0.00014, "output": 0.00028},
-                "deepseek-coder": {"input": 0.00014, "output": 0.00028}
-            },
-            "groq": {
-                "llama-3.3-70b": {"input": 0.00059, "output": 0.00079},
-                "mixtral-8x7b": {"input": 0.00024, "output": 0.00024}
-            },
-            "mistral": {
-                "mistral-large": {"input": 0.002, "output": 0.006},
-                "codestral": {"input": 0.001, "output": 0.003}
-            }
+            provider: table.prices.get(provider, {}) for provider in DEFAULT_PROVIDERS
         },
         "credit_packages": [
             {"amount": 5, "price": 5, "bonus": 0},
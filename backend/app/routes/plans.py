@@ -6,7 +6,11 @@ from app.core.security import require_auth
 from app.db.mongo import db
 from app.models.plan import PurchasePlanRequest
 from app.models.wallet import AddMoneyRequest
-from app.services.utils import get_plans_from_db, get_plan_by_id, validate_coupon, get_user_generations_limit
+from app.services.utils import (
+    get_plans_from_db, get_plan_by_id, validate_coupon, get_user_generations_limit, adjust_wallet_balance
+)
+from app.core.user_cache import invalidate_user
+from app.services.admin_rollups import record_purchase
 from app.services.payments import create_cashfree_order, verify_cashfree_payment
 from app.core.config import CASHFREE_APP_ID, CASHFREE_SECRET_KEY
 
@@ -63,17 +67,22 @@ async def purchase_plan(request: PurchasePlanRequest, user: dict = Depends(requi
         now = datetime.now(timezone.utc)
         expiry = (now + timedelta(days=365 if request.billing_cycle == 'yearly' else 30)).isoformat()
         
-        # Update user
-        await db.users.update_one(
-            {"id": user['id']},
-            {"$set": {
-                "plan": request.plan,
-                "plan_expiry": expiry,
-                "wallet_balance": wallet_balance - final_price,
-                "generations_limit": get_user_generations_limit(request.plan),
-                "generations_used": 0
-            }}
+        # Update user - debit only if the balance still covers the price
+        updated = await db.users.update_one(
+            {"id": user['id'], "wallet_balance": {"$gte": final_price}},
+            {
+                "$set": {
+                    "plan": request.plan,
+                    "plan_expiry": expiry,
+                    "generations_limit": get_user_generations_limit(request.plan),
+                    "generations_used": 0
+                },
+                "$inc": {"wallet_balance": -final_price}
+            }
         )
+        await invalidate_user(user['id'])
+        if updated.modified_count == 0:
+            raise HTTPException(status_code=409, detail="Wallet balance changed, please retry")
         
         # Record transaction
         transaction = {
@@ -102,6 +111,7 @@ async def purchase_plan(request: PurchasePlanRequest, user: dict = Depends(requi
             "created_at": now.isoformat()
         }
         await db.purchases.insert_one(purchase)
+        await record_purchase(final_price)
         
         # Update coupon usage
         if coupon_data:
@@ -118,10 +128,7 @@ async def purchase_plan(request: PurchasePlanRequest, user: dict = Depends(requi
                 "bonus_given": False
             })
             if referral:
-                await db.users.update_one(
-                    {"id": user['referred_by']},
-                    {"$inc": {"wallet_balance": referral['bonus_amount']}}
-                )
+                await adjust_wallet_balance(user['referred_by'], referral['bonus_amount'])
                 await db.referrals.update_one(
                     {"id": referral['id']},
                     {"$set": {"bonus_given": True}}
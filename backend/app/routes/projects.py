@@ -1,11 +1,32 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response
+from fastapi.responses import StreamingResponse
 from datetime import datetime, timezone
-from typing import List
+from typing import List, Optional
 import uuid
 
 from app.core.security import require_auth
 from app.db.mongo import db
-from app.models.project import Project, ProjectCreate, ProjectUpdate, ChatMessage, ChatRequest
+from app.services.quota import consume_generation, refund_generation
+from app.services.retention import with_retention_date, RETENTION_DATE_FIELD
+from app.services.pagination import fetch_page, set_next_cursor_header
+from app.services.blob_store import put_blob, hydrate_refs
+from app.services.artifacts import (
+    ARTIFACT_PROJECT_PROJECTION, get_artifact_manifest, stream_project_zip, artifact_filename,
+)
+from app.services.project_versions import (
+    record_code_change, list_versions, get_version_code, rollback_to_version,
+)
+from app.services.project_store import (
+    PROJECT_SUMMARY_PROJECTION, PROJECT_ETAG_PROJECTION,
+    compute_code_stats, with_code_stats, ensure_code_stats, project_etag, etag_matches,
+)
+from app.services.project_files import (
+    CODE_FILES, normalize_path, write_files, list_directory, read_files, ensure_project_files, delete_project_files,
+)
+from app.services.preview_cache import render_project_preview
+from app.models.project import (
+    Project, ProjectSummary, ProjectCreate, ProjectUpdate, ProjectFilesUpdate, ChatMessage, ChatRequest,
+)
 from app.services.ai_router import generate_code
 from app.core.config import PLANS
 
@@ -33,6 +54,7 @@ async def create_project(project_data: ProjectCreate, user: dict = Depends(requi
         "html_code": None,
         "css_code": None,
         "js_code": None,
+        **compute_code_stats({}),
         "created_at": now,
         "updated_at": now
     }
@@ -40,22 +62,45 @@ async def create_project(project_data: ProjectCreate, user: dict = Depends(requi
     await db.projects.insert_one(project_doc)
     return Project(**project_doc)
 
-@router.get("/projects", response_model=List[Project])
-async def get_projects(user: dict = Depends(require_auth)):
-    projects = await db.projects.find(
-        {"user_id": user['id']},
-        {"_id": 0}
-    ).sort("updated_at", -1).to_list(100)
-    return [Project(**p) for p in projects]
+@router.get("/projects", response_model=List[ProjectSummary])
+async def get_projects(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=200),
+    user: dict = Depends(require_auth)
+):
+    projects, next_cursor = await fetch_page(
+        db.projects, {"user_id": user['id']}, cursor, limit,
+        PROJECT_SUMMARY_PROJECTION, sort_field="updated_at"
+    )
+    set_next_cursor_header(response, next_cursor)
+    return [ProjectSummary(**p) for p in projects]
 
 @router.get("/projects/{project_id}", response_model=Project)
-async def get_project(project_id: str, user: dict = Depends(require_auth)):
-    project = await db.projects.find_one(
-        {"id": project_id, "user_id": user['id']},
-        {"_id": 0}
-    )
+async def get_project(
+    project_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    user: dict = Depends(require_auth)
+):
+    query = {"id": project_id, "user_id": user['id']}
+    
+    # Conditional GET: answer from the hash/timestamp without loading the code
+    if if_none_match:
+        meta = await db.projects.find_one(query, PROJECT_ETAG_PROJECTION)
+        if not meta:
+            raise HTTPException(status_code=404, detail="Project not found")
+        etag = project_etag(meta)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    
+    project = await db.projects.find_one(query, {"_id": 0})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    project = await ensure_code_stats(project)
+    
+    response.headers["ETag"] = project_etag(project)
+    response.headers["Cache-Control"] = "private, no-cache"
     return Project(**project)
 
 @router.put("/projects/{project_id}", response_model=Project)
@@ -66,8 +111,10 @@ async def update_project(project_id: str, update_data: ProjectUpdate, user: dict
     
     update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
     update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_dict = with_code_stats(update_dict, project)
     
     await db.projects.update_one({"id": project_id}, {"$set": update_dict})
+    await record_code_change(project, update_dict, source="update", user_id=user['id'])
     
     updated_project = await db.projects.find_one({"id": project_id}, {"_id": 0})
     return Project(**updated_project)
@@ -78,42 +125,176 @@ async def delete_project(project_id: str, user: dict = Depends(require_auth)):
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    # Delete chat history
+    # Delete chat history, versions and files
     await db.chat_messages.delete_many({"project_id": project_id})
+    await db.project_versions.delete_many({"project_id": project_id})
+    await delete_project_files(project_id)
     return {"message": "Project deleted successfully"}
 
+# ========== DOWNLOAD ==========
+@router.get("/projects/{project_id}/download")
+async def download_project(
+    project_id: str,
+    if_none_match: Optional[str] = Header(None),
+    user: dict = Depends(require_auth)
+):
+    project = await db.projects.find_one({"id": project_id, "user_id": user['id']}, ARTIFACT_PROJECT_PROJECTION)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    artifact_hash, manifest = await get_artifact_manifest(project)
+    etag = f'"{artifact_hash[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    return StreamingResponse(
+        stream_project_zip(project_id, artifact_hash, manifest),
+        media_type="application/zip",
+        headers={**headers, "Content-Disposition": f'attachment; filename="{artifact_filename(project)}"'}
+    )
+
+# ========== FILES ==========
+@router.get("/projects/{project_id}/files")
+async def list_project_files(
+    project_id: str,
+    path: str = "",
+    recursive: bool = False,
+    user: dict = Depends(require_auth)
+):
+    project = await db.projects.find_one({"id": project_id, "user_id": user['id']}, {"_id": 1})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    try:
+        entries = await list_directory(project_id, path, recursive)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"path": path, "entries": entries}
+
+@router.get("/projects/{project_id}/files/content")
+async def get_project_file(project_id: str, path: str, user: dict = Depends(require_auth)):
+    project = await db.projects.find_one({"id": project_id, "user_id": user['id']}, {"_id": 1})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    try:
+        files = await read_files(project_id, [path])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not files:
+        raise HTTPException(status_code=404, detail="File not found")
+    [(path, content)] = files.items()
+    return {"path": path, "content": content}
+
+@router.put("/projects/{project_id}/files")
+async def update_project_files(project_id: str, update: ProjectFilesUpdate, user: dict = Depends(require_auth)):
+    project = await db.projects.find_one(
+        {"id": project_id, "user_id": user['id']},
+        {"_id": 0, "id": 1, "html_code": 1, "css_code": 1, "js_code": 1},
+    )
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    await ensure_project_files(project_id)
+    try:
+        result = await write_files(project_id, update.files, source="editor")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Keep the editor's code fields in step with their files
+    files = {normalize_path(p): c for p, c in update.files.items()}
+    code = {field: files[name] or "" for field, name in CODE_FILES.items() if name in files}
+    if code and any(CODE_FILES[field] in result["changed"] for field in code):
+        code_update = with_code_stats({**code, "updated_at": datetime.now(timezone.utc).isoformat()}, project)
+        await db.projects.update_one({"id": project_id}, {"$set": code_update})
+        await record_code_change(project, code_update, source="files", user_id=user['id'])
+    return result
+
+@router.get("/projects/{project_id}/preview")
+async def preview_project(
+    project_id: str,
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    user: dict = Depends(require_auth)
+):
+    project = await db.projects.find_one({"id": project_id, "user_id": user['id']}, {"_id": 1})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return await render_project_preview(project_id, if_none_match, accept_encoding)
+
+# ========== VERSIONS ==========
+@router.get("/projects/{project_id}/versions")
+async def get_project_versions(
+    project_id: str,
+    before: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    user: dict = Depends(require_auth)
+):
+    project = await db.projects.find_one({"id": project_id, "user_id": user['id']}, {"_id": 0, "version": 1})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    return {"current_version": project.get("version", 0), **await list_versions(project_id, before, limit)}
+
+@router.get("/projects/{project_id}/versions/{version}")
+async def get_project_version(project_id: str, version: int, user: dict = Depends(require_auth)):
+    project = await db.projects.find_one({"id": project_id, "user_id": user['id']}, {"_id": 1})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    meta, code = await get_version_code(project_id, version)
+    return {**meta, **code}
+
+@router.post("/projects/{project_id}/versions/{version}/rollback", response_model=Project)
+async def rollback_project(project_id: str, version: int, user: dict = Depends(require_auth)):
+    project = await db.projects.find_one({"id": project_id, "user_id": user['id']}, {"_id": 0})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    if project.get("is_frozen"):
+        raise HTTPException(status_code=403, detail="Project is frozen")
+    
+    await rollback_to_version(project, version, user_id=user['id'])
+    
+    updated_project = await db.projects.find_one({"id": project_id}, {"_id": 0})
+    return Project(**updated_project)
+
 # ========== CHAT ==========
 @router.post("/chat")
 async def chat_with_ai(request: ChatRequest, user: dict = Depends(require_auth)):
-    # Check generation limit
-    generations_limit = user.get('generations_limit', 100)
-    generations_used = user.get('generations_used', 0)
-    
-    if generations_limit != -1 and generations_used >= generations_limit:
-        raise HTTPException(status_code=403, detail="Generation limit reached. Upgrade your plan for more.")
-    
     # Verify project ownership
     project = await db.projects.find_one({"id": request.project_id, "user_id": user['id']})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
+    # Reserve a generation up front (atomic check-and-increment)
+    usage = await consume_generation(user['id'])
+    if usage is None:
+        raise HTTPException(status_code=403, detail="Generation limit reached. Upgrade your plan for more.")
+    
     # Get recent chat history
     recent_messages = await db.chat_messages.find(
-        {"project_id": request.project_id}
+        {"project_id": request.project_id},
+        {"_id": 0, "role": 1, "content": 1, "content_preview": 1}
     ).sort("created_at", -1).limit(5).to_list(5)
     recent_messages.reverse()
     
     # Build context
-    context = "\n".join([f"{m['role']}: {m['content'][:500]}" for m in recent_messages])
+    context = "\n".join([
+        f"{m['role']}: {m.get('content_preview') or (m.get('content') or '')[:500]}"
+        for m in recent_messages
+    ])
     full_prompt = f"Previous context:\n{context}\n\nUser request: {request.message}" if context else request.message
     
     # Generate code
-    generated_code = await generate_code(
-        prompt=full_prompt,
-        ai_provider=request.ai_provider,
-        existing_code=project.get('html_code'),
-        user_id=user['id']
-    )
+    try:
+        generated_code = await generate_code(
+            prompt=full_prompt,
+            ai_provider=request.ai_provider,
+            existing_code=project.get('html_code'),
+            user_id=user['id']
+        )
+    except Exception:
+        await refund_generation(user['id'])
+        raise
     
     now = datetime.now(timezone.utc).isoformat()
     
@@ -125,51 +306,57 @@ async def chat_with_ai(request: ChatRequest, user: dict = Depends(require_auth))
         "content": request.message,
         "created_at": now
     }
-    await db.chat_messages.insert_one(user_msg)
+    await db.chat_messages.insert_one(with_retention_date(user_msg))
     
-    # Save assistant message
+    # Save assistant message - the code itself lives in the blob store once,
+    # referenced by both content and code_generated
     assistant_msg_id = str(uuid.uuid4())
+    code_ref = await put_blob(generated_code)
     assistant_msg = {
         "id": assistant_msg_id,
         "project_id": request.project_id,
         "role": "assistant",
-        "content": generated_code,
-        "code_generated": generated_code,
+        "content_ref": code_ref,
+        "code_ref": code_ref,
+        "content_preview": generated_code[:500],
         "ai_provider": request.ai_provider,
         "created_at": now
     }
-    await db.chat_messages.insert_one(assistant_msg)
+    await db.chat_messages.insert_one(with_retention_date(assistant_msg))
     
     # Update project code
-    await db.projects.update_one(
-        {"id": request.project_id},
-        {"$set": {"html_code": generated_code, "updated_at": now}}
-    )
-    
-    # Update generation count
-    new_generations_used = generations_used + 1
-    await db.users.update_one(
-        {"id": user['id']},
-        {"$set": {"generations_used": new_generations_used}}
+    code_update = with_code_stats({"html_code": generated_code, "updated_at": now}, project)
+    await db.projects.update_one({"id": request.project_id}, {"$set": code_update})
+    await record_code_change(
+        project, code_update, source="chat", message=request.message[:200], user_id=user['id']
     )
     
     return {
         "message": generated_code,
         "message_id": assistant_msg_id,
-        "generations_used": new_generations_used,
-        "generations_limit": generations_limit
+        "generations_used": usage["generations_used"],
+        "generations_limit": usage["generations_limit"]
     }
 
 @router.get("/chat/{project_id}", response_model=List[ChatMessage])
-async def get_chat_history(project_id: str, user: dict = Depends(require_auth)):
-    project = await db.projects.find_one({"id": project_id, "user_id": user['id']})
+async def get_chat_history(
+    project_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    user: dict = Depends(require_auth)
+):
+    project = await db.projects.find_one({"id": project_id, "user_id": user['id']}, {"_id": 1})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
-    messages = await db.chat_messages.find(
-        {"project_id": project_id},
-        {"_id": 0}
-    ).sort("created_at", 1).to_list(100)
+    # Oldest first; the cursor continues forward in time
+    messages, next_cursor = await fetch_page(
+        db.chat_messages, {"project_id": project_id}, cursor, limit,
+        {"_id": 0, RETENTION_DATE_FIELD: 0}, direction=1
+    )
+    await hydrate_refs(messages, {"content_ref": "content", "code_ref": "code_generated"})
+    set_next_cursor_header(response, next_cursor)
     
     return [ChatMessage(**m) for m in messages]
 
@@ -13,6 +13,9 @@ from app.core.security import require_auth
 from app.db.mongo import db
 from app.models.wallet import AddMoneyRequest
 from app.services.payments import create_cashfree_order, verify_cashfree_payment
+from app.services.utils import adjust_wallet_balance
+from app.services.pagination import fetch_page
+from app.services.admin_enrichment import attach_users
 from app.core.config import CASHFREE_APP_ID, RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET
 
 router = APIRouter(tags=["wallet"])
@@ -53,28 +56,25 @@ async def get_wallet(user: dict = Depends(require_auth)):
 @router.get("/wallet/transactions")
 async def get_transactions(
     type: Optional[str] = None,
-    limit: int = Query(50, le=200),
-    offset: int = 0,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
     user: dict = Depends(require_auth)
 ):
-    """Get paginated transactions with filters"""
+    """Get paginated transactions with filters (pass next_cursor back as cursor)"""
     query = {"user_id": user['id']}
     if type:
         query["type"] = type
     
-    transactions = await db.wallet_transactions.find(
-        query,
-        {"_id": 0}
-    ).sort("created_at", -1).skip(offset).limit(limit).to_list(limit)
+    transactions, next_cursor = await fetch_page(db.wallet_transactions, query, cursor, limit)
     
-    total = await db.wallet_transactions.count_documents(query)
-    
-    return {
+    response = {
         "transactions": transactions,
-        "total": total,
-        "offset": offset,
+        "next_cursor": next_cursor,
         "limit": limit
     }
+    if not cursor:
+        response["total"] = await db.wallet_transactions.count_documents(query)
+    return response
 
 
 # =============================================================================
@@ -111,12 +111,7 @@ async def add_money_to_wallet(
     
     # Demo mode - directly credit wallet
     if payment_method == "demo" or (not razorpay_available and not cashfree_available):
-        new_balance = user.get('wallet_balance', 0) + request.amount
-        
-        await db.users.update_one(
-            {"id": user['id']},
-            {"$set": {"wallet_balance": new_balance}}
-        )
+        new_balance = await adjust_wallet_balance(user['id'], request.amount)
         
         transaction = {
             "id": str(uuid.uuid4()),
@@ -266,12 +261,7 @@ async def verify_razorpay_payment(
     amount = pending_order['amount']
     now = datetime.now(timezone.utc)
     
-    new_balance = user.get('wallet_balance', 0) + amount
-    
-    await db.users.update_one(
-        {"id": user['id']},
-        {"$set": {"wallet_balance": new_balance}}
-    )
+    new_balance = await adjust_wallet_balance(user['id'], amount)
     
     transaction = {
         "id": str(uuid.uuid4()),
@@ -325,12 +315,7 @@ async def verify_cashfree_wallet_payment(
             amount = pending_order.get('amount', 0) if pending_order else 0
         
         now = datetime.now(timezone.utc)
-        new_balance = user.get('wallet_balance', 0) + amount
-        
-        await db.users.update_one(
-            {"id": user['id']},
-            {"$set": {"wallet_balance": new_balance}}
-        )
+        new_balance = await adjust_wallet_balance(user['id'], amount)
         
         transaction = {
             "id": str(uuid.uuid4()),
@@ -378,22 +363,14 @@ async def deduct_from_wallet(
     category: str = "usage"
 ) -> dict:
     """Deduct amount from user wallet"""
-    user = await db.users.find_one({"id": user_id})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    current_balance = user.get('wallet_balance', 0)
-    if current_balance < amount:
+    new_balance = await adjust_wallet_balance(user_id, -amount, require_funds=True)
+    if new_balance is None:
+        if not await db.users.find_one({"id": user_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="User not found")
         raise HTTPException(status_code=400, detail="Insufficient wallet balance")
     
-    new_balance = current_balance - amount
     now = datetime.now(timezone.utc)
     
-    await db.users.update_one(
-        {"id": user_id},
-        {"$set": {"wallet_balance": new_balance}}
-    )
-    
     transaction = {
         "id": str(uuid.uuid4()),
         "user_id": user_id,
@@ -416,18 +393,12 @@ async def credit_to_wallet(
     category: str = "bonus"
 ) -> dict:
     """Credit amount to user wallet"""
-    user = await db.users.find_one({"id": user_id})
-    if not user:
+    new_balance = await adjust_wallet_balance(user_id, amount)
+    if new_balance is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    new_balance = user.get('wallet_balance', 0) + amount
     now = datetime.now(timezone.utc)
     
-    await db.users.update_one(
-        {"id": user_id},
-        {"$set": {"wallet_balance": new_balance}}
-    )
-    
     transaction = {
         "id": str(uuid.uuid4()),
         "user_id": user_id,
@@ -473,11 +444,9 @@ async def request_withdrawal(
     
     now = datetime.now(timezone.utc)
     
-    new_balance = current_balance - amount
-    await db.users.update_one(
-        {"id": user['id']},
-        {"$set": {"wallet_balance": new_balance}}
-    )
+    new_balance = await adjust_wallet_balance(user['id'], -amount, require_funds=True)
+    if new_balance is None:
+        raise HTTPException(status_code=400, detail="Insufficient balance")
     
     withdrawal = {
         "id": str(uuid.uuid4()),
@@ -641,13 +610,7 @@ async def process_withdrawal(
         return {"status": "success", "message": "Withdrawal approved"}
     
     elif action == "reject":
-        target_user = await db.users.find_one({"id": withdrawal['user_id']})
-        new_balance = target_user.get('wallet_balance', 0) + withdrawal['amount']
-        
-        await db.users.update_one(
-            {"id": withdrawal['user_id']},
-            {"$set": {"wallet_balance": new_balance}}
-        )
+        await adjust_wallet_balance(withdrawal['user_id'], withdrawal['amount'])
         
         await db.withdrawals.update_one(
             {"id": withdrawal_id},
@@ -684,6 +647,8 @@ async def process_withdrawal(
 @router.get("/admin/withdrawals")
 async def get_all_withdrawals(
     status: str = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
     user: dict = Depends(require_auth)
 ):
     """Admin: Get all withdrawal requests"""
@@ -694,19 +659,12 @@ async def get_all_withdrawals(
     if status:
         query["status"] = status
     
-    withdrawals = await db.withdrawals.find(
-        query,
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
+    withdrawals, next_cursor = await fetch_page(db.withdrawals, query, cursor, limit)
     
-    for w in withdrawals:
-        user_info = await db.users.find_one(
-            {"id": w['user_id']},
-            {"_id": 0, "id": 1, "name": 1, "email": 1}
-        )
-        w['user'] = user_info
+    # One users query for the whole page
+    await attach_users(withdrawals)
     
-    return {"withdrawals": withdrawals}
+    return {"withdrawals": withdrawals, "next_cursor": next_cursor}
 
 
 @router.post("/admin/wallet/credit")
@@ -0,0 +1,94 @@
+"""
+Batched enrichment for admin list pages
+
+Admin lists used to decorate each row with its own queries (owner lookup,
+project/deployment counts, revenue), so a 100-row page cost hundreds of
+round-trips. These helpers take the ids of a whole page and answer with a
+single `$in` query or `$group` aggregation per collection, keyed by id.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.db.mongo import db
+
+
+def _unique(values: Iterable[Any]) -> List[Any]:
+    return list({v for v in values if v is not None})
+
+
+async def users_by_id(user_ids: Iterable[str], projection: Optional[Dict[str, int]] = None) -> Dict[str, Dict]:
+    """{user_id: user} for every id found, in one query."""
+    return await docs_by_id(db.users, user_ids, {"name": 1, "email": 1, **(projection or {})})
+
+
+async def docs_by_id(collection, ids: Iterable[str], projection: Optional[Dict[str, int]] = None) -> Dict[str, Dict]:
+    """{id: doc} for a page of ids from any collection keyed by `id`."""
+    unique = _unique(ids)
+    if not unique:
+        return {}
+    fields = {"_id": 0, "id": 1, **(projection or {})}
+    docs = await collection.find({"id": {"$in": unique}}, fields).to_list(len(unique))
+    return {d["id"]: d for d in docs}
+
+
+async def count_by(collection, field: str, values: Iterable[Any], match: Optional[Dict] = None) -> Dict[Any, int]:
+    """{value: number of docs with field == value}, one $group per page."""
+    ids = _unique(values)
+    if not ids:
+        return {}
+    rows = await collection.aggregate([
+        {"$match": {field: {"$in": ids}, **(match or {})}},
+        {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+    ]).to_list(len(ids))
+    return {row["_id"]: row["count"] for row in rows}
+
+
+async def sum_by(collection, field: str, values: Iterable[Any], sum_field: str, match: Optional[Dict] = None) -> Dict[Any, float]:
+    """{value: sum of sum_field over docs with field == value}."""
+    ids = _unique(values)
+    if not ids:
+        return {}
+    rows = await collection.aggregate([
+        {"$match": {field: {"$in": ids}, **(match or {})}},
+        {"$group": {"_id": f"${field}", "total": {"$sum": {"$ifNull": [f"${sum_field}", 0]}}}},
+    ]).to_list(len(ids))
+    return {row["_id"]: row["total"] for row in rows}
+
+
+async def latest_by(collection, field: str, values: Iterable[Any], sort_field: str = "created_at") -> Dict[Any, Dict]:
+    """{value: most recent doc with field == value}."""
+    ids = _unique(values)
+    if not ids:
+        return {}
+    rows = await collection.aggregate([
+        {"$match": {field: {"$in": ids}}},
+        {"$sort": {field: 1, sort_field: -1}},
+        {"$group": {"_id": f"${field}", "doc": {"$first": "$$ROOT"}}},
+        {"$replaceRoot": {"newRoot": "$doc"}},
+        {"$project": {"_id": 0}},
+    ]).to_list(len(ids))
+    return {row[field]: row for row in rows}
+
+
+# =============================================================================
+# PAGE ENRICHERS
+# =============================================================================
+
+async def enrich_users(users: List[Dict]):
+    """Add projects_count, deployments_count and total_revenue to a page of users."""
+    ids = [u["id"] for u in users]
+    projects = await count_by(db.projects, "user_id", ids)
+    deployments = await count_by(db.deployments, "user_id", ids)
+    revenue = await sum_by(db.purchases, "user_id", ids, "amount", {"status": "completed"})
+
+    for user in users:
+        user["projects_count"] = projects.get(user["id"], 0)
+        user["deployments_count"] = deployments.get(user["id"], 0)
+        user["total_revenue"] = revenue.get(user["id"], 0)
+
+
+async def attach_users(rows: List[Dict], key: str = "user", projection: Optional[Dict[str, int]] = None):
+    """Set rows[i][key] to the owning user (or None), looked up in one query."""
+    owners = await users_by_id((r.get("user_id") for r in rows), projection)
+    for row in rows:
+        row[key] = owners.get(row.get("user_id"))
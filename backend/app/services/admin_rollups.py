@@ -0,0 +1,329 @@
+"""
+Admin Rollups - materialized counters for the admin dashboard
+
+Two kinds of precomputed documents live in `admin_rollups`:
+
+- Buckets (`hour:YYYY-MM-DDTHH`, `day:YYYY-MM-DD`): event counters bumped with
+  `$inc` at write time - signups, purchases, revenue, refunds, AI runs, AI
+  cost and errors by type.
+- Gauges (`gauges`): point-in-time totals (users by plan, MRR, projects, open
+  tickets, ...) recomputed by the aggregator every few minutes.
+
+The dashboard reads one gauges doc plus at most ~30 bucket docs, no matter
+how much raw data has piled up.
+"""
+
+import asyncio
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, Optional
+
+from pymongo import UpdateOne
+
+from app.db.mongo import db
+from app.core.config import PLANS
+
+
+# Hourly buckets are only needed for the rolling 24h window
+HOUR_BUCKET_RETENTION_DAYS = 14
+
+# Gauges older than this are recomputed inline by the dashboard
+GAUGES_MAX_AGE_SECONDS = 600
+
+BUCKET_METRICS = (
+    "signups", "purchases", "revenue", "refunds", "refunded_amount",
+    "ai_runs", "ai_runs_failed", "ai_cost", "errors",
+)
+
+
+def _hour_key(at: datetime) -> str:
+    return at.strftime("%Y-%m-%dT%H")
+
+
+def _day_key(at: datetime) -> str:
+    return at.strftime("%Y-%m-%d")
+
+
+def _safe_field(name: str) -> str:
+    """Error types become sub-document keys; Mongo keys can't hold '.' or '$'."""
+    return (name or "Unknown").replace(".", "_").replace("$", "_")[:100]
+
+
+# =============================================================================
+# WRITE PATH
+# =============================================================================
+
+async def record_metrics(incs: Dict[str, float], at: Optional[datetime] = None):
+    """
+    Bump counters in the hour and day buckets for `at` (default now).
+    One bulk_write, so a single round trip per recorded event.
+    """
+    at = at or datetime.now(timezone.utc)
+    hour, day = _hour_key(at), _day_key(at)
+
+    hour_start = at.replace(minute=0, second=0, microsecond=0)
+    ops = [
+        UpdateOne(
+            {"_id": f"hour:{hour}"},
+            {
+                "$inc": incs,
+                "$setOnInsert": {
+                    "period": "hour",
+                    "bucket": hour,
+                    "expires_at": hour_start + timedelta(days=HOUR_BUCKET_RETENTION_DAYS),
+                },
+            },
+            upsert=True,
+        ),
+        UpdateOne(
+            {"_id": f"day:{day}"},
+            {"$inc": incs, "$setOnInsert": {"period": "day", "bucket": day}},
+            upsert=True,
+        ),
+    ]
+    try:
+        await db.admin_rollups.bulk_write(ops, ordered=False)
+    except Exception as e:
+        # Dashboard counters must never break the request that triggered them
+        print(f"[Rollups] Failed to record {list(incs)}: {e}")
+
+
+async def record_signup():
+    await record_metrics({"signups": 1})
+
+
+async def record_purchase(amount: float):
+    await record_metrics({"purchases": 1, "revenue": amount})
+
+
+async def record_refund(amount: float):
+    await record_metrics({"refunds": 1, "refunded_amount": amount})
+
+
+async def record_ai_run(status: str, cost: float):
+    incs = {"ai_runs": 1, "ai_cost": cost or 0}
+    if status == "failed":
+        incs["ai_runs_failed"] = 1
+    await record_metrics(incs)
+
+
+async def record_error(error_type: str):
+    await record_metrics({"errors": 1, f"errors_by_type.{_safe_field(error_type)}": 1})
+
+
+# =============================================================================
+# GAUGES (aggregator)
+# =============================================================================
+
+async def refresh_gauges() -> Dict[str, Any]:
+    """Recompute point-in-time totals with counts and server-side $group."""
+    now = datetime.now(timezone.utc)
+    month_ago = (now - timedelta(days=30)).isoformat()
+
+    plan_rows = await db.users.aggregate([
+        {"$group": {"_id": "$plan", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    plan_distribution = {"free": 0, "pro": 0, "enterprise": 0}
+    for row in plan_rows:
+        plan_distribution[row["_id"] or "free"] = plan_distribution.get(row["_id"] or "free", 0) + row["count"]
+
+    active_rows = await db.users.aggregate([
+        {"$match": {"plan": {"$in": ["pro", "enterprise"]}, "plan_expiry": {"$gte": now.isoformat()}}},
+        {"$group": {"_id": "$plan", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    mrr = sum(PLANS.get(row["_id"], {}).get("price_monthly", 0) * row["count"] for row in active_rows)
+
+    revenue_rows = await db.purchases.aggregate([
+        {"$match": {"status": "completed"}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
+    ]).to_list(1)
+
+    job_rows = await db.jobs.aggregate([
+        {"$match": {"status": {"$in": ["running", "failed", "queued"]}}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    ai_jobs = {"running": 0, "failed": 0, "queued": 0}
+    ai_jobs.update({row["_id"]: row["count"] for row in job_rows})
+
+    gauges = {
+        "users_total": sum(plan_distribution.values()),
+        "pro_users": plan_distribution.get("pro", 0) + plan_distribution.get("enterprise", 0),
+        "plan_distribution": plan_distribution,
+        "revenue_total": revenue_rows[0]["total"] if revenue_rows else 0,
+        "mrr": mrr,
+        "churned_30d": await db.purchases.count_documents({
+            "status": "cancelled",
+            "created_at": {"$gte": month_ago},
+        }),
+        "projects_total": await db.projects.estimated_document_count(),
+        "deployments_total": await db.deployments.estimated_document_count(),
+        "ai_jobs": ai_jobs,
+        "open_tickets": await db.support_tickets.count_documents({"status": {"$in": ["open", "in_progress"]}}),
+        "computed_at": now.isoformat(),
+    }
+
+    await db.admin_rollups.update_one({"_id": "gauges"}, {"$set": gauges}, upsert=True)
+    return gauges
+
+
+# =============================================================================
+# BACKFILL
+# =============================================================================
+
+async def rebuild_buckets(days: int = 31):
+    """
+    Recompute hour/day buckets for the last `days` from the raw collections.
+
+    Used once to bootstrap rollups on an existing database. Buckets are
+    overwritten with $set, so don't run it while heavy traffic is recording
+    into the same buckets.
+    """
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+
+    sources = [
+        ("users", {}, {"signups": {"$sum": 1}}),
+        ("purchases", {"status": {"$in": ["completed", "refunded"]}}, {
+            "purchases": {"$sum": 1},
+            "revenue": {"$sum": "$amount"},
+        }),
+        ("ai_runs", {}, {
+            "ai_runs": {"$sum": 1},
+            "ai_runs_failed": {"$sum": {"$cond": [{"$eq": ["$status", "failed"]}, 1, 0]}},
+            "ai_cost": {"$sum": {"$ifNull": ["$cost_estimate", 0]}},
+        }),
+        ("error_logs", {}, {"errors": {"$sum": 1}}),
+    ]
+
+    buckets: Dict[str, Dict[str, Any]] = {}
+    for period, length in (("hour", 13), ("day", 10)):
+        for collection, match, accumulators in sources:
+            rows = await db[collection].aggregate([
+                {"$match": {**match, "created_at": {"$gte": since}}},
+                {"$group": {"_id": {"$substrBytes": ["$created_at", 0, length]}, **accumulators}},
+            ]).to_list(None)
+            for row in rows:
+                bucket = buckets.setdefault(f"{period}:{row['_id']}", {"period": period, "bucket": row["_id"]})
+                bucket.update({k: v for k, v in row.items() if k != "_id"})
+
+        error_rows = await db.error_logs.aggregate([
+            {"$match": {"created_at": {"$gte": since}}},
+            {"$group": {
+                "_id": {"bucket": {"$substrBytes": ["$created_at", 0, length]}, "type": "$error_type"},
+                "count": {"$sum": 1},
+            }},
+        ]).to_list(None)
+        for row in error_rows:
+            bucket = buckets.setdefault(
+                f"{period}:{row['_id']['bucket']}", {"period": period, "bucket": row["_id"]["bucket"]}
+            )
+            bucket.setdefault("errors_by_type", {})[_safe_field(row["_id"].get("type"))] = row["count"]
+
+    ops = []
+    for bucket_id, fields in buckets.items():
+        for metric in BUCKET_METRICS:
+            fields.setdefault(metric, 0)
+        if fields["period"] == "hour":
+            hour_start = datetime.strptime(fields["bucket"], "%Y-%m-%dT%H").replace(tzinfo=timezone.utc)
+            fields["expires_at"] = hour_start + timedelta(days=HOUR_BUCKET_RETENTION_DAYS)
+        ops.append(UpdateOne({"_id": bucket_id}, {"$set": fields}, upsert=True))
+
+    if ops:
+        await db.admin_rollups.bulk_write(ops, ordered=False)
+    await db.admin_rollups.update_one(
+        {"_id": "meta"},
+        {"$set": {"rebuilt_at": datetime.now(timezone.utc).isoformat(), "rebuilt_days": days}},
+        upsert=True,
+    )
+    print(f"[Rollups] Rebuilt {len(ops)} buckets from the last {days} days")
+
+
+async def ensure_rollups_bootstrapped():
+    """Backfill buckets and gauges the first time rollups run on a database."""
+    if not await db.admin_rollups.find_one({"_id": "meta"}):
+        await rebuild_buckets()
+    await refresh_gauges()
+
+
+# =============================================================================
+# READ PATH
+# =============================================================================
+
+def _sum_buckets(docs) -> Dict[str, Any]:
+    totals: Dict[str, Any] = {metric: 0 for metric in BUCKET_METRICS}
+    totals["errors_by_type"] = {}
+    for doc in docs:
+        for metric in BUCKET_METRICS:
+            totals[metric] += doc.get(metric, 0)
+        for error_type, count in (doc.get("errors_by_type") or {}).items():
+            totals["errors_by_type"][error_type] = totals["errors_by_type"].get(error_type, 0) + count
+    return totals
+
+
+async def get_dashboard_stats() -> Dict[str, Any]:
+    """
+    Assemble /admin/stats from precomputed docs: the gauges doc, the last
+    25 hourly buckets (rolling 24h) and the last 31 daily buckets.
+    """
+    now = datetime.now(timezone.utc)
+
+    gauges = await db.admin_rollups.find_one({"_id": "gauges"}) or {}
+    computed_at = gauges.get("computed_at")
+    if not computed_at or (now - datetime.fromisoformat(computed_at)).total_seconds() > GAUGES_MAX_AGE_SECONDS:
+        gauges = await refresh_gauges()
+
+    hour_docs, day_docs = await asyncio.gather(
+        db.admin_rollups.find({
+            "period": "hour",
+            "bucket": {"$gte": _hour_key(now - timedelta(hours=24))},
+        }).to_list(25),
+        db.admin_rollups.find({
+            "period": "day",
+            "bucket": {"$gte": _day_key(now - timedelta(days=30))},
+        }).to_list(31),
+    )
+
+    last_24h = _sum_buckets(hour_docs)
+    today = _day_key(now)
+    week_start = _day_key(now - timedelta(days=7))
+    signups_today = sum(d.get("signups", 0) for d in day_docs if d["bucket"] == today)
+    signups_week = sum(d.get("signups", 0) for d in day_docs if d["bucket"] >= week_start)
+    signups_month = sum(d.get("signups", 0) for d in day_docs)
+
+    total_runs = last_24h["ai_runs"]
+    failed_runs = last_24h["ai_runs_failed"]
+    error_rate = (failed_runs / total_runs * 100) if total_runs > 0 else 0
+    top_errors = sorted(last_24h["errors_by_type"].items(), key=lambda x: x[1], reverse=True)[:5]
+
+    return {
+        "users": {
+            "total": gauges.get("users_total", 0),
+            "pro": gauges.get("pro_users", 0),
+            "today_signups": signups_today,
+            "week_signups": signups_week,
+            "month_signups": signups_month,
+            "plan_distribution": gauges.get("plan_distribution", {}),
+        },
+        "revenue": {
+            "total": gauges.get("revenue_total", 0),
+            "mrr": gauges.get("mrr", 0),
+            "churned_30d": gauges.get("churned_30d", 0),
+        },
+        "projects": {
+            "total": gauges.get("projects_total", 0),
+            "deployments": gauges.get("deployments_total", 0),
+        },
+        "ai_jobs": gauges.get("ai_jobs", {"running": 0, "failed": 0, "queued": 0}),
+        "ai_usage_24h": {
+            "total_runs": total_runs,
+            "failed_runs": failed_runs,
+            "error_rate": round(error_rate, 2),
+            "total_cost": round(last_24h["ai_cost"], 4),
+        },
+        "errors_24h": {
+            "count": last_24h["errors"],
+            "top_errors": [{"type": t, "count": c} for t, c in top_errors],
+        },
+        "support": {
+            "open_tickets": gauges.get("open_tickets", 0),
+        },
+        "computed_at": gauges.get("computed_at"),
+    }
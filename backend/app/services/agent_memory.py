@@ -0,0 +1,153 @@
+"""
+Agent Memory - bounded, summarized history per conversation
+
+Coding agents are process-wide singletons, so history kept on the agent grew
+without limit and was shared by every user. History now belongs to a
+conversation (`agent_conversations.memory`) and is bounded by a token budget:
+
+- each turn is clipped to AGENT_MEMORY_TURN_MAX_TOKENS (head and tail kept)
+- when the turns outgrow AGENT_MEMORY_TOKEN_BUDGET, the oldest ones are
+  folded into a rolling summary - one line per turn, code reduced to the
+  files it produced - and the summary keeps only its newest lines
+- hot conversations are cached in-process; idle ones are evicted after
+  AGENT_MEMORY_IDLE_SECONDS and reloaded from Mongo on the next turn
+
+Process memory is therefore capped at roughly
+AGENT_MEMORY_MAX_CONVERSATIONS x (budget + summary), whatever the traffic.
+The full transcript shown in the UI stays in `messages`; this is only the
+context handed to the model.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from cachetools import TTLCache
+
+from app.core.config import (
+    AGENT_MEMORY_TOKEN_BUDGET,
+    AGENT_MEMORY_SUMMARY_TOKENS,
+    AGENT_MEMORY_TURN_MAX_TOKENS,
+    AGENT_MEMORY_MAX_CONVERSATIONS,
+    AGENT_MEMORY_IDLE_SECONDS,
+)
+from app.db.mongo import db
+from app.services.code_fences import extract_code_blocks
+
+
+# Always keep the latest exchange verbatim, even over budget
+MIN_TURNS = 2
+SUMMARY_LINE_CHARS = 200
+
+_cache: TTLCache = TTLCache(maxsize=AGENT_MEMORY_MAX_CONVERSATIONS, ttl=AGENT_MEMORY_IDLE_SECONDS)
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    return (len(text or "") + 3) // 4
+
+
+def _empty() -> Dict[str, Any]:
+    return {"summary": [], "turns": []}
+
+
+# =============================================================================
+# COMPACTION
+# =============================================================================
+
+def clip_turn(content: str, max_tokens: int = AGENT_MEMORY_TURN_MAX_TOKENS) -> str:
+    """Keep the head and tail of an oversized turn."""
+    max_chars = max_tokens * 4
+    if len(content) <= max_chars:
+        return content
+    half = max_chars // 2
+    return f"{content[:half]}\n[... {len(content) - 2 * half} characters omitted ...]\n{content[-half:]}"
+
+
+def summarize_turn(turn: Dict[str, str]) -> str:
+    """One summary line: the prose before any code, plus the files it produced."""
+    content = turn.get("content") or ""
+    prose = " ".join(content.split("```", 1)[0].split())
+    if len(prose) > SUMMARY_LINE_CHARS:
+        prose = prose[:SUMMARY_LINE_CHARS - 3] + "..."
+    line = f"{turn.get('role', 'user').capitalize()}: {prose or '(code only)'}"
+
+    files = [b["filename"] for b in extract_code_blocks(content) if b.get("filename")]
+    if files:
+        line += f" [files: {', '.join(files[:8])}]"
+    return line
+
+
+def compact(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Fold the oldest turns into the summary until the state fits the budget."""
+    turns = state["turns"]
+    summary = state["summary"]
+    used = sum(estimate_tokens(t["content"]) for t in turns) + sum(estimate_tokens(line) for line in summary)
+
+    while used > AGENT_MEMORY_TOKEN_BUDGET and len(turns) > MIN_TURNS:
+        turn = turns.pop(0)
+        line = summarize_turn(turn)
+        summary.append(line)
+        used += estimate_tokens(line) - estimate_tokens(turn["content"])
+
+    summary_tokens = sum(estimate_tokens(line) for line in summary)
+    while summary and summary_tokens > AGENT_MEMORY_SUMMARY_TOKENS:
+        summary_tokens -= estimate_tokens(summary.pop(0))
+    return state
+
+
+def to_messages(state: Dict[str, Any]) -> List[Dict[str, str]]:
+    """The state as chat messages: the summary (if any) first, then the turns."""
+    messages = []
+    if state["summary"]:
+        messages.append({
+            "role": "system",
+            "content": "Summary of the earlier conversation:\n" + "\n".join(f"- {line}" for line in state["summary"]),
+        })
+    messages.extend({"role": t["role"], "content": t["content"]} for t in state["turns"])
+    return messages
+
+
+# =============================================================================
+# STORE
+# =============================================================================
+
+async def _load(conversation_id: str) -> Dict[str, Any]:
+    state = _cache.get(conversation_id)
+    if state is None:
+        doc = await db.agent_conversations.find_one({"id": conversation_id}, {"_id": 0, "memory": 1})
+        memory = (doc or {}).get("memory") or {}
+        state = {"summary": list(memory.get("summary") or []), "turns": list(memory.get("turns") or [])}
+    # Re-inserting restarts the idle timer
+    _cache[conversation_id] = state
+    return state
+
+
+async def get_history(conversation_id: Optional[str]) -> List[Dict[str, str]]:
+    """Context messages for the next model call in a conversation."""
+    if not conversation_id:
+        return []
+    return to_messages(await _load(conversation_id))
+
+
+async def remember(conversation_id: Optional[str], *turns: Dict[str, str]):
+    """Append turns ({"role", "content"}) to a conversation's memory and persist it."""
+    if not conversation_id:
+        return
+    state = await _load(conversation_id)
+    for turn in turns:
+        if turn.get("content"):
+            state["turns"].append({"role": turn["role"], "content": clip_turn(turn["content"])})
+    compact(state)
+
+    await db.agent_conversations.update_one(
+        {"id": conversation_id},
+        {"$set": {"memory": {
+            **state,
+            "tokens": sum(estimate_tokens(t["content"]) for t in state["turns"]),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }}},
+    )
+
+
+def forget(conversation_id: str):
+    """Drop a conversation from the in-process cache (e.g. after deleting it)."""
+    _cache.pop(conversation_id, None)
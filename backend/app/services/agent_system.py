@@ -12,84 +12,66 @@ from typing import Dict, List, Optional, Tuple, Any, AsyncGenerator
 from enum import Enum
 
 from app.db.mongo import db
+from app.services.retention import with_retention_date
+from app.services.blob_store import put_blob, externalize, hydrate_refs
+from app.services.preview_cache import add_preview_file, finish_preview
+from app.services.project_files import context_for_turn, save_blocks
+from app.services.job_registry import reserve_job, run_job, cancel_job, job_task
+from app.services.intent_router import analyze_query
+from app.services.code_fences import FenceParser
+from app.services.plan_executor import (
+    normalize_plan, run_plan, STEP_STARTED, STEP_EVENT, STEP_COMPLETED, STEP_FAILED
+)
 from app.models.build import (
     BuildJob, BuildEvent, BuildStatus, AgentType, EventType,
     PlanStep, ChatMessage
 )
-from app.services.ai_router import call_ai_provider
+from app.services.ai_router import complete
+
+
+# =============================================================================
+# EVENT STORAGE
+# =============================================================================
+# Events are streamed to the client with their code inline, but persisted
+# with the code moved to the blob store (FILE_CREATED carries a file, the
+# AI message carries every block again).
+
+async def compact_event_payload(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of an event dict with code payloads replaced by blob refs."""
+    data = event.get("data")
+    if not data:
+        return event
+    data = dict(data)
+    if isinstance(data.get("code"), str):
+        data["code_ref"] = await put_blob(data.pop("code"))
+    if data.get("code_blocks"):
+        data["code_blocks"] = await externalize(data["code_blocks"], {"code": "code_ref"})
+    return {**event, "data": data}
+
+
+async def hydrate_event_payloads(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Inverse of compact_event_payload for a batch of stored events."""
+    payloads = [e["data"] for e in events if e.get("data")]
+    blocks = [b for d in payloads for b in d.get("code_blocks") or []]
+    await hydrate_refs(payloads + blocks, {"code_ref": "code"})
+    return events
 
 
 class AgentRouter:
     """
     Routes queries to the appropriate agent based on intent.
+    Keyword scoring lives in intent_router, shared with the other routers.
     """
     
-    # Intent classification patterns
-    CODE_PATTERNS = [
-        "write", "code", "script", "program", "create app", "build", "develop",
-        "make a", "generate", "implement", "function", "class", "api",
-        "website", "web app", "frontend", "backend", "database", "server",
-        "python", "javascript", "react", "node", "html", "css"
-    ]
-    
-    FILE_PATTERNS = [
-        "file", "folder", "directory", "find", "locate", "search for",
-        "move", "copy", "delete", "rename", "organize", "list files"
-    ]
-    
-    WEB_PATTERNS = [
-        "search", "browse", "look up", "find online", "google",
-        "latest news", "weather", "stock", "price", "what is"
-    ]
-    
-    MCP_PATTERNS = [
-        "use mcp", "mcp tool", "model context", "external tool",
-        "calendar", "email", "slack", "github api", "database query"
-    ]
-    
     @classmethod
     def classify_intent(cls, query: str) -> AgentType:
         """Classify user query to determine best agent"""
-        query_lower = query.lower()
-        
-        # Check for explicit MCP request
-        if any(p in query_lower for p in cls.MCP_PATTERNS):
-            return AgentType.MCP
-        
-        # Check for code/build tasks
-        if any(p in query_lower for p in cls.CODE_PATTERNS):
-            return AgentType.CODER
-        
-        # Check for file operations
-        if any(p in query_lower for p in cls.FILE_PATTERNS):
-            return AgentType.FILE
-        
-        # Check for web/search tasks
-        if any(p in query_lower for p in cls.WEB_PATTERNS):
-            return AgentType.BROWSER
-        
-        # Default to casual for conversation
-        return AgentType.CASUAL
+        return AgentType(analyze_query(query).agent or AgentType.CASUAL.value)
     
     @classmethod
     def is_complex_task(cls, query: str) -> bool:
         """Determine if task needs planning (multiple steps)"""
-        complexity_indicators = [
-            "and then", "after that", "multiple", "several",
-            "complete", "full", "entire", "project",
-            "step by step", "workflow", "process"
-        ]
-        query_lower = query.lower()
-        
-        # Long queries are likely complex
-        if len(query.split()) > 20:
-            return True
-        
-        # Check for complexity indicators
-        if any(ind in query_lower for ind in complexity_indicators):
-            return True
-        
-        return False
+        return analyze_query(query).needs_planner
 
 
 class BaseAgent:
@@ -132,10 +114,14 @@ Be concise but helpful. If the user wants to build something, suggest they descr
             {"role": "user", "content": prompt}
         ]
         
-        response = await call_ai_provider(
-            messages=messages,
+        response = await complete(
+            messages,
             provider=context.get("provider", "auto"),
-            model=context.get("model", "auto")
+            model=context.get("model", "auto"),
+            user_id=context.get("user_id"),
+            project_id=context.get("project_id"),
+            job_id=job_id,
+            agent_type=self.agent_type.value
         )
         
         yield BuildEvent(
@@ -143,8 +129,8 @@ Be concise but helpful. If the user wants to build something, suggest they descr
             job_id=job_id,
             type=EventType.AI_MESSAGE,
             agent=self.agent_type,
-            message=response.get("content", "I'm not sure how to help with that."),
-            data={"model": response.get("model"), "provider": response.get("provider")},
+            message=response.text or "I'm not sure how to help with that.",
+            data={"model": response.model, "provider": response.provider, "tokens": response.tokens, "cost": response.cost},
             timestamp=datetime.now(timezone.utc).isoformat()
         )
 
@@ -184,14 +170,10 @@ Respond with your reasoning first, then provide the code."""
             timestamp=datetime.now(timezone.utc).isoformat()
         )
         
-        # Build context with existing files if project exists
-        files_context = ""
-        if project_id:
-            project = await db.projects.find_one({"id": project_id})
-            if project and project.get("files"):
-                files_context = "\n\nExisting project files:\n"
-                for f in project.get("files", [])[:5]:
-                    files_context += f"- {f.get('name')}: {f.get('description', 'No description')}\n"
+        # Project files: content only for what changed since the model last saw them
+        files_context = await context_for_turn(project_id)
+        if files_context:
+            files_context = "\n\n" + files_context
         
         messages = [
             {"role": "system", "content": self.system_prompt + files_context},
@@ -207,22 +189,26 @@ Respond with your reasoning first, then provide the code."""
             timestamp=datetime.now(timezone.utc).isoformat()
         )
         
-        response = await call_ai_provider(
-            messages=messages,
+        response = await complete(
+            messages,
             provider=context.get("provider", "auto"),
-            model=context.get("model", "auto")
+            model=context.get("model", "auto"),
+            user_id=context.get("user_id"),
+            project_id=context.get("project_id"),
+            job_id=job_id,
+            agent_type=self.agent_type.value
         )
         
-        content = response.get("content", "")
+        content = response.text
         
-        # Extract code blocks
-        code_blocks = self._extract_code_blocks(content)
+        # Extract code blocks - each file is announced as soon as its fence closes
+        parser = FenceParser()
         files_created = []
         
-        for i, block in enumerate(code_blocks):
-            lang = block.get("language", "text")
-            code = block.get("code", "")
-            filename = block.get("filename") or self._infer_filename(lang, i)
+        for block in parser.feed(content) + parser.close():
+            lang = block["language"]
+            code = block["code"]
+            filename = block["filename"]
             
             yield BuildEvent(
                 id=str(uuid.uuid4()),
@@ -234,6 +220,7 @@ Respond with your reasoning first, then provide the code."""
                 timestamp=datetime.now(timezone.utc).isoformat()
             )
             files_created.append(filename)
+        code_blocks = parser.blocks
         
         # Check if it's a web project for preview
         is_web_project = any(f.endswith(('.html', '.jsx', '.tsx')) for f in files_created)
@@ -245,8 +232,10 @@ Respond with your reasoning first, then provide the code."""
             agent=self.agent_type,
             message=content,
             data={
-                "model": response.get("model"),
-                "provider": response.get("provider"),
+                "model": response.model,
+                "provider": response.provider,
+                "tokens": response.tokens,
+                "cost": response.cost,
                 "code_blocks": code_blocks,
                 "files_created": files_created,
                 "has_preview": is_web_project
@@ -264,67 +253,6 @@ Respond with your reasoning first, then provide the code."""
                 data={"files": files_created},
                 timestamp=datetime.now(timezone.utc).isoformat()
             )
-    
-    def _extract_code_blocks(self, content: str) -> List[Dict]:
-        """Extract code blocks from markdown content"""
-        blocks = []
-        import re
-        
-        # Pattern for ```language\ncode\n```
-        pattern = r'```(\w+)?\n(.*?)```'
-        matches = re.findall(pattern, content, re.DOTALL)
-        
-        for i, (lang, code) in enumerate(matches):
-            lang = lang or "text"
-            # Try to extract filename from comment
-            filename = None
-            lines = code.strip().split('\n')
-            if lines and ('filename:' in lines[0].lower() or 'file:' in lines[0].lower()):
-                filename = lines[0].split(':')[-1].strip().strip('"\'')
-                code = '\n'.join(lines[1:])
-            
-            blocks.append({
-                "language": lang,
-                "code": code.strip(),
-                "filename": filename
-            })
-        
-        return blocks
-    
-    def _infer_filename(self, lang: str, index: int) -> str:
-        """Infer filename from language"""
-        ext_map = {
-            "python": ".py",
-            "javascript": ".js",
-            "typescript": ".ts",
-            "html": ".html",
-            "css": ".css",
-            "json": ".json",
-            "jsx": ".jsx",
-            "tsx": ".tsx",
-            "go": ".go",
-            "rust": ".rs",
-            "java": ".java",
-            "c": ".c",
-            "cpp": ".cpp",
-            "bash": ".sh",
-            "shell": ".sh",
-            "sql": ".sql",
-            "yaml": ".yaml",
-            "yml": ".yml",
-        }
-        ext = ext_map.get(lang.lower(), ".txt")
-        
-        if lang.lower() == "html":
-            return "index.html" if index == 0 else f"page{index}.html"
-        elif lang.lower() == "css":
-            return "styles.css" if index == 0 else f"styles{index}.css"
-        elif lang.lower() in ["javascript", "js"]:
-            return "script.js" if index == 0 else f"script{index}.js"
-        elif lang.lower() == "python":
-            return "main.py" if index == 0 else f"module{index}.py"
-        else:
-            return f"file{index}{ext}"
 
 
 class PlannerAgent(BaseAgent):
@@ -345,13 +273,14 @@ Respond with a JSON plan in this format:
 ```json
 {
   "plan": [
-    {"id": "1", "agent": "coder", "task": "Create the HTML structure"},
-    {"id": "2", "agent": "coder", "task": "Add CSS styling"},
-    {"id": "3", "agent": "coder", "task": "Implement JavaScript functionality"}
+    {"id": "1", "agent": "coder", "task": "Create the HTML structure", "dependencies": []},
+    {"id": "2", "agent": "coder", "task": "Add CSS styling", "dependencies": ["1"]},
+    {"id": "3", "agent": "coder", "task": "Implement JavaScript functionality", "dependencies": ["1"]}
   ]
 }
 ```
 
+List in "dependencies" the ids of the steps whose output a step needs; steps without dependencies on each other run in parallel.
 Keep plans concise (3-5 steps for most tasks). Be specific in task descriptions."""
     
     async def process(self, prompt: str, context: Dict = None) -> AsyncGenerator[BuildEvent, None]:
@@ -372,13 +301,18 @@ Keep plans concise (3-5 steps for most tasks). Be specific in task descriptions.
             {"role": "user", "content": f"Create a plan for: {prompt}"}
         ]
         
-        response = await call_ai_provider(
-            messages=messages,
+        response = await complete(
+            messages,
             provider=context.get("provider", "auto"),
-            model=context.get("model", "auto")
+            model=context.get("model", "auto"),
+            temperature=0,
+            user_id=context.get("user_id"),
+            project_id=context.get("project_id"),
+            job_id=job_id,
+            agent_type=self.agent_type.value
         )
         
-        content = response.get("content", "")
+        content = response.text
         plan = self._parse_plan(content)
         
         if not plan:
@@ -405,56 +339,70 @@ Keep plans concise (3-5 steps for most tasks). Be specific in task descriptions.
             timestamp=datetime.now(timezone.utc).isoformat()
         )
         
-        # Execute each step
-        accumulated_context = context.copy() if context else {}
-        accumulated_results = []
+        # Execute steps as a dependency graph; independent steps run concurrently
+        steps = normalize_plan(plan)
+        user_id = context.get("user_id")
         
-        for i, step in enumerate(plan):
-            step_id = step.get("id", str(i + 1))
-            agent_type_str = step.get("agent", "coder")
-            task = step.get("task", "")
-            
+        async def run_step(step: Dict, inputs: Dict, emit) -> str:
             try:
-                agent_type = AgentType(agent_type_str)
-            except:
+                agent_type = AgentType(step.get("agent", "coder"))
+            except ValueError:
                 agent_type = AgentType.CODER
-            
-            yield BuildEvent(
-                id=str(uuid.uuid4()),
-                job_id=job_id,
-                type=EventType.PLAN_STEP_STARTED,
-                agent=agent_type,
-                message=f"Step {step_id}: {task}",
-                data={"step_id": step_id, "agent": agent_type_str, "task": task},
-                timestamp=datetime.now(timezone.utc).isoformat()
-            )
-            
-            # Get the agent
             agent = self.agents.get(agent_type, self.agents[AgentType.CODER])
             
-            # Build task prompt with context from previous steps
-            task_prompt = task
-            if accumulated_results:
-                task_prompt = f"Previous work:\n{chr(10).join(accumulated_results[-2:])}\n\nNow: {task}"
+            # Build task prompt with context from the steps this one depends on
+            task = step.get("task", "")
+            previous = [f"Step {dep}: {(result or '')[:200]}..." for dep, result in inputs.items()]
+            task_prompt = f"Previous work:\n{chr(10).join(previous)}\n\nNow: {task}" if previous else task
             
-            # Execute step
             step_result = ""
-            async for event in agent.process(task_prompt, accumulated_context):
-                yield event
+            # Each step gets its own context copy - steps may run at the same time
+            async for event in agent.process(task_prompt, dict(context)):
+                emit(event)
                 if event.type == EventType.AI_MESSAGE:
                     step_result = event.message
+            return step_result
+        
+        async for item in run_plan(steps, run_step, user_id=user_id):
+            step_id = item["step_id"]
+            step = next(s for s in steps if s["id"] == step_id)
+            agent_type_str = step.get("agent", "coder")
             
-            accumulated_results.append(f"Step {step_id}: {step_result[:200]}...")
-            
-            yield BuildEvent(
-                id=str(uuid.uuid4()),
-                job_id=job_id,
-                type=EventType.PLAN_STEP_COMPLETED,
-                agent=agent_type,
-                message=f"Completed step {step_id}",
-                data={"step_id": step_id},
-                timestamp=datetime.now(timezone.utc).isoformat()
-            )
+            if item["type"] == STEP_EVENT:
+                yield item["event"]
+            elif item["type"] == STEP_STARTED:
+                yield BuildEvent(
+                    id=str(uuid.uuid4()),
+                    job_id=job_id,
+                    type=EventType.PLAN_STEP_START,
+                    agent=agent_type_str,
+                    message=f"Step {step_id}: {step.get('task', '')}",
+                    data={"step_id": step_id, "agent": agent_type_str, "task": step.get("task", ""),
+                          "dependencies": step["dependencies"]},
+                    timestamp=datetime.now(timezone.utc).isoformat()
+                )
+            elif item["type"] == STEP_COMPLETED:
+                yield BuildEvent(
+                    id=str(uuid.uuid4()),
+                    job_id=job_id,
+                    type=EventType.PLAN_STEP_COMPLETE,
+                    agent=agent_type_str,
+                    message=f"Completed step {step_id}",
+                    data={"step_id": step_id, "duration_ms": item["duration_ms"]},
+                    timestamp=datetime.now(timezone.utc).isoformat()
+                )
+            else:
+                failed = item["type"] == STEP_FAILED
+                yield BuildEvent(
+                    id=str(uuid.uuid4()),
+                    job_id=job_id,
+                    type=EventType.ERROR,
+                    agent=agent_type_str,
+                    message=f"Step {step_id} failed: {item['error']}" if failed else f"Skipped step {step_id}: {item['reason']}",
+                    data={"step_id": step_id, "status": "failed" if failed else "cancelled",
+                          "error": item.get("error"), "reason": item.get("reason")},
+                    timestamp=datetime.now(timezone.utc).isoformat()
+                )
     
     def _parse_plan(self, content: str) -> List[Dict]:
         """Parse plan from AI response"""
@@ -481,7 +429,8 @@ Keep plans concise (3-5 steps for most tasks). Be specific in task descriptions.
 
 class AgentOrchestrator:
     """
-    Main orchestrator that manages agents and job execution.
+    Main orchestrator that manages agents and job execution. Jobs run as
+    tasks in the job registry, so they outlive the request that started them.
     """
     
     def __init__(self):
@@ -497,9 +446,6 @@ class AgentOrchestrator:
         # Planner has access to all agents
         self.planner_agent = PlannerAgent(self.agents)
         self.agents[AgentType.PLANNER] = self.planner_agent
-        
-        # Active jobs
-        self.active_jobs: Dict[str, asyncio.Task] = {}
     
     async def start_job(
         self,
@@ -508,11 +454,14 @@ class AgentOrchestrator:
         project_id: Optional[str] = None,
         model: str = "auto",
         provider: str = "auto"
-    ) -> AsyncGenerator[BuildEvent, None]:
-        """Start a new build job and stream events"""
-        
+    ) -> Optional[str]:
+        """
+        Create a build job and run it detached from the caller. Returns the
+        job id, or None when the user already has their maximum of jobs running.
+        """
         job_id = str(uuid.uuid4())
-        now = datetime.now(timezone.utc).isoformat()
+        if not await reserve_job(job_id, user_id, kind="build"):
+            return None
         
         # Create job record
         job = BuildJob(
@@ -523,21 +472,39 @@ class AgentOrchestrator:
             status=BuildStatus.QUEUED,
             model=model,
             provider=provider,
-            created_at=now
+            created_at=datetime.now(timezone.utc).isoformat()
         )
         
         # Save to DB
         await db.build_jobs.insert_one(job.dict())
         
+        run_job(job_id, self._run_job(job_id, prompt, user_id, project_id, model, provider))
+        return job_id
+    
+    async def _emit(self, event: BuildEvent):
+        await db.build_events.insert_one(with_retention_date(await compact_event_payload(event.dict())))
+    
+    async def _run_job(
+        self,
+        job_id: str,
+        prompt: str,
+        user_id: str,
+        project_id: Optional[str],
+        model: str,
+        provider: str
+    ):
+        """Run a job to completion, storing its events for the streams."""
+        now = datetime.now(timezone.utc).isoformat()
+        
         # Emit job started
-        yield BuildEvent(
+        await self._emit(BuildEvent(
             id=str(uuid.uuid4()),
             job_id=job_id,
             type=EventType.JOB_STARTED,
             message="Job started",
             data={"job_id": job_id, "prompt": prompt},
             timestamp=now
-        )
+        ))
         
         # Update status
         await db.build_jobs.update_one(
@@ -549,7 +516,7 @@ class AgentOrchestrator:
         intent = AgentRouter.classify_intent(prompt)
         is_complex = AgentRouter.is_complex_task(prompt)
         
-        yield BuildEvent(
+        await self._emit(BuildEvent(
             id=str(uuid.uuid4()),
             job_id=job_id,
             type=EventType.AGENT_SELECTED,
@@ -557,7 +524,7 @@ class AgentOrchestrator:
             message=f"Selected {'Planner' if is_complex else intent.value} agent",
             data={"intent": intent.value, "is_complex": is_complex},
             timestamp=datetime.now(timezone.utc).isoformat()
-        )
+        ))
         
         # Update job with agent
         selected_agent = AgentType.PLANNER if is_complex else intent
@@ -577,17 +544,23 @@ class AgentOrchestrator:
         
         agent = self.agents.get(selected_agent, self.casual_agent)
         files_created = []
+        file_blocks = []
         
         try:
             async for event in agent.process(prompt, context):
-                # Save event to DB
-                await db.build_events.insert_one(event.dict())
+                await self._emit(event)
                 
                 # Track files
                 if event.type == EventType.FILE_CREATED:
                     files_created.append(event.data.get("filename"))
-                
-                yield event
+                    file_blocks.append(event.data)
+                    await add_preview_file(
+                        job_id, user_id,
+                        event.data.get("filename"), event.data.get("language"), event.data.get("code"),
+                    )
+            
+            # The files become part of the project in one batched write
+            await save_blocks(project_id, file_blocks, source="agent")
             
             # Job completed
             await db.build_jobs.update_one(
@@ -601,15 +574,21 @@ class AgentOrchestrator:
                     }
                 }
             )
+            await finish_preview(job_id)
             
-            yield BuildEvent(
+            await self._emit(BuildEvent(
                 id=str(uuid.uuid4()),
                 job_id=job_id,
                 type=EventType.JOB_COMPLETED,
                 message="Job completed successfully",
                 data={"files_created": files_created},
                 timestamp=datetime.now(timezone.utc).isoformat()
-            )
+            ))
+        
+        except asyncio.CancelledError:
+            # Stopped: the agent's in-flight LLM request was aborted with the task
+            await self._finish_cancelled(job_id, files_created)
+            raise
             
         except Exception as e:
             # Job failed
@@ -623,32 +602,55 @@ class AgentOrchestrator:
                     }
                 }
             )
+            await finish_preview(job_id)
             
-            yield BuildEvent(
+            await self._emit(BuildEvent(
                 id=str(uuid.uuid4()),
                 job_id=job_id,
                 type=EventType.JOB_FAILED,
                 message=f"Job failed: {str(e)}",
                 data={"error": str(e)},
                 timestamp=datetime.now(timezone.utc).isoformat()
-            )
+            ))
     
-    async def stop_job(self, job_id: str) -> bool:
-        """Stop a running job"""
-        if job_id in self.active_jobs:
-            self.active_jobs[job_id].cancel()
-            del self.active_jobs[job_id]
-        
-        await db.build_jobs.update_one(
-            {"id": job_id},
+    async def _finish_cancelled(self, job_id: str, files_created: Optional[List[str]] = None):
+        result = await db.build_jobs.update_one(
+            {"id": job_id, "status": {"$nin": [BuildStatus.COMPLETED, BuildStatus.FAILED, BuildStatus.CANCELLED]}},
             {
                 "$set": {
                     "status": BuildStatus.CANCELLED,
-                    "completed_at": datetime.now(timezone.utc).isoformat()
+                    "completed_at": datetime.now(timezone.utc).isoformat(),
+                    "files_created": files_created or [],
                 }
             }
         )
-        return True
+        if not result.modified_count:
+            return
+        await finish_preview(job_id)
+        await self._emit(BuildEvent(
+            id=str(uuid.uuid4()),
+            job_id=job_id,
+            type=EventType.JOB_CANCELLED,
+            message="Job cancelled",
+            data={"files_created": files_created or []},
+            timestamp=datetime.now(timezone.utc).isoformat()
+        ))
+    
+    async def wait_job(self, job_id: str):
+        """Wait for a job started here to end; the job isn't cancelled if the waiter is."""
+        task = job_task(job_id)
+        if task is not None:
+            await asyncio.wait({task})
+    
+    async def stop_job(self, job_id: str) -> bool:
+        """
+        Stop a job wherever it runs; its task marks it cancelled. A job no
+        worker is running any more (its worker died) is marked here.
+        """
+        if await cancel_job(job_id):
+            return True
+        await self._finish_cancelled(job_id)
+        return False
     
     async def get_job(self, job_id: str) -> Optional[Dict]:
         """Get job details"""
@@ -661,7 +663,7 @@ class AgentOrchestrator:
             {"job_id": job_id},
             {"_id": 0}
         ).sort("timestamp", 1).to_list(1000)
-        return events
+        return await hydrate_event_payloads(events)
 
 
 # Global orchestrator instance
@@ -17,6 +17,9 @@ from app.services.learning_service import (
     extract_and_save_pattern, record_error, get_user_preferences,
     update_user_preferences
 )
+from app.services.retention import run_retention_jobs
+from app.services.admin_rollups import refresh_gauges, ensure_rollups_bootstrapped
+from app.services.pricing import ensure_usage_rollups_bootstrapped
 
 
 # =============================================================================
@@ -346,18 +349,8 @@ async def build_autofix_library(days_back: int = 30, min_occurrences: int = 3):
 # =============================================================================
 # CLEANUP JOBS
 # =============================================================================
-
-async def cleanup_old_events(days_to_keep: int = 90):
-    """Remove old events to save storage"""
-    cutoff = (datetime.now(timezone.utc) - timedelta(days=days_to_keep)).isoformat()
-    
-    result = await db.project_events.delete_many({
-        "created_at": {"$lt": cutoff}
-    })
-    
-    print(f"[Cleanup] Deleted {result.deleted_count} old events")
-    return result.deleted_count
-
+# project_events, build_events, error_logs, ai_runs and chat_messages are
+# expired by TTL indexes - see app/services/retention.py.
 
 async def cleanup_old_patterns(days_to_keep: int = 90, min_score: float = 0.3):
     """Remove low-performing old patterns"""
@@ -396,7 +389,7 @@ async def run_nightly_jobs():
     await extract_winning_patterns()
     await aggregate_user_preferences()
     await build_autofix_library()
-    await cleanup_old_events()
+    await run_retention_jobs()
     await cleanup_old_patterns()
     
     print("\n[Aggregator] Nightly jobs completed!\n")
@@ -422,10 +415,25 @@ async def start_aggregator_scheduler():
         last_hourly = datetime.now(timezone.utc)
         last_nightly = datetime.now(timezone.utc)
         
+        try:
+            await ensure_rollups_bootstrapped()
+        except Exception as e:
+            print(f"[Scheduler] Rollup bootstrap failed: {e}")
+        try:
+            await ensure_usage_rollups_bootstrapped()
+        except Exception as e:
+            print(f"[Scheduler] Usage rollup bootstrap failed: {e}")
+        
         while True:
             try:
                 now = datetime.now(timezone.utc)
                 
+                # Refresh admin dashboard gauges every tick
+                try:
+                    await refresh_gauges()
+                except Exception as e:
+                    print(f"[Scheduler] Gauge refresh failed: {e}")
+                
                 # Run hourly jobs
                 if (now - last_hourly).seconds >= 3600:
                     try:
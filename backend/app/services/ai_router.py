@@ -2,17 +2,29 @@
 AI Router Service - Direct API Integration
 Nirman AI Builder - Direct API calls to AI providers (No third-party wrappers)
 Supports: OpenAI, Gemini, Claude, Grok, DeepSeek
+
+Every model call goes through `complete(messages, ...)`, which returns an
+LLMResult (text, usage, cost, latency, provider, model, cache hit) and
+shares the pooled HTTP client, per-provider concurrency limit, response
+cache, run logging and metrics. Runs are priced and metered when logged
+(app/services/pricing.py). `generate_code` is the website-builder shortcut
+on top of it.
 """
 
+import asyncio
+import hashlib
 import traceback
 import time
 import uuid
 import json
 import httpx
 import os
+from collections import defaultdict
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from cryptography.fernet import Fernet
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 # Load env variables
@@ -39,7 +51,25 @@ from app.core.config import (
     DEFAULT_AI_PROVIDER
 )
 from app.db.mongo import db
-from app.core.config import ENCRYPTION_KEY as CONFIG_ENCRYPTION_KEY
+from app.services.retention import with_retention_date
+from app.services.admin_rollups import record_ai_run, record_error
+from app.services.pricing import (
+    get_price_table,
+    current_price_table,
+    count_tokens,
+    count_message_tokens,
+    record_usage,
+)
+from app.core.config import ENCRYPTION_KEY as CONFIG_ENCRYPTION_KEY, BYO_KEY_CACHE_TTL_SECONDS
+from app.core.config import (
+    LLM_TIMEOUT_SECONDS,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_CONCURRENCY_PER_PROVIDER,
+    LLM_DEFAULT_MAX_TOKENS,
+    LLM_CACHE_TTL_SECONDS,
+    LLM_CACHE_MAX_ENTRIES,
+    PROVIDER_HEALTH_TTL_SECONDS,
+)
 
 # Encryption key for BYO API keys - use from config or generate fallback
 # WARNING: If no ENCRYPTION_KEY in env, keys will be lost on restart!
@@ -259,7 +289,7 @@ MODEL_CONFIG = {
     }
 }
 
-# Model pricing (approx per 1K tokens)
+# Model pricing (approx per 1K tokens) - the built-in price table, see app/services/pricing.py
 MODEL_PRICING = {
     "gpt-4o": {"input": 0.005, "output": 0.015},
     "gpt-4o-mini": {"input": 0.00015, "output": 0.0006},
@@ -330,11 +360,15 @@ async def log_ai_run(
     error_message: str = None,
     project_id: str = None,
     job_id: str = None,
-    is_byo_key: bool = False
+    is_byo_key: bool = False,
+    cost: float = None,
+    agent_type: str = None,
+    llm_key_id: str = None
 ):
-    """Log AI run to database"""
-    pricing = MODEL_PRICING.get(model, {"input": 0.001, "output": 0.002})
-    cost = (tokens_in / 1000 * pricing["input"]) + (tokens_out / 1000 * pricing["output"])
+    """Log AI run to database, priced with the active price table, and add it to the usage rollups"""
+    table = await get_price_table()
+    if cost is None:
+        cost = table.cost(provider, model, tokens_in, tokens_out)
     
     ai_run = {
         "id": str(uuid.uuid4()),
@@ -345,14 +379,21 @@ async def log_ai_run(
         "model": model,
         "tokens_in": tokens_in,
         "tokens_out": tokens_out,
+        "tokens_used": tokens_in + tokens_out,
         "latency_ms": latency_ms,
         "status": status,
         "error_message": error_message,
         "cost_estimate": round(cost, 6),
+        "price_version": table.version,
         "is_byo_key": is_byo_key,
+        "llm_key_id": llm_key_id,
+        "agent_type": agent_type,
+        "rolled_up": True,  # counted by record_usage below, so the usage backfill skips it
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.ai_runs.insert_one(ai_run)
+    await db.ai_runs.insert_one(with_retention_date(ai_run))
+    await record_ai_run(status, ai_run["cost_estimate"])
+    await record_usage(ai_run)
     return ai_run
 
 async def log_error(error_type: str, error_message: str, endpoint: str, user_id: str = None, stack_trace: str = None):
@@ -366,362 +407,217 @@ async def log_error(error_type: str, error_message: str, endpoint: str, user_id:
         "stack_trace": stack_trace,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.error_logs.insert_one(error_doc)
+    await db.error_logs.insert_one(with_retention_date(error_doc))
+    await record_error(error_type)
 
 # =============================================================================
 # USER KEY MANAGEMENT
 # =============================================================================
 
+# Decrypted BYO keys (or None for "no active key"), keyed by (user_id, provider).
+# Saves a Mongo lookup and a Fernet decrypt on every generation.
+_byo_key_cache: TTLCache = TTLCache(maxsize=10000, ttl=BYO_KEY_CACHE_TTL_SECONDS)
+
 async def get_user_ai_key(user_id: str, provider: str) -> Optional[str]:
     """Get user's BYO API key for a provider"""
+    cache_key = (user_id, provider)
+    if cache_key in _byo_key_cache:
+        return _byo_key_cache[cache_key]
+    
     key_doc = await db.user_ai_keys.find_one({
         "user_id": user_id,
         "provider": provider,
         "is_active": True
-    })
-    if key_doc:
-        return decrypt_api_key(key_doc["encrypted_key"])
-    return None
+    }, {"_id": 0, "encrypted_key": 1})
+    api_key = decrypt_api_key(key_doc["encrypted_key"]) if key_doc else None
+    _byo_key_cache[cache_key] = api_key
+    return api_key
+
+def invalidate_user_ai_key(user_id: str, provider: str):
+    """Drop a cached BYO key after it is added, replaced, toggled or deleted."""
+    _byo_key_cache.pop((user_id, provider), None)
+
+# Provider enable/block flags, re-read at most every PROVIDER_HEALTH_TTL_SECONDS
+_provider_health: TTLCache = TTLCache(maxsize=100, ttl=PROVIDER_HEALTH_TTL_SECONDS)
 
 async def check_provider_health(provider: str) -> dict:
     """Check if AI provider is healthy"""
+    if provider in _provider_health:
+        return _provider_health[provider]
     config = await db.ai_provider_configs.find_one({"provider": provider})
     if config:
-        return {
+        health = {
             "is_enabled": config.get("is_enabled", True),
             "is_blocked": config.get("is_blocked", False),
             "health_status": config.get("health_status", "healthy")
         }
-    return {"is_enabled": True, "is_blocked": False, "health_status": "healthy"}
+    else:
+        health = {"is_enabled": True, "is_blocked": False, "health_status": "healthy"}
+    _provider_health[provider] = health
+    return health
+
+def invalidate_provider_health(provider: str):
+    """Drop a provider's cached flags after an admin changes them."""
+    _provider_health.pop(provider, None)
 
 # =============================================================================
 # DIRECT API CALLS - NO WRAPPERS
 # =============================================================================
 
-async def call_openai(
-    prompt: str, 
-    system_prompt: str, 
-    api_key: str, 
-    model: str = "gpt-5.2"
+# One pooled client for every provider call (keep-alive across requests)
+_client: Optional[httpx.AsyncClient] = None
+
+def get_llm_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=10.0),
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS // 2),
+        )
+    return _client
+
+async def close_llm_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def _post(url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> Dict[str, Any]:
+    response = await get_llm_client().post(url, headers=headers, json=payload)
+    response.raise_for_status()
+    return response.json()
+
+def _split_system(messages: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, str]]]:
+    """System messages joined into one instruction, and the remaining turns."""
+    system = "\n\n".join(m["content"] for m in messages if m["role"] == "system" and m.get("content"))
+    return system, [m for m in messages if m["role"] != "system"]
+
+async def call_openai_compatible(
+    provider: str,
+    messages: List[Dict[str, str]],
+    api_key: str,
+    model: str,
+    max_tokens: int,
+    temperature: float
 ) -> Dict[str, Any]:
-    """Direct call to OpenAI API"""
-    url = MODEL_CONFIG["openai"]["url"]
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    messages.append({"role": "user", "content": prompt})
-    
+    """Chat completions format: OpenAI, Grok, DeepSeek, Mistral, Groq, Together, Perplexity, Fireworks, AI21, Qwen, Moonshot, Yi, Zhipu, Hugging Face"""
+    url = MODEL_CONFIG[provider]["url"].format(model=model)
     payload = {
         "model": model,
         "messages": messages,
-        "max_tokens": 16000,
-        "temperature": 0.7
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+    data = await _post(url, {"Authorization": f"Bearer {api_key}"}, payload)
+    usage = data.get("usage") or {}
+    return {
+        "text": data["choices"][0]["message"].get("content") or "",
+        "tokens_in": usage.get("prompt_tokens"),
+        "tokens_out": usage.get("completion_tokens")
     }
-    
-    async with httpx.AsyncClient(timeout=180.0) as client:
-        response = await client.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        
-        return {
-            "text": data["choices"][0]["message"]["content"],
-            "tokens_in": data.get("usage", {}).get("prompt_tokens", 0),
-            "tokens_out": data.get("usage", {}).get("completion_tokens", 0)
-        }
 
 async def call_gemini(
-    prompt: str, 
-    system_prompt: str, 
-    api_key: str, 
-    model: str = "gemini-2.0-flash-exp"
+    messages: List[Dict[str, str]],
+    api_key: str,
+    model: str,
+    max_tokens: int,
+    temperature: float
 ) -> Dict[str, Any]:
     """Direct call to Google Gemini API"""
     url = MODEL_CONFIG["gemini"]["url"].format(model=model)
-    url = f"{url}?key={api_key}"
-    
-    headers = {
-        "Content-Type": "application/json"
-    }
-    
-    # Build contents with optional system instruction
-    contents = []
-    if system_prompt:
-        contents.append({
-            "role": "user",
-            "parts": [{"text": f"System Instructions: {system_prompt}\n\nUser Request: {prompt}"}]
-        })
-    else:
-        contents.append({
-            "role": "user", 
-            "parts": [{"text": prompt}]
-        })
+    system, turns = _split_system(messages)
     
     payload = {
-        "contents": contents,
+        "contents": [
+            {"role": "model" if m["role"] == "assistant" else "user", "parts": [{"text": m["content"]}]}
+            for m in turns
+        ],
         "generationConfig": {
-            "maxOutputTokens": 16000,
-            "temperature": 0.7
+            "maxOutputTokens": max_tokens,
+            "temperature": temperature
         }
     }
-    
-    async with httpx.AsyncClient(timeout=180.0) as client:
-        response = await client.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Extract text from Gemini response
-        text = ""
-        if "candidates" in data and len(data["candidates"]) > 0:
-            candidate = data["candidates"][0]
-            if "content" in candidate and "parts" in candidate["content"]:
-                text = candidate["content"]["parts"][0].get("text", "")
-        
-        # Gemini usage metadata
-        usage = data.get("usageMetadata", {})
-        
-        return {
-            "text": text,
-            "tokens_in": usage.get("promptTokenCount", len(prompt) // 4),
-            "tokens_out": usage.get("candidatesTokenCount", len(text) // 4)
-        }
+    if system:
+        payload["systemInstruction"] = {"parts": [{"text": system}]}
+    
+    data = await _post(url, {"x-goog-api-key": api_key}, payload)
+    
+    # Extract text from Gemini response
+    text = ""
+    if data.get("candidates"):
+        parts = data["candidates"][0].get("content", {}).get("parts", [])
+        text = "".join(part.get("text", "") for part in parts)
+    
+    usage = data.get("usageMetadata") or {}
+    return {
+        "text": text,
+        "tokens_in": usage.get("promptTokenCount"),
+        "tokens_out": usage.get("candidatesTokenCount")
+    }
 
 async def call_claude(
-    prompt: str, 
-    system_prompt: str, 
-    api_key: str, 
-    model: str = "claude-sonnet-4-20250514"
+    messages: List[Dict[str, str]],
+    api_key: str,
+    model: str,
+    max_tokens: int,
+    temperature: float
 ) -> Dict[str, Any]:
     """Direct call to Anthropic Claude API"""
-    url = MODEL_CONFIG["claude"]["url"]
-    
+    system, turns = _split_system(messages)
     headers = {
         "x-api-key": api_key,
-        "anthropic-version": "2023-06-01",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "model": model,
-        "max_tokens": 16000,
-        "messages": [{"role": "user", "content": prompt}]
-    }
-    
-    if system_prompt:
-        payload["system"] = system_prompt
-    
-    async with httpx.AsyncClient(timeout=180.0) as client:
-        response = await client.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Extract text from Claude response
-        text = ""
-        if "content" in data and len(data["content"]) > 0:
-            text = data["content"][0].get("text", "")
-        
-        return {
-            "text": text,
-            "tokens_in": data.get("usage", {}).get("input_tokens", 0),
-            "tokens_out": data.get("usage", {}).get("output_tokens", 0)
-        }
-
-async def call_grok(
-    prompt: str, 
-    system_prompt: str, 
-    api_key: str, 
-    model: str = "grok-2-latest"
-) -> Dict[str, Any]:
-    """Direct call to xAI Grok API"""
-    url = MODEL_CONFIG["grok"]["url"]
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
+        "anthropic-version": "2023-06-01"
     }
-    
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    messages.append({"role": "user", "content": prompt})
-    
     payload = {
         "model": model,
-        "messages": messages,
-        "max_tokens": 16000,
-        "temperature": 0.7
-    }
-    
-    async with httpx.AsyncClient(timeout=180.0) as client:
-        response = await client.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        
-        return {
-            "text": data["choices"][0]["message"]["content"],
-            "tokens_in": data.get("usage", {}).get("prompt_tokens", 0),
-            "tokens_out": data.get("usage", {}).get("completion_tokens", 0)
-        }
-
-async def call_deepseek(
-    prompt: str, 
-    system_prompt: str, 
-    api_key: str, 
-    model: str = "deepseek-chat"
-) -> Dict[str, Any]:
-    """Direct call to DeepSeek API (OpenAI-compatible)"""
-    url = MODEL_CONFIG["deepseek"]["url"]
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "messages": turns
     }
+    if system:
+        payload["system"] = system
     
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    messages.append({"role": "user", "content": prompt})
+    data = await _post(MODEL_CONFIG["claude"]["url"], headers, payload)
     
-    payload = {
-        "model": model,
-        "messages": messages,
-        "max_tokens": 16000,
-        "temperature": 0.7,
-        "stream": False
+    usage = data.get("usage") or {}
+    return {
+        "text": "".join(part.get("text", "") for part in data.get("content", []) if part.get("type") == "text"),
+        "tokens_in": usage.get("input_tokens"),
+        "tokens_out": usage.get("output_tokens")
     }
-    
-    async with httpx.AsyncClient(timeout=180.0) as client:
-        response = await client.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        
-        return {
-            "text": data["choices"][0]["message"]["content"],
-            "tokens_in": data.get("usage", {}).get("prompt_tokens", 0),
-            "tokens_out": data.get("usage", {}).get("completion_tokens", 0)
-        }
-
-# =============================================================================
-# OPENAI-COMPATIBLE PROVIDERS (Mistral, Groq, Together, Perplexity, Fireworks, AI21, Qwen, Moonshot, Yi, Zhipu)
-# =============================================================================
-
-async def call_openai_compatible(
-    prompt: str, 
-    system_prompt: str, 
-    api_key: str, 
-    provider: str,
-    model: str = None
-) -> Dict[str, Any]:
-    """Generic call for OpenAI-compatible APIs (Mistral, Groq, Together, Perplexity, Fireworks, AI21, Qwen, Moonshot, Yi, Zhipu)"""
-    config = MODEL_CONFIG.get(provider, {})
-    url = config.get("url", "")
-    if not model:
-        model = config.get("default_model", "")
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    messages.append({"role": "user", "content": prompt})
-    
-    payload = {
-        "model": model,
-        "messages": messages,
-        "max_tokens": 16000,
-        "temperature": 0.7,
-    }
-    
-    async with httpx.AsyncClient(timeout=180.0) as client:
-        response = await client.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        
-        return {
-            "text": data["choices"][0]["message"]["content"],
-            "tokens_in": data.get("usage", {}).get("prompt_tokens", 0),
-            "tokens_out": data.get("usage", {}).get("completion_tokens", 0)
-        }
 
 async def call_cohere(
-    prompt: str, 
-    system_prompt: str, 
-    api_key: str, 
-    model: str = "command-r-plus"
+    messages: List[Dict[str, str]],
+    api_key: str,
+    model: str,
+    max_tokens: int,
+    temperature: float
 ) -> Dict[str, Any]:
-    """Direct call to Cohere API (different format)"""
-    url = MODEL_CONFIG["cohere"]["url"]
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
+    """Direct call to Cohere API (last message + chat_history format)"""
+    system, turns = _split_system(messages)
+    *history, last = turns
     payload = {
         "model": model,
-        "message": prompt,
-        "temperature": 0.7,
+        "message": last["content"],
+        "max_tokens": max_tokens,
+        "temperature": temperature,
     }
-    
-    if system_prompt:
-        payload["preamble"] = system_prompt
-    
-    async with httpx.AsyncClient(timeout=180.0) as client:
-        response = await client.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        
-        return {
-            "text": data.get("text", ""),
-            "tokens_in": data.get("meta", {}).get("tokens", {}).get("input_tokens", 0),
-            "tokens_out": data.get("meta", {}).get("tokens", {}).get("output_tokens", 0)
-        }
-
-async def call_huggingface(
-    prompt: str, 
-    system_prompt: str, 
-    api_key: str, 
-    model: str = "meta-llama/Llama-3.3-70B-Instruct"
-) -> Dict[str, Any]:
-    """Direct call to Hugging Face Inference API"""
-    url = MODEL_CONFIG["huggingface"]["url"].format(model=model)
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
+    if history:
+        payload["chat_history"] = [
+            {"role": "CHATBOT" if m["role"] == "assistant" else "USER", "message": m["content"]}
+            for m in history
+        ]
+    if system:
+        payload["preamble"] = system
+    
+    data = await _post(MODEL_CONFIG["cohere"]["url"], {"Authorization": f"Bearer {api_key}"}, payload)
+    
+    tokens = (data.get("meta") or {}).get("billed_units") or (data.get("meta") or {}).get("tokens") or {}
+    return {
+        "text": data.get("text", ""),
+        "tokens_in": tokens.get("input_tokens"),
+        "tokens_out": tokens.get("output_tokens")
     }
-    
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    messages.append({"role": "user", "content": prompt})
-    
-    payload = {
-        "model": model,
-        "messages": messages,
-        "max_tokens": 16000,
-        "temperature": 0.7,
-        "stream": False
-    }
-    
-    async with httpx.AsyncClient(timeout=180.0) as client:
-        response = await client.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        
-        return {
-            "text": data["choices"][0]["message"]["content"],
-            "tokens_in": data.get("usage", {}).get("prompt_tokens", 0),
-            "tokens_out": data.get("usage", {}).get("completion_tokens", 0)
-        }
 
 # =============================================================================
 # PROVIDER ROUTER
@@ -729,178 +625,279 @@ async def call_huggingface(
 
 async def call_ai_provider(
     provider: str,
-    prompt: str,
-    system_prompt: str,
+    messages: List[Dict[str, str]],
     api_key: str,
-    model: str = None
+    model: str,
+    max_tokens: int = LLM_DEFAULT_MAX_TOKENS,
+    temperature: float = 0.7
 ) -> Dict[str, Any]:
-    """Route to appropriate AI provider"""
-    
-    # Get default model if not specified
-    if not model:
-        model = MODEL_CONFIG.get(provider, {}).get("default_model", "gpt-4o")
-    
-    # Providers with custom API formats
-    if provider == "openai":
-        return await call_openai(prompt, system_prompt, api_key, model)
-    elif provider == "gemini":
-        return await call_gemini(prompt, system_prompt, api_key, model)
+    """Route to appropriate AI provider; returns {"text", "tokens_in", "tokens_out"} (usage may be None)"""
+    if provider == "gemini":
+        return await call_gemini(messages, api_key, model, max_tokens, temperature)
     elif provider == "claude":
-        return await call_claude(prompt, system_prompt, api_key, model)
+        return await call_claude(messages, api_key, model, max_tokens, temperature)
     elif provider == "cohere":
-        return await call_cohere(prompt, system_prompt, api_key, model)
-    
-    # OpenAI-compatible providers
-    elif provider in ["grok", "deepseek", "mistral", "groq", "together", "perplexity", "fireworks", "ai21", "qwen", "moonshot", "yi", "zhipu"]:
-        return await call_openai_compatible(prompt, system_prompt, api_key, provider, model)
-    
-    # Hugging Face Inference API
-    elif provider == "huggingface":
-        return await call_huggingface(prompt, system_prompt, api_key, model)
-    
-    else:
-        # Default to OpenAI
-        return await call_openai(prompt, system_prompt, api_key, model)
+        return await call_cohere(messages, api_key, model, max_tokens, temperature)
+    return await call_openai_compatible(provider, messages, api_key, model, max_tokens, temperature)
 
 # =============================================================================
-# MAIN GENERATION FUNCTION
+# LLM GATEWAY
 # =============================================================================
 
-async def generate_code(
-    prompt: str,
-    ai_provider: str,
-    existing_code: str = None,
+@dataclass
+class LLMResult:
+    """One model call, as every caller sees it"""
+    text: str
+    provider: str
+    model: str
+    tokens_in: int = 0
+    tokens_out: int = 0
+    cost: float = 0.0
+    latency_ms: int = 0
+    cached: bool = False
+    is_byo_key: bool = False
+    
+    @property
+    def tokens(self) -> int:
+        return self.tokens_in + self.tokens_out
+
+
+class LLMError(Exception):
+    """A model call failed (provider disabled, no key, API error); already logged"""
+    def __init__(self, message: str, provider: str = None, model: str = None, status_code: int = None):
+        super().__init__(message)
+        self.provider = provider
+        self.model = model
+        self.status_code = status_code
+
+
+# Identical deterministic (temperature 0) calls by the same user within the TTL are answered from here
+_responses: TTLCache = TTLCache(maxsize=LLM_CACHE_MAX_ENTRIES, ttl=max(LLM_CACHE_TTL_SECONDS, 1))
+
+# In-flight requests per provider
+_provider_slots: Dict[str, asyncio.Semaphore] = {}
+
+# Per-provider counters since start-up
+_metrics: Dict[str, Dict[str, float]] = defaultdict(lambda: {
+    "requests": 0, "cache_hits": 0, "errors": 0,
+    "tokens_in": 0, "tokens_out": 0, "cost": 0.0, "latency_ms": 0,
+})
+
+def get_llm_metrics() -> Dict[str, Dict[str, float]]:
+    """Gateway counters per provider (this process)"""
+    return {provider: dict(counters) for provider, counters in _metrics.items()}
+
+def resolve_model(provider: Optional[str], model: Optional[str]) -> Tuple[str, str]:
+    """("auto" or unknown) provider and ("auto" or empty) model to concrete ones"""
+    if not provider or provider not in MODEL_CONFIG:
+        provider = DEFAULT_AI_PROVIDER if DEFAULT_AI_PROVIDER in MODEL_CONFIG else "openai"
+    if not model or model == "auto":
+        model = MODEL_CONFIG[provider]["default_model"]
+    return provider, model
+
+def estimate_cost(provider: str, model: str, tokens_in: int, tokens_out: int) -> float:
+    """Cost with the cached active price table (no I/O)"""
+    return current_price_table().cost(provider, model, tokens_in, tokens_out)
+
+def _cache_key(
+    provider: str,
+    model: str,
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    user_id: Optional[str],
+    is_byo_key: bool
+) -> str:
+    # Per user and key source: output paid for with a user's own key is never served to anyone else
+    body = json.dumps([provider, model, max_tokens, user_id, is_byo_key, messages], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+async def complete(
+    messages: List[Dict[str, str]],
+    provider: str = "auto",
+    model: Optional[str] = None,
+    max_tokens: int = LLM_DEFAULT_MAX_TOKENS,
+    temperature: float = 0.7,
     user_id: str = None,
     project_id: str = None,
     job_id: str = None,
-    is_planner: bool = False
-) -> str:
-    """Generate code using AI provider - Direct API calls
-    
-    Args:
-        prompt: The prompt to send to AI
-        ai_provider: Which AI provider to use (openai, gemini, claude, grok)
-        existing_code: Optional existing code to modify
-        user_id: User ID for logging and BYO key lookup
-        project_id: Project ID for logging
-        job_id: Job ID for logging
-        is_planner: If True, skip adding SYSTEM_PROMPT (prompt already contains full instructions)
+    agent_type: str = None,
+    use_cache: bool = True,
+    llm_key_id: str = None
+) -> LLMResult:
+    """
+    Call a model with chat messages ({"role": "system"|"user"|"assistant",
+    "content"}). Uses the user's BYO key when they have one, the pooled
+    client, the per-provider concurrency limit and (for temperature 0 calls,
+    after the provider and key checks) the per-user response cache, and
+    logs the run with its usage and cost. Runs paid with a universal LLM
+    key (`llm_key_id`) are charged to its credits. Raises LLMError on failure.
     """
     start_time = time.time()
-    is_byo_key = False
-    model = None
+    provider, model = resolve_model(provider, model)
+    counters = _metrics[provider]
     
+    key = None
+    hit = None
+    is_byo_key = False
     try:
-        # Validate provider
-        if ai_provider not in MODEL_CONFIG:
-            ai_provider = DEFAULT_AI_PROVIDER or "openai"
-        
         # Check provider health
-        health = await check_provider_health(ai_provider)
+        health = await check_provider_health(provider)
         if not health["is_enabled"] or health["is_blocked"]:
-            raise Exception(f"Provider {ai_provider} is currently disabled")
-        
-        # Build full prompt
-        full_prompt = prompt
-        if existing_code:
-            full_prompt = f"{prompt}\n\nExisting code to modify/improve:\n{existing_code}"
+            raise Exception(f"Provider {provider} is currently disabled")
         
         # Get API key - check BYO first, then platform key
-        api_key = get_platform_key(ai_provider)
+        api_key = get_platform_key(provider)
         if user_id:
-            byo_key = await get_user_ai_key(user_id, ai_provider)
+            byo_key = await get_user_ai_key(user_id, provider)
             if byo_key:
                 api_key = byo_key
                 is_byo_key = True
         
         if not api_key:
-            raise Exception(f"No API key configured for {ai_provider}. Please add your API key in settings.")
+            raise Exception(f"No API key configured for {provider}. Please add your API key in settings.")
         
-        # Get model
-        model = MODEL_CONFIG[ai_provider]["default_model"]
-        
-        # Use appropriate system prompt
-        system_prompt = None if is_planner else SYSTEM_PROMPT
-        
-        # Call AI provider directly
-        result = await call_ai_provider(
-            provider=ai_provider,
-            prompt=full_prompt,
-            system_prompt=system_prompt,
-            api_key=api_key,
-            model=model
-        )
+        # Only deterministic calls are cached: a sampled answer (e.g. "regenerate") must stay fresh
+        if use_cache and temperature == 0 and LLM_CACHE_TTL_SECONDS > 0:
+            key = _cache_key(provider, model, messages, max_tokens, user_id, is_byo_key)
+            hit = _responses.get(key)
         
+        if hit is None:
+            slots = _provider_slots.setdefault(provider, asyncio.Semaphore(LLM_MAX_CONCURRENCY_PER_PROVIDER))
+            async with slots:
+                response = await call_ai_provider(provider, messages, api_key, model, max_tokens, temperature)
+    
+    except Exception as e:
         latency_ms = int((time.time() - start_time) * 1000)
+        counters["errors"] += 1
+        status_code = None
+        if isinstance(e, httpx.HTTPStatusError):
+            status_code = e.response.status_code
+            error_msg = f"API Error: {status_code} - {e.response.text[:500]}"
+            error_type = "AI_API_ERROR"
+        else:
+            error_msg = str(e) or type(e).__name__
+            error_type = "AI_GENERATION_ERROR"
         
-        # Log AI run
         await log_ai_run(
             user_id=user_id,
-            provider=ai_provider,
+            provider=provider,
             model=model,
-            tokens_in=result.get("tokens_in", len(full_prompt) // 4),
-            tokens_out=result.get("tokens_out", len(result["text"]) // 4),
-            latency_ms=latency_ms,
-            status="success",
-            project_id=project_id,
-            job_id=job_id,
-            is_byo_key=is_byo_key
-        )
-        
-        # Update user's BYO key last used
-        if is_byo_key and user_id:
-            await db.user_ai_keys.update_one(
-                {"user_id": user_id, "provider": ai_provider},
-                {"$set": {"last_used_at": datetime.now(timezone.utc).isoformat()}}
-            )
-        
-        return result["text"]
-        
-    except httpx.HTTPStatusError as e:
-        latency_ms = int((time.time() - start_time) * 1000)
-        error_msg = f"API Error: {e.response.status_code} - {e.response.text[:500]}"
-        
-        await log_ai_run(
-            user_id=user_id,
-            provider=ai_provider,
-            model=model or "unknown",
             latency_ms=latency_ms,
             status="failed",
             error_message=error_msg,
             project_id=project_id,
             job_id=job_id,
-            is_byo_key=is_byo_key
+            is_byo_key=is_byo_key,
+            agent_type=agent_type,
+            llm_key_id=llm_key_id
         )
-        
         await log_error(
-            error_type="AI_API_ERROR",
+            error_type=error_type,
             error_message=error_msg,
             endpoint="/chat",
             user_id=user_id,
             stack_trace=traceback.format_exc()
         )
-        raise Exception(f"AI generation failed: {error_msg}")
-        
-    except Exception as e:
-        latency_ms = int((time.time() - start_time) * 1000)
-        
-        await log_ai_run(
-            user_id=user_id,
-            provider=ai_provider,
-            model=model or "unknown",
-            latency_ms=latency_ms,
-            status="failed",
-            error_message=str(e),
-            project_id=project_id,
-            job_id=job_id,
-            is_byo_key=is_byo_key
-        )
-        
-        await log_error(
-            error_type="AI_GENERATION_ERROR",
-            error_message=str(e),
-            endpoint="/chat",
-            user_id=user_id,
-            stack_trace=traceback.format_exc()
+        raise LLMError(f"AI generation failed: {error_msg}", provider, model, status_code) from e
+    
+    latency_ms = int((time.time() - start_time) * 1000)
+    if hit is not None:
+        counters["cache_hits"] += 1
+        return replace(hit, tokens_in=0, tokens_out=0, cost=0.0, latency_ms=latency_ms, cached=True)
+    
+    text = response["text"] or ""
+    # Providers that omit usage get a local token count
+    tokens_in = response.get("tokens_in")
+    if tokens_in is None:
+        tokens_in = count_message_tokens(messages, model)
+    tokens_out = response.get("tokens_out")
+    if tokens_out is None:
+        tokens_out = count_tokens(text, model)
+    
+    result = LLMResult(
+        text=text,
+        provider=provider,
+        model=model,
+        tokens_in=tokens_in,
+        tokens_out=tokens_out,
+        cost=(await get_price_table()).cost(provider, model, tokens_in, tokens_out),
+        latency_ms=latency_ms,
+        is_byo_key=is_byo_key
+    )
+    
+    counters["requests"] += 1
+    counters["tokens_in"] += tokens_in
+    counters["tokens_out"] += tokens_out
+    counters["cost"] += result.cost
+    counters["latency_ms"] += latency_ms
+    if key and text:
+        _responses[key] = result
+    
+    await log_ai_run(
+        user_id=user_id,
+        provider=provider,
+        model=model,
+        tokens_in=tokens_in,
+        tokens_out=tokens_out,
+        latency_ms=latency_ms,
+        status="success",
+        project_id=project_id,
+        job_id=job_id,
+        is_byo_key=is_byo_key,
+        cost=result.cost,
+        agent_type=agent_type,
+        llm_key_id=llm_key_id
+    )
+    
+    # Update user's BYO key last used
+    if is_byo_key and user_id:
+        await db.user_ai_keys.update_one(
+            {"user_id": user_id, "provider": provider},
+            {"$set": {"last_used_at": datetime.now(timezone.utc).isoformat()}}
         )
-        raise Exception(f"AI generation failed: {str(e)}")
+    
+    return result
+
+# =============================================================================
+# MAIN GENERATION FUNCTION
+# =============================================================================
+
+async def generate_code(
+    prompt: str,
+    ai_provider: str,
+    existing_code: str = None,
+    user_id: str = None,
+    project_id: str = None,
+    job_id: str = None,
+    is_planner: bool = False,
+    temperature: float = 0.7
+) -> str:
+    """Generate code with the website builder prompt; returns the text (see complete)
+    
+    Args:
+        prompt: The prompt to send to AI
+        ai_provider: Which AI provider to use (openai, gemini, claude, grok)
+        existing_code: Optional existing code to modify
+        user_id: User ID for logging and BYO key lookup
+        project_id: Project ID for logging
+        job_id: Job ID for logging
+        is_planner: If True, skip adding SYSTEM_PROMPT (prompt already contains full instructions)
+        temperature: 0 for deterministic calls (plans, specs), which can be served from the response cache
+    """
+    full_prompt = prompt
+    if existing_code:
+        full_prompt = f"{prompt}\n\nExisting code to modify/improve:\n{existing_code}"
+    
+    messages = [{"role": "user", "content": full_prompt}]
+    if not is_planner:
+        messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
+    
+    result = await complete(
+        messages,
+        provider=ai_provider,
+        temperature=temperature,
+        user_id=user_id,
+        project_id=project_id,
+        job_id=job_id
+    )
+    return result.text
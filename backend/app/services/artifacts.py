@@ -0,0 +1,126 @@
+"""
+Project artifacts - streamed ZIP downloads
+
+A project's download is a ZIP of its file tree (project_files) plus its
+build spec. The archive is written straight into the response as each file
+is compressed; zipfile handles the unseekable output by emitting data
+descriptors, so nothing is buffered beyond one chunk.
+
+Artifacts are keyed by a content hash computed from hashes we already store
+(each file's blob ref and the build spec), so an unchanged project is
+answered with 304 or from the in-process cache without loading or
+compressing any code.
+"""
+
+import hashlib
+import json
+import re
+import zipfile
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+
+from app.db.mongo import db
+from app.services.blob_store import get_blobs
+from app.services.project_files import list_files, manifest_hash
+
+
+CHUNK_SIZE = 64 * 1024
+# Finished archives kept in memory, by total bytes; larger ones are rebuilt
+ARTIFACT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+ARTIFACT_CACHE_ENTRY_MAX_BYTES = 8 * 1024 * 1024
+
+_cache: LRUCache = LRUCache(maxsize=ARTIFACT_CACHE_MAX_BYTES, getsizeof=len)
+
+ARTIFACT_PROJECT_PROJECTION = {"_id": 0, "id": 1, "name": 1, "code_hash": 1, "build_spec": 1, "updated_at": 1}
+
+
+async def get_artifact_manifest(project: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    (artifact hash, file manifest) without reading any code: the hash is
+    built from each file's path and content ref plus the build spec.
+    """
+    files = await list_files(project["id"])
+    digest = hashlib.sha256()
+    digest.update(manifest_hash(files).encode())
+    digest.update(json.dumps(project.get("build_spec"), sort_keys=True, default=str).encode())
+    return digest.hexdigest(), files
+
+
+async def _collect_files(project_id: str, manifest: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    blobs = await get_blobs(f.get("ref") for f in manifest)
+    files = [(f["path"], blobs.get(f.get("ref"), "") if f.get("ref") else "") for f in manifest]
+
+    spec = await db.projects.find_one({"id": project_id}, {"_id": 0, "build_spec": 1}) or {}
+    if spec.get("build_spec") and "build_spec.json" not in {path for path, _ in files}:
+        files.append(("build_spec.json", json.dumps(spec["build_spec"], indent=2, default=str)))
+    return files
+
+
+class _ChunkSink:
+    """Write-only, unseekable file object that hands its bytes back on drain()."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+async def stream_project_zip(project_id: str, artifact_hash: str, manifest: List[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """Yield the ZIP for a project; remembers small archives by hash."""
+    cached = _cache.get(artifact_hash)
+    if cached is not None:
+        for i in range(0, len(cached), CHUNK_SIZE):
+            yield cached[i:i + CHUNK_SIZE]
+        return
+
+    files = await _collect_files(project_id, manifest)
+    sink = _ChunkSink()
+    kept: Optional[List[bytes]] = []
+    kept_size = 0
+
+    def emit(data: bytes):
+        nonlocal kept, kept_size
+        if kept is not None:
+            kept.append(data)
+            kept_size += len(data)
+            if kept_size > ARTIFACT_CACHE_ENTRY_MAX_BYTES:
+                kept = None
+        return data
+
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for path, text in files:
+            data = text.encode("utf-8")
+            info = zipfile.ZipInfo(path, date_time=(2024, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, mode="w") as entry:
+                for i in range(0, len(data), CHUNK_SIZE):
+                    entry.write(data[i:i + CHUNK_SIZE])
+                    chunk = sink.drain()
+                    if chunk:
+                        yield emit(chunk)
+            chunk = sink.drain()
+            if chunk:
+                yield emit(chunk)
+    tail = sink.drain()
+    if tail:
+        yield emit(tail)
+
+    if kept is not None:
+        _cache[artifact_hash] = b"".join(kept)
+
+
+def artifact_filename(project: Dict[str, Any]) -> str:
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "-", project.get("name") or "project").strip("-").lower()
+    return f"{slug or 'project'}.zip"
+
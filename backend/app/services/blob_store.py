@@ -0,0 +1,168 @@
+"""
+Blob Store - content-addressed, compressed storage for large text
+
+Generated code used to be copied into every document that mentioned it (the
+assistant chat message twice, job code blocks, persisted agent events).
+Large payloads now go here once, keyed by their SHA-256, and documents keep
+the hash as a `*_ref` field. Writing the same content again is a no-op, so
+identical code is stored once however many turns, jobs or versions use it.
+
+Blobs are compressed with zstd when the `zstandard` package is installed and
+zlib otherwise; the codec is recorded per blob so either build can read
+both. Blobs too large for a document go to GridFS.
+"""
+
+import hashlib
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import Binary
+from cachetools import LRUCache
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+from app.db.mongo import db
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+
+# Compressed blobs above this go to GridFS (Mongo docs cap at 16MB)
+INLINE_MAX_BYTES = 12 * 1024 * 1024
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 6
+
+# Decoded blobs are immutable, so an LRU bounded by total characters is safe to share
+CACHE_MAX_CHARS = 32 * 1024 * 1024
+_cache: LRUCache = LRUCache(maxsize=CACHE_MAX_CHARS, getsizeof=len)
+_gridfs: Optional[AsyncIOMotorGridFSBucket] = None
+
+
+def _bucket() -> AsyncIOMotorGridFSBucket:
+    global _gridfs
+    if _gridfs is None:
+        _gridfs = AsyncIOMotorGridFSBucket(db, bucket_name="blob_chunks")
+    return _gridfs
+
+
+# =============================================================================
+# CODECS
+# =============================================================================
+
+def _compress(data: bytes) -> tuple:
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return "zlib", zlib.compress(data, ZLIB_LEVEL)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Blob is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    return data
+
+
+def _remember(ref: str, text: str):
+    if len(text) <= CACHE_MAX_CHARS // 8:
+        _cache[ref] = text
+
+
+def blob_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# =============================================================================
+# READ / WRITE
+# =============================================================================
+
+async def put_blob(text: Optional[str]) -> Optional[str]:
+    """Store `text` (once) and return its hash. None/empty stays None."""
+    if not text:
+        return None
+
+    raw = text.encode("utf-8")
+    ref = hashlib.sha256(raw).hexdigest()
+    if ref in _cache:
+        return ref
+
+    codec, packed = _compress(raw)
+    doc: Dict[str, Any] = {
+        "codec": codec,
+        "size": len(raw),
+        "stored_size": len(packed),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    if len(packed) > INLINE_MAX_BYTES:
+        if not await db.blobs.find_one({"_id": ref}, {"_id": 1}):
+            doc["gridfs_id"] = await _bucket().upload_from_stream(ref, packed)
+    else:
+        doc["data"] = Binary(packed)
+
+    # Same content, same _id: concurrent writers both end up with one doc
+    await db.blobs.update_one({"_id": ref}, {"$setOnInsert": doc}, upsert=True)
+    _remember(ref, text)
+    return ref
+
+
+async def get_blobs(refs: Iterable[Optional[str]]) -> Dict[str, str]:
+    """{ref: text} for every ref found, in one query for the uncached ones."""
+    wanted = {r for r in refs if r}
+    found = {r: _cache[r] for r in wanted if r in _cache}
+    missing = list(wanted - found.keys())
+    if not missing:
+        return found
+
+    async for blob in db.blobs.find({"_id": {"$in": missing}}):
+        if "gridfs_id" in blob:
+            stream = await _bucket().open_download_stream(blob["gridfs_id"])
+            packed = await stream.read()
+        else:
+            packed = bytes(blob["data"])
+        text = _decompress(blob["codec"], packed).decode("utf-8")
+        _remember(blob["_id"], text)
+        found[blob["_id"]] = text
+    return found
+
+
+async def get_blob(ref: Optional[str]) -> Optional[str]:
+    if not ref:
+        return None
+    return (await get_blobs([ref])).get(ref)
+
+
+async def hydrate_refs(docs: List[Dict[str, Any]], fields: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    Resolve `*_ref` fields in place for a batch of docs.
+    `fields` maps ref field -> field to fill, e.g. {"content_ref": "content"}.
+    Docs that still carry the inline field are left alone.
+    """
+    refs = [doc.get(ref_field) for doc in docs for ref_field in fields]
+    blobs = await get_blobs(refs)
+    for doc in docs:
+        for ref_field, target in fields.items():
+            if ref_field not in doc:
+                continue
+            ref = doc.pop(ref_field)
+            if target not in doc:
+                doc[target] = blobs.get(ref, "") if ref else ""
+    return docs
+
+
+async def externalize(docs: List[Dict[str, Any]], fields: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    Copies of `docs` with large fields moved into the store.
+    `fields` maps inline field -> ref field, e.g. {"code": "code_ref"}.
+    """
+    stored = []
+    for doc in docs:
+        doc = dict(doc)
+        for field, ref_field in fields.items():
+            if field in doc:
+                doc[ref_field] = await put_blob(doc.pop(field))
+        stored.append(doc)
+    return stored
@@ -12,6 +12,10 @@ from typing import Optional, Dict, Any, AsyncGenerator
 from collections import defaultdict
 
 from app.db.mongo import db
+from app.services.retention import with_retention_date, RETENTION_DATE_FIELD
+from app.services.project_store import with_code_stats
+from app.services.project_versions import record_code_change
+from app.services.artifacts import ARTIFACT_PROJECT_PROJECTION, get_artifact_manifest, stream_project_zip
 from app.models.jobs import BuildJob, BuildEvent, BuildJobStatus, BuildEventType
 from app.models.learning import EventType
 from app.services.ai_router import generate_code
@@ -126,7 +130,7 @@ async def emit_event(
     )
     
     # Store in database
-    await db.build_events.insert_one(event.model_dump())
+    await db.build_events.insert_one(with_retention_date(event.model_dump()))
     
     # Publish to subscribers
     event_dict = event.model_dump()
@@ -260,7 +264,8 @@ async def run_build_worker(job_id: str, user_id: str, project_id: str, prompt: s
                 user_id=user_id,
                 project_id=project_id,
                 job_id=job_id,
-                is_planner=True
+                is_planner=True,
+                temperature=0
             )
             
             # Extract JSON from response
@@ -416,17 +421,27 @@ async def run_build_worker(job_id: str, user_id: str, project_id: str, prompt: s
             event_type=BuildEventType.PACKAGING,
             message="📦 Packaging your application..."
         )
-        await asyncio.sleep(0.5)
         
         # Save generated code and spec to project
-        await db.projects.update_one(
-            {"id": project_id},
-            {"$set": {
-                "html_code": generated_code,
-                "build_spec": spec,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
+        current = await db.projects.find_one(
+            {"id": project_id}, {"_id": 0, "id": 1, "html_code": 1, "css_code": 1, "js_code": 1}
         )
+        code_update = with_code_stats({
+            "html_code": generated_code,
+            "build_spec": spec,
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }, current)
+        await db.projects.update_one({"id": project_id}, {"$set": code_update})
+        if current:
+            await record_code_change(current, code_update, source="build", message=prompt[:200], user_id=user_id)
+        
+        # Build the ZIP once now so the first download is served from cache
+        artifact_project = await db.projects.find_one({"id": project_id}, ARTIFACT_PROJECT_PROJECTION)
+        artifact_hash, artifact_size = None, 0
+        if artifact_project:
+            artifact_hash, manifest = await get_artifact_manifest(artifact_project)
+            async for chunk in stream_project_zip(project_id, artifact_hash, manifest):
+                artifact_size += len(chunk)
         await update_job_status(job_id, BuildJobStatus.RUNNING, progress=90)
         
         # Step 5: Artifact ready
@@ -437,7 +452,9 @@ async def run_build_worker(job_id: str, user_id: str, project_id: str, prompt: s
             message="Your app is ready to download!",
             payload={
                 "download_url": artifact_url,
-                "project_id": project_id
+                "project_id": project_id,
+                "artifact_hash": artifact_hash,
+                "artifact_size": artifact_size
             }
         )
         
@@ -808,7 +825,8 @@ async def stream_job_events(job_id: str) -> AsyncGenerator[str, None]:
     """
     # First, send any existing events
     existing_events = await db.build_events.find(
-        {"job_id": job_id}
+        {"job_id": job_id},
+        {RETENTION_DATE_FIELD: 0}
     ).sort("seq", 1).to_list(100)
     
     for event in existing_events:
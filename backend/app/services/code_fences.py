@@ -0,0 +1,217 @@
+"""
+Code Fences - incremental extraction of fenced code blocks
+
+Agents used to pull code out of model output with
+re.findall(r"```(\\w+)?\\n(.*?)```", text, re.DOTALL) once the whole response
+had arrived. `FenceParser` does it as text arrives instead: feed it chunks
+of any size and it returns each block the moment its closing fence is seen,
+so FILE_CREATED can go out before the rest of the response is parsed.
+
+- one pass over the text, line by line; only the current unfinished line
+  is buffered, so work is linear in output size whatever the chunking
+- fences follow markdown rules: ``` or ~~~, three or more, closed by the
+  same character at least as long, so a ``` inside a ```` block is code
+- the filename comes from the info string (```python:main.py,
+  ```python main.py, ```html title="index.html"), a first-line comment
+  (# filename: app.py, <!-- index.html -->) or the prose line before the
+  fence (**styles.css**); otherwise it is inferred from the language
+- a block still open at close() is returned with `truncated` set instead
+  of being dropped
+"""
+
+import re
+from typing import Dict, List, Optional
+
+
+EXTENSIONS = {
+    "python": ".py", "py": ".py",
+    "javascript": ".js", "js": ".js",
+    "typescript": ".ts", "ts": ".ts",
+    "jsx": ".jsx", "tsx": ".tsx",
+    "html": ".html", "htm": ".html",
+    "css": ".css", "scss": ".scss",
+    "json": ".json",
+    "go": ".go", "rust": ".rs", "java": ".java",
+    "c": ".c", "cpp": ".cpp",
+    "bash": ".sh", "shell": ".sh", "sh": ".sh",
+    "sql": ".sql",
+    "yaml": ".yaml", "yml": ".yml",
+    "markdown": ".md", "md": ".md",
+}
+LANGUAGE_BY_EXTENSION = {
+    ".py": "python", ".js": "javascript", ".ts": "typescript", ".jsx": "jsx", ".tsx": "tsx",
+    ".html": "html", ".htm": "html", ".css": "css", ".scss": "scss", ".json": "json",
+    ".go": "go", ".rs": "rust", ".java": "java", ".c": "c", ".cpp": "cpp", ".sh": "bash",
+    ".sql": "sql", ".yaml": "yaml", ".yml": "yml", ".md": "markdown",
+}
+
+# Conventional names for the first block of a language, then numbered ones
+DEFAULT_NAMES = {
+    "html": ("index", "page"),
+    "css": ("styles", "styles"),
+    "javascript": ("script", "script"),
+    "js": ("script", "script"),
+    "python": ("main", "module"),
+}
+
+_OPEN_FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})\s*([^`]*)$")
+_FILENAME = r"([\w][\w./-]*\.[A-Za-z0-9]{1,8})"
+_INFO_FILENAME = re.compile(r"(?:title|file(?:name)?)=[\"']?" + _FILENAME)
+_COMMENT_FILENAME = re.compile(
+    r"^\s*(?://|#|--|/\*|<!--)\s*(?:file(?:name)?\s*:\s*)?" + _FILENAME + r"\s*(?:\*/|-->)?\s*$",
+    re.IGNORECASE,
+)
+_PLAIN_FILENAME = re.compile(r"^\s*file(?:name)?\s*:\s*[\"']?" + _FILENAME + r"[\"']?\s*$", re.IGNORECASE)
+_PROSE_FILENAME = re.compile(r"^[\s#*_`>-]*(?:\d+\.\s*)?(?:file(?:name)?\s*:\s*)?[*_`]*" + _FILENAME + r"[*_`]*\s*:?\s*$", re.IGNORECASE)
+
+
+def infer_filename(language: str, index: int) -> str:
+    """Name for the `index`-th (0-based) unnamed block of `language`."""
+    lang = (language or "text").lower()
+    ext = EXTENSIONS.get(lang, ".txt")
+    first, rest = DEFAULT_NAMES.get(lang, ("file", "file"))
+    return f"{first}{ext}" if index == 0 else f"{rest}{index}{ext}"
+
+
+def _parse_info(info: str) -> tuple:
+    """(language, filename) from a fence info string."""
+    info = info.strip()
+    if not info:
+        return None, None
+    match = _INFO_FILENAME.search(info)
+    head = info.split()[0]
+    language, _, named = head.partition(":")
+    filename = named or (match.group(1) if match else None)
+    if not filename:
+        rest = info.split()[1:]
+        if rest and re.fullmatch(_FILENAME, rest[0]):
+            filename = rest[0]
+    if "." in language and not filename and re.fullmatch(_FILENAME, language):
+        # ```index.html - a bare filename as the info string
+        filename, language = language, None
+    return (language.lower() or None) if language else None, filename
+
+
+class FenceParser:
+    """
+    Incremental fenced-code-block parser.
+
+        parser = FenceParser()
+        for chunk in chunks:
+            for block in parser.feed(chunk):
+                ...  # block closed: emit FILE_CREATED
+        for block in parser.close():
+            ...      # an unterminated last block, flagged truncated
+
+    Blocks are dicts with language, filename, code and truncated. With
+    infer_filenames=False, filename stays None unless the output names it.
+    """
+
+    def __init__(self, infer_filenames: bool = True):
+        self.infer_filenames = infer_filenames
+        self.blocks: List[Dict] = []
+        self._partial: List[str] = []
+        self._fence: Optional[str] = None
+        self._language: Optional[str] = None
+        self._filename: Optional[str] = None
+        self._lines: List[str] = []
+        self._last_prose = ""
+        self._per_language: Dict[str, int] = {}  # default name -> unnamed blocks so far
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """Consume a chunk; return the blocks it closed."""
+        if not chunk:
+            return []
+        closed: List[Dict] = []
+        start = 0
+        while True:
+            end = chunk.find("\n", start)
+            if end == -1:
+                self._partial.append(chunk[start:])
+                return closed
+            self._partial.append(chunk[start:end])
+            line = "".join(self._partial)
+            self._partial.clear()
+            block = self._line(line.rstrip("\r"))
+            if block:
+                closed.append(block)
+            start = end + 1
+
+    def close(self) -> List[Dict]:
+        """End of output: flush the last line and any still-open block."""
+        closed: List[Dict] = []
+        if self._partial:
+            line = "".join(self._partial)
+            self._partial.clear()
+            block = self._line(line.rstrip("\r"))
+            if block:
+                closed.append(block)
+        if self._fence is not None:
+            closed.append(self._finish(truncated=True))
+        return closed
+
+    def _line(self, line: str) -> Optional[Dict]:
+        if self._fence is None:
+            match = _OPEN_FENCE.match(line)
+            if match:
+                self._fence = match.group(1)
+                self._language, self._filename = _parse_info(match.group(2))
+                self._lines = []
+            elif line.strip():
+                self._last_prose = line
+            return None
+
+        stripped = line.strip()
+        if stripped and stripped[0] == self._fence[0] and len(stripped) >= len(self._fence) \
+                and stripped == stripped[0] * len(stripped) and len(line) - len(line.lstrip(" ")) <= 3:
+            return self._finish(truncated=False)
+
+        if not self._lines and not self._filename:
+            named = _PLAIN_FILENAME.match(line) or _COMMENT_FILENAME.match(line)
+            if named:
+                self._filename = named.group(1)
+                # A bare "filename: x" line is a label, not code; keep real comments
+                if _PLAIN_FILENAME.match(line):
+                    return None
+        self._lines.append(line)
+        return None
+
+    def _finish(self, truncated: bool) -> Dict:
+        filename = self._filename
+        if not filename:
+            prose = _PROSE_FILENAME.match(self._last_prose)
+            if prose:
+                filename = prose.group(1)
+
+        language = self._language
+        if not language and filename:
+            language = LANGUAGE_BY_EXTENSION.get("." + filename.rsplit(".", 1)[-1].lower())
+        language = language or "text"
+
+        if not filename and self.infer_filenames:
+            # Count by default name so "js" and "javascript" blocks don't both become script.js
+            key = infer_filename(language, 0)
+            index = self._per_language.get(key, 0)
+            self._per_language[key] = index + 1
+            filename = infer_filename(language, index)
+
+        block = {
+            "language": language,
+            "filename": filename,
+            "code": "\n".join(self._lines).strip(),
+            "truncated": truncated,
+        }
+        self.blocks.append(block)
+        self._fence = None
+        self._language = self._filename = None
+        self._lines = []
+        self._last_prose = ""
+        return block
+
+
+def extract_code_blocks(text: str, infer_filenames: bool = True) -> List[Dict]:
+    """All fenced blocks in a complete text."""
+    parser = FenceParser(infer_filenames=infer_filenames)
+    parser.feed(text or "")
+    parser.close()
+    return parser.blocks
@@ -0,0 +1,679 @@
+"""
+Code Runner - sandboxed execution of generated code
+
+Runs the code blocks the coder agent produces as local subprocesses; no
+containers needed, just a Linux host with the toolchains installed.
+
+- limits: every run gets its own scratch directory and session, CPU time
+  (RLIMIT_CPU), file size and open files capped by rlimits, and a wall
+  clock (CODE_EXEC_TIMEOUT_SECONDS) after which the whole process group is
+  killed; memory is RLIMIT_AS for python/bash/rust, the runtime's own heap
+  flag for node and java, GOMEMLIMIT for go
+- warm workers: CODE_EXEC_WARM_PYTHON python interpreters are started once
+  and fork a fresh child per run, so a run skips interpreter start-up; the
+  other languages are spawned per run (compiled ones are built first, with
+  CODE_EXEC_COMPILE_TIMEOUT_SECONDS)
+- fairness: at most CODE_EXEC_WORKERS runs at a time and CODE_EXEC_PER_USER
+  per user; waiting runs are served round-robin across users, so one user
+  queueing many runs does not starve the others
+- output: stdout/stderr are streamed to an `on_output(stream, text)`
+  callback in small batches as they are produced, and capped in total
+- identity: runs switch to CODE_EXEC_USER (setgid/setuid, no supplementary
+  groups) before the code starts, so they can't read the API's .env or
+  files; that user must not be the API's own, and the API must start as
+  root to switch. Without a usable CODE_EXEC_USER nothing is executed
+
+This is process-level isolation, not a container: the run user still has
+network access, so firewall it off from MongoDB and internal services
+(e.g. an iptables owner match). Execution is off unless CODE_EXEC_ENABLED
+is set.
+"""
+
+import asyncio
+import codecs
+import json
+import os
+import pwd
+import resource
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import lru_cache, partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import (
+    CODE_EXEC_ENABLED,
+    CODE_EXEC_WORKERS,
+    CODE_EXEC_WARM_PYTHON,
+    CODE_EXEC_PER_USER,
+    CODE_EXEC_MAX_QUEUED_PER_USER,
+    CODE_EXEC_TIMEOUT_SECONDS,
+    CODE_EXEC_CPU_SECONDS,
+    CODE_EXEC_MEMORY_MB,
+    CODE_EXEC_COMPILE_TIMEOUT_SECONDS,
+    CODE_EXEC_WORKDIR,
+    CODE_EXEC_USER,
+)
+
+
+OutputCallback = Callable[[str, str], Awaitable[None]]
+
+MAX_OUTPUT_CHARS = 64_000
+MAX_FILE_BYTES = 16 * 1024 * 1024
+MAX_OPEN_FILES = 64
+FLUSH_CHARS = 2048
+FLUSH_SECONDS = 0.25
+KILL_GRACE_SECONDS = 2.0
+MAX_BLOCKS_PER_RESPONSE = 3
+
+# {memory_mb} is filled in per run; "rlimit_memory" languages get RLIMIT_AS instead
+LANGUAGES: Dict[str, Dict[str, Any]] = {
+    "python": {"file": "main.py", "run": [sys.executable, "-I", "main.py"], "warm": True, "rlimit_memory": True},
+    "javascript": {"file": "main.js", "run": ["node", "--max-old-space-size={memory_mb}", "main.js"]},
+    "bash": {"file": "main.sh", "run": ["bash", "main.sh"], "rlimit_memory": True},
+    "go": {"file": "main.go", "compile": ["go", "build", "-o", "main", "main.go"], "run": ["./main"]},
+    "rust": {"file": "main.rs", "compile": ["rustc", "-o", "main", "main.rs"], "run": ["./main"], "rlimit_memory": True},
+    "java": {"file": "Main.java", "run": ["java", "-Xmx{memory_mb}m", "-XX:+UseSerialGC", "Main.java"]},
+}
+ALIASES = {"py": "python", "python3": "python", "js": "javascript", "node": "javascript",
+           "sh": "bash", "shell": "bash", "golang": "go", "rs": "rust"}
+
+
+@dataclass
+class RunResult:
+    """Outcome of one run; `error` is set when the code could not be run at all."""
+    language: str
+    exit_code: Optional[int] = None
+    stdout: str = ""
+    stderr: str = ""
+    duration_ms: int = 0
+    timed_out: bool = False
+    truncated: bool = False
+    warm: bool = False
+    error: Optional[str] = None
+
+    @property
+    def success(self) -> bool:
+        return self.error is None and self.exit_code == 0 and not self.timed_out
+
+
+def normalize_language(language: Optional[str]) -> str:
+    language = (language or "").lower()
+    return ALIASES.get(language, language)
+
+
+def sandbox_identity() -> Tuple[int, int]:
+    """(uid, gid) of CODE_EXEC_USER; ValueError when runs can't switch to it here."""
+    if not CODE_EXEC_USER:
+        raise ValueError("CODE_EXEC_USER is not set")
+    try:
+        entry = pwd.getpwuid(int(CODE_EXEC_USER)) if CODE_EXEC_USER.isdigit() else pwd.getpwnam(CODE_EXEC_USER)
+    except KeyError:
+        raise ValueError(f"CODE_EXEC_USER {CODE_EXEC_USER!r} does not exist")
+    if entry.pw_uid == 0:
+        raise ValueError("CODE_EXEC_USER must be an unprivileged user")
+    if entry.pw_uid == os.geteuid():
+        raise ValueError("CODE_EXEC_USER must not be the user the API runs as")
+    if os.geteuid() != 0:
+        raise ValueError("the API must start as root to switch to CODE_EXEC_USER")
+    return entry.pw_uid, entry.pw_gid
+
+
+@lru_cache(maxsize=1)
+def _sandbox() -> Tuple[Optional[Tuple[int, int]], Optional[str]]:
+    """(identity, None), or (None, why execution is refused)."""
+    try:
+        return sandbox_identity(), None
+    except ValueError as e:
+        return None, str(e)
+
+
+@lru_cache(maxsize=1)
+def available_languages() -> Tuple[str, ...]:
+    """Languages whose toolchain is installed on this host."""
+    available = []
+    for language, spec in LANGUAGES.items():
+        tool = (spec.get("compile") or spec["run"])[0]
+        if os.path.isabs(tool) or shutil.which(tool):
+            available.append(language)
+    return tuple(available)
+
+
+def runnable_blocks(code_blocks: List[Dict]) -> List[Dict]:
+    """
+    The blocks of a response worth executing: complete blocks in a language
+    we can run. Web projects (any HTML block) are previewed, not executed -
+    their scripts expect a browser.
+    """
+    if not CODE_EXEC_ENABLED or _sandbox()[1]:
+        return []
+    if any(normalize_language(b.get("language")) in ("html", "htm") for b in code_blocks):
+        return []
+    available = available_languages()
+    return [
+        b for b in code_blocks
+        if normalize_language(b.get("language")) in available and not b.get("truncated") and b.get("code")
+    ][:MAX_BLOCKS_PER_RESPONSE]
+
+
+# =============================================================================
+# FAIR SCHEDULING
+# =============================================================================
+
+class FairScheduler:
+    """
+    Run slots shared round-robin across users: a freed slot goes to the
+    waiting user (under their own cap) who was served least recently, not
+    to whoever queued the most runs.
+    """
+
+    def __init__(self, slots: int, per_user: int, max_queued_per_user: int):
+        self.free = max(1, slots)
+        self.per_user = max(1, per_user)
+        self.max_queued_per_user = max_queued_per_user
+        self.running: Dict[str, int] = {}
+        self.waiting: Dict[str, deque] = {}
+        self.served: Dict[str, int] = {}  # user -> turn of their last grant
+        self._turn = 0
+
+    def queued(self, user_id: str) -> int:
+        return sum(1 for f in self.waiting.get(user_id, ()) if not f.done())
+
+    @asynccontextmanager
+    async def slot(self, user_id: str):
+        """Hold one run slot; raises asyncio.QueueFull when the user has too many waiting."""
+        if self.queued(user_id) >= self.max_queued_per_user:
+            raise asyncio.QueueFull()
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(user_id, deque()).append(future)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(user_id)  # granted, then cancelled before use
+            raise
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    def _release(self, user_id: str):
+        self.free += 1
+        self.running[user_id] -= 1
+        if not self.running[user_id]:
+            del self.running[user_id]
+        self._dispatch()
+        if user_id not in self.running and user_id not in self.waiting:
+            self.served.pop(user_id, None)
+
+    def _dispatch(self):
+        while self.free > 0:
+            eligible = []
+            for user_id in list(self.waiting):
+                queue = self.waiting[user_id]
+                while queue and queue[0].done():
+                    queue.popleft()  # cancelled while waiting
+                if not queue:
+                    del self.waiting[user_id]
+                elif self.running.get(user_id, 0) < self.per_user:
+                    eligible.append(user_id)
+            if not eligible:
+                return
+            # min() keeps the first of equals: ties go to the user waiting longest
+            user_id = min(eligible, key=lambda u: self.served.get(u, -1))
+            queue = self.waiting[user_id]
+            future = queue.popleft()
+            if not queue:
+                del self.waiting[user_id]
+            self._turn += 1
+            self.served[user_id] = self._turn
+            self.free -= 1
+            self.running[user_id] = self.running.get(user_id, 0) + 1
+            future.set_result(None)
+
+
+# =============================================================================
+# OUTPUT
+# =============================================================================
+
+class _Output:
+    """Captures stdout/stderr, streams them in batches and enforces the cap."""
+
+    def __init__(self, on_output: Optional[OutputCallback]):
+        self.on_output = on_output
+        self.captured = {"stdout": [], "stderr": []}
+        self.pending = {"stdout": [], "stderr": []}
+        self.pending_chars = 0
+        self.size = 0
+        self.truncated = False
+        self.last_flush = time.monotonic()
+
+    async def add(self, stream: str, text: str) -> bool:
+        """Record output; False once the cap is reached (the run should be killed)."""
+        if not text or self.truncated:
+            return not self.truncated
+        room = MAX_OUTPUT_CHARS - self.size
+        if len(text) > room:
+            text, self.truncated = text[:room], True
+        self.size += len(text)
+        self.captured[stream].append(text)
+        self.pending[stream].append(text)
+        self.pending_chars += len(text)
+        if self.pending_chars >= FLUSH_CHARS or time.monotonic() - self.last_flush >= FLUSH_SECONDS:
+            await self.flush()
+        return not self.truncated
+
+    async def flush(self):
+        self.last_flush = time.monotonic()
+        self.pending_chars = 0
+        for stream in ("stdout", "stderr"):
+            if self.pending[stream]:
+                text = "".join(self.pending[stream])
+                self.pending[stream].clear()
+                if self.on_output:
+                    await self.on_output(stream, text)
+
+    def text(self, stream: str) -> str:
+        return "".join(self.captured[stream])
+
+
+# =============================================================================
+# PROCESSES
+# =============================================================================
+
+def _apply_limits(cpu_seconds: int, memory_bytes: Optional[int], identity: Optional[Tuple[int, int]]):
+    """preexec_fn for spawned runs (keep in step with the warm worker's limit())."""
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    if memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (MAX_FILE_BYTES, MAX_FILE_BYTES))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (MAX_OPEN_FILES, MAX_OPEN_FILES))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    if identity:
+        os.setgroups([])
+        os.setgid(identity[1])
+        os.setuid(identity[0])
+
+
+def _kill_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _run_env(workdir: str) -> Dict[str, str]:
+    return {
+        "PATH": os.environ.get("PATH", "/usr/local/bin:/usr/bin:/bin"),
+        "HOME": workdir,
+        "TMPDIR": workdir,
+        "LANG": "C.UTF-8",
+        "PYTHONIOENCODING": "utf-8",
+        "PYTHONDONTWRITEBYTECODE": "1",
+        "GOCACHE": os.path.join(_workroot(), "go-build-cache"),
+        "GOPATH": os.path.join(workdir, "go"),
+        "GOMEMLIMIT": f"{CODE_EXEC_MEMORY_MB}MiB",
+    }
+
+
+async def _spawn(argv: List[str], workdir: str, cpu_seconds: int, memory_bytes: Optional[int],
+                 output: _Output, timeout: float) -> Tuple[Optional[int], bool]:
+    """Run a fresh process under the limits; returns (exit code, timed out)."""
+    proc = await asyncio.create_subprocess_exec(
+        *argv,
+        cwd=workdir,
+        env=_run_env(workdir),
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+        preexec_fn=partial(_apply_limits, cpu_seconds, memory_bytes, _sandbox()[0]),
+    )
+
+    async def pump(reader: asyncio.StreamReader, stream: str):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data = await reader.read(16384)
+            if not data:
+                break
+            if not await output.add(stream, decoder.decode(data)):
+                _kill_group(proc.pid)
+        await output.add(stream, decoder.decode(b"", final=True))
+
+    try:
+        await asyncio.wait_for(asyncio.gather(pump(proc.stdout, "stdout"), pump(proc.stderr, "stderr"), proc.wait()), timeout)
+        return proc.returncode, False
+    except asyncio.TimeoutError:
+        _kill_group(proc.pid)
+        await proc.wait()
+        return proc.returncode, True
+    except BaseException:
+        # Cancelled (job stopped): the run must not outlive it
+        _kill_group(proc.pid)
+        raise
+
+
+# Runs inside each warm interpreter: reads one JSON job per line, forks a
+# child per job and relays its output as JSON frames
+WARM_WORKER_SOURCE = r'''
+import codecs, json, os, pkgutil, resource, runpy, selectors, sys, traceback  # runpy.run_path imports pkgutil
+import collections, datetime, functools, itertools, math, random, re, string, typing  # warm common imports
+
+def limit(job):
+    resource.setrlimit(resource.RLIMIT_CPU, (job["cpu"], job["cpu"] + 1))
+    if job["memory"]:
+        resource.setrlimit(resource.RLIMIT_AS, (job["memory"], job["memory"]))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (job["fsize"], job["fsize"]))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (job["nofile"], job["nofile"]))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    if job["uid"] is not None:
+        os.setgroups([])
+        os.setgid(job["gid"])
+        os.setuid(job["uid"])
+
+def child(job, out_w, err_w):
+    code = 1
+    try:
+        os.setsid()
+        os.chdir(job["dir"])
+        os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+        os.dup2(out_w, 1)
+        os.dup2(err_w, 2)
+        os.closerange(3, 65536)
+        sys.stdin = open(0, "r", closefd=False)
+        sys.stdout = open(1, "w", encoding="utf-8", errors="backslashreplace", buffering=1, closefd=False)
+        sys.stderr = open(2, "w", encoding="utf-8", errors="backslashreplace", buffering=1, closefd=False)
+        os.environ.clear()
+        os.environ.update(job["env"])
+        sys.argv = [job["file"]]
+        sys.path[0] = job["dir"]
+        limit(job)
+        runpy.run_path(job["file"], run_name="__main__")
+        code = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+def send(frame):
+    channel.write(json.dumps(frame).encode() + b"\n")
+    channel.flush()
+
+channel = sys.stdout.buffer
+for line in sys.stdin.buffer:
+    job = json.loads(line)
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(out_r)
+        os.close(err_r)
+        child(job, out_w, err_w)
+    os.close(out_w)
+    os.close(err_w)
+    send({"pid": pid})
+    selector = selectors.DefaultSelector()
+    selector.register(out_r, selectors.EVENT_READ, ("stdout", codecs.getincrementaldecoder("utf-8")("replace")))
+    selector.register(err_r, selectors.EVENT_READ, ("stderr", codecs.getincrementaldecoder("utf-8")("replace")))
+    while selector.get_map():
+        for key, _ in selector.select():
+            stream, decoder = key.data
+            data = os.read(key.fd, 16384)
+            if data:
+                send({"stream": stream, "data": decoder.decode(data)})
+            else:
+                selector.unregister(key.fd)
+                os.close(key.fd)
+    _, status = os.waitpid(pid, 0)
+    send({"exit": os.waitstatus_to_exitcode(status)})
+'''
+
+
+class _WarmPython:
+    """A long-lived interpreter that forks one child per run."""
+
+    def __init__(self):
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.child: Optional[int] = None  # pid of the current run's child
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-I", "-c", WARM_WORKER_SOURCE,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            start_new_session=True,
+            limit=1024 * 1024,
+        )
+
+    async def stop(self):
+        if self.alive:
+            self.proc.kill()
+            await self.proc.wait()
+
+    async def abort(self):
+        """Kill the current run's process group and this worker (its pipe may hold unread frames)."""
+        if self.child is None and self.alive:
+            # The job was sent but its pid frame not read yet
+            try:
+                self.child = (await asyncio.wait_for(self._frame(), KILL_GRACE_SECONDS)).get("pid")
+            except (asyncio.TimeoutError, RuntimeError, ValueError):
+                pass
+        if self.child:
+            _kill_group(self.child)
+        await self.stop()
+
+    async def _frame(self) -> Dict[str, Any]:
+        line = await self.proc.stdout.readline()
+        if not line:
+            raise RuntimeError("warm worker exited")
+        return json.loads(line)
+
+    async def run(self, workdir: str, filename: str, output: _Output, timeout: float) -> Tuple[Optional[int], bool]:
+        uid, gid = _sandbox()[0] or (None, None)
+        job = {
+            "dir": workdir,
+            "file": filename,
+            "env": _run_env(workdir),
+            "cpu": CODE_EXEC_CPU_SECONDS,
+            "memory": CODE_EXEC_MEMORY_MB * 1024 * 1024,
+            "fsize": MAX_FILE_BYTES,
+            "nofile": MAX_OPEN_FILES,
+            "uid": uid,
+            "gid": gid,
+        }
+        self.child = None
+        self.proc.stdin.write(json.dumps(job).encode() + b"\n")
+        await self.proc.stdin.drain()
+        pid = self.child = (await self._frame())["pid"]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        timed_out = killed = False
+        while True:
+            try:
+                frame = await asyncio.wait_for(self._frame(), max(deadline - loop.time(), 0.01))
+            except asyncio.TimeoutError:
+                if killed:
+                    raise RuntimeError("warm worker did not reap its child")
+                timed_out = killed = True
+                _kill_group(pid)
+                deadline = loop.time() + KILL_GRACE_SECONDS
+                continue
+            if "exit" in frame:
+                return frame["exit"], timed_out
+            if not await output.add(frame["stream"], frame["data"]) and not killed:
+                killed = True
+                _kill_group(pid)
+                deadline = loop.time() + KILL_GRACE_SECONDS
+
+
+class _WarmPool:
+    """Idle warm interpreters; a dead one is replaced in the background."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.idle: List[_WarmPython] = []
+        self.started = False
+        self._tasks: set = set()
+
+    async def start(self):
+        if self.started:
+            return
+        self.started = True
+        await asyncio.gather(*(self._add() for _ in range(self.size)))
+
+    async def _add(self):
+        worker = _WarmPython()
+        try:
+            await worker.start()
+            self.idle.append(worker)
+        except OSError as e:
+            print(f"[CodeRunner] Could not start warm python worker: {e}")
+
+    def take(self) -> Optional[_WarmPython]:
+        while self.idle:
+            worker = self.idle.pop()
+            if worker.alive:
+                return worker
+        return None
+
+    def give_back(self, worker: _WarmPython):
+        if worker.alive and self.started:
+            self.idle.append(worker)
+            return
+        if self.started:
+            task = asyncio.create_task(self._add())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def stop(self):
+        self.started = False
+        workers, self.idle = self.idle, []
+        await asyncio.gather(*(w.stop() for w in workers))
+
+
+_scheduler = FairScheduler(CODE_EXEC_WORKERS, CODE_EXEC_PER_USER, CODE_EXEC_MAX_QUEUED_PER_USER)
+_warm_pool = _WarmPool(min(CODE_EXEC_WARM_PYTHON, CODE_EXEC_WORKERS))
+
+
+def _workroot() -> str:
+    return CODE_EXEC_WORKDIR or tempfile.gettempdir()
+
+
+# =============================================================================
+# PUBLIC API
+# =============================================================================
+
+async def start_code_runner():
+    """Pre-warm the python workers (startup hook; no-op when execution is disabled)."""
+    if not CODE_EXEC_ENABLED:
+        return
+    problem = _sandbox()[1]
+    if problem:
+        print(f"[CodeRunner] Code execution is enabled but refused: {problem}")
+    elif "python" in available_languages():
+        await _warm_pool.start()
+
+
+async def stop_code_runner():
+    await _warm_pool.stop()
+
+
+async def run_code(code: str, language: str, user_id: str, on_output: Optional[OutputCallback] = None) -> RunResult:
+    """
+    Run one program and return its result. Waits for a fair share of the
+    run slots first; never raises for problems in the code itself.
+    """
+    language = normalize_language(language)
+    if not CODE_EXEC_ENABLED:
+        return RunResult(language=language, error="Code execution is disabled on this server")
+    if _sandbox()[1]:
+        return RunResult(language=language, error="Code execution is not set up on this server")
+    if language not in available_languages():
+        return RunResult(language=language, error=f"Running {language or 'this'} code is not supported here")
+
+    try:
+        async with _scheduler.slot(user_id):
+            return await _execute(code, language, on_output)
+    except asyncio.QueueFull:
+        return RunResult(language=language, error="Too many runs queued; try again when the current ones finish")
+
+
+async def _execute(code: str, language: str, on_output: Optional[OutputCallback]) -> RunResult:
+    spec = LANGUAGES[language]
+    memory_bytes = CODE_EXEC_MEMORY_MB * 1024 * 1024 if spec.get("rlimit_memory") else None
+    identity = _sandbox()[0]
+    go_cache = os.path.join(_workroot(), "go-build-cache")
+    os.makedirs(go_cache, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix="nirman-run-", dir=_workroot())
+    with open(os.path.join(workdir, spec["file"]), "w", encoding="utf-8") as f:
+        f.write(code)
+    if identity:
+        # mkdtemp is private to us; hand the run its directory (and the shared build cache)
+        for path in (workdir, os.path.join(workdir, spec["file"]), go_cache):
+            os.chown(path, *identity)
+
+    output = _Output(on_output)
+    result = RunResult(language=language)
+    started = time.monotonic()
+    try:
+        if spec.get("compile"):
+            compile_seconds = int(CODE_EXEC_COMPILE_TIMEOUT_SECONDS)
+            result.exit_code, result.timed_out = await _spawn(
+                spec["compile"], workdir, compile_seconds, None, output, CODE_EXEC_COMPILE_TIMEOUT_SECONDS,
+            )
+            if result.exit_code != 0 or result.timed_out:
+                result.error = "Compilation timed out" if result.timed_out else "Compilation failed"
+                return result
+
+        worker = _warm_pool.take() if spec.get("warm") else None
+        if worker:
+            result.warm = True
+            try:
+                result.exit_code, result.timed_out = await worker.run(workdir, spec["file"], output, CODE_EXEC_TIMEOUT_SECONDS)
+            except (RuntimeError, OSError, ValueError) as e:
+                await worker.abort()
+                result.error = f"Execution worker failed: {e}"
+            except BaseException:
+                # Cancelled mid-run: don't hand back a worker with a live child
+                await worker.abort()
+                raise
+            finally:
+                _warm_pool.give_back(worker)
+        else:
+            argv = [arg.format(memory_mb=CODE_EXEC_MEMORY_MB) for arg in spec["run"]]
+            result.exit_code, result.timed_out = await _spawn(
+                argv, workdir, CODE_EXEC_CPU_SECONDS, memory_bytes, output, CODE_EXEC_TIMEOUT_SECONDS,
+            )
+        return result
+    except OSError as e:
+        # e.g. the toolchain isn't readable by CODE_EXEC_USER
+        result.error = f"Could not start the run: {e}"
+        return result
+    finally:
+        await output.flush()
+        result.stdout = output.text("stdout")
+        result.stderr = output.text("stderr")
+        result.truncated = output.truncated
+        result.duration_ms = int((time.monotonic() - started) * 1000)
+        await asyncio.to_thread(shutil.rmtree, workdir, True)
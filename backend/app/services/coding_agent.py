@@ -15,17 +15,27 @@ Pay Model Integration:
 """
 
 import asyncio
-import uuid
 import json
 import re
-from datetime import datetime, timezone
 from typing import Optional, Dict, Any, List, Tuple
 from enum import Enum
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, field
-
-from app.db.mongo import db
-from app.services.ai_router import generate_code, MODEL_CONFIG
+from dataclasses import dataclass, field, asdict
+
+from app.services.quota import consume_daily_quota, release_daily_quota, get_daily_usage, AGENT_REQUESTS
+from app.core.user_cache import get_cached_user
+from app.services.ai_router import complete, LLMError, LLMResult, MODEL_CONFIG
+from app.services.pricing import get_usage_today, get_usage_totals
+from app.services.intent_router import analyze_query
+from app.services.code_fences import extract_code_blocks
+from app.services.agent_memory import get_history, remember
+from app.services import web_research
+from app.services.code_runner import run_code, runnable_blocks
+from app.services.project_files import (
+    context_for_turn, ensure_project_files, list_directory, normalize_path, owns_project, save_blocks,
+    write_files,
+)
+from app.services.plan_executor import normalize_plan, run_plan, STEP_COMPLETED, STEP_FAILED, STEP_CANCELLED
 
 
 # =============================================================================
@@ -121,6 +131,7 @@ class AgentResponse:
     execution_results: List[ExecutionResult] = field(default_factory=list)
     tokens_used: int = 0
     cost_estimate: float = 0.0
+    error: Optional[str] = None  # set when the run failed; `answer` then explains it
 
 
 # =============================================================================
@@ -269,121 +280,29 @@ After operations, provide:
 class AgentRouter:
     """
     Selects the appropriate agent based on query analysis.
-    Uses few-shot classification for task routing.
+    Keyword scoring lives in intent_router, shared with the other routers;
+    each query is analyzed once and memoized.
     """
     
-    # Task classification examples
-    TASK_EXAMPLES = {
-        "coder": [
-            "write a python script",
-            "create a react component",
-            "build a web app",
-            "debug this code",
-            "make a snake game",
-            "generate api endpoint",
-            "implement authentication",
-            "create database schema",
-        ],
-        "browser": [
-            "search the web for",
-            "find information about",
-            "research",
-            "look up",
-            "what is the latest",
-            "find tutorials on",
-            "search online",
-        ],
-        "file": [
-            "organize files",
-            "find the file",
-            "move files",
-            "rename files",
-            "create folder",
-            "list directory",
-            "delete files",
-        ],
-        "planner": [
-            "create a plan for",
-            "help me build a complete",
-            "i need a full application",
-            "design a system",
-            "create architecture for",
-            "build a project with multiple",
-        ],
-        "casual": [
-            "hello",
-            "how are you",
-            "tell me about",
-            "explain",
-            "what is",
-            "why does",
-            "thanks",
-        ],
-    }
-    
-    # Complexity indicators
-    COMPLEXITY_INDICATORS = {
-        "high": [
-            "multiple", "full stack", "complete application",
-            "with database", "authentication", "deployment",
-            "microservices", "api integration", "real-time",
-        ],
-        "medium": [
-            "with", "including", "add", "integrate",
-            "responsive", "interactive", "dynamic",
-        ],
-        "low": [
-            "simple", "basic", "quick", "just",
-            "small", "only", "single",
-        ],
-    }
-    
     @classmethod
     def classify_task(cls, query: str) -> AgentType:
         """Classify query to determine best agent."""
-        query_lower = query.lower()
-        
-        # Score each agent type
-        scores = {agent: 0 for agent in AgentType}
-        
-        for agent_type, keywords in cls.TASK_EXAMPLES.items():
-            for keyword in keywords:
-                if keyword in query_lower:
-                    scores[AgentType(agent_type)] += 1
-        
-        # Get highest scoring agent
-        best_agent = max(scores, key=scores.get)
-        
-        # Default to coder if no clear match
-        if scores[best_agent] == 0:
+        agent = analyze_query(query).agent_or(AgentType.CODER.value)
+        # This service has no MCP agent; MCP-style requests go to the coder
+        try:
+            return AgentType(agent)
+        except ValueError:
             return AgentType.CODER
-        
-        return best_agent
     
     @classmethod
     def estimate_complexity(cls, query: str) -> TaskComplexity:
         """Estimate task complexity."""
-        query_lower = query.lower()
-        
-        for complexity, indicators in cls.COMPLEXITY_INDICATORS.items():
-            for indicator in indicators:
-                if indicator in query_lower:
-                    return TaskComplexity(complexity)
-        
-        # Default to medium
-        return TaskComplexity.MEDIUM
+        return TaskComplexity(analyze_query(query).complexity)
     
     @classmethod
     def should_use_planner(cls, query: str) -> bool:
         """Determine if planner agent should be used."""
-        complexity = cls.estimate_complexity(query)
-        agent_type = cls.classify_task(query)
-        
-        # Use planner for high complexity or explicit planner requests
-        return (
-            complexity == TaskComplexity.HIGH or 
-            agent_type == AgentType.PLANNER
-        )
+        return analyze_query(query).needs_planner
 
 
 # =============================================================================
@@ -406,52 +325,55 @@ class BaseAgent(ABC):
         self.system_prompt = system_prompt
         self.provider = provider
         self.model = model
-        self.memory: List[Dict[str, str]] = []
         self.tools: Dict[str, Any] = {}
     
-    def add_to_memory(self, role: str, content: str):
-        """Add message to agent memory."""
-        self.memory.append({"role": role, "content": content})
-    
-    def clear_memory(self):
-        """Clear agent memory."""
-        self.memory = []
-    
-    def build_messages(self, user_prompt: str) -> List[Dict[str, str]]:
+    def build_messages(
+        self,
+        user_prompt: str,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> List[Dict[str, str]]:
         """Build message list for LLM."""
+        # Agents are shared by all users; history is per conversation (see agent_memory)
         messages = [{"role": "system", "content": self.system_prompt}]
-        messages.extend(self.memory)
+        messages.extend(history or [])
         messages.append({"role": "user", "content": user_prompt})
         return messages
     
+    async def call_llm(
+        self,
+        prompt: str,
+        user_id: str,
+        provider: str,
+        model: str,
+        max_tokens: int,
+        history: Optional[List[Dict[str, str]]] = None,
+        temperature: float = 0.7,
+    ) -> LLMResult:
+        """One model call with this agent's system prompt and the conversation so far."""
+        return await complete(
+            self.build_messages(prompt, history),
+            provider=provider,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            user_id=user_id,
+            agent_type=self.agent_type.value,
+        )
+    
     @abstractmethod
     async def process(
         self,
         prompt: str,
         user_id: str,
         user_plan: str = "free",
+        history: Optional[List[Dict[str, str]]] = None,
     ) -> AgentResponse:
         """Process user prompt and return response."""
         pass
     
     def extract_code_blocks(self, text: str) -> List[Dict[str, str]]:
-        """Extract code blocks from response."""
-        pattern = r"```(\w+)?(?::([^\n]+))?\n(.*?)```"
-        matches = re.findall(pattern, text, re.DOTALL)
-        
-        blocks = []
-        for match in matches:
-            language = match[0] or "text"
-            filename = match[1] or None
-            code = match[2].strip()
-            
-            blocks.append({
-                "language": language,
-                "filename": filename,
-                "code": code,
-            })
-        
-        return blocks
+        """Extract code blocks from response (filename only when the output names one)."""
+        return extract_code_blocks(text, infer_filenames=False)
 
 
 # =============================================================================
@@ -491,6 +413,7 @@ class CoderAgent(BaseAgent):
         prompt: str,
         user_id: str,
         user_plan: str = "free",
+        history: Optional[List[Dict[str, str]]] = None,
     ) -> AgentResponse:
         """Process coding request."""
         
@@ -501,42 +424,41 @@ class CoderAgent(BaseAgent):
         provider = self.provider if self.provider != "auto" else plan_config["default_provider"]
         model = self.model or plan_config["default_model"]
         
-        # Build messages
-        messages = self.build_messages(prompt)
-        
         # Generate code
-        result = await generate_code(
-            prompt=prompt,
-            provider=provider,
-            model=model,
-            user_id=user_id,
-            job_id=str(uuid.uuid4()),
-            system_prompt=self.system_prompt,
-            conversation_history=[],
-            max_tokens=plan_config["max_tokens"],
-        )
-        
-        if not result["success"]:
+        try:
+            result = await self.call_llm(prompt, user_id, provider, model, plan_config["max_tokens"], history)
+        except LLMError as e:
             return AgentResponse(
-                answer=f"Error: {result.get('error', 'Unknown error')}",
+                answer=f"Error: {e}",
                 reasoning="Code generation failed",
                 tokens_used=0,
                 cost_estimate=0.0,
+                error=str(e),
             )
         
         # Extract code blocks
-        code = result.get("code", "")
+        code = result.text
         code_blocks = self.extract_code_blocks(code)
         
-        # Add to memory
-        self.add_to_memory("assistant", code)
+        # Run what can be run (no-op unless code execution is enabled)
+        execution_results = []
+        for block in runnable_blocks(code_blocks):
+            run = await run_code(block["code"], block["language"], user_id)
+            execution_results.append(ExecutionResult(
+                success=run.success,
+                output=run.stdout,
+                error=run.error or ("Timed out" if run.timed_out else None) or run.stderr or None,
+                execution_time_ms=run.duration_ms,
+                tool_type=f"code:{run.language}",
+            ))
         
         return AgentResponse(
             answer=code,
             reasoning=f"Generated code using {provider}/{model}",
             code_blocks=code_blocks,
-            tokens_used=result.get("tokens_in", 0) + result.get("tokens_out", 0),
-            cost_estimate=result.get("cost_estimate", 0.0),
+            execution_results=execution_results,
+            tokens_used=result.tokens,
+            cost_estimate=result.cost,
         )
 
 
@@ -558,13 +480,13 @@ class BrowserAgent(BaseAgent):
             provider=provider,
             model=model,
         )
-        self.search_results_cache: Dict[str, Any] = {}
     
     async def process(
         self,
         prompt: str,
         user_id: str,
         user_plan: str = "free",
+        history: Optional[List[Dict[str, str]]] = None,
     ) -> AgentResponse:
         """Process web research request."""
         
@@ -573,10 +495,26 @@ class BrowserAgent(BaseAgent):
         provider = self.provider if self.provider != "auto" else plan_config["default_provider"]
         model = self.model or plan_config["default_model"]
         
+        # Search and fetch first, so the model works from extracted page text
+        research = await web_research.research(prompt, max_pages=5)
+        sources = research["sources"]
+        if sources:
+            context = "\n\n".join(
+                f"[{i}] {s['title'] or s['url']}\nURL: {s['url']}\n{s['text']}"
+                for i, s in enumerate(sources, 1)
+            )
+            source_note = f"""Use these web sources (cite them as [n]):
+
+{context}
+
+"""
+        else:
+            source_note = ""
+        
         # Build research prompt
         research_prompt = f"""Research Request: {prompt}
 
-Please help me research this topic. Provide:
+{source_note}Please help me research this topic. Provide:
 1. A comprehensive summary of the topic
 2. Key facts and information
 3. Relevant resources and references
@@ -586,30 +524,23 @@ Please help me research this topic. Provide:
 Structure your response clearly with sections."""
         
         # Generate research response
-        result = await generate_code(
-            prompt=research_prompt,
-            provider=provider,
-            model=model,
-            user_id=user_id,
-            job_id=str(uuid.uuid4()),
-            system_prompt=self.system_prompt,
-            conversation_history=[],
-            max_tokens=plan_config["max_tokens"],
-        )
-        
-        if not result["success"]:
+        try:
+            result = await self.call_llm(research_prompt, user_id, provider, model, plan_config["max_tokens"], history)
+        except LLMError as e:
             return AgentResponse(
-                answer=f"Error during research: {result.get('error', 'Unknown error')}",
+                answer=f"Error during research: {e}",
                 reasoning="Web research failed",
                 tokens_used=0,
                 cost_estimate=0.0,
+                error=str(e),
             )
         
-        answer = result.get("code", "")
+        answer = result.text
         code_blocks = self.extract_code_blocks(answer)
         
-        # Extract any URLs/links mentioned
-        urls = self._extract_urls(answer)
+        # Fetched sources first, then any other URLs the answer mentions
+        urls = [s["url"] for s in sources]
+        urls += [u for u in self._extract_urls(answer) if u not in urls]
         
         # Add metadata about sources
         if urls:
@@ -617,14 +548,12 @@ Structure your response clearly with sections."""
             for url in urls[:10]:  # Limit to 10 URLs
                 answer += f"- {url}\n"
         
-        self.add_to_memory("assistant", answer)
-        
         return AgentResponse(
             answer=answer,
-            reasoning=f"Web research completed using {provider}/{model}",
+            reasoning=f"Web research completed using {provider}/{model} ({len(sources)} pages via {research['backend']} search)",
             code_blocks=code_blocks,
-            tokens_used=result.get("tokens_in", 0) + result.get("tokens_out", 0),
-            cost_estimate=result.get("cost_estimate", 0.0),
+            tokens_used=result.tokens,
+            cost_estimate=result.cost,
         )
     
     def _extract_urls(self, text: str) -> List[str]:
@@ -633,31 +562,13 @@ Structure your response clearly with sections."""
         return re.findall(url_pattern, text)
     
     async def web_search(self, query: str) -> Dict[str, Any]:
-        """
-        Perform a web search (simulated with AI knowledge).
-        In production, integrate with actual search API (SearxNG, Google, etc.)
-        """
-        # For now, return AI-generated search simulation
-        # TODO: Integrate with real search API like SearxNG
-        return {
-            "query": query,
-            "results": [],
-            "status": "simulated",
-            "note": "Integrate with SearxNG for real search results"
-        }
+        """Search with the configured backend (SearxNG, fixture or disabled)."""
+        return await web_research.web_search(query)
     
     async def fetch_url(self, url: str) -> Dict[str, Any]:
-        """
-        Fetch and extract content from a URL.
-        In production, use httpx/aiohttp with proper parsing.
-        """
-        # TODO: Implement actual URL fetching with httpx
-        return {
-            "url": url,
-            "content": "",
-            "status": "not_implemented",
-            "note": "URL fetching to be implemented"
-        }
+        """Fetch a URL (robots-aware, cached) and extract its readable text."""
+        page = await web_research.fetch_page(url)
+        return {**page, "content": page["text"]}
 
 
 # =============================================================================
@@ -685,13 +596,13 @@ class FileAgent(BaseAgent):
             provider=provider,
             model=model,
         )
-        self.operations_log: List[Dict[str, Any]] = []
     
     async def process(
         self,
         prompt: str,
         user_id: str,
         user_plan: str = "free",
+        history: Optional[List[Dict[str, str]]] = None,
     ) -> AgentResponse:
         """Process file operation request."""
         
@@ -720,26 +631,18 @@ content here
 ```"""
         
         # Generate file operations response
-        result = await generate_code(
-            prompt=file_prompt,
-            provider=provider,
-            model=model,
-            user_id=user_id,
-            job_id=str(uuid.uuid4()),
-            system_prompt=self.system_prompt,
-            conversation_history=[],
-            max_tokens=plan_config["max_tokens"],
-        )
-        
-        if not result["success"]:
+        try:
+            result = await self.call_llm(file_prompt, user_id, provider, model, plan_config["max_tokens"], history)
+        except LLMError as e:
             return AgentResponse(
-                answer=f"Error processing file operation: {result.get('error', 'Unknown error')}",
+                answer=f"Error processing file operation: {e}",
                 reasoning="File operation failed",
                 tokens_used=0,
                 cost_estimate=0.0,
+                error=str(e),
             )
         
-        answer = result.get("code", "")
+        answer = result.text
         code_blocks = self.extract_code_blocks(answer)
         
         # Parse and validate file operations
@@ -752,8 +655,6 @@ content here
                 status_icon = "✅" if op.get("valid", True) else "⚠️"
                 answer += f"{status_icon} {op['operation'].upper()}: `{op.get('path', 'N/A')}`\n"
         
-        self.add_to_memory("assistant", answer)
-        
         return AgentResponse(
             answer=answer,
             reasoning=f"File operations processed using {provider}/{model}",
@@ -766,8 +667,8 @@ content here
                 )
                 for op in operations
             ],
-            tokens_used=result.get("tokens_in", 0) + result.get("tokens_out", 0),
-            cost_estimate=result.get("cost_estimate", 0.0),
+            tokens_used=result.tokens,
+            cost_estimate=result.cost,
         )
     
     def _parse_file_operations(
@@ -835,35 +736,44 @@ content here
         
         return True
     
-    async def create_file(self, path: str, content: str) -> Dict[str, Any]:
-        """Create a new file with content."""
+    async def create_file(self, project_id: str, user_id: str, path: str, content: str) -> Dict[str, Any]:
+        """Create (or overwrite) a file in the user's project's tree."""
+        if not await owns_project(project_id, user_id):
+            return {"success": False, "error": "Project not found"}
         if not self._validate_path(path):
             return {"success": False, "error": "Invalid file path"}
+        try:
+            path = normalize_path(path)
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
         
-        # Log operation (actual file creation would happen here)
-        self.operations_log.append({
-            "operation": "create",
-            "path": path,
-            "content_length": len(content),
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-        })
+        await ensure_project_files(project_id)
+        result = await write_files(project_id, {path: content}, source="file_agent")
         
         return {
             "success": True,
             "path": path,
             "operation": "create",
+            "revision": result["revision"],
+            "changed": bool(result["changed"]),
             "message": f"File created: {path}"
         }
     
-    async def list_directory(self, path: str = ".") -> Dict[str, Any]:
-        """List directory contents."""
-        # This would interact with actual filesystem in production
+    async def list_directory(self, project_id: str, user_id: str, path: str = "") -> Dict[str, Any]:
+        """List one directory of the user's project's tree."""
+        if not await owns_project(project_id, user_id):
+            return {"success": False, "error": "Project not found"}
+        try:
+            await ensure_project_files(project_id)
+            contents = await list_directory(project_id, path)
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
+        
         return {
             "success": True,
             "path": path,
             "operation": "list",
-            "contents": [],
-            "note": "Directory listing simulated"
+            "contents": contents,
         }
 
 
@@ -909,6 +819,7 @@ Keep responses natural and engaging."""
         prompt: str,
         user_id: str,
         user_plan: str = "free",
+        history: Optional[List[Dict[str, str]]] = None,
     ) -> AgentResponse:
         """Process casual conversation request."""
         
@@ -918,34 +829,26 @@ Keep responses natural and engaging."""
         model = self.model or plan_config["default_model"]
         
         # Generate response
-        result = await generate_code(
-            prompt=prompt,
-            provider=provider,
-            model=model,
-            user_id=user_id,
-            job_id=str(uuid.uuid4()),
-            system_prompt=self.system_prompt,
-            conversation_history=[],
-            max_tokens=min(plan_config["max_tokens"], 2000),  # Limit for casual chat
-        )
-        
-        if not result["success"]:
+        try:
+            # Limit for casual chat
+            result = await self.call_llm(prompt, user_id, provider, model, min(plan_config["max_tokens"], 2000), history)
+        except LLMError as e:
             return AgentResponse(
-                answer=f"Sorry, I had trouble responding: {result.get('error', 'Unknown error')}",
+                answer=f"Sorry, I had trouble responding: {e}",
                 reasoning="Casual response failed",
                 tokens_used=0,
                 cost_estimate=0.0,
+                error=str(e),
             )
         
-        answer = result.get("code", "")
-        self.add_to_memory("assistant", answer)
+        answer = result.text
         
         return AgentResponse(
             answer=answer,
             reasoning=f"Casual response using {provider}/{model}",
             code_blocks=[],
-            tokens_used=result.get("tokens_in", 0) + result.get("tokens_out", 0),
-            cost_estimate=result.get("cost_estimate", 0.0),
+            tokens_used=result.tokens,
+            cost_estimate=result.cost,
         )
 
 
@@ -981,6 +884,7 @@ class PlannerAgent(BaseAgent):
         prompt: str,
         user_id: str,
         user_plan: str = "free",
+        history: Optional[List[Dict[str, str]]] = None,
     ) -> AgentResponse:
         """Create and execute plan for complex task."""
         
@@ -997,57 +901,72 @@ USER REQUEST: {prompt}
 Create a JSON plan with steps, agent assignments, and dependencies.
 Focus on actionable, specific steps that can be executed."""
         
-        plan_result = await generate_code(
-            prompt=plan_prompt,
-            provider=provider,
-            model=model,
-            user_id=user_id,
-            job_id=str(uuid.uuid4()),
-            system_prompt=self.system_prompt,
-            conversation_history=[],
-            max_tokens=2000,
-        )
-        
-        if not plan_result["success"]:
+        try:
+            # Plans are parsed as JSON: ask for the deterministic (and cacheable) answer
+            plan_result = await self.call_llm(plan_prompt, user_id, provider, model, 2000, history, temperature=0)
+        except LLMError as e:
             return AgentResponse(
-                answer=f"Error creating plan: {plan_result.get('error', 'Unknown error')}",
+                answer=f"Error creating plan: {e}",
                 reasoning="Planning failed",
                 tokens_used=0,
                 cost_estimate=0.0,
+                error=str(e),
             )
         
         # Parse plan
-        plan_text = plan_result.get("code", "")
+        plan_text = plan_result.text
         plan_json = self._extract_json(plan_text)
         
         if not plan_json:
             # Fallback: Treat as single coder task
             coder = self.agents[AgentType.CODER]
-            return await coder.process(prompt, user_id, user_plan)
+            return await coder.process(prompt, user_id, user_plan, history)
         
-        # Step 2: Execute plan steps
-        total_tokens = plan_result.get("tokens_in", 0) + plan_result.get("tokens_out", 0)
-        total_cost = plan_result.get("cost_estimate", 0.0)
+        # Step 2: Execute plan steps - independent steps run concurrently
+        total_tokens = plan_result.tokens
+        total_cost = plan_result.cost
         all_results = []
         
-        steps = plan_json.get("steps", [])
-        for step in steps:
-            agent_type = AgentType(step.get("agent", "coder"))
-            agent = self.agents.get(agent_type)
+        steps = normalize_plan(plan_json.get("steps", []))
+        
+        async def run_step(step: Dict, inputs: Dict, emit) -> AgentResponse:
+            try:
+                agent_type = AgentType(step.get("agent", "coder"))
+            except ValueError:
+                agent_type = AgentType.CODER
+            agent = self.agents.get(agent_type, self.agents[AgentType.CODER])
             
-            if agent:
-                step_result = await agent.process(
-                    step["description"],
-                    user_id,
-                    user_plan,
-                )
-                all_results.append({
-                    "step": step["id"],
-                    "description": step["description"],
+            task = step.get("description") or step.get("task") or ""
+            previous = [r.answer[:1000] for r in inputs.values() if r is not None]
+            if previous:
+                task = "Results of earlier steps:\n" + "\n\n".join(previous) + f"\n\nNow: {task}"
+            response = await agent.process(task, user_id, user_plan)
+            if response.error:
+                raise LLMError(response.error)
+            return response
+        
+        order = {}
+        completed = 0
+        async for item in run_plan(steps, run_step, user_id=user_id):
+            if item["type"] == STEP_COMPLETED:
+                completed += 1
+                step_result = item["result"]
+                order[item["step_id"]] = {
+                    "step": item["step_id"],
                     "result": step_result.answer,
-                })
+                }
                 total_tokens += step_result.tokens_used
                 total_cost += step_result.cost_estimate
+            elif item["type"] == STEP_FAILED:
+                order[item["step_id"]] = {"step": item["step_id"], "result": f"Step failed: {item['error']}"}
+            elif item["type"] == STEP_CANCELLED:
+                order[item["step_id"]] = {"step": item["step_id"], "result": f"Skipped: {item['reason']}"}
+        
+        # Report in plan order, not completion order
+        for step in steps:
+            entry = order.get(step["id"])
+            if entry:
+                all_results.append({**entry, "description": step.get("description") or step.get("task") or ""})
         
         # Combine results
         combined_answer = self._combine_results(plan_json, all_results)
@@ -1058,6 +977,7 @@ Focus on actionable, specific steps that can be executed."""
             code_blocks=[],
             tokens_used=total_tokens,
             cost_estimate=total_cost,
+            error=None if completed or not steps else "Every step of the plan failed",
         )
     
     def _extract_json(self, text: str) -> Optional[Dict]:
@@ -1121,6 +1041,7 @@ class CodingAgentService:
         provider: str = "auto",
         model: str = None,
         agent_type: Optional[str] = None,
+        conversation_id: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
         Process a coding agent request.
@@ -1132,20 +1053,16 @@ class CodingAgentService:
         """
         
         # Get user info
-        user = await db.users.find_one({"id": user_id})
+        user = await get_cached_user(user_id)
         if not user:
             return {"success": False, "error": "User not found"}
         
         user_plan = user.get("plan", "free")
         plan_config = PLAN_MODELS.get(user_plan, PLAN_MODELS["free"])
         
-        # Check daily limit
-        if not await self._check_daily_limit(user_id, plan_config):
-            return {
-                "success": False,
-                "error": "Daily request limit reached. Upgrade your plan for more requests.",
-                "limit_reached": True,
-            }
+        # The project's files go into the prompt and get written back
+        if project_id and not await owns_project(project_id, user_id):
+            return {"success": False, "error": "Project not found"}
         
         # Determine agent based on query analysis or explicit type
         if agent_type:
@@ -1177,76 +1094,58 @@ class CodingAgentService:
         if model:
             agent.model = model
         
+        # Take one request from today's quota (atomic check-and-increment)
+        quota = await consume_daily_quota(user_id, AGENT_REQUESTS, plan_config["daily_limit"])
+        if not quota.allowed:
+            return {
+                "success": False,
+                "error": "Daily request limit reached. Upgrade your plan for more requests.",
+                "limit_reached": True,
+            }
+        
         # Process request
         try:
-            response = await agent.process(prompt, user_id, user_plan)
-            
-            # Track usage
-            await self._track_usage(
-                user_id=user_id,
-                project_id=project_id,
-                agent_type=agent.agent_type.value,
-                tokens_used=response.tokens_used,
-                cost=response.cost_estimate,
+            history = await get_history(conversation_id)
+            files_context = await context_for_turn(project_id)
+            agent_prompt = f"{files_context}\n\n{prompt}" if files_context else prompt
+            response = await agent.process(agent_prompt, user_id, user_plan, history)
+            if response.error:
+                # The model call failed: give the request back and report it
+                await release_daily_quota(user_id, AGENT_REQUESTS)
+                return {
+                    "success": False,
+                    "answer": response.answer,
+                    "agent_type": agent.agent_type.value,
+                    "error": response.error,
+                }
+            files = await save_blocks(project_id, response.code_blocks, source=agent.agent_type.value)
+            await remember(
+                conversation_id,
+                {"role": "user", "content": prompt},
+                {"role": "assistant", "content": response.answer},
             )
             
+            # Usage is logged per model call by the gateway (ai_router.complete)
+            
             return {
                 "success": True,
                 "answer": response.answer,
                 "reasoning": response.reasoning,
                 "code_blocks": response.code_blocks,
+                "execution_results": [asdict(r) for r in response.execution_results],
                 "tokens_used": response.tokens_used,
                 "cost_estimate": response.cost_estimate,
                 "agent_type": agent.agent_type.value,
+                "files_changed": files["changed"],
             }
             
         except Exception as e:
+            # Failed requests don't count against the quota
+            await release_daily_quota(user_id, AGENT_REQUESTS)
             return {
                 "success": False,
                 "error": str(e),
             }
-    
-    async def _check_daily_limit(
-        self,
-        user_id: str,
-        plan_config: Dict,
-    ) -> bool:
-        """Check if user is within daily limit."""
-        if plan_config["daily_limit"] == -1:
-            return True  # Unlimited
-        
-        # Count today's requests
-        today_start = datetime.now(timezone.utc).replace(
-            hour=0, minute=0, second=0, microsecond=0
-        ).isoformat()
-        
-        count = await db.ai_runs.count_documents({
-            "user_id": user_id,
-            "created_at": {"$gte": today_start},
-        })
-        
-        return count < plan_config["daily_limit"]
-    
-    async def _track_usage(
-        self,
-        user_id: str,
-        project_id: Optional[str],
-        agent_type: str,
-        tokens_used: int,
-        cost: float,
-    ):
-        """Track AI usage for billing."""
-        usage_doc = {
-            "id": str(uuid.uuid4()),
-            "user_id": user_id,
-            "project_id": project_id,
-            "agent_type": agent_type,
-            "tokens_used": tokens_used,
-            "cost_estimate": cost,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-        }
-        
-        await db.ai_runs.insert_one(usage_doc)
 
 
 # =============================================================================
@@ -1267,6 +1166,7 @@ async def process_coding_request(
     provider: str = "auto",
     model: str = None,
     agent_type: Optional[str] = None,
+    conversation_id: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     Convenience function to process coding requests.
@@ -1279,6 +1179,7 @@ async def process_coding_request(
         provider: AI provider (auto, openai, gemini, etc.)
         model: Specific model to use
         agent_type: Force specific agent (coder, browser, file, planner, casual)
+        conversation_id: agent_conversations id whose memory to use and extend
     """
     return await coding_agent_service.process_request(
         prompt=prompt,
@@ -1287,44 +1188,25 @@ async def process_coding_request(
         provider=provider,
         model=model,
         agent_type=agent_type,
+        conversation_id=conversation_id,
     )
 
 
 async def get_agent_status(user_id: str) -> Dict[str, Any]:
     """Get agent status and usage info for user."""
-    user = await db.users.find_one({"id": user_id})
+    user = await get_cached_user(user_id)
     if not user:
         return {"error": "User not found"}
     
     user_plan = user.get("plan", "free")
     plan_config = PLAN_MODELS.get(user_plan, PLAN_MODELS["free"])
     
-    # Count today's requests
-    today_start = datetime.now(timezone.utc).replace(
-        hour=0, minute=0, second=0, microsecond=0
-    ).isoformat()
+    # Today's requests from the quota counter (single _id lookup)
+    today_count = await get_daily_usage(user_id, AGENT_REQUESTS)
     
-    today_count = await db.ai_runs.count_documents({
-        "user_id": user_id,
-        "created_at": {"$gte": today_start},
-    })
-    
-    # Total usage
-    total_usage = await db.ai_runs.aggregate([
-        {"$match": {"user_id": user_id}},
-        {"$group": {
-            "_id": None,
-            "total_tokens": {"$sum": "$tokens_used"},
-            "total_cost": {"$sum": "$cost_estimate"},
-            "total_requests": {"$sum": 1},
-        }},
-    ]).to_list(1)
-    
-    usage_stats = total_usage[0] if total_usage else {
-        "total_tokens": 0,
-        "total_cost": 0,
-        "total_requests": 0,
-    }
+    # Usage from the per-day rollups (costed when each run was logged)
+    usage_today = await get_usage_today(user_id)
+    usage_stats = await get_usage_totals(user_id)
     
     return {
         "plan": user_plan,
@@ -1338,7 +1220,8 @@ async def get_agent_status(user_id: str) -> Dict[str, Any]:
         "allowed_providers": plan_config["allowed_providers"],
         "default_provider": plan_config["default_provider"],
         "default_model": plan_config["default_model"],
-        "total_tokens_used": usage_stats.get("total_tokens", 0),
-        "total_cost": usage_stats.get("total_cost", 0),
-        "total_requests": usage_stats.get("total_requests", 0),
+        "cost_today": round(usage_today.get("cost", 0), 6),
+        "total_tokens_used": usage_stats["tokens_in"] + usage_stats["tokens_out"],
+        "total_cost": round(usage_stats["cost"], 6),
+        "total_requests": usage_stats["requests"],
     }
@@ -0,0 +1,244 @@
+"""
+Streaming CSV exporter
+
+Exports are produced as an async generator of bytes and served through a
+StreamingResponse, so memory stays constant whatever the row count: rows are
+read from a Mongo cursor in batches, written through the `csv` module (proper
+quoting) and flushed per batch, optionally through a streaming gzip encoder.
+
+Long ranges are split into date windows and each window gets its own short
+cursor, which keeps every query on the created_at index and avoids cursors
+timing out server-side while a slow client downloads.
+"""
+
+import csv
+import io
+import json
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timezone, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from app.db.mongo import db
+
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+DEFAULT_CHUNK_DAYS = 7
+
+# Spreadsheet apps evaluate cells starting with these as formulas
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+@dataclass
+class ExportSpec:
+    collection: str
+    columns: List[str]
+    filename: str
+    base_query: Dict[str, Any] = field(default_factory=dict)
+    date_field: str = "created_at"
+    # Per-column formatters for values that aren't plain scalars
+    formatters: Dict[str, Callable[[Any], Any]] = field(default_factory=dict)
+
+
+def _as_json(value: Any) -> str:
+    return json.dumps(value, default=str, separators=(",", ":")) if value is not None else ""
+
+
+EXPORTS: Dict[str, ExportSpec] = {
+    "invoices": ExportSpec(
+        collection="purchases",
+        base_query={"status": "completed"},
+        columns=["id", "user_email", "plan", "billing_cycle", "amount", "coupon_code", "coupon_discount", "created_at"],
+        filename="invoices",
+    ),
+    "ai_runs": ExportSpec(
+        collection="ai_runs",
+        columns=[
+            "id", "user_id", "project_id", "job_id", "provider", "model", "status",
+            "tokens_in", "tokens_out", "latency_ms", "cost_estimate", "is_byo_key",
+            "error_message", "created_at",
+        ],
+        filename="ai_runs",
+    ),
+    "wallet_transactions": ExportSpec(
+        collection="wallet_transactions",
+        columns=[
+            "id", "user_id", "type", "category", "amount", "description",
+            "payment_method", "payment_id", "status", "created_at",
+        ],
+        filename="wallet_transactions",
+    ),
+    "audit_logs": ExportSpec(
+        collection="audit_logs",
+        columns=[
+            "id", "admin_email", "action", "target_type", "target_id",
+            "old_value", "new_value", "reason", "ip_address", "created_at",
+        ],
+        filename="audit_logs",
+        formatters={"old_value": _as_json, "new_value": _as_json},
+    ),
+}
+
+
+# =============================================================================
+# ROW ENCODING
+# =============================================================================
+
+def _cell(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return _as_json(value)
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class _CsvEncoder:
+    """csv.writer over a reusable buffer; drain() returns the pending bytes."""
+
+    def __init__(self, compress: bool):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        # wbits=31 -> gzip container
+        self._gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def writerow(self, row: List[Any]):
+        self._writer.writerow(row)
+
+    def drain(self) -> bytes:
+        data = self._buffer.getvalue().encode("utf-8")
+        self._buffer.seek(0)
+        self._buffer.truncate(0)
+        return self._gzip.compress(data) if self._gzip else data
+
+    def finish(self) -> bytes:
+        tail = self.drain()
+        if self._gzip:
+            tail += self._gzip.flush()
+        return tail
+
+
+# =============================================================================
+# DATE WINDOWS
+# =============================================================================
+
+def _parse_date(value: str) -> datetime:
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+async def _date_windows(
+    spec: ExportSpec,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    chunk_days: int,
+) -> List[Tuple[str, str, bool]]:
+    """
+    Split [start, end] into (lo, hi, inclusive_hi) windows of chunk_days.
+    Without a start date, the range begins at the oldest matching row.
+    """
+    collection = db[spec.collection]
+    if start_date:
+        start = start_date
+    else:
+        oldest = await collection.find_one(
+            {**spec.base_query, spec.date_field: {"$type": "string"}},
+            {"_id": 0, spec.date_field: 1},
+            sort=[(spec.date_field, 1)],
+        )
+        if not oldest:
+            return []
+        start = oldest[spec.date_field]
+    end = end_date or datetime.now(timezone.utc).isoformat()
+
+    windows = []
+    cursor = _parse_date(start)
+    stop = _parse_date(end)
+    lo = start
+    while True:
+        cursor += timedelta(days=chunk_days)
+        if cursor >= stop:
+            windows.append((lo, end, True))
+            return windows
+        hi = cursor.isoformat()
+        windows.append((lo, hi, False))
+        lo = hi
+
+
+# =============================================================================
+# STREAM
+# =============================================================================
+
+async def stream_csv(
+    spec: ExportSpec,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    compress: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    chunk_days: int = DEFAULT_CHUNK_DAYS,
+) -> AsyncIterator[bytes]:
+    """Yield the CSV (header first) for every row of `spec` in the date range."""
+    encoder = _CsvEncoder(compress)
+    encoder.writerow(spec.columns)
+    yield encoder.drain()
+
+    projection = {"_id": 0, **{c: 1 for c in spec.columns}}
+    collection = db[spec.collection]
+
+    for lo, hi, inclusive in await _date_windows(spec, start_date, end_date, chunk_days):
+        query = {**spec.base_query, spec.date_field: {"$gte": lo, ("$lte" if inclusive else "$lt"): hi}}
+        cursor = collection.find(query, projection).sort(spec.date_field, 1).batch_size(batch_size)
+
+        pending = 0
+        async for doc in cursor:
+            encoder.writerow([
+                spec.formatters[c](doc.get(c)) if c in spec.formatters else _cell(doc.get(c))
+                for c in spec.columns
+            ])
+            pending += 1
+            if pending >= batch_size:
+                chunk = encoder.drain()
+                if chunk:
+                    yield chunk
+                pending = 0
+
+        chunk = encoder.drain()
+        if chunk:
+            yield chunk
+
+    yield encoder.finish()
+
+
+def csv_export_response(
+    dataset: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    compress: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    chunk_days: int = DEFAULT_CHUNK_DAYS,
+) -> StreamingResponse:
+    spec = EXPORTS.get(dataset)
+    if not spec:
+        raise HTTPException(status_code=404, detail=f"Unknown export: {dataset}")
+    for value in (start_date, end_date):
+        if value:
+            _parse_date(value)
+
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    chunk_days = max(1, chunk_days)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d")
+    filename = f"{spec.filename}-{stamp}.csv" + (".gz" if compress else "")
+
+    return StreamingResponse(
+        stream_csv(spec, start_date, end_date, compress, batch_size, chunk_days),
+        media_type="application/gzip" if compress else "text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
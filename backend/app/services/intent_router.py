@@ -0,0 +1,222 @@
+"""
+Intent Router - keyword routing shared by every agent entry point
+
+The coding agent, the agent system and the agent chat routes used to keep
+their own keyword lists and scan them with `keyword in query` one by one.
+They now share one vocabulary, compiled once into a single regex:
+
+- a keyword matches whole words only, with an optional plural "s"
+  ("file" matches "files", not "profile")
+- one `finditer` pass scores every agent and complexity level; a keyword
+  counts once per word it spans, so "list files" outweighs "list"
+- results are memoized per normalized query
+
+`analyze_query` returns the scores plus the routing decision. Callers map
+`agent` onto their own AgentType enum.
+"""
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+
+CODER = "coder"
+BROWSER = "browser"
+FILE = "file"
+MCP = "mcp"
+PLANNER = "planner"
+CASUAL = "casual"
+
+COMPLEXITY_HIGH = "high"
+COMPLEXITY_MEDIUM = "medium"
+COMPLEXITY_LOW = "low"
+
+# Label -> keywords. Agent labels pick the agent; "complexity_*" labels grade the task.
+KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    CODER: (
+        "write", "code", "script", "program", "function", "class", "api", "endpoint",
+        "website", "web app", "app", "application", "landing page", "page", "component",
+        "html", "css", "javascript", "js", "typescript", "python", "react", "node",
+        "flask", "django", "fastapi", "database", "sql", "mongodb", "schema", "server",
+        "frontend", "backend", "implement", "generate", "develop", "build", "create",
+        "make a", "create app", "debug", "fix", "bug", "refactor", "game", "calculator",
+        "authentication", "login form", "todo",
+    ),
+    BROWSER: (
+        "search", "browse", "google", "web search", "search online", "look up",
+        "find out", "find online", "find information", "find tutorials", "research",
+        "latest news", "news", "what is the latest", "who is", "check website",
+        "visit", "open url", "navigate to", "weather", "stock price", "price of",
+    ),
+    FILE: (
+        "file", "folder", "directory", "organize", "move", "copy", "delete", "rename",
+        "locate", "find file", "find the file", "create folder", "list files",
+        "list directory", "clean up",
+    ),
+    MCP: (
+        "mcp", "use mcp", "mcp tool", "model context", "external tool", "calendar",
+        "contacts", "email", "slack", "github api",
+    ),
+    PLANNER: (
+        "plan", "step by step", "and then", "after that", "multiple", "several",
+        "complete project", "entire", "full application", "full stack",
+        "comprehensive", "design a system", "architecture", "workflow",
+    ),
+    CASUAL: (
+        "hello", "hi", "hey", "how are you", "thanks", "thank you", "explain",
+        "tell me about", "what is", "why does", "why is", "how does", "joke",
+    ),
+    "complexity_high": (
+        "multiple", "full stack", "complete application", "with database",
+        "authentication", "deployment", "microservices", "api integration",
+        "real-time", "real time",
+    ),
+    "complexity_medium": (
+        "with", "including", "add", "integrate", "responsive", "interactive", "dynamic",
+    ),
+    "complexity_low": (
+        "simple", "basic", "quick", "just", "small", "only", "single",
+    ),
+}
+
+AGENTS = (CODER, BROWSER, FILE, MCP, PLANNER, CASUAL)
+# Ties go to the first agent in this order
+AGENT_PRIORITY = (MCP, CODER, FILE, BROWSER, CASUAL)
+
+# Queries longer than this (in words) are treated as multi-step coding work
+LONG_QUERY_WORDS = 25
+MEMO_MAX_CHARS = 2000
+
+
+# =============================================================================
+# COMPILE
+# =============================================================================
+
+def _trie_pattern(words) -> str:
+    """
+    One regex for all `words`, shaped as a character trie so the engine
+    walks shared prefixes once instead of trying every alternative. Optional
+    groups are greedy, so the longest keyword at a position wins.
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" not in node:
+            return body
+        return body + "?" if len(body) == 1 else "(?:" + body + ")?"
+
+    return build(trie)
+
+
+def _compile(keywords: Dict[str, Tuple[str, ...]]):
+    labels: Dict[str, List[str]] = {}
+    for label, words in keywords.items():
+        for word in words:
+            labels.setdefault(word, []).append(label)
+
+    # Each word start reports its longest keyword; the shorter keywords that
+    # are word-prefixes of it are credited too, all precomputed as
+    # matched keyword -> ((keyword, label, weight), ...)
+    ordered = sorted(labels, key=len, reverse=True)
+    pattern = re.compile(r"\b(?=(" + _trie_pattern(ordered) + r")s?\b)")
+    credits = {
+        word: tuple(
+            (k, label, k.count(" ") + 1)
+            for k in ordered if k == word or word.startswith(k + " ")
+            for label in labels[k]
+        )
+        for word in ordered
+    }
+    return pattern, credits
+
+
+_PATTERN, _CREDITS = _compile(KEYWORDS)
+_EMPTY_SCORES = dict.fromkeys(
+    AGENTS + tuple(f"complexity_{c}" for c in (COMPLEXITY_HIGH, COMPLEXITY_MEDIUM, COMPLEXITY_LOW)), 0
+)
+
+
+# =============================================================================
+# ANALYZE
+# =============================================================================
+
+@dataclass(frozen=True)
+class QueryIntent:
+    """Scores and routing decision for one query."""
+    scores: Mapping[str, int]
+    matches: Tuple[str, ...]
+    agent: Optional[str]          # best non-planner agent, None when nothing matched
+    complexity: str
+    needs_planner: bool
+
+    def agent_or(self, default: str) -> str:
+        """The agent to run: planner when needed, else the best match or `default`."""
+        if self.needs_planner:
+            return PLANNER
+        return self.agent or default
+
+
+def _normalize(query: str) -> str:
+    return " ".join((query or "").lower().split())
+
+
+def _analyze(text: str) -> QueryIntent:
+    scores = _EMPTY_SCORES.copy()
+    matches: List[str] = []
+    for match in _PATTERN.finditer(text):
+        for word, label, weight in _CREDITS[match.group(1)]:
+            if not matches or matches[-1] != word:
+                matches.append(word)
+            scores[label] += weight
+
+    agent = None
+    for candidate in AGENT_PRIORITY:
+        if scores[candidate] > (scores[agent] if agent else 0):
+            agent = candidate
+
+    complexity = COMPLEXITY_MEDIUM
+    for level in (COMPLEXITY_HIGH, COMPLEXITY_MEDIUM, COMPLEXITY_LOW):
+        if scores[f"complexity_{level}"]:
+            complexity = level
+            break
+
+    # Planning only pays off for work, not for chat or lookups
+    actionable = agent in (CODER, FILE, BROWSER) or (agent is None and scores[PLANNER] > 1)
+    needs_planner = actionable and (
+        scores[PLANNER] > 0
+        or (agent == CODER and complexity == COMPLEXITY_HIGH)
+        or (agent == CODER and len(text.split()) > LONG_QUERY_WORDS)
+    )
+
+    return QueryIntent(
+        scores=MappingProxyType(scores),
+        matches=tuple(matches),
+        agent=agent,
+        complexity=complexity,
+        needs_planner=needs_planner,
+    )
+
+
+@lru_cache(maxsize=4096)
+def _analyze_cached(text: str) -> QueryIntent:
+    return _analyze(text)
+
+
+def analyze_query(query: str) -> QueryIntent:
+    """Score `query` against every agent in one pass (memoized)."""
+    text = _normalize(query)
+    if len(text) > MEMO_MAX_CHARS:
+        # Long prompts are rarely repeated; don't let them evict short ones
+        return _analyze(text)
+    return _analyze_cached(text)
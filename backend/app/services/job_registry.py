@@ -0,0 +1,204 @@
+"""
+Job Registry - detached, cancellable agent jobs
+
+Agent jobs run as tracked asyncio tasks owned by the API process, not inside
+the request that started them: a client disconnecting from a stream no
+longer kills (or orphans) its job, and stopping a job cancels the task, so
+the in-flight LLM request is aborted instead of running to completion.
+
+- running jobs are registered in `running_jobs` (job, user, owning worker,
+  heartbeat), so any instance can list them or ask for a stop
+- the per-user cap (AGENT_MAX_JOBS_PER_USER) is a unique (user_id, slot)
+  claim: instances can't race past it, and a slot whose heartbeat has
+  lapsed (a crashed worker) can be taken over
+- stop: a local job is cancelled right away; for one owned by another
+  instance `cancel_requested` is set and the owner's watcher cancels it on
+  its next beat
+- the registry doc is removed when the task ends; the TTL index on
+  `expires_at` clears docs of workers that died without cleaning up
+"""
+
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timezone, timedelta
+from functools import partial
+from typing import Any, Coroutine, Dict, List, Optional, Set
+
+from pymongo.errors import DuplicateKeyError
+
+from app.db.mongo import db
+from app.core.config import AGENT_MAX_JOBS_PER_USER, AGENT_JOB_HEARTBEAT_SECONDS
+
+
+# Identifies this process in `running_jobs`
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# A job whose heartbeat is this old belongs to a dead worker
+STALE_AFTER_SECONDS = AGENT_JOB_HEARTBEAT_SECONDS * 3
+
+RUNNING_JOB_PROJECTION = {
+    "_id": 0, "job_id": 1, "user_id": 1, "kind": 1, "worker_id": 1,
+    "started_at": 1, "cancel_requested": 1,
+}
+
+# job_id -> task, for jobs owned by this process
+_tasks: Dict[str, asyncio.Task] = {}
+_releasing: Set[asyncio.Future] = set()
+_watcher_task: Optional[asyncio.Task] = None
+
+
+def _expires_at() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=STALE_AFTER_SECONDS)
+
+
+# =============================================================================
+# CLAIM & RUN
+# =============================================================================
+
+async def reserve_job(job_id: str, user_id: str, kind: str = "agent", limit: int = None) -> bool:
+    """
+    Take one of the user's job slots for `job_id`. False when all of them are
+    held by live jobs. Call before creating the job's records, then run_job.
+    """
+    limit = AGENT_MAX_JOBS_PER_USER if limit is None else limit
+    now = datetime.now(timezone.utc)
+    for slot in range(limit):
+        doc = {
+            "job_id": job_id,
+            "user_id": user_id,
+            "slot": slot,
+            "kind": kind,
+            "worker_id": WORKER_ID,
+            "cancel_requested": False,
+            "started_at": now.isoformat(),
+            "expires_at": _expires_at(),
+        }
+        try:
+            await db.running_jobs.insert_one(doc)
+            return True
+        except DuplicateKeyError:
+            # The slot is taken; take it over if its owner stopped beating
+            result = await db.running_jobs.replace_one(
+                {"user_id": user_id, "slot": slot, "expires_at": {"$lt": now}}, doc,
+            )
+            if result.modified_count:
+                return True
+    return False
+
+
+def run_job(job_id: str, coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+    """Run a reserved job as a tracked task; its slot is released when it ends."""
+    task = asyncio.create_task(coro, name=f"job:{job_id}")
+    _tasks[job_id] = task
+    task.add_done_callback(partial(_job_done, job_id))
+    return task
+
+
+def _job_done(job_id: str, task: asyncio.Task):
+    _tasks.pop(job_id, None)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[Jobs] Job {job_id} crashed: {task.exception()!r}")
+    release = asyncio.ensure_future(release_job(job_id))
+    _releasing.add(release)
+    release.add_done_callback(_releasing.discard)
+
+
+async def release_job(job_id: str):
+    await db.running_jobs.delete_one({"job_id": job_id, "worker_id": WORKER_ID})
+
+
+# =============================================================================
+# QUERY & CANCEL
+# =============================================================================
+
+async def list_running_jobs(user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Jobs running on any instance (optionally one user's), oldest first."""
+    query: Dict[str, Any] = {"expires_at": {"$gte": datetime.now(timezone.utc)}}
+    if user_id:
+        query["user_id"] = user_id
+    return await db.running_jobs.find(query, RUNNING_JOB_PROJECTION).sort("started_at", 1).to_list(None)
+
+
+async def count_running_jobs(user_id: str) -> int:
+    return await db.running_jobs.count_documents(
+        {"user_id": user_id, "expires_at": {"$gte": datetime.now(timezone.utc)}}
+    )
+
+
+def job_task(job_id: str) -> Optional[asyncio.Task]:
+    """The task of a job running in this process."""
+    return _tasks.get(job_id)
+
+
+async def cancel_job(job_id: str) -> bool:
+    """
+    Stop a running job wherever it runs. Returns False when it isn't running
+    (finished, or its worker died), in which case the caller marks it.
+    """
+    task = _tasks.get(job_id)
+    if task is not None:
+        task.cancel()
+        return True
+    result = await db.running_jobs.update_one(
+        {"job_id": job_id, "expires_at": {"$gte": datetime.now(timezone.utc)}},
+        {"$set": {"cancel_requested": True}},
+    )
+    return result.matched_count > 0
+
+
+# =============================================================================
+# WATCHER
+# =============================================================================
+
+async def _beat():
+    """Refresh this worker's heartbeats and apply stops requested elsewhere."""
+    if not _tasks:
+        return
+    job_ids = list(_tasks)
+    await db.running_jobs.update_many(
+        {"job_id": {"$in": job_ids}, "worker_id": WORKER_ID},
+        {"$set": {"expires_at": _expires_at()}},
+    )
+    async for doc in db.running_jobs.find(
+        {"job_id": {"$in": job_ids}, "worker_id": WORKER_ID, "cancel_requested": True},
+        {"_id": 0, "job_id": 1},
+    ):
+        task = _tasks.get(doc["job_id"])
+        if task is not None:
+            task.cancel()
+
+
+async def start_job_watcher():
+    global _watcher_task
+    if _watcher_task is not None:
+        return
+
+    async def watch():
+        while True:
+            await asyncio.sleep(AGENT_JOB_HEARTBEAT_SECONDS)
+            try:
+                await _beat()
+            except Exception as e:
+                print(f"[Jobs] Heartbeat failed: {e}")
+
+    _watcher_task = asyncio.create_task(watch())
+
+
+async def stop_job_watcher():
+    """Stop the watcher and cancel this worker's jobs (they are marked cancelled)."""
+    global _watcher_task
+    if _watcher_task is not None:
+        _watcher_task.cancel()
+        try:
+            await _watcher_task
+        except asyncio.CancelledError:
+            pass
+        _watcher_task = None
+
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.gather(*_releasing, return_exceptions=True)
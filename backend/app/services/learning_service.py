@@ -11,6 +11,7 @@ from typing import Optional, List, Dict, Any
 from collections import defaultdict
 
 from app.db.mongo import db
+from app.services.retention import with_retention_date
 from app.models.learning import (
     ProjectEvent, EventType, SpecVersion, UserPreferences, ThemePreference,
     PatternLibrary, PatternCategory, ErrorSignature,
@@ -43,7 +44,7 @@ async def track_event(
         created_at=datetime.now(timezone.utc).isoformat()
     )
     
-    await db.project_events.insert_one(event.model_dump())
+    await db.project_events.insert_one(with_retention_date(event.model_dump()))
     
     # Trigger real-time preference updates for certain events
     if event_type in [EventType.THEME_CHANGED, EventType.SECTION_ADDED, 
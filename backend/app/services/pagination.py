@@ -0,0 +1,104 @@
+"""
+Keyset (cursor) pagination helpers
+
+`skip(n)` makes Mongo walk and discard n index entries, so deep pages get
+slower the further you go. Keyset pagination instead remembers the sort key
+of the last row returned and asks for rows strictly after it. The cursor
+handed to clients is opaque (base64url JSON of the last sort value + id).
+
+Endpoints that return an object include `next_cursor` in the body; endpoints
+whose body is a bare list send it in the X-Next-Cursor header instead so
+existing clients keep working. Either way, a null/absent cursor means the
+last page has been reached.
+"""
+
+import base64
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Response
+
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(value: Any, tie_breaker: Any) -> str:
+    raw = json.dumps([value, tie_breaker], separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, tie_breaker = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return value, tie_breaker
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_filter(
+    query: Dict[str, Any],
+    cursor: Optional[str],
+    sort_field: str = "created_at",
+    direction: int = -1,
+    tie_field: str = "id",
+) -> Dict[str, Any]:
+    """
+    Combine `query` with the "after this cursor" condition for a sort on
+    (sort_field, tie_field) in `direction` (-1 = newest first).
+    """
+    if not cursor:
+        return query
+
+    value, tie_breaker = decode_cursor(cursor)
+    op = "$lt" if direction == -1 else "$gt"
+    after = {"$or": [
+        {sort_field: {op: value}},
+        {sort_field: value, tie_field: {op: tie_breaker}},
+    ]}
+    return {"$and": [query, after]} if query else after
+
+
+def keyset_sort(sort_field: str = "created_at", direction: int = -1, tie_field: str = "id") -> List[Tuple[str, int]]:
+    return [(sort_field, direction), (tie_field, direction)]
+
+
+def page_from_rows(
+    rows: List[Dict[str, Any]],
+    limit: int,
+    sort_field: str = "created_at",
+    tie_field: str = "id",
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Split `limit + 1` fetched rows into the page and the next cursor
+    (None when there is no further page).
+    """
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    last = page[-1]
+    return page, encode_cursor(last.get(sort_field), last.get(tie_field))
+
+
+async def fetch_page(
+    collection,
+    query: Dict[str, Any],
+    cursor: Optional[str],
+    limit: int,
+    projection: Optional[Dict[str, Any]] = None,
+    sort_field: str = "created_at",
+    direction: int = -1,
+    tie_field: str = "id",
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Run one keyset page query and return (items, next_cursor)."""
+    rows = await collection.find(
+        keyset_filter(query, cursor, sort_field, direction, tie_field),
+        projection if projection is not None else {"_id": 0},
+    ).sort(keyset_sort(sort_field, direction, tie_field)).limit(limit + 1).to_list(limit + 1)
+    return page_from_rows(rows, limit, sort_field, tie_field)
+
+
+def set_next_cursor_header(response: Response, next_cursor: Optional[str]):
+    """Expose the next cursor on list-shaped responses."""
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
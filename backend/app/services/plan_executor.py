@@ -0,0 +1,222 @@
+"""
+Plan Executor - runs planner steps as a dependency graph
+
+Planner agents ask the model for steps with `dependencies` (ids of steps
+that must finish first). Steps whose dependencies are done run concurrently,
+so a plan finishes in about the time of its critical path rather than the sum
+of its steps:
+
+- concurrency is capped per user (PLAN_STEP_CONCURRENCY), shared by every
+  plan the user has running in this process
+- when a step fails, every step depending on it (directly or not) is
+  cancelled; unrelated branches keep going
+- plans that declare no dependencies at all run in order, each step seeing
+  the one before it, which is what planners did before
+- unknown dependency ids are ignored; a cycle falls back to running the plan
+  in order
+
+`run_plan` is an async generator of progress dicts, so callers can stream
+per-step events while the graph runs.
+"""
+
+import asyncio
+import time
+import weakref
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from app.core.config import PLAN_STEP_CONCURRENCY
+
+
+# Step lifecycle (the `type` of each dict yielded by run_plan)
+STEP_STARTED = "step_started"
+STEP_EVENT = "step_event"
+STEP_COMPLETED = "step_completed"
+STEP_FAILED = "step_failed"
+STEP_CANCELLED = "step_cancelled"
+
+# run_step(step, dependency results, emit) -> step result
+StepRunner = Callable[[Dict[str, Any], Dict[str, Any], Callable[[Any], None]], Awaitable[Any]]
+
+# One semaphore per user while any of their plans is running
+_user_slots: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+
+def _user_semaphore(user_id: Optional[str], limit: int) -> asyncio.Semaphore:
+    if user_id is None:
+        return asyncio.Semaphore(limit)
+    slots = _user_slots.get(user_id)
+    if slots is None:
+        slots = asyncio.Semaphore(limit)
+        _user_slots[user_id] = slots
+    return slots
+
+
+# =============================================================================
+# GRAPH
+# =============================================================================
+
+def normalize_plan(steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Copies of `steps` with a string `id` and a clean `dependencies` list
+    (known ids only, no self-references), in a form run_plan can schedule.
+    """
+    normalized = []
+    for i, step in enumerate(steps):
+        step = dict(step)
+        step["id"] = str(step.get("id") or i + 1)
+        normalized.append(step)
+
+    ids = [s["id"] for s in normalized]
+    if len(set(ids)) != len(ids):
+        # Duplicate ids make the graph ambiguous; number the steps instead
+        for i, step in enumerate(normalized):
+            step["id"] = str(i + 1)
+        ids = [s["id"] for s in normalized]
+
+    if not any("dependencies" in s for s in steps):
+        for prev, step in zip([None] + ids, normalized):
+            step["dependencies"] = [prev] if prev else []
+        return normalized
+
+    known = set(ids)
+    for step in normalized:
+        deps = step.get("dependencies") or []
+        if not isinstance(deps, list):
+            deps = [deps]
+        step["dependencies"] = list(dict.fromkeys(
+            str(d) for d in deps if str(d) in known and str(d) != step["id"]
+        ))
+
+    if _has_cycle(normalized):
+        for prev, step in zip([None] + ids, normalized):
+            step["dependencies"] = [prev] if prev else []
+    return normalized
+
+
+def _has_cycle(steps: List[Dict[str, Any]]) -> bool:
+    pending = {s["id"]: set(s["dependencies"]) for s in steps}
+    while pending:
+        ready = [sid for sid, deps in pending.items() if not deps]
+        if not ready:
+            return True
+        for sid in ready:
+            del pending[sid]
+        for deps in pending.values():
+            deps.difference_update(ready)
+    return False
+
+
+def _dependents(steps: List[Dict[str, Any]], failed_id: str) -> List[str]:
+    """Ids of every step that (transitively) depends on `failed_id`."""
+    children: Dict[str, List[str]] = {}
+    for step in steps:
+        for dep in step["dependencies"]:
+            children.setdefault(dep, []).append(step["id"])
+    found: List[str] = []
+    stack = list(children.get(failed_id, []))
+    while stack:
+        sid = stack.pop()
+        if sid not in found:
+            found.append(sid)
+            stack.extend(children.get(sid, []))
+    return found
+
+
+# =============================================================================
+# EXECUTE
+# =============================================================================
+
+async def run_plan(
+    steps: List[Dict[str, Any]],
+    run_step: StepRunner,
+    user_id: Optional[str] = None,
+    max_parallel: Optional[int] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run `steps` (see normalize_plan) and yield progress as it happens:
+
+        {"type": STEP_STARTED, "step_id", "step"}
+        {"type": STEP_EVENT, "step_id", "event"}         # whatever run_step emits
+        {"type": STEP_COMPLETED, "step_id", "result", "duration_ms"}
+        {"type": STEP_FAILED, "step_id", "error", "duration_ms"}
+        {"type": STEP_CANCELLED, "step_id", "reason"}
+
+    `run_step(step, inputs, emit)` gets the results of the step's direct
+    dependencies as {step_id: result}; an exception fails the step.
+    """
+    steps = normalize_plan(steps)
+    by_id = {s["id"]: s for s in steps}
+    slots = _user_semaphore(user_id, max_parallel or PLAN_STEP_CONCURRENCY)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    results: Dict[str, Any] = {}
+    remaining = {s["id"]: set(s["dependencies"]) for s in steps}
+    running: Dict[str, asyncio.Task] = {}
+    cancelled: set = set()
+
+    async def execute(step: Dict[str, Any]):
+        step_id = step["id"]
+        inputs = {dep: results.get(dep) for dep in step["dependencies"]}
+        async with slots:
+            queue.put_nowait({"type": STEP_STARTED, "step_id": step_id, "step": step})
+            started = time.monotonic()
+            try:
+                result = await run_step(
+                    step, inputs, lambda event: queue.put_nowait({"type": STEP_EVENT, "step_id": step_id, "event": event})
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                queue.put_nowait({
+                    "type": STEP_FAILED,
+                    "step_id": step_id,
+                    "error": str(e) or type(e).__name__,
+                    "duration_ms": int((time.monotonic() - started) * 1000),
+                })
+                return
+            queue.put_nowait({
+                "type": STEP_COMPLETED,
+                "step_id": step_id,
+                "result": result,
+                "duration_ms": int((time.monotonic() - started) * 1000),
+            })
+
+    def launch_ready():
+        for step_id in [sid for sid, deps in remaining.items() if not deps]:
+            del remaining[step_id]
+            running[step_id] = asyncio.create_task(execute(by_id[step_id]))
+
+    try:
+        launch_ready()
+        while running:
+            item = await queue.get()
+            step_id = item["step_id"]
+
+            if item["type"] == STEP_COMPLETED:
+                results[step_id] = item["result"]
+                running.pop(step_id, None)
+                for deps in remaining.values():
+                    deps.discard(step_id)
+            elif item["type"] == STEP_FAILED:
+                running.pop(step_id, None)
+
+            yield item
+
+            if item["type"] == STEP_FAILED:
+                for dependent in _dependents(steps, step_id):
+                    if dependent in remaining and dependent not in cancelled:
+                        cancelled.add(dependent)
+                        del remaining[dependent]
+                        yield {
+                            "type": STEP_CANCELLED,
+                            "step_id": dependent,
+                            "reason": f"Dependency {step_id} failed",
+                        }
+            if item["type"] in (STEP_COMPLETED, STEP_FAILED):
+                launch_ready()
+    finally:
+        # Consumer stopped early (job cancelled, client gone): stop the branches too
+        for task in running.values():
+            task.cancel()
+        if running:
+            await asyncio.gather(*running.values(), return_exceptions=True)
@@ -0,0 +1,311 @@
+"""
+Preview Cache - materialized live previews for agent jobs
+
+Preview iframes reload /preview/{job_id} constantly. Instead of re-reading
+the job and its events and re-stitching code blocks on every request, the
+composed page is materialized in `job_previews` as files are created:
+
+- `add_preview_file` records one file (its code goes to the blob store) and
+  recomposes the page from the files recorded so far
+- `finish_preview` marks the page final once the job is done
+- `render_preview` serves the page with a strong ETag (the content hash) and
+  negotiated gzip/brotli, answering If-None-Match with 304
+
+Jobs from before the cache existed are materialized on first request.
+Project previews are composed from the project's file tree instead, keyed
+by the hashes of the files they use.
+"""
+
+import gzip
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+from fastapi import HTTPException, Response
+from pymongo import ReturnDocument
+
+from app.db.mongo import db
+from app.services.blob_store import blob_hash, put_blob, get_blob, get_blobs
+from app.services.project_store import etag_matches
+from app.services.project_files import list_files, manifest_hash
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+HTML_LANGUAGES = {"html", "htm"}
+CSS_LANGUAGES = {"css"}
+JS_LANGUAGES = {"javascript", "js"}
+# Preferred file of each kind when a project tree has several
+PAGE_FILES = {"html": "index.html", "css": "styles.css", "js": "script.js"}
+
+# Compressed bodies by (content hash, encoding); the HTML itself is cached by the blob store
+_encoded: LRUCache = LRUCache(maxsize=32 * 1024 * 1024, getsizeof=len)
+
+PREVIEW_META_PROJECTION = {"_id": 0, "html_ref": 1, "content_hash": 1, "complete": 1}
+
+
+def _file_key(filename: str) -> str:
+    # Mongo field names can't contain dots or start with $
+    return re.sub(r"[.$]", "_", filename)
+
+
+def _kind(filename: str, language: Optional[str]) -> Optional[str]:
+    lang = (language or "").lower()
+    name = (filename or "").lower()
+    if lang in HTML_LANGUAGES or name.endswith((".html", ".htm")):
+        return "html"
+    if lang in CSS_LANGUAGES or name.endswith(".css"):
+        return "css"
+    if lang in JS_LANGUAGES or name.endswith(".js"):
+        return "js"
+    return None
+
+
+def compose_preview(files: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    Stitch html/css/js files (in creation order, last one of each kind wins)
+    into one page. Returns None when there is no HTML.
+    """
+    parts: Dict[str, str] = {}
+    for f in files:
+        kind = _kind(f.get("filename"), f.get("language"))
+        if kind and f.get("code"):
+            parts[kind] = f["code"]
+
+    html = parts.get("html")
+    if not html:
+        return None
+    if parts.get("css") and "<style>" not in html:
+        html = html.replace("</head>", f"<style>{parts['css']}</style></head>")
+    if parts.get("js") and "<script>" not in html:
+        html = html.replace("</body>", f"<script>{parts['js']}</script></body>")
+    return html
+
+
+# =============================================================================
+# MATERIALIZE
+# =============================================================================
+
+def _ordered(files: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return sorted(files.values(), key=lambda f: f.get("added_at", ""))
+
+
+async def _recompose(preview: Dict[str, Any]):
+    files = _ordered(preview.get("files", {}))
+    blobs = await get_blobs(f["code_ref"] for f in files)
+    html = compose_preview([{**f, "code": blobs.get(f["code_ref"])} for f in files])
+    if html is None:
+        return
+
+    # Only the newest file change gets to write; an older compose racing it is dropped
+    await db.job_previews.update_one(
+        {"job_id": preview["job_id"], "seq": preview["seq"]},
+        {"$set": {
+            "html_ref": await put_blob(html),
+            "content_hash": blob_hash(html),
+            "size": len(html),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }},
+    )
+
+
+async def add_preview_file(job_id: str, user_id: str, filename: str, language: Optional[str], code: str):
+    """Record a created file and refresh the job's composed preview."""
+    if not code:
+        return
+    now = datetime.now(timezone.utc).isoformat()
+    preview = await db.job_previews.find_one_and_update(
+        {"job_id": job_id},
+        {
+            "$inc": {"seq": 1},
+            "$set": {f"files.{_file_key(filename)}": {
+                "filename": filename,
+                "language": language,
+                "code_ref": await put_blob(code),
+                "added_at": now,
+            }},
+            "$setOnInsert": {"user_id": user_id, "complete": False, "created_at": now},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    if _kind(filename, language) is not None:
+        await _recompose(preview)
+
+
+async def add_preview_blocks(job_id: str, user_id: str, blocks: List[Dict[str, Any]]):
+    for block in blocks:
+        await add_preview_file(job_id, user_id, block.get("filename"), block.get("language"), block.get("code"))
+
+
+async def finish_preview(job_id: str):
+    await db.job_previews.update_one({"job_id": job_id}, {"$set": {"complete": True}})
+
+
+async def _materialize_legacy(job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Build the cache entry for a job finished before previews were cached."""
+    # Mark the job as materialized even if it turns out to have no files
+    await db.job_previews.update_one(
+        {"job_id": job["id"]},
+        {"$setOnInsert": {
+            "user_id": job["user_id"],
+            "files": {},
+            "seq": 0,
+            "complete": False,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }},
+        upsert=True,
+    )
+    blocks = list(job.get("code_blocks") or [])
+    if not blocks:
+        events = await db.build_events.find(
+            {"job_id": job["id"], "type": "file_created"},
+            {"_id": 0, "data": 1},
+        ).sort("timestamp", 1).to_list(200)
+        for event in events:
+            data = event.get("data") or {}
+            blocks.append({
+                "filename": data.get("filename"),
+                "language": data.get("language"),
+                "code": data.get("code"),
+                "code_ref": data.get("code_ref"),
+            })
+
+    blobs = await get_blobs(b.get("code_ref") for b in blocks if not b.get("code"))
+    for block in blocks:
+        if not block.get("code"):
+            block["code"] = blobs.get(block.get("code_ref"), "")
+        if not block.get("filename"):
+            block["filename"] = f"file.{block.get('language') or 'txt'}"
+
+    await add_preview_blocks(job["id"], job["user_id"], blocks)
+    if job.get("status") in ("success", "completed", "failed", "cancelled"):
+        await finish_preview(job["id"])
+    return await db.job_previews.find_one({"job_id": job["id"]}, PREVIEW_META_PROJECTION)
+
+
+# =============================================================================
+# SERVE
+# =============================================================================
+
+def _negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    accepted = {e.split(";")[0].strip() for e in (accept_encoding or "").lower().split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _encode(content_hash: str, html: str, encoding: Optional[str]) -> bytes:
+    if encoding is None:
+        return html.encode("utf-8")
+    key = f"{content_hash}:{encoding}"
+    body = _encoded.get(key)
+    if body is None:
+        raw = html.encode("utf-8")
+        body = brotli.compress(raw) if encoding == "br" else gzip.compress(raw, compresslevel=6)
+        if len(body) <= _encoded.maxsize // 8:
+            _encoded[key] = body
+    return body
+
+
+async def get_preview_meta(job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    meta = await db.job_previews.find_one({"job_id": job["id"]}, PREVIEW_META_PROJECTION)
+    if meta is None:
+        meta = await _materialize_legacy(job)
+    return meta if meta and meta.get("html_ref") else None
+
+
+async def render_preview(
+    job: Dict[str, Any],
+    if_none_match: Optional[str] = None,
+    accept_encoding: Optional[str] = None,
+) -> Response:
+    """The job's composed preview page as an HTML response (or 304)."""
+    meta = await get_preview_meta(job)
+    if not meta:
+        raise HTTPException(status_code=404, detail="No preview available")
+
+    encoding = _negotiate(accept_encoding)
+    suffix = {"br": "-br", "gzip": "-gz"}.get(encoding, "")
+    etag = f'"{meta["content_hash"][:32]}{suffix}"'
+    headers = {
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+        # Finished previews never change; live ones must be revalidated
+        "Cache-Control": "private, max-age=86400" if meta.get("complete") else "private, no-cache",
+    }
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    html = await get_blob(meta["html_ref"])
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(
+        content=_encode(meta["content_hash"], html or "", encoding),
+        media_type="text/html; charset=utf-8",
+        headers=headers,
+    )
+
+
+async def get_preview_files(job: Dict[str, Any], if_none_match: Optional[str] = None) -> Tuple[Optional[Dict[str, str]], str]:
+    """
+    ({filename: code}, etag) for the files recorded for a job. The etag is
+    derived from the files' blob refs, so a matching If-None-Match returns
+    (None, etag) without loading any code.
+    """
+    preview = await db.job_previews.find_one({"job_id": job["id"]}, {"_id": 0, "files": 1})
+    if preview is None:
+        await _materialize_legacy(job)
+        preview = await db.job_previews.find_one({"job_id": job["id"]}, {"_id": 0, "files": 1}) or {}
+
+    files = _ordered(preview.get("files", {}))
+    digest = blob_hash("\0".join(f"{f['filename']}:{f['code_ref']}" for f in files))
+    etag = f'"{digest[:32]}"'
+    if etag_matches(if_none_match, etag):
+        return None, etag
+
+    blobs = await get_blobs(f["code_ref"] for f in files)
+    return {f["filename"]: blobs.get(f["code_ref"], "") for f in files}, etag
+
+
+async def render_project_preview(
+    project_id: str,
+    if_none_match: Optional[str] = None,
+    accept_encoding: Optional[str] = None,
+) -> Response:
+    """A project's page composed from its file tree (or 304)."""
+    picked: Dict[str, Dict[str, Any]] = {}
+    for f in await list_files(project_id):
+        kind = _kind(f["path"], f.get("language"))
+        if kind and (kind not in picked or f["path"] == PAGE_FILES[kind]):
+            picked[kind] = f
+    if "html" not in picked:
+        raise HTTPException(status_code=404, detail="No preview available")
+    files = [picked[kind] for kind in PAGE_FILES if kind in picked]
+
+    content_hash = manifest_hash(files)
+    encoding = _negotiate(accept_encoding)
+    suffix = {"br": "-br", "gzip": "-gz"}.get(encoding, "")
+    etag = f'"{content_hash[:32]}{suffix}"'
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    blobs = await get_blobs(f.get("ref") for f in files)
+    html = compose_preview([
+        {"filename": f["path"], "language": f.get("language"), "code": blobs.get(f.get("ref"), "")}
+        for f in files
+    ])
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(
+        content=_encode(content_hash, html or "", encoding),
+        media_type="text/html; charset=utf-8",
+        headers=headers,
+    )
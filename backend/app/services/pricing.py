@@ -0,0 +1,423 @@
+"""
+Pricing - model price tables, token counts and usage rollups
+
+- Prices are USD per 1K input/output tokens, per provider and model, kept as
+  versioned tables in `price_tables`. The newest table whose `effective_at`
+  has passed is the active one; it is cached in memory and re-read every
+  PRICE_TABLE_CACHE_SECONDS (right away after an admin publishes one). With
+  no table in the database the prices shipped in MODEL_CONFIG apply.
+- A run is priced once, when it is logged, and stamped with the version of
+  the table that priced it.
+- When a provider doesn't report usage, tokens are counted with tiktoken,
+  or a word/punctuation estimate when it isn't available.
+- Logged runs are added to per-user, per-day rollups in `usage_rollups`
+  (requests, tokens, cost, by provider, model and LLM key) with `$inc`, so
+  usage status, history and credit reads never scan `ai_runs`. Day docs
+  expire after USAGE_ROLLUP_RETENTION_DAYS; a per-user lifetime doc with
+  the same sums doesn't, so all-time totals stay a single lookup.
+- Runs logged before metering existed are backfilled once per database, by
+  whichever worker claims it; the backfill only `$inc`s runs not yet
+  counted (`rolled_up`), so it doesn't race the live updates.
+"""
+
+import re
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from app.db.mongo import db
+from app.core.config import PRICE_TABLE_CACHE_SECONDS, USAGE_ROLLUP_RETENTION_DAYS
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to the estimate below
+    tiktoken = None
+
+
+BUILTIN_PRICE_VERSION = "builtin"
+
+# Models missing from the active table (per 1K tokens)
+DEFAULT_PRICE = {"input": 0.001, "output": 0.002}
+
+# Used for models tiktoken doesn't know (every non-OpenAI one)
+DEFAULT_ENCODING = "o200k_base"
+
+# Chat framing per message / per request, as OpenAI documents it
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REQUEST = 3
+
+ROLLUP_SUMS = ("requests", "failed", "tokens_in", "tokens_out", "cost", "billed_cost")
+
+
+# =============================================================================
+# PRICE TABLES
+# =============================================================================
+
+@dataclass(frozen=True)
+class PriceTable:
+    """{provider: {model: {"input", "output"}}} at one version"""
+    version: str
+    prices: Dict[str, Dict[str, Dict[str, float]]]
+    effective_at: Optional[str] = None
+
+    def price(self, provider: str, model: str) -> Dict[str, float]:
+        """
+        Exact model first, then the longest listed prefix of it (so dated
+        releases like gpt-4o-2024-08-06 get gpt-4o's price), then the same
+        under "*" (provider-independent entries), then the provider's "*".
+        """
+        for scope in (self.prices.get(provider) or {}, self.prices.get("*") or {}):
+            if model in scope:
+                return scope[model]
+            prefixes = [name for name in scope if name != "*" and model.startswith(name)]
+            if prefixes:
+                return scope[max(prefixes, key=len)]
+        return (self.prices.get(provider) or {}).get("*") or DEFAULT_PRICE
+
+    def cost(self, provider: str, model: str, tokens_in: int, tokens_out: int) -> float:
+        price = self.price(provider, model)
+        return round(tokens_in / 1000 * price["input"] + tokens_out / 1000 * price["output"], 6)
+
+
+def builtin_price_table() -> PriceTable:
+    # Imported here: ai_router prices its runs through this module
+    from app.services.ai_router import MODEL_CONFIG, MODEL_PRICING
+
+    prices = {provider: dict(config.get("models", {})) for provider, config in MODEL_CONFIG.items()}
+    prices["*"] = dict(MODEL_PRICING)
+    return PriceTable(version=BUILTIN_PRICE_VERSION, prices=prices)
+
+
+_active: Optional[PriceTable] = None
+_loaded_at: Optional[datetime] = None
+
+
+def current_price_table() -> PriceTable:
+    """The cached active table, without I/O (the built-in one until loaded)."""
+    global _active
+    if _active is None:
+        _active = builtin_price_table()
+    return _active
+
+
+async def get_price_table() -> PriceTable:
+    """The active table, re-read from `price_tables` once the cache is stale."""
+    global _active, _loaded_at
+    now = datetime.now(timezone.utc)
+    if _active is not None and _loaded_at and (now - _loaded_at).total_seconds() < PRICE_TABLE_CACHE_SECONDS:
+        return _active
+
+    try:
+        doc = await db.price_tables.find_one(
+            {"effective_at": {"$lte": now.isoformat()}},
+            {"_id": 0, "version": 1, "prices": 1, "effective_at": 1},
+            sort=[("effective_at", -1)],
+        )
+    except Exception as e:
+        # Keep pricing with what we have; the next call retries
+        print(f"[Pricing] Failed to load price table: {e}")
+        return current_price_table()
+
+    _active = PriceTable(doc["version"], _nest_prices(doc["prices"]), doc["effective_at"]) if doc else builtin_price_table()
+    _loaded_at = now
+    return _active
+
+
+def _nest_prices(rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Stored rows ({provider, model, input, output}; model ids hold dots) to the nested table."""
+    prices: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for row in rows:
+        prices.setdefault(row["provider"], {})[row["model"]] = {"input": row["input"], "output": row["output"]}
+    return prices
+
+
+def invalidate_price_table():
+    global _loaded_at
+    _loaded_at = None
+
+
+async def publish_price_table(
+    prices: Dict[str, Dict[str, Dict[str, float]]],
+    version: Optional[str] = None,
+    effective_at: Optional[str] = None,
+    created_by: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Store a new table version. It replaces the active one at `effective_at`
+    (default now); earlier versions are kept for auditing priced runs.
+    Raises ValueError for an unparseable `effective_at`, DuplicateKeyError
+    for an existing version.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    if effective_at:
+        at = datetime.fromisoformat(effective_at)
+        effective_at = (at if at.tzinfo else at.replace(tzinfo=timezone.utc)).astimezone(timezone.utc).isoformat()
+    doc = {
+        "id": str(uuid.uuid4()),
+        "version": version or now[:19].replace(":", "-"),
+        "prices": [
+            {"provider": provider, "model": model, "input": price["input"], "output": price["output"]}
+            for provider, models in prices.items()
+            for model, price in models.items()
+        ],
+        "effective_at": effective_at or now,
+        "created_by": created_by,
+        "created_at": now,
+    }
+    await db.price_tables.insert_one(doc)
+    invalidate_price_table()
+    doc.pop("_id", None)
+    return doc
+
+
+async def list_price_tables(limit: int = 20) -> List[Dict[str, Any]]:
+    """Published versions, newest first (prices omitted)."""
+    return await db.price_tables.find(
+        {}, {"_id": 0, "prices": 0}
+    ).sort("effective_at", -1).to_list(limit)
+
+
+# =============================================================================
+# TOKEN COUNTING
+# =============================================================================
+
+# Words cost about one token per 4 characters, every other symbol about one
+_PIECES = re.compile(r"\w+|\S")
+
+
+@lru_cache(maxsize=64)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception as e:
+        print(f"[Pricing] tiktoken unavailable for {model}: {e}")
+        return None
+    try:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        # The encoding file couldn't be loaded (e.g. offline); estimate instead
+        print(f"[Pricing] tiktoken unavailable: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    """Tokens in `text` for `model`: tiktoken when available, else an estimate."""
+    if not text:
+        return 0
+    encoding = _encoding(model or "")
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return sum((len(piece) + 3) // 4 for piece in _PIECES.findall(text))
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str = "") -> int:
+    """Prompt tokens of a chat request, including the per-message framing."""
+    return TOKENS_PER_REQUEST + sum(
+        TOKENS_PER_MESSAGE + count_tokens(m.get("content") or "", model) for m in messages
+    )
+
+
+# =============================================================================
+# USAGE ROLLUPS (write path)
+# =============================================================================
+
+def _field(name: str) -> str:
+    """Providers, models and key ids become sub-document keys; Mongo keys can't hold '.' or '$'."""
+    return (name or "unknown").replace(".", "_").replace("$", "_")[:100]
+
+
+def _rollup_id(user_id: str, day: str) -> str:
+    return f"{user_id}:{day}"
+
+
+def _lifetime_id(user_id: str) -> str:
+    return f"{user_id}:lifetime"
+
+
+def _expires_at(day: str) -> datetime:
+    start = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return start + timedelta(days=1 + USAGE_ROLLUP_RETENTION_DAYS)
+
+
+def _rollup_incs(run: Dict[str, Any], requests: int = 1) -> Dict[str, float]:
+    tokens_in, tokens_out = run.get("tokens_in", 0), run.get("tokens_out", 0)
+    cost = run.get("cost_estimate", 0) or 0
+    provider, model = _field(run.get("provider")), _field(run.get("model"))
+    incs = {
+        "requests": requests,
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+        "cost": cost,
+        f"by_provider.{provider}.requests": requests,
+        f"by_provider.{provider}.tokens": tokens_in + tokens_out,
+        f"by_provider.{provider}.cost": cost,
+        f"by_model.{model}.requests": requests,
+        f"by_model.{model}.cost": cost,
+    }
+    # Backfilled groups carry their failed count; a logged run has a status
+    failed = run["failed"] if "failed" in run else int(run.get("status") == "failed")
+    if failed:
+        incs["failed"] = failed
+    # Runs on the user's own provider key aren't paid by the platform
+    if not run.get("is_byo_key"):
+        incs["billed_cost"] = cost
+    if run.get("llm_key_id"):
+        key = _field(run["llm_key_id"])
+        incs[f"by_key.{key}.requests"] = requests
+        incs[f"by_key.{key}.cost"] = cost
+    return incs
+
+
+def _rollup_updates(user_id: str, day: Optional[str], incs: Dict[str, Any]) -> List[UpdateOne]:
+    """$inc upserts of the day doc (unless `day` is None) and the lifetime doc."""
+    updates = [UpdateOne(
+        {"_id": _lifetime_id(user_id)},
+        {"$inc": {field: value for field, value in incs.items() if field in ROLLUP_SUMS},
+         "$setOnInsert": {"user_id": user_id, "period": "lifetime"}},
+        upsert=True,
+    )]
+    if day:
+        updates.insert(0, UpdateOne(
+            {"_id": _rollup_id(user_id, day)},
+            {"$inc": incs, "$setOnInsert": {"user_id": user_id, "day": day, "expires_at": _expires_at(day)}},
+            upsert=True,
+        ))
+    return updates
+
+
+async def record_usage(run: Dict[str, Any]):
+    """
+    Add a logged ai_run to its user's rollup for the day and lifetime totals
+    (one bulk_write), and charge the LLM key that paid for it, if any.
+    """
+    if not run.get("user_id"):
+        return
+    try:
+        await db.usage_rollups.bulk_write(
+            _rollup_updates(run["user_id"], run["created_at"][:10], _rollup_incs(run)), ordered=False,
+        )
+        if run.get("llm_key_id") and run.get("status") == "success":
+            await _charge_llm_key(run)
+    except Exception as e:
+        # Metering must never break the request that triggered it
+        print(f"[Pricing] Failed to record usage for run {run.get('id')}: {e}")
+
+
+async def _charge_llm_key(run: Dict[str, Any]):
+    cost = run.get("cost_estimate", 0) or 0
+    await db.llm_keys.update_one(
+        {"id": run["llm_key_id"], "user_id": run["user_id"]},
+        {
+            "$inc": {"credits_balance": -cost, "credits_used": cost, "total_requests": 1},
+            "$set": {"last_used_at": run["created_at"]},
+        },
+    )
+    await db.llm_key_usage.insert_one({
+        "id": str(uuid.uuid4()),
+        "key_id": run["llm_key_id"],
+        "user_id": run["user_id"],
+        "provider": run["provider"],
+        "model": run["model"],
+        "tokens_in": run.get("tokens_in", 0),
+        "tokens_out": run.get("tokens_out", 0),
+        "cost": cost,
+        "latency_ms": run.get("latency_ms", 0),
+        "status": run["status"],
+        "created_at": run["created_at"],
+    })
+
+
+async def backfill_usage_rollups():
+    """
+    Add the runs in `ai_runs` that aren't counted yet (logged before
+    metering) to the rollups, pricing runs logged without a cost with the
+    active table, and mark them counted. Day docs past their retention are
+    skipped; lifetime totals get everything. Updates are $inc, like the live
+    path, so runs recorded meanwhile aren't lost - but two backfills at once
+    would count runs twice: go through ensure_usage_rollups_bootstrapped.
+    """
+    table = await get_price_table()
+    now = datetime.now(timezone.utc)
+    # Runs logged from here on are counted live (and inserted as rolled_up)
+    match = {"user_id": {"$ne": None}, "rolled_up": {"$ne": True}, "created_at": {"$lt": now.isoformat()}}
+    # Day docs past their retention would only be removed again by the TTL index
+    oldest_day = (now - timedelta(days=USAGE_ROLLUP_RETENTION_DAYS)).strftime("%Y-%m-%d")
+
+    rows = await db.ai_runs.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "day": {"$substrBytes": ["$created_at", 0, 10]},
+                "provider": "$provider",
+                "model": "$model",
+                "is_byo_key": {"$ifNull": ["$is_byo_key", False]},
+            },
+            "requests": {"$sum": 1},
+            "failed": {"$sum": {"$cond": [{"$eq": ["$status", "failed"]}, 1, 0]}},
+            "tokens_in": {"$sum": {"$ifNull": ["$tokens_in", 0]}},
+            "tokens_out": {"$sum": {"$ifNull": ["$tokens_out", 0]}},
+            "cost": {"$sum": {"$ifNull": ["$cost_estimate", 0]}},
+        }},
+    ], allowDiskUse=True).to_list(None)
+
+    updates = []
+    for row in rows:
+        group = row["_id"]
+        cost = row["cost"] or table.cost(group["provider"], group["model"], row["tokens_in"], row["tokens_out"])
+        incs = _rollup_incs({**group, **row, "cost_estimate": cost}, requests=row["requests"])
+        updates += _rollup_updates(group["user_id"], group["day"] if group["day"] >= oldest_day else None, incs)
+    if updates:
+        await db.usage_rollups.bulk_write(updates, ordered=False)
+        await db.ai_runs.update_many(match, {"$set": {"rolled_up": True}})
+    print(f"[Pricing] Backfilled usage rollups from {sum(row['requests'] for row in rows)} ai_runs")
+
+
+async def ensure_usage_rollups_bootstrapped():
+    """Backfill once per database: the worker whose claim on the meta doc succeeds runs it."""
+    now = datetime.now(timezone.utc).isoformat()
+    try:
+        claim = await db.usage_rollups.update_one(
+            {"_id": "meta", "backfill_claimed_at": {"$exists": False}},
+            {"$set": {"backfill_claimed_at": now}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return  # the meta doc exists and is already claimed
+    if not (claim.modified_count or claim.upserted_id):
+        return
+    await backfill_usage_rollups()
+    await db.usage_rollups.update_one({"_id": "meta"}, {"$set": {"backfilled_at": datetime.now(timezone.utc).isoformat()}})
+
+
+# =============================================================================
+# USAGE ROLLUPS (read path)
+# =============================================================================
+
+async def get_usage_days(user_id: str, days: int) -> List[Dict[str, Any]]:
+    """The user's rollups for the last `days` days (today included), oldest first."""
+    today = datetime.now(timezone.utc)
+    ids = [_rollup_id(user_id, (today - timedelta(days=n)).strftime("%Y-%m-%d")) for n in range(days)]
+    docs = await db.usage_rollups.find({"_id": {"$in": ids}}, {"_id": 0, "expires_at": 0}).to_list(days)
+    return sorted(docs, key=lambda doc: doc["day"])
+
+
+async def get_usage_today(user_id: str) -> Dict[str, Any]:
+    """Today's rollup - a single _id lookup (zeros when there's no usage yet)."""
+    days = await get_usage_days(user_id, 1)
+    return days[0] if days else {field: 0 for field in ROLLUP_SUMS}
+
+
+async def get_usage_totals(user_id: str) -> Dict[str, Any]:
+    """The user's lifetime totals - a single _id lookup."""
+    totals = await db.usage_rollups.find_one({"_id": _lifetime_id(user_id)}) or {}
+    return {field: totals.get(field, 0) for field in ROLLUP_SUMS}
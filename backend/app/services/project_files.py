@@ -0,0 +1,351 @@
+"""
+Project Files - a project's virtual file tree
+
+One doc per file in `project_files`: the path, the blob ref of its content
+(the ref is the content's SHA-256, so it doubles as the file hash), size,
+language and the project revision that last changed it. This is the single
+source for a project's files: previews, ZIP downloads and GitHub / Vercel /
+Firebase deploys all read it.
+
+- writes are batched: one revision bump on the project (`files_revision`),
+  one query for the current hashes, one bulk_write for every file that
+  actually changed; unchanged files are skipped
+- deletes leave a tombstone carrying the revision, so "what changed since
+  revision N" includes removed files
+- directories are path prefixes: listing is a range scan on the
+  (project_id, path) index
+- `build_context` gives the model full content only for files changed since
+  the revision it last saw, and just the names of the rest
+
+The html_code/css_code/js_code fields the editor uses are mirrored in as
+index.html/styles.css/script.js whenever they change; projects written
+before the tree existed are migrated on first use.
+"""
+
+import asyncio
+import hashlib
+import posixpath
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from cachetools import LRUCache
+from pymongo import ReturnDocument, UpdateOne
+
+from app.db.mongo import db
+from app.services.blob_store import blob_hash, get_blobs, put_blob
+from app.services.code_fences import LANGUAGE_BY_EXTENSION
+
+
+CODE_FILES = {"html_code": "index.html", "css_code": "styles.css", "js_code": "script.js"}
+
+MAX_PATH_LENGTH = 255
+MAX_PATH_DEPTH = 16
+# Characters of file content build_context sends per turn
+CONTEXT_MAX_CHARS = 24000
+
+# Projects known to have a tree, so the migration check is skipped
+_has_tree: LRUCache = LRUCache(maxsize=10000)
+
+FILE_PROJECTION = {"_id": 0, "path": 1, "ref": 1, "size": 1, "language": 1, "revision": 1, "deleted": 1, "updated_at": 1}
+
+
+def normalize_path(path: str) -> str:
+    """A clean relative path inside the project; raises ValueError otherwise."""
+    raw = (path or "").replace("\\", "/").strip()
+    if not raw or raw.startswith("/") or "\0" in raw:
+        raise ValueError(f"Invalid file path: {path!r}")
+    parts = [p for p in raw.split("/") if p not in ("", ".")]
+    if not parts or ".." in parts or len(parts) > MAX_PATH_DEPTH:
+        raise ValueError(f"Invalid file path: {path!r}")
+    clean = "/".join(parts)
+    if len(clean) > MAX_PATH_LENGTH:
+        raise ValueError(f"File path too long: {path!r}")
+    return clean
+
+
+def _directory(path: Optional[str]) -> str:
+    """'' for the root, otherwise a normalized prefix ending in '/'."""
+    if not path or path.strip() in ("", ".", "/"):
+        return ""
+    return normalize_path(path.strip("/")) + "/"
+
+
+def language_for(path: str) -> Optional[str]:
+    return LANGUAGE_BY_EXTENSION.get(posixpath.splitext(path)[1].lower())
+
+
+def manifest_hash(files: Iterable[Dict[str, Any]]) -> str:
+    """Hash of a file list (path + content ref), e.g. for ETags."""
+    digest = hashlib.sha256()
+    for f in sorted(files, key=lambda f: f["path"]):
+        digest.update(f"{f['path']}\0{f.get('ref') or ''}\n".encode())
+    return digest.hexdigest()
+
+
+# =============================================================================
+# WRITE
+# =============================================================================
+
+async def _next_revision(project_id: str) -> Optional[int]:
+    project = await db.projects.find_one_and_update(
+        {"id": project_id},
+        {"$inc": {"files_revision": 1}},
+        projection={"_id": 0, "files_revision": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    return project["files_revision"] if project else None
+
+
+async def write_files(project_id: str, files: Dict[str, Optional[str]], source: str = "agent") -> Dict[str, Any]:
+    """
+    Apply a batch of changes ({path: content}, None deletes) in one update.
+    Returns {"revision", "changed"}; revision is None when nothing changed.
+    Raises ValueError for an invalid path.
+    """
+    changes = {normalize_path(path): content for path, content in files.items()}
+    if not changes:
+        return {"revision": None, "changed": []}
+
+    current = {
+        f["path"]: f
+        async for f in db.project_files.find(
+            {"project_id": project_id, "path": {"$in": list(changes)}},
+            {"_id": 0, "path": 1, "ref": 1, "deleted": 1},
+        )
+    }
+
+    changed: Dict[str, Optional[str]] = {}
+    for path, content in changes.items():
+        existing = current.get(path)
+        live = existing is not None and not existing.get("deleted")
+        if content is None:
+            if live:
+                changed[path] = None
+        elif not live or existing.get("ref") != (blob_hash(content) if content else None):
+            changed[path] = content
+    if not changed:
+        return {"revision": None, "changed": []}
+
+    revision = await _next_revision(project_id)
+    if revision is None:
+        return {"revision": None, "changed": []}
+
+    paths = list(changed)
+    refs = await asyncio.gather(*(put_blob(changed[p]) for p in paths))
+    now = datetime.now(timezone.utc).isoformat()
+    ops = []
+    for path, ref in zip(paths, refs):
+        content = changed[path]
+        doc = {
+            "ref": ref,
+            "size": len(content.encode("utf-8")) if content else 0,
+            "language": language_for(path),
+            "dir": posixpath.dirname(path),
+            "revision": revision,
+            "deleted": content is None,
+            "source": source,
+            "updated_at": now,
+        }
+        ops.append(UpdateOne(
+            {"project_id": project_id, "path": path},
+            {"$set": doc, "$setOnInsert": {"created_at": now}},
+            upsert=True,
+        ))
+    await db.project_files.bulk_write(ops, ordered=False)
+    return {"revision": revision, "changed": sorted(paths)}
+
+
+async def delete_files(project_id: str, paths: Iterable[str], source: str = "agent") -> Dict[str, Any]:
+    return await write_files(project_id, {p: None for p in paths}, source)
+
+
+async def save_blocks(project_id: Optional[str], blocks: List[Dict[str, Any]], source: str = "agent") -> Dict[str, Any]:
+    """Write an agent's complete code blocks (named ones) to the project."""
+    if not project_id:
+        return {"revision": None, "changed": []}
+    files = {}
+    for block in blocks:
+        if block.get("filename") and block.get("code") and not block.get("truncated"):
+            try:
+                files[normalize_path(block["filename"])] = block["code"]
+            except ValueError:
+                continue
+    await ensure_project_files(project_id)
+    return await write_files(project_id, files, source)
+
+
+async def sync_code_fields(project_id: str, code: Dict[str, Optional[str]], source: str = "editor") -> Dict[str, Any]:
+    """Mirror html_code/css_code/js_code values (as just saved) into the tree."""
+    files = {name: code.get(field) or None for field, name in CODE_FILES.items() if field in code}
+    await ensure_project_files(project_id)
+    return await write_files(project_id, files, source)
+
+
+async def owns_project(project_id: str, user_id: str) -> bool:
+    """Whether the project belongs to the user; check before reading or writing its tree for them."""
+    return bool(await db.projects.find_one({"id": project_id, "user_id": user_id}, {"_id": 0, "id": 1}))
+
+
+async def ensure_project_files(project_id: str):
+    """
+    Build the tree for a project written before it existed: its code fields
+    plus the code blocks of its latest agent job (under src/, as downloads
+    used to lay them out).
+    """
+    if project_id in _has_tree:
+        return
+    project = await db.projects.find_one({"id": project_id}, {"_id": 0, "files_revision": 1})
+    if not project:
+        return
+    if project.get("files_revision") is not None:
+        _has_tree[project_id] = True
+        return
+
+    project = await db.projects.find_one({"id": project_id}, {"_id": 0, **{f: 1 for f in CODE_FILES}}) or {}
+
+    files: Dict[str, Optional[str]] = {}
+    job = await db.build_jobs.find_one(
+        {"project_id": project_id, "code_blocks.0": {"$exists": True}},
+        {"_id": 0, "code_blocks": 1},
+        sort=[("created_at", -1)],
+    )
+    blocks = (job or {}).get("code_blocks", [])
+    blobs = await get_blobs(b.get("code_ref") for b in blocks if b.get("code") is None)
+    for block in blocks:
+        name = block.get("filename") or f"file.{block.get('language') or 'txt'}"
+        try:
+            path = normalize_path("src/" + name)
+        except ValueError:
+            continue
+        files.setdefault(path, block["code"] if block.get("code") is not None else blobs.get(block.get("code_ref"), ""))
+    for field, name in CODE_FILES.items():
+        if project.get(field):
+            files[name] = project[field]
+
+    # Claim the migration first so concurrent requests don't both run it
+    claimed = await db.projects.update_one(
+        {"id": project_id, "files_revision": {"$exists": False}},
+        {"$set": {"files_revision": 0}},
+    )
+    if claimed.modified_count:
+        await write_files(project_id, files, source="migration")
+    _has_tree[project_id] = True
+
+
+async def delete_project_files(project_id: str):
+    _has_tree.pop(project_id, None)
+    await db.project_files.delete_many({"project_id": project_id})
+
+
+# =============================================================================
+# READ
+# =============================================================================
+
+async def list_files(project_id: str, include_deleted: bool = False) -> List[Dict[str, Any]]:
+    """Every file's metadata (no content), sorted by path."""
+    await ensure_project_files(project_id)
+    query: Dict[str, Any] = {"project_id": project_id}
+    if not include_deleted:
+        query["deleted"] = {"$ne": True}
+    return await db.project_files.find(query, FILE_PROJECTION).sort("path", 1).to_list(None)
+
+
+async def list_directory(project_id: str, path: str = "", recursive: bool = False) -> List[Dict[str, Any]]:
+    """
+    Entries under a directory. Non-recursive listings fold deeper files into
+    {"type": "dir"} entries with a file count and total size.
+    """
+    await ensure_project_files(project_id)
+    prefix = _directory(path)
+    query: Dict[str, Any] = {"project_id": project_id, "deleted": {"$ne": True}}
+    if prefix:
+        # Anchored, case-sensitive prefix: a range scan on the (project_id, path) index
+        query["path"] = {"$regex": "^" + re.escape(prefix)}
+    files = await db.project_files.find(query, FILE_PROJECTION).sort("path", 1).to_list(None)
+
+    if recursive:
+        return [{"type": "file", **f} for f in files]
+
+    entries: Dict[str, Dict[str, Any]] = {}
+    for f in files:
+        rest = f["path"][len(prefix):]
+        name, sep, _ = rest.partition("/")
+        if not sep:
+            entries[name] = {"type": "file", "name": name, **f}
+            continue
+        entry = entries.setdefault(name, {"type": "dir", "name": name, "path": prefix + name, "files": 0, "size": 0})
+        entry["files"] += 1
+        entry["size"] += f.get("size") or 0
+    return sorted(entries.values(), key=lambda e: (e["type"] != "dir", e["name"]))
+
+
+async def read_files(project_id: str, paths: Optional[Iterable[str]] = None) -> Dict[str, str]:
+    """{path: content} for the given paths (all files by default), in path order."""
+    files = await list_files(project_id)
+    if paths is not None:
+        wanted = {normalize_path(p) for p in paths}
+        files = [f for f in files if f["path"] in wanted]
+    blobs = await get_blobs(f.get("ref") for f in files)
+    return {f["path"]: blobs.get(f.get("ref"), "") if f.get("ref") else "" for f in files}
+
+
+async def changed_since(project_id: str, revision: int) -> List[Dict[str, Any]]:
+    """Files (including deletions) changed after `revision`."""
+    await ensure_project_files(project_id)
+    return await db.project_files.find(
+        {"project_id": project_id, "revision": {"$gt": revision}}, FILE_PROJECTION,
+    ).sort("path", 1).to_list(None)
+
+
+async def build_context(project_id: str, since_revision: int = 0, max_chars: int = CONTEXT_MAX_CHARS) -> Dict[str, Any]:
+    """
+    Prompt context for the next turn: every file's path, with the content of
+    the ones changed after `since_revision` (within `max_chars`). Returns
+    {"text", "revision", "changed"}; pass revision back next turn.
+    """
+    files = await list_files(project_id, include_deleted=True)
+    revision = max((f.get("revision") or 0 for f in files), default=since_revision)
+    live = [f for f in files if not f.get("deleted")]
+    changed = [f for f in live if (f.get("revision") or 0) > since_revision]
+    deleted = [f["path"] for f in files if f.get("deleted") and (f.get("revision") or 0) > since_revision]
+    if not live and not deleted:
+        return {"text": "", "revision": revision, "changed": []}
+
+    changed_paths = {f["path"] for f in changed}
+    lines = [f"Project files ({len(live)}):"]
+    for f in live:
+        note = "" if f["path"] in changed_paths else " (unchanged since your last look)"
+        lines.append(f"- {f['path']} ({f.get('size') or 0} bytes){note}")
+    if deleted:
+        lines.append("Deleted: " + ", ".join(deleted))
+
+    blobs = await get_blobs(f.get("ref") for f in changed)
+    budget = max_chars
+    sections = []
+    for f in changed:
+        content = blobs.get(f.get("ref"), "") if f.get("ref") else ""
+        if len(content) > budget:
+            sections.append(f"{f['path']}: {len(content)} characters, not included")
+            continue
+        budget -= len(content)
+        sections.append(f"```{f.get('language') or 'text'}:{f['path']}\n{content}\n```")
+    if sections:
+        lines.append("\nChanged files:\n" + "\n\n".join(sections))
+
+    return {"text": "\n".join(lines), "revision": revision, "changed": sorted(changed_paths) + deleted}
+
+
+async def context_for_turn(project_id: Optional[str]) -> str:
+    """
+    build_context since the revision the agents last sent for this project,
+    recording the new one (`files_context_revision`) for the next turn.
+    """
+    if not project_id:
+        return ""
+    project = await db.projects.find_one({"id": project_id}, {"_id": 0, "files_context_revision": 1})
+    if project is None:
+        return ""
+    context = await build_context(project_id, since_revision=project.get("files_context_revision") or 0)
+    await db.projects.update_one({"id": project_id}, {"$set": {"files_context_revision": context["revision"]}})
+    return context["text"]
@@ -0,0 +1,93 @@
+"""
+Project Store - project code fields and their metadata
+
+Project docs carry the generated code inline (html/css/js can be hundreds of
+KB). List endpoints read a summary projection instead, and every write that
+touches code goes through `with_code_stats` so `code_size` and `code_hash`
+stay in step with the code. The hash also drives the ETag on the detail
+endpoint, letting the editor skip re-downloading unchanged code.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from app.db.mongo import db
+
+
+CODE_FIELDS = ("html_code", "css_code", "js_code")
+
+# Everything a project list needs - no code, no build spec
+PROJECT_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "user_id": 1,
+    "name": 1,
+    "description": 1,
+    "framework": 1,
+    "code_size": 1,
+    "code_hash": 1,
+    "version": 1,
+    "is_frozen": 1,
+    "created_at": 1,
+    "updated_at": 1,
+}
+
+# What the detail response carries besides the code (which code_hash stands
+# for), plus the frozen flag; the ETag covers all of it, so writes that don't
+# bump updated_at (admin freeze, ...) still change it
+PROJECT_ETAG_FIELDS = (
+    "id", "user_id", "name", "description", "framework", "code_size", "code_hash",
+    "version", "is_frozen", "created_at", "updated_at",
+)
+
+# Enough to answer a conditional GET without loading the code
+PROJECT_ETAG_PROJECTION = {"_id": 0, **{field: 1 for field in PROJECT_ETAG_FIELDS}}
+
+
+def compute_code_stats(code: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    """Size in bytes and sha256 over the project's code fields."""
+    digest = hashlib.sha256()
+    size = 0
+    for field in CODE_FIELDS:
+        data = (code.get(field) or "").encode("utf-8")
+        size += len(data)
+        digest.update(data)
+        digest.update(b"\0")
+    return {"code_size": size, "code_hash": digest.hexdigest()}
+
+
+def with_code_stats(update: Dict[str, Any], current: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Return a copy of a `$set` payload with code_size/code_hash added when it
+    touches any code field. Fields not in the update are taken from
+    `current` (the project as it is now).
+    """
+    if not any(field in update for field in CODE_FIELDS):
+        return update
+    merged = {field: update.get(field, (current or {}).get(field)) for field in CODE_FIELDS}
+    return {**update, **compute_code_stats(merged)}
+
+
+def project_etag(project: Dict[str, Any]) -> str:
+    """ETag for a project detail response; changes whenever any field it returns does."""
+    state = json.dumps([project.get(field) for field in PROJECT_ETAG_FIELDS], default=str)
+    tag = hashlib.sha256(state.encode()).hexdigest()[:32]
+    return f'"{tag}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+async def ensure_code_stats(project: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill in stats for projects written before they were tracked."""
+    if project.get("code_hash"):
+        return project
+    stats = compute_code_stats(project)
+    await db.projects.update_one({"id": project["id"]}, {"$set": stats})
+    project.update(stats)
+    return project
@@ -0,0 +1,243 @@
+"""
+Project Versions - history of a project's code with delta storage
+
+The project doc keeps the current code inline, so "get latest" is still one
+read. Every write that changes code also records a version in
+`project_versions`:
+
+- every SNAPSHOT_EVERY-th version (and the first) is a snapshot holding blob
+  refs for html/css/js - identical code is stored once by the blob store
+- the versions in between hold a line diff against their parent
+
+Rebuilding version N loads the nearest snapshot at or below N plus the
+deltas after it in one query, so the chain is at most SNAPSHOT_EVERY long.
+Rollback rebuilds the old code, writes it back as the current code and
+records that as a new version; history is never rewritten. Both paths also
+mirror the code into the project's file tree (project_files).
+"""
+
+import difflib
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from app.db.mongo import db
+from app.services.blob_store import put_blob, get_blobs
+from app.services.project_store import CODE_FIELDS, compute_code_stats, with_code_stats
+from app.services.project_files import sync_code_fields
+
+
+SNAPSHOT_EVERY = 10
+# A delta bigger than this share of the full code is stored as a snapshot
+MAX_DELTA_RATIO = 0.5
+
+# Version metadata for listings - no delta payloads
+VERSION_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "project_id": 1,
+    "version": 1,
+    "kind": 1,
+    "source": 1,
+    "message": 1,
+    "code_size": 1,
+    "code_hash": 1,
+    "restored_from": 1,
+    "created_by": 1,
+    "created_at": 1,
+}
+
+
+# =============================================================================
+# LINE DIFFS
+# =============================================================================
+# A delta is a list of ops over the parent's lines:
+#   ["=", i1, i2]   copy parent lines i1:i2
+#   ["+", [lines]]  insert these lines
+
+def _lines(text: Optional[str]) -> List[str]:
+    return (text or "").splitlines(keepends=True)
+
+
+def make_delta(old: Optional[str], new: Optional[str]) -> List[list]:
+    old_lines, new_lines = _lines(old), _lines(new)
+    ops: List[list] = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(["=", i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append(["+", new_lines[j1:j2]])
+        # "delete": nothing to copy
+    return ops
+
+
+def apply_delta(old: Optional[str], ops: List[list]) -> str:
+    old_lines = _lines(old)
+    out: List[str] = []
+    for op in ops:
+        if op[0] == "=":
+            out.extend(old_lines[op[1]:op[2]])
+        else:
+            out.extend(op[1])
+    return "".join(out)
+
+
+def _delta_size(ops: List[list]) -> int:
+    return sum(len(line) for op in ops if op[0] == "+" for line in op[1]) + 16 * len(ops)
+
+
+# =============================================================================
+# RECORD
+# =============================================================================
+
+async def record_version(
+    project_id: str,
+    code: Dict[str, Optional[str]],
+    previous: Optional[Dict[str, Optional[str]]] = None,
+    source: str = "update",
+    message: Optional[str] = None,
+    user_id: Optional[str] = None,
+    restored_from: Optional[int] = None,
+) -> int:
+    """
+    Record the project's new code as the next version and return its number.
+
+    `previous` is the code the caller replaced. It is only used as the delta
+    base when it matches the stored parent version; otherwise (first version,
+    concurrent writers) a snapshot is written instead.
+    """
+    code = {f: code.get(f) for f in CODE_FIELDS}
+    stats = compute_code_stats(code)
+
+    counter = await db.projects.find_one_and_update(
+        {"id": project_id},
+        {"$inc": {"version": 1}},
+        projection={"_id": 0, "version": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not counter:
+        raise HTTPException(status_code=404, detail="Project not found")
+    version = counter["version"]
+
+    doc: Dict[str, Any] = {
+        "id": str(uuid.uuid4()),
+        "project_id": project_id,
+        "version": version,
+        "source": source,
+        "message": message,
+        "restored_from": restored_from,
+        "created_by": user_id,
+        **stats,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+    delta = None
+    # Versions 1, 1 + SNAPSHOT_EVERY, ... are always snapshots
+    if previous is not None and (version - 1) % SNAPSHOT_EVERY != 0:
+        parent = await db.project_versions.find_one(
+            {"project_id": project_id, "version": version - 1},
+            {"_id": 0, "code_hash": 1},
+        )
+        if parent and parent["code_hash"] == compute_code_stats(previous)["code_hash"]:
+            delta = {f: make_delta(previous.get(f), code[f]) for f in CODE_FIELDS}
+            if sum(_delta_size(ops) for ops in delta.values()) > stats["code_size"] * MAX_DELTA_RATIO:
+                delta = None
+
+    if delta is not None:
+        doc.update(kind="delta", delta=delta)
+    else:
+        doc.update(kind="snapshot", refs={f: await put_blob(code[f]) for f in CODE_FIELDS})
+
+    await db.project_versions.insert_one(doc)
+    return version
+
+
+# =============================================================================
+# READ
+# =============================================================================
+
+async def get_version_code(project_id: str, version: int) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """(version metadata, {field: code}) for one version of a project."""
+    snapshot = await db.project_versions.find_one(
+        {"project_id": project_id, "version": {"$lte": version}, "kind": "snapshot"},
+        {"_id": 0, "version": 1},
+        sort=[("version", -1)],
+    )
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="Version not found")
+
+    chain = await db.project_versions.find(
+        {"project_id": project_id, "version": {"$gte": snapshot["version"], "$lte": version}},
+        {"_id": 0},
+    ).sort("version", 1).to_list(SNAPSHOT_EVERY * 2)
+    if not chain or chain[-1]["version"] != version:
+        raise HTTPException(status_code=404, detail="Version not found")
+
+    # A chain can contain a later snapshot when deltas were skipped
+    start = max(i for i, v in enumerate(chain) if v["kind"] == "snapshot")
+    base = chain[start]
+    blobs = await get_blobs(base["refs"].values())
+    code = {f: blobs.get(base["refs"].get(f), "") if base["refs"].get(f) else "" for f in CODE_FIELDS}
+
+    for entry in chain[start + 1:]:
+        code = {f: apply_delta(code[f], entry["delta"].get(f, [])) for f in CODE_FIELDS}
+
+    meta = {k: v for k, v in chain[-1].items() if k in VERSION_SUMMARY_PROJECTION}
+    return meta, code
+
+
+async def list_versions(project_id: str, before: Optional[int] = None, limit: int = 50) -> Dict[str, Any]:
+    """Newest first; pass next_before back as `before` for older versions."""
+    query: Dict[str, Any] = {"project_id": project_id}
+    if before is not None:
+        query["version"] = {"$lt": before}
+    rows = await db.project_versions.find(query, VERSION_SUMMARY_PROJECTION).sort(
+        "version", -1
+    ).limit(limit + 1).to_list(limit + 1)
+    next_before = rows[limit - 1]["version"] if len(rows) > limit else None
+    return {"versions": rows[:limit], "next_before": next_before}
+
+
+async def rollback_to_version(project: Dict[str, Any], version: int, user_id: Optional[str] = None) -> int:
+    """Make an old version current again; returns the new version number."""
+    _, code = await get_version_code(project["id"], version)
+    now = datetime.now(timezone.utc).isoformat()
+    await db.projects.update_one(
+        {"id": project["id"]},
+        {"$set": with_code_stats({**code, "updated_at": now}, project)},
+    )
+    await sync_code_fields(project["id"], code, "rollback")
+    return await record_version(
+        project["id"],
+        code,
+        previous={f: project.get(f) for f in CODE_FIELDS},
+        source="rollback",
+        message=f"Rolled back to version {version}",
+        user_id=user_id,
+        restored_from=version,
+    )
+
+
+async def record_code_change(
+    project: Dict[str, Any],
+    update: Dict[str, Any],
+    source: str,
+    message: Optional[str] = None,
+    user_id: Optional[str] = None,
+) -> Optional[int]:
+    """
+    Record a version for a `$set` that was just applied to `project` (the doc
+    as it was before). Updates that don't change the code are skipped.
+    """
+    if not any(field in update for field in CODE_FIELDS):
+        return None
+    previous = {f: project.get(f) for f in CODE_FIELDS}
+    code = {f: update.get(f, previous[f]) for f in CODE_FIELDS}
+    if compute_code_stats(code)["code_hash"] == compute_code_stats(previous)["code_hash"]:
+        return None
+    await sync_code_fields(project["id"], code, source)
+    return await record_version(project["id"], code, previous, source, message, user_id)
@@ -0,0 +1,187 @@
+"""
+Quota Service - atomic usage counters
+
+Daily limits are enforced with one counter document per (scope, user, day),
+incremented with a conditional `find_one_and_update`. The check and the
+increment are a single atomic operation, so concurrent requests can't slip
+past the limit and the cost does not grow with the day's usage.
+
+A small in-process cache serves hot users: once a counter is exhausted the
+worker rejects further requests for that day without touching Mongo, and
+recent counts are reused for status reads.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from typing import Optional, Dict, Any
+
+from cachetools import TTLCache
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.db.mongo import db
+from app.core.user_cache import invalidate_user
+
+
+# Counter docs expire a week after their day ends (TTL index on expires_at)
+QUOTA_RETENTION_DAYS = 7
+
+# Scopes
+AGENT_REQUESTS = "agent_requests"
+
+# (scope, user_id, day) -> the limit that was reached (a plan upgrade raises
+# the limit, which makes the entry stale and it is ignored)
+_exhausted: TTLCache = TTLCache(maxsize=50000, ttl=300)
+# (scope, user_id, day) -> last known count, for status reads
+_counts: TTLCache = TTLCache(maxsize=50000, ttl=10)
+
+
+@dataclass
+class QuotaResult:
+    allowed: bool
+    used: int
+    limit: int
+
+    @property
+    def remaining(self):
+        if self.limit == -1:
+            return "unlimited"
+        return max(0, self.limit - self.used)
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def _counter_id(scope: str, user_id: str, day: str) -> str:
+    return f"{scope}:{user_id}:{day}"
+
+
+def _expires_at(day: str) -> datetime:
+    start = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return start + timedelta(days=1 + QUOTA_RETENTION_DAYS)
+
+
+# =============================================================================
+# DAILY COUNTERS
+# =============================================================================
+
+async def consume_daily_quota(user_id: str, scope: str, limit: int, amount: int = 1) -> QuotaResult:
+    """
+    Atomically take `amount` units from today's quota.
+
+    The filter only matches while `count + amount <= limit`. When it doesn't
+    match, the upsert tries to insert a doc with the same _id and fails with
+    a duplicate key - that is the "limit reached" signal. `limit == -1`
+    means unlimited; the counter is still kept for usage display.
+    """
+    day = _today()
+    cache_key = (scope, user_id, day)
+
+    if limit != -1:
+        exhausted_at = _exhausted.get(cache_key)
+        if amount > limit or (exhausted_at is not None and exhausted_at >= limit):
+            return QuotaResult(allowed=False, used=_counts.get(cache_key, limit), limit=limit)
+
+    query: Dict[str, Any] = {"_id": _counter_id(scope, user_id, day)}
+    if limit != -1:
+        query["count"] = {"$lte": limit - amount}
+
+    try:
+        counter = await db.usage_quotas.find_one_and_update(
+            query,
+            {
+                "$inc": {"count": amount},
+                "$setOnInsert": {
+                    "user_id": user_id,
+                    "scope": scope,
+                    "day": day,
+                    "expires_at": _expires_at(day),
+                },
+            },
+            projection={"count": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        _exhausted[cache_key] = limit
+        used = await get_daily_usage(user_id, scope, use_cache=False)
+        return QuotaResult(allowed=False, used=used, limit=limit)
+
+    used = counter["count"]
+    _counts[cache_key] = used
+    if limit != -1 and used >= limit:
+        _exhausted[cache_key] = limit
+    return QuotaResult(allowed=True, used=used, limit=limit)
+
+
+async def release_daily_quota(user_id: str, scope: str, amount: int = 1):
+    """Give units back, e.g. when the request they were taken for failed."""
+    day = _today()
+    cache_key = (scope, user_id, day)
+    _exhausted.pop(cache_key, None)
+    _counts.pop(cache_key, None)
+
+    await db.usage_quotas.update_one(
+        {"_id": _counter_id(scope, user_id, day), "count": {"$gte": amount}},
+        {"$inc": {"count": -amount}},
+    )
+
+
+async def get_daily_usage(user_id: str, scope: str, use_cache: bool = True) -> int:
+    """Today's count for a scope - a single _id lookup."""
+    day = _today()
+    cache_key = (scope, user_id, day)
+
+    if use_cache and cache_key in _counts:
+        return _counts[cache_key]
+
+    counter = await db.usage_quotas.find_one({"_id": _counter_id(scope, user_id, day)}, {"count": 1})
+    used = counter["count"] if counter else 0
+    _counts[cache_key] = used
+    return used
+
+
+# =============================================================================
+# MONTHLY GENERATIONS (stored on the user doc)
+# =============================================================================
+
+async def consume_generation(user_id: str) -> Optional[Dict[str, int]]:
+    """
+    Atomically count one generation against the user's plan allowance.
+
+    Returns the updated {generations_used, generations_limit}, or None when
+    the limit is already reached. The counter lives on the user doc because
+    plan purchases and admin edits reset it there.
+    """
+    updated = await db.users.find_one_and_update(
+        {
+            "id": user_id,
+            "$or": [
+                {"generations_limit": -1},
+                {"$expr": {"$lt": [
+                    {"$ifNull": ["$generations_used", 0]},
+                    {"$ifNull": ["$generations_limit", 100]},
+                ]}},
+            ],
+        },
+        {"$inc": {"generations_used": 1}},
+        projection={"_id": 0, "generations_used": 1, "generations_limit": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    await invalidate_user(user_id)
+    if not updated:
+        return None
+    return {
+        "generations_used": updated.get("generations_used", 0),
+        "generations_limit": updated.get("generations_limit", 100),
+    }
+
+
+async def refund_generation(user_id: str):
+    """Undo consume_generation when the generation itself failed."""
+    await db.users.update_one(
+        {"id": user_id, "generations_used": {"$gt": 0}},
+        {"$inc": {"generations_used": -1}},
+    )
+    await invalidate_user(user_id)
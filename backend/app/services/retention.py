@@ -0,0 +1,291 @@
+"""
+Retention - TTL-index based expiry for high-volume collections
+
+Every append-only log collection declares a retention policy here. Mongo
+expires documents through a TTL index on a BSON date field, so nothing has
+to scan and delete_many at night. Rows that are about to expire can be rolled
+into `daily_summaries` first so admin stats keep their history.
+
+Chat messages are what users see as their project's chat history, so they
+only expire when CHAT_MESSAGE_RETENTION_DAYS opts in.
+"""
+
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, Optional
+
+from app.core.config import CHAT_MESSAGE_RETENTION_DAYS
+from app.db.mongo import db
+
+
+# =============================================================================
+# POLICIES
+# =============================================================================
+
+# BSON date mirror of the ISO-string `created_at` field. TTL indexes only
+# work on real dates, so writers stamp this next to `created_at`.
+RETENTION_DATE_FIELD = "created_at_dt"
+
+# Days of lookahead when rolling up rows that are about to expire
+ROLLUP_LOOKAHEAD_DAYS = 2
+
+BACKFILL_BATCH_SIZE = 5000
+
+RETENTION_POLICIES: Dict[str, Dict[str, Any]] = {
+    "project_events": {
+        "days": 90,
+        "summarize": True,
+        "group_by": "event_type",
+    },
+    "build_events": {
+        "days": 30,
+        "summarize": True,
+        "group_by": "type",
+        # Older build events only carry `timestamp`
+        "timestamp_fallback": True,
+    },
+    "error_logs": {
+        "days": 60,
+        "summarize": True,
+        "group_by": "error_type",
+    },
+    "ai_runs": {
+        "days": 180,
+        "summarize": True,
+        "group_by": "provider",
+        "sum_fields": ["tokens_in", "tokens_out", "tokens_used", "cost_estimate"],
+    },
+}
+
+# Opt-in policies: with the setting off, the collection keeps its rows (and
+# a TTL index left from when it was on is dropped)
+OPTIONAL_POLICIES: Dict[str, Dict[str, Any]] = {
+    "chat_messages": {
+        "days": CHAT_MESSAGE_RETENTION_DAYS,
+        "summarize": True,
+        "group_by": "role",
+        # Agent chat messages only carry `timestamp`
+        "timestamp_fallback": True,
+    },
+}
+RETENTION_POLICIES.update({
+    collection: policy for collection, policy in OPTIONAL_POLICIES.items() if policy["days"] > 0
+})
+
+
+def with_retention_date(doc: Dict[str, Any], now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Return a copy of `doc` stamped with the BSON date used by TTL indexes.
+
+    A copy is returned so the caller's dict stays JSON-serializable (no
+    datetime, no ObjectId from insert_one) for SSE streams and responses.
+    """
+    return {**doc, RETENTION_DATE_FIELD: now or datetime.now(timezone.utc)}
+
+
+def _source_date_expr() -> Dict[str, Any]:
+    """
+    Aggregation expression converting the ISO `created_at` (or the older
+    `timestamp` field on build events and agent chat messages) into a BSON date.
+
+    Only the first 19 characters are parsed because Python's isoformat() may
+    carry microseconds, which $dateFromString rejects. All stored times are UTC.
+    """
+    source = {"$ifNull": ["$created_at", "$timestamp"]}
+    return {
+        "$dateFromString": {
+            "dateString": {"$concat": [{"$substrBytes": [source, 0, 19]}, "Z"]},
+            "onError": "$$NOW",
+            "onNull": "$$NOW",
+        }
+    }
+
+
+def _day_expr() -> Dict[str, Any]:
+    """Aggregation expression for the YYYY-MM-DD day of a row."""
+    return {"$substrBytes": [{"$ifNull": ["$created_at", "$timestamp"]}, 0, 10]}
+
+
+# =============================================================================
+# TTL INDEXES
+# =============================================================================
+
+async def ensure_ttl_indexes():
+    """
+    Create (or retune) the TTL index for every policy. Idempotent.
+
+    If the retention window changed since the index was built, the index is
+    updated in place with collMod instead of being dropped and rebuilt.
+    """
+    index_name = f"ttl_{RETENTION_DATE_FIELD}"
+    for collection in OPTIONAL_POLICIES:
+        if collection not in RETENTION_POLICIES and index_name in await db[collection].index_information():
+            await db[collection].drop_index(index_name)
+            print(f"[Retention] Dropped TTL on {collection} (retention is off)")
+
+    for collection, policy in RETENTION_POLICIES.items():
+        expire_after = int(policy["days"]) * 86400
+
+        existing = await db[collection].index_information()
+        current = existing.get(index_name)
+
+        if current and current.get("expireAfterSeconds") != expire_after:
+            await db.command({
+                "collMod": collection,
+                "index": {"name": index_name, "expireAfterSeconds": expire_after},
+            })
+            print(f"[Retention] Updated TTL on {collection} to {policy['days']} days")
+        elif not current:
+            await db[collection].create_index(
+                RETENTION_DATE_FIELD,
+                name=index_name,
+                expireAfterSeconds=expire_after,
+            )
+            print(f"[Retention] Created TTL index on {collection} ({policy['days']} days)")
+
+
+# =============================================================================
+# BACKFILL
+# =============================================================================
+
+async def backfill_retention_dates(collection: str, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Stamp the BSON date on rows written before the retention field existed.
+
+    Works in `_id` batches so one huge update never holds the collection.
+    """
+    total = 0
+    missing = {RETENTION_DATE_FIELD: {"$exists": False}}
+
+    while True:
+        batch = await db[collection].find(missing, {"_id": 1}).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        result = await db[collection].update_many(
+            {"_id": {"$in": [doc["_id"] for doc in batch]}},
+            [{"$set": {RETENTION_DATE_FIELD: _source_date_expr()}}],
+        )
+        total += result.modified_count
+
+        if len(batch) < batch_size:
+            break
+
+    if total:
+        print(f"[Retention] Backfilled {total} rows in {collection}")
+    return total
+
+
+async def backfill_all_retention_dates() -> Dict[str, int]:
+    """Backfill every collection that has a retention policy."""
+    return {
+        collection: await backfill_retention_dates(collection)
+        for collection in RETENTION_POLICIES
+    }
+
+
+# =============================================================================
+# DAILY SUMMARIES
+# =============================================================================
+
+async def rollup_expiring_rows(collection: str) -> int:
+    """
+    Summarize whole days that will expire within ROLLUP_LOOKAHEAD_DAYS.
+
+    Summaries are keyed by `{collection}:{day}` and written with upserts, so
+    re-running a day is harmless. A watermark in `retention_state` keeps each
+    run from re-reading days it already rolled up.
+    """
+    policy = RETENTION_POLICIES[collection]
+    if not policy.get("summarize"):
+        return 0
+
+    now = datetime.now(timezone.utc)
+    horizon = (now - timedelta(days=policy["days"] - ROLLUP_LOOKAHEAD_DAYS)).strftime("%Y-%m-%d")
+
+    state = await db.retention_state.find_one({"_id": collection}) or {}
+    watermark = state.get("summarized_through", "")
+
+    match: Dict[str, Any] = {"created_at": {"$lt": horizon}}
+    if watermark:
+        match["created_at"]["$gte"] = watermark
+    if policy.get("timestamp_fallback"):
+        match = {"$or": [match, {"created_at": {"$exists": False}, "timestamp": match["created_at"]}]}
+
+    group_key = f"${policy['group_by']}"
+    group: Dict[str, Any] = {
+        "_id": {"day": _day_expr(), "key": {"$ifNull": [group_key, "unknown"]}},
+        "count": {"$sum": 1},
+    }
+    for field in policy.get("sum_fields", []):
+        group[field] = {"$sum": {"$ifNull": [f"${field}", 0]}}
+
+    rows = await db[collection].aggregate([
+        {"$match": match},
+        {"$group": group},
+    ]).to_list(None)
+
+    summaries: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        day = row["_id"]["day"]
+        key = str(row["_id"]["key"])
+        summary = summaries.setdefault(day, {"total": 0, "by_key": {}, "sums": {}})
+        summary["total"] += row["count"]
+        summary["by_key"][key] = summary["by_key"].get(key, 0) + row["count"]
+        for field in policy.get("sum_fields", []):
+            summary["sums"][field] = summary["sums"].get(field, 0) + row.get(field, 0)
+
+    for day, summary in summaries.items():
+        await db.daily_summaries.update_one(
+            {"_id": f"{collection}:{day}"},
+            {"$set": {
+                "collection": collection,
+                "day": day,
+                "group_by": policy["group_by"],
+                "total": summary["total"],
+                f"by_{policy['group_by']}": summary["by_key"],
+                **{f"sum_{field}": value for field, value in summary["sums"].items()},
+                "updated_at": now.isoformat(),
+            }},
+            upsert=True,
+        )
+
+    await db.retention_state.update_one(
+        {"_id": collection},
+        {"$set": {"summarized_through": horizon, "updated_at": now.isoformat()}},
+        upsert=True,
+    )
+
+    if summaries:
+        print(f"[Retention] Rolled up {len(summaries)} days of {collection}")
+    return len(summaries)
+
+
+async def get_daily_summaries(collection: str, start_day: str, end_day: str) -> list:
+    """Read archived daily summaries for a collection (inclusive range)."""
+    return await db.daily_summaries.find(
+        {"collection": collection, "day": {"$gte": start_day, "$lte": end_day}},
+        {"_id": 0},
+    ).sort("day", 1).to_list(None)
+
+
+# =============================================================================
+# RUNNER
+# =============================================================================
+
+async def run_retention_jobs() -> Dict[str, Any]:
+    """
+    Nightly retention pass: summarize rows before they expire, backfill any
+    rows missing the BSON date, and make sure TTL indexes match the policies.
+    Mongo's TTL monitor does the actual deletes.
+    """
+    results: Dict[str, Any] = {"rolled_up_days": {}, "backfilled": {}}
+
+    for collection in RETENTION_POLICIES:
+        try:
+            results["rolled_up_days"][collection] = await rollup_expiring_rows(collection)
+        except Exception as e:
+            print(f"[Retention] Rollup failed for {collection}: {e}")
+
+    results["backfilled"] = await backfill_all_retention_dates()
+    await ensure_ttl_indexes()
+    return results
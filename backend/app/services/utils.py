@@ -1,6 +1,11 @@
 from datetime import datetime, timezone
+from typing import Optional
 import uuid
+from pymongo import ReturnDocument
 from app.db.mongo import db
+from app.core.user_cache import invalidate_user
+from app.services.retention import with_retention_date
+from app.services.admin_rollups import record_error
 from app.core.config import PLANS
 
 async def log_error(error_type: str, error_message: str, endpoint: str, user_id: str = None, stack_trace: str = None):
@@ -14,7 +19,31 @@ async def log_error(error_type: str, error_message: str, endpoint: str, user_id:
         "stack_trace": stack_trace,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.error_logs.insert_one(error_doc)
+    await db.error_logs.insert_one(with_retention_date(error_doc))
+    await record_error(error_type)
+
+async def adjust_wallet_balance(user_id: str, delta: float, require_funds: bool = False) -> Optional[float]:
+    """
+    Atomically add `delta` to a user's wallet and return the new balance.
+    
+    With require_funds a debit only applies when the balance covers it.
+    Returns None if nothing was updated (no such user, or insufficient funds).
+    """
+    query = {"id": user_id}
+    if require_funds and delta < 0:
+        query["wallet_balance"] = {"$gte": -delta}
+    
+    updated = await db.users.find_one_and_update(
+        query,
+        {"$inc": {"wallet_balance": delta}},
+        projection={"_id": 0, "wallet_balance": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated:
+        return None
+    
+    await invalidate_user(user_id)
+    return updated.get("wallet_balance", 0)
 
 def get_user_generations_limit(plan: str) -> int:
     """Get generation limit based on plan"""
@@ -0,0 +1,381 @@
+"""
+Web Research - search, fetch and extract pages for the browser agent
+
+The pipeline behind BrowserAgent:
+
+- search: a pluggable backend - SearxNG in production, a JSON fixture for
+  local development and tests (SEARCH_BACKEND / SEARXNG_URL /
+  SEARCH_FIXTURE_PATH)
+- fetch: one pooled httpx client shared by all requests, at most
+  WEB_FETCH_MAX_CONCURRENCY fetches in flight and WEB_FETCH_PER_HOST per
+  host, honouring robots.txt; only public http(s) addresses are fetched,
+  and redirects are followed hop by hop so each hop is checked
+- cache: extracted pages in an LRU (bounded by characters) keyed by URL;
+  entries are fresh for WEB_FETCH_CACHE_TTL_SECONDS, then revalidated with
+  their ETag / Last-Modified, so an unchanged page costs a 304
+- extract: readable text only (no scripts, styles, navigation), capped per
+  page, so the model gets content instead of markup
+"""
+
+import asyncio
+import ipaddress
+import json
+import socket
+import time
+import weakref
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional
+from urllib.parse import urljoin, urlsplit
+from urllib.robotparser import RobotFileParser
+
+import httpx
+from cachetools import LRUCache, TTLCache
+
+from app.core.config import (
+    SEARCH_BACKEND,
+    SEARXNG_URL,
+    SEARCH_FIXTURE_PATH,
+    WEB_FETCH_TIMEOUT_SECONDS,
+    WEB_FETCH_MAX_CONCURRENCY,
+    WEB_FETCH_PER_HOST,
+    WEB_FETCH_CACHE_TTL_SECONDS,
+    WEB_FETCH_USER_AGENT,
+)
+
+
+MAX_FETCH_URLS = 10
+MAX_REDIRECTS = 5
+MAX_BODY_BYTES = 2 * 1024 * 1024
+MAX_PAGE_CHARS = 6000
+FETCHABLE_TYPES = ("text/html", "application/xhtml+xml", "text/plain", "application/json")
+
+# url -> extracted page (+ validators); bounded by text size
+_pages: LRUCache = LRUCache(maxsize=16 * 1024 * 1024, getsizeof=lambda page: len(page["text"]) + 512)
+# host -> parsed robots.txt (None: allow everything)
+_robots: TTLCache = TTLCache(maxsize=2048, ttl=3600)
+_host_slots: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+_fetch_slots: Optional[asyncio.Semaphore] = None
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(WEB_FETCH_TIMEOUT_SECONDS, connect=5.0),
+            limits=httpx.Limits(max_connections=WEB_FETCH_MAX_CONCURRENCY * 2, max_keepalive_connections=WEB_FETCH_MAX_CONCURRENCY),
+            headers={"User-Agent": WEB_FETCH_USER_AGENT, "Accept": "text/html,text/plain;q=0.9,*/*;q=0.5"},
+            follow_redirects=False,
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _slots_for(host: str) -> asyncio.Semaphore:
+    slots = _host_slots.get(host)
+    if slots is None:
+        slots = asyncio.Semaphore(WEB_FETCH_PER_HOST)
+        _host_slots[host] = slots
+    return slots
+
+
+def _global_slots() -> asyncio.Semaphore:
+    global _fetch_slots
+    if _fetch_slots is None:
+        _fetch_slots = asyncio.Semaphore(WEB_FETCH_MAX_CONCURRENCY)
+    return _fetch_slots
+
+
+# =============================================================================
+# TEXT EXTRACTION
+# =============================================================================
+
+SKIP_TAGS = {"script", "style", "noscript", "svg", "template", "iframe", "nav", "footer", "header", "form", "aside", "button"}
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "ul", "ol", "tr", "table", "br", "pre",
+              "blockquote", "h1", "h2", "h3", "h4", "h5", "h6", "dd", "dt"}
+VOID_TAGS = {"br", "img", "hr", "input", "meta", "link", "source", "wbr", "area", "base", "col", "embed", "param", "track"}
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.parts: List[str] = []
+        self._skip = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS and tag not in VOID_TAGS:
+            self._skip += 1
+        elif tag == "title":
+            self._in_title = True
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+            if tag in ("h1", "h2", "h3"):
+                self.parts.append("#" * int(tag[1]) + " ")
+            elif tag == "li":
+                self.parts.append("- ")
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and tag not in VOID_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag == "title":
+            self._in_title = False
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip:
+            self.parts.append(data)
+
+
+def extract_text(html: str, max_chars: int = MAX_PAGE_CHARS) -> Dict[str, str]:
+    """{"title", "text"} of an HTML page: visible prose, one block per line."""
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        pass  # malformed markup: keep whatever was parsed
+    lines = (" ".join(line.split()) for line in "".join(parser.parts).splitlines())
+    text = "\n".join(line for line in lines if line and line not in ("-", "#", "##", "###"))
+    return {"title": " ".join(parser.title.split()), "text": text[:max_chars]}
+
+
+# =============================================================================
+# FETCH
+# =============================================================================
+
+async def _is_public(host: str) -> bool:
+    """True when every address `host` resolves to is publicly routable."""
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        return False
+    addresses = {info[4][0] for info in infos}
+    return bool(addresses) and all(ipaddress.ip_address(a.split("%")[0]).is_global for a in addresses)
+
+
+async def _robots_allows(url: str) -> bool:
+    parts = urlsplit(url)
+    origin = f"{parts.scheme}://{parts.netloc}"
+    if origin not in _robots:
+        rules: Optional[RobotFileParser] = None
+        try:
+            # Same guarded path as pages: a private host fails here with ValueError
+            response = await _get(f"{origin}/robots.txt", {})
+            if response.status_code in (401, 403):
+                rules = RobotFileParser()
+                rules.disallow_all = True
+            elif response.status_code == 200:
+                rules = RobotFileParser()
+                rules.parse(response.text[:200_000].splitlines())
+        except httpx.HTTPError:
+            pass
+        _robots[origin] = rules
+    rules = _robots[origin]
+    return rules is None or rules.can_fetch(WEB_FETCH_USER_AGENT, url)
+
+
+async def _get(url: str, headers: Dict[str, str]) -> httpx.Response:
+    """GET with manual redirects, so every hop passes the address check."""
+    client = get_client()
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("Only http(s) URLs can be fetched")
+        if not await _is_public(parts.hostname):
+            raise ValueError("URL does not resolve to a public address")
+
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.is_redirect and "location" in response.headers:
+                url = urljoin(url, response.headers["location"])
+                continue
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body.extend(chunk)
+                if len(body) > MAX_BODY_BYTES:
+                    break
+            return httpx.Response(
+                status_code=response.status_code,
+                headers=response.headers,
+                content=bytes(body[:MAX_BODY_BYTES]),
+                request=response.request,
+            )
+    raise ValueError("Too many redirects")
+
+
+def _page(url: str, status: str, **extra) -> Dict[str, Any]:
+    return {"url": url, "status": status, "title": "", "text": "", **extra}
+
+
+async def fetch_page(url: str) -> Dict[str, Any]:
+    """
+    Fetch one URL and return {"url", "status", "title", "text", ...}.
+    status is "ok", "cached", "not_modified", "blocked" (robots/address),
+    "unsupported" (content type), "http_error" or "error"; never raises.
+    """
+    cached = _pages.get(url)
+    if cached and time.monotonic() - cached["fetched_at"] < WEB_FETCH_CACHE_TTL_SECONDS:
+        return {**cached, "status": "cached"}
+
+    host = urlsplit(url).hostname or ""
+    async with _global_slots(), _slots_for(host):
+        try:
+            if not await _robots_allows(url):
+                return _page(url, "blocked", error="Disallowed by robots.txt")
+
+            headers = {}
+            if cached and cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached and cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+            response = await _get(url, headers)
+        except ValueError as e:
+            return _page(url, "blocked", error=str(e))
+        except httpx.HTTPError as e:
+            return _page(url, "error", error=type(e).__name__)
+
+    if response.status_code == 304 and cached:
+        cached["fetched_at"] = time.monotonic()
+        _pages[url] = cached
+        return {**cached, "status": "not_modified"}
+    if response.status_code >= 400:
+        return _page(url, "http_error", http_status=response.status_code)
+
+    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type and content_type not in FETCHABLE_TYPES:
+        return _page(url, "unsupported", content_type=content_type)
+
+    body = response.text
+    if content_type in ("text/html", "application/xhtml+xml") or (not content_type and "<html" in body[:1000].lower()):
+        extracted = extract_text(body)
+    else:
+        extracted = {"title": "", "text": body[:MAX_PAGE_CHARS]}
+
+    page = {
+        "url": url,
+        "title": extracted["title"],
+        "text": extracted["text"],
+        "etag": response.headers.get("etag"),
+        "last_modified": response.headers.get("last-modified"),
+        "fetched_at": time.monotonic(),
+    }
+    _pages[url] = page
+    return {**page, "status": "ok"}
+
+
+async def fetch_pages(urls: List[str], limit: int = MAX_FETCH_URLS) -> List[Dict[str, Any]]:
+    """Fetch up to `limit` distinct URLs concurrently, in input order."""
+    unique = list(dict.fromkeys(u for u in urls if u))[:min(limit, MAX_FETCH_URLS)]
+    return list(await asyncio.gather(*(fetch_page(u) for u in unique)))
+
+
+# =============================================================================
+# SEARCH
+# =============================================================================
+
+class SearchBackend:
+    name = "disabled"
+
+    async def search(self, query: str, limit: int = 5) -> List[Dict[str, str]]:
+        return []
+
+
+class SearxngBackend(SearchBackend):
+    """SearxNG JSON API (the instance must have the json format enabled)."""
+    name = "searxng"
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+
+    async def search(self, query: str, limit: int = 5) -> List[Dict[str, str]]:
+        response = await get_client().get(
+            f"{self.base_url}/search",
+            params={"q": query, "format": "json", "safesearch": 1},
+        )
+        response.raise_for_status()
+        return [
+            {"title": r.get("title", ""), "url": r.get("url", ""), "snippet": r.get("content", "")}
+            for r in response.json().get("results", [])[:limit]
+            if r.get("url")
+        ]
+
+
+class FixtureBackend(SearchBackend):
+    """
+    Canned results from a JSON file: {"query": [{"title", "url", "snippet"}]}.
+    Queries are matched case-insensitively; "*" is the fallback for any query.
+    """
+    name = "fixture"
+
+    def __init__(self, path: str = None, results: Dict[str, List[Dict[str, str]]] = None):
+        if results is None:
+            with open(path, encoding="utf-8") as f:
+                results = json.load(f)
+        self.results = {q.lower(): r for q, r in results.items()}
+
+    async def search(self, query: str, limit: int = 5) -> List[Dict[str, str]]:
+        key = " ".join(query.lower().split())
+        return list(self.results.get(key, self.results.get("*", [])))[:limit]
+
+
+_backend: Optional[SearchBackend] = None
+
+
+def get_search_backend() -> SearchBackend:
+    global _backend
+    if _backend is None:
+        if SEARCH_BACKEND == "searxng" and SEARXNG_URL:
+            _backend = SearxngBackend(SEARXNG_URL)
+        elif SEARCH_BACKEND == "fixture" and SEARCH_FIXTURE_PATH:
+            _backend = FixtureBackend(SEARCH_FIXTURE_PATH)
+        else:
+            _backend = SearchBackend()
+    return _backend
+
+
+def set_search_backend(backend: Optional[SearchBackend]):
+    """Swap the backend (tests, local tooling); None re-reads the config."""
+    global _backend
+    _backend = backend
+
+
+async def web_search(query: str, limit: int = 5) -> Dict[str, Any]:
+    backend = get_search_backend()
+    try:
+        results = await backend.search(query, limit)
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"[Research] {backend.name} search failed: {e}")
+        return {"query": query, "results": [], "backend": backend.name, "status": "error"}
+    return {"query": query, "results": results, "backend": backend.name,
+            "status": "ok" if backend.name != "disabled" else "disabled"}
+
+
+async def research(query: str, max_pages: int = 5, max_chars: int = 12000) -> Dict[str, Any]:
+    """
+    Search, fetch the top results concurrently and return the readable text
+    of the pages that could be fetched, within `max_chars` in total.
+    """
+    search = await web_search(query, limit=max_pages)
+    pages = await fetch_pages([r["url"] for r in search["results"]], limit=max_pages)
+
+    snippets = {r["url"]: r.get("snippet", "") for r in search["results"]}
+    sources, budget = [], max_chars
+    for page in pages:
+        text = page["text"] or snippets.get(page["url"], "")
+        if not text or budget <= 0:
+            continue
+        text = text[:budget]
+        budget -= len(text)
+        sources.append({"url": page["url"], "title": page["title"], "text": text, "status": page["status"]})
+
+    return {**search, "pages": pages, "sources": sources}
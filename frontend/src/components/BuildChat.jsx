@@ -15,7 +15,18 @@ import {
 } from 'lucide-react';
 import { Button } from './ui/button';
 import { Progress } from './ui/progress';
-import { buildAPI, API_BASE } from '../lib/api';
+import { buildAPI, projectsAPI, API_BASE } from '../lib/api';
+
+// The download needs the auth header, so fetch it as a blob instead of a plain link
+const downloadProject = async (projectId) => {
+  const res = await projectsAPI.downloadProject(projectId);
+  const url = URL.createObjectURL(res.data);
+  const a = document.createElement('a');
+  a.href = url;
+  a.download = 'project.zip';
+  a.click();
+  URL.revokeObjectURL(url);
+};
 
 // Event type icons and colors
 const EVENT_CONFIG = {
@@ -198,13 +209,14 @@ function BuildChat({
             </pre>
           )}
           {event.payload?.download_url && (
-            <a 
-              href={event.payload.download_url}
+            <button
+              type="button"
+              onClick={() => downloadProject(event.payload.project_id)}
               className="mt-2 inline-flex items-center gap-1 text-sm text-green-600 hover:text-green-700"
             >
               <Download className="w-4 h-4" />
               Download Project
-            </a>
+            </button>
           )}
           <p className="text-xs text-gray-400 mt-1">
             <Clock className="w-3 h-3 inline mr-1" />
@@ -39,11 +39,11 @@ export const plansAPI = {
 // Wallet API
 export const walletAPI = {
   getWallet: () => api.get('/wallet'),
-  getTransactions: (type, limit, offset) => {
+  getTransactions: (type, limit, cursor) => {
     const params = new URLSearchParams();
     if (type) params.append('type', type);
     if (limit) params.append('limit', limit);
-    if (offset) params.append('offset', offset);
+    if (cursor) params.append('cursor', cursor);
     return api.get(`/wallet/transactions?${params.toString()}`);
   },
   addMoney: (amount, paymentMethod = 'auto') => 
@@ -80,7 +80,8 @@ export const projectsAPI = {
   createProject: (name, description, framework) => 
     api.post('/projects', { name, description, framework }),
   updateProject: (id, data) => api.put(`/projects/${id}`, data),
-  deleteProject: (id) => api.delete(`/projects/${id}`)
+  deleteProject: (id) => api.delete(`/projects/${id}`),
+  downloadProject: (id) => api.get(`/projects/${id}/download`, { responseType: 'blob' })
 };
 
 // Chat API
@@ -111,7 +112,8 @@ export const adminAPI = {
   // Purchases
   getPurchases: (status) => api.get(`/admin/purchases${status ? `?status=${status}` : ''}`),
   refundPurchase: (purchaseId, reason) => api.post(`/admin/purchases/${purchaseId}/refund?reason=${encodeURIComponent(reason)}`),
-  exportInvoices: (startDate, endDate) => api.get(`/admin/invoices/export${startDate ? `?start_date=${startDate}` : ''}${endDate ? `&end_date=${endDate}` : ''}`),
+  exportInvoices: (startDate, endDate) => api.get('/admin/invoices/export', { params: { start_date: startDate, end_date: endDate }, responseType: 'blob' }),
+  exportDataset: (dataset, params = {}) => api.get(`/admin/export/${dataset}`, { params, responseType: 'blob' }),
   
   // Errors
   getErrors: (errorType) => api.get(`/admin/errors${errorType ? `?error_type=${errorType}` : ''}`),
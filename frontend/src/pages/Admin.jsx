@@ -406,8 +406,7 @@ const Admin = () => {
               <h2 className="text-xl font-semibold">Purchases & Payments</h2>
               <button onClick={async () => {
                 const res = await adminAPI.exportInvoices();
-                const blob = new Blob([res.data.csv_data], { type: 'text/csv' });
-                const url = URL.createObjectURL(blob);
+                const url = URL.createObjectURL(res.data);
                 const a = document.createElement('a');
                 a.href = url;
                 a.download = 'invoices.csv';
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Event-loop lag under concurrent logins
+
+Simulates a burst of concurrent logins (one bcrypt verify each) while a probe
+coroutine measures how late the event loop wakes it up. Runs the burst twice:
+once with the old inline `verify_password`, once with `verify_password_async`
+(bounded thread pool). Inline hashing shows lag in the hundreds of
+milliseconds; the pooled version keeps the loop responsive.
+
+Usage (from the repo root, with backend requirements installed):
+    python tests/bench_event_loop_lag.py [--logins 50] [--rounds 12]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman_bench")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import bcrypt  # noqa: E402
+
+from app.core.security import verify_password, verify_password_async  # noqa: E402
+
+PROBE_INTERVAL = 0.01
+
+
+async def probe_lag(stop: asyncio.Event, samples: list):
+    """Sleep in short ticks and record how late each wake-up is (ms)."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        samples.append((time.perf_counter() - start - PROBE_INTERVAL) * 1000)
+
+
+async def login_inline(password: str, hashed: str):
+    # What /api/auth/login did before: a blocking call inside the coroutine
+    return verify_password(password, hashed)
+
+
+async def login_pooled(password: str, hashed: str):
+    return await verify_password_async(password, hashed)
+
+
+async def run_burst(login, logins: int, password: str, hashed: str) -> dict:
+    samples: list = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_lag(stop, samples))
+    await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login(password, hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await probe
+    samples.sort()
+    return {
+        "elapsed_s": elapsed,
+        "lag_p50_ms": statistics.median(samples),
+        "lag_p99_ms": samples[int(len(samples) * 0.99) - 1] if len(samples) > 1 else samples[0],
+        "lag_max_ms": samples[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    args = parser.parse_args()
+
+    password = "correct horse battery staple"
+    hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=args.rounds)).decode()
+
+    print(f"{args.logins} concurrent logins, bcrypt cost {args.rounds}\n")
+    print(f"{'mode':<10}{'total s':>10}{'p50 lag ms':>14}{'p99 lag ms':>14}{'max lag ms':>14}")
+    for name, login in (("inline", login_inline), ("pooled", login_pooled)):
+        result = asyncio.run(run_burst(login, args.logins, password, hashed))
+        print(
+            f"{name:<10}{result['elapsed_s']:>10.2f}{result['lag_p50_ms']:>14.1f}"
+            f"{result['lag_p99_ms']:>14.1f}{result['lag_max_ms']:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
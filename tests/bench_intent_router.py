@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Intent routing speed and accuracy
+
+Classifies the labeled queries from test_intent_router.py with the old
+linear keyword scan (what routes/agent_chat.py `classify_query` did: one
+`in` check per keyword, per category) and with the compiled intent_router,
+cold (memo cleared) and warm. Prints per-query latency and accuracy on the
+labeled set, so a routing change can be judged on both.
+
+Usage (from the repo root):
+    python tests/bench_intent_router.py [--rounds 200]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from test_intent_router import LABELED_QUERIES  # noqa: E402
+
+from app.services.intent_router import analyze_query, _analyze_cached, CASUAL  # noqa: E402
+
+
+# The agent_chat keyword lists and priority order before the shared router
+LEGACY_PATTERNS = [
+    ("planner", ["plan", "step by step", "multiple", "and then", "first", "after that",
+                 "complex", "comprehensive", "full", "complete project", "entire"]),
+    ("coder", ["write", "create", "build", "code", "program", "script", "function",
+               "class", "api", "website", "app", "application", "html", "css", "js",
+               "python", "javascript", "react", "node", "flask", "django", "fastapi",
+               "database", "sql", "mongodb", "component", "page", "implement",
+               "generate code", "make a", "develop", "frontend", "backend"]),
+    ("browser", ["search", "browse", "find out", "look up", "google", "web search",
+                 "latest news", "research", "check website", "visit", "open url",
+                 "navigate to", "who is", "what is the latest"]),
+    ("file", ["file", "folder", "directory", "organize", "move", "copy", "delete",
+              "rename", "find file", "locate", "create folder", "list files"]),
+    ("mcp", ["mcp", "tool", "use mcp", "calendar", "contacts", "stock",
+             "market", "weather", "external tool"]),
+]
+
+
+def legacy_classify(query: str) -> str:
+    query_lower = query.lower()
+    for agent, patterns in LEGACY_PATTERNS:
+        if any(p in query_lower for p in patterns):
+            return agent
+    return CASUAL
+
+
+def compiled_classify(query: str) -> str:
+    return analyze_query(query).agent_or(CASUAL)
+
+
+def time_per_query(classify, rounds: int, clear=None) -> float:
+    """Median microseconds per query over `rounds` passes of the labeled set."""
+    samples = []
+    for _ in range(rounds):
+        if clear:
+            clear()
+        started = time.perf_counter()
+        for query, _ in LABELED_QUERIES:
+            classify(query)
+        samples.append((time.perf_counter() - started) / len(LABELED_QUERIES) * 1e6)
+    return statistics.median(samples)
+
+
+def accuracy(classify) -> float:
+    hits = sum(1 for query, expected in LABELED_QUERIES if classify(query) == expected)
+    return hits / len(LABELED_QUERIES)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    rows = [
+        ("legacy linear scan", time_per_query(legacy_classify, args.rounds), accuracy(legacy_classify)),
+        ("compiled (cold)", time_per_query(compiled_classify, args.rounds, _analyze_cached.cache_clear),
+         accuracy(compiled_classify)),
+        ("compiled (memoized)", time_per_query(compiled_classify, args.rounds), accuracy(compiled_classify)),
+    ]
+
+    print(f"{len(LABELED_QUERIES)} labeled queries, {args.rounds} rounds")
+    print(f"{'router':<22}{'us/query':>10}{'accuracy':>10}")
+    for name, micros, acc in rows:
+        print(f"{name:<22}{micros:>10.2f}{acc:>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
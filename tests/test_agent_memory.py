@@ -0,0 +1,66 @@
+"""
+Agent memory compaction tests
+
+Checks that conversation memory stays within its token budget by folding
+old turns into a rolling summary. Pure functions, no database needed (the
+backend package still has to be importable).
+"""
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("motor")
+pytest.importorskip("cachetools")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services.agent_memory import (  # noqa: E402
+    AGENT_MEMORY_SUMMARY_TOKENS,
+    AGENT_MEMORY_TOKEN_BUDGET,
+    MIN_TURNS,
+    clip_turn,
+    compact,
+    estimate_tokens,
+    summarize_turn,
+    to_messages,
+)
+
+
+def _turn(i):
+    code = "```html\n" + "<p>line</p>\n" * 200 + "```"
+    return {"role": "assistant" if i % 2 else "user", "content": f"Turn {i} text.\n{code}"}
+
+
+def test_long_conversation_stays_within_budget():
+    state = {"summary": [], "turns": []}
+    for i in range(200):
+        state["turns"].append(_turn(i))
+        compact(state)
+
+    turn_tokens = sum(estimate_tokens(t["content"]) for t in state["turns"])
+    summary_tokens = sum(estimate_tokens(line) for line in state["summary"])
+    assert turn_tokens + summary_tokens <= AGENT_MEMORY_TOKEN_BUDGET or len(state["turns"]) == MIN_TURNS
+    assert summary_tokens <= AGENT_MEMORY_SUMMARY_TOKENS
+    # The newest turns are kept verbatim, the summary holds the most recent folded ones
+    assert state["turns"][-1]["content"].startswith("Turn 199")
+    assert not state["summary"][0].startswith("User: Turn 0 ")
+
+
+def test_summary_line_keeps_prose_and_files():
+    line = summarize_turn({"role": "assistant", "content": "Built the page.\n```html\n<p>x</p>\n```"})
+    assert line == "Assistant: Built the page. [files: index.html]"
+
+
+def test_oversized_turn_is_clipped_head_and_tail():
+    text = "a" * 10000 + "z" * 10000
+    clipped = clip_turn(text, max_tokens=100)
+    assert clipped.startswith("a") and clipped.endswith("z") and len(clipped) < 500
+
+
+def test_summary_is_sent_as_one_system_message():
+    messages = to_messages({"summary": ["User: hi"], "turns": [{"role": "user", "content": "next"}]})
+    assert [m["role"] for m in messages] == ["system", "user"]
@@ -0,0 +1,111 @@
+"""
+Code fence parser tests
+
+Feeds model-style output to FenceParser in whole and in random chunks and
+checks blocks, filenames and unterminated fences. Pure functions, no
+database.
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services.code_fences import FenceParser, extract_code_blocks  # noqa: E402
+
+
+RESPONSE = """Here is your page.
+
+**index.html**
+```html
+<html><body><h1>Hi</h1></body></html>
+```
+
+```css
+body { margin: 0; }
+```
+
+````markdown
+Nested fences stay inside the block:
+```python
+print("hi")
+```
+````
+
+```python:app/server.py
+print("server")
+```
+
+```js
+// filename: app.js
+console.log("app");
+```
+
+```javascript
+console.log("second script");
+```
+"""
+
+
+def _chunked(text, parser, rng):
+    blocks, i = [], 0
+    while i < len(text):
+        size = rng.randint(1, 9)
+        blocks += parser.feed(text[i:i + size])
+        i += size
+    return blocks + parser.close()
+
+
+def test_blocks_and_filenames():
+    blocks = extract_code_blocks(RESPONSE)
+    assert [(b["language"], b["filename"]) for b in blocks] == [
+        ("html", "index.html"),
+        ("css", "styles.css"),
+        ("markdown", "file.md"),
+        ("python", "app/server.py"),
+        ("js", "app.js"),
+        ("javascript", "script.js"),
+    ]
+    assert blocks[2]["code"].count("```") == 2
+    assert not any(b["truncated"] for b in blocks)
+
+
+def test_chunking_does_not_change_the_result():
+    rng = random.Random(7)
+    expected = extract_code_blocks(RESPONSE)
+    for _ in range(20):
+        assert _chunked(RESPONSE, FenceParser(), rng) == expected
+
+
+def test_blocks_are_emitted_when_their_fence_closes():
+    parser = FenceParser()
+    assert parser.feed("```html\n<p>a</p>\n") == []
+    closed = parser.feed("```\nmore prose")
+    assert [b["filename"] for b in closed] == ["index.html"]
+
+
+def test_unterminated_fence_is_returned_as_truncated():
+    parser = FenceParser()
+    assert parser.feed("```python\nx = 1\ny = 2") == []
+    [block] = parser.close()
+    assert block["truncated"] and block["code"] == "x = 1\ny = 2"
+
+
+def test_filenames_can_be_left_unset():
+    blocks = extract_code_blocks("```python\nx = 1\n```\n```python:a.py\ny = 1\n```\n", infer_filenames=False)
+    assert [b["filename"] for b in blocks] == [None, "a.py"]
+
+
+def test_parse_time_is_linear_in_output_size():
+    unit = "```python\n" + "x = 1\n" * 500 + "```\nprose\n"
+
+    def timed(copies):
+        text = unit * copies
+        started = time.perf_counter()
+        extract_code_blocks(text)
+        return time.perf_counter() - started
+
+    small, large = min(timed(20) for _ in range(3)), min(timed(160) for _ in range(3))
+    assert large < small * 8 * 3  # 8x the input; generous bound for timer noise
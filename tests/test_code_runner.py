@@ -0,0 +1,177 @@
+"""
+Code runner tests
+
+Runs small python and bash programs through the sandbox (cold and warm
+workers) and checks output streaming, limits, cancellation and fair
+scheduling. Needs a POSIX host; no database.
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("resource")
+pytest.importorskip("dotenv")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services import code_runner  # noqa: E402
+from app.services.code_runner import FairScheduler, run_code, runnable_blocks  # noqa: E402
+
+UNCACHED_SANDBOX = code_runner._sandbox.__wrapped__
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(code_runner, "CODE_EXEC_ENABLED", True)
+    monkeypatch.setattr(code_runner, "CODE_EXEC_TIMEOUT_SECONDS", 2)
+    # Run as the test user; test_runs_switch_to_the_sandbox_user covers the switch
+    monkeypatch.setattr(code_runner, "_sandbox", lambda: (None, None))
+
+
+def sandbox_user(monkeypatch, user):
+    monkeypatch.setattr(code_runner, "CODE_EXEC_USER", user)
+    monkeypatch.setattr(code_runner, "_sandbox", UNCACHED_SANDBOX)
+
+
+async def _with_warm_pool(coro):
+    await code_runner.start_code_runner()
+    try:
+        return await coro
+    finally:
+        await code_runner.stop_code_runner()
+
+
+def test_output_is_streamed_and_captured():
+    streamed = []
+
+    async def on_output(stream, text):
+        streamed.append((stream, text))
+
+    code = "import sys\nprint('hello')\nprint('oops', file=sys.stderr)\nsys.exit(3)\n"
+    cold = asyncio.run(run_code(code, "python", "u1", on_output))
+    warm = asyncio.run(_with_warm_pool(run_code(code, "py", "u1")))
+
+    for result in (cold, warm):
+        assert (result.stdout, result.stderr, result.exit_code) == ("hello\n", "oops\n", 3)
+        assert not result.success
+    assert warm.warm and not cold.warm
+    assert ("stdout", "hello\n") in streamed
+
+
+def test_time_memory_and_output_limits():
+    async def scenario():
+        return await asyncio.gather(
+            run_code("while True: pass", "python", "u1"),
+            run_code("x = bytearray(4 * 1024 ** 3)", "python", "u2"),
+            run_code("yes 0123456789", "bash", "u3"),
+        )
+
+    spin, hog, chatty = asyncio.run(_with_warm_pool(scenario()))
+    assert spin.timed_out and not spin.success
+    assert hog.exit_code != 0 and "MemoryError" in hog.stderr
+    assert chatty.truncated and len(chatty.stdout) == code_runner.MAX_OUTPUT_CHARS
+
+
+def test_cancelled_runs_are_killed_and_the_next_run_works(tmp_path, monkeypatch):
+    # One warm worker, so the next run gets the one whose run was cancelled
+    monkeypatch.setattr(code_runner, "_warm_pool", code_runner._WarmPool(1))
+
+    async def cancel_once_started(language, code, ticks):
+        task = asyncio.create_task(run_code(code, language, "u1"))
+        while not ticks.exists():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    # Each program ticks into a file until killed
+    warm_ticks, cold_ticks = tmp_path / "warm", tmp_path / "cold"
+    warm_code = ("import time\n"
+                 f"while True:\n    open({str(warm_ticks)!r}, 'a').write('.')\n    time.sleep(0.02)\n")
+    cold_code = f"while true; do echo -n . >> {cold_ticks}; sleep 0.02; done"
+
+    async def scenario():
+        await cancel_once_started("python", warm_code, warm_ticks)
+        await cancel_once_started("bash", cold_code, cold_ticks)
+        await asyncio.sleep(0.2)
+        ticks = (warm_ticks.read_text(), cold_ticks.read_text())
+        await asyncio.sleep(0.3)
+        assert (warm_ticks.read_text(), cold_ticks.read_text()) == ticks
+        return await run_code("print('next')", "python", "u1")
+
+    after = asyncio.run(_with_warm_pool(scenario()))
+    assert after.success and after.warm and after.stdout == "next\n"
+
+
+def test_scheduler_round_robins_across_users():
+    async def scenario():
+        scheduler = FairScheduler(slots=1, per_user=1, max_queued_per_user=5)
+        order = []
+
+        async def job(user, name):
+            async with scheduler.slot(user):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        tasks = [asyncio.create_task(job("a", f"a{i}")) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(job("b", "b0")))
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["a0", "b0", "a1", "a2"]
+
+
+def test_queue_cap_refuses_extra_runs(monkeypatch):
+    monkeypatch.setattr(code_runner, "_scheduler", FairScheduler(slots=1, per_user=1, max_queued_per_user=1))
+
+    async def scenario():
+        return await asyncio.gather(*(run_code("import time; time.sleep(0.2)", "python", "u1") for _ in range(3)))
+
+    results = asyncio.run(scenario())
+    assert sum(r.success for r in results) == 2
+    assert "queued" in [r.error for r in results if not r.success][0]
+
+
+def test_web_projects_are_not_executed():
+    page = [{"language": "html", "code": "<p>x</p>"}, {"language": "javascript", "code": "alert(1)"}]
+    script = [{"language": "python", "code": "print(1)"}, {"language": "css", "code": "p {}"}]
+    assert runnable_blocks(page) == []
+    assert [b["language"] for b in runnable_blocks(script)] == ["python"]
+
+
+def test_execution_is_refused_without_a_separate_run_user(monkeypatch):
+    sandbox_user(monkeypatch, "")
+    result = asyncio.run(run_code("print(1)", "python", "u1"))
+    assert result.error and result.exit_code is None
+    assert runnable_blocks([{"language": "python", "code": "print(1)"}]) == []
+
+    sandbox_user(monkeypatch, str(os.geteuid()))
+    with pytest.raises(ValueError):
+        code_runner.sandbox_identity()
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="switching users needs root")
+def test_runs_switch_to_the_sandbox_user(monkeypatch, tmp_path):
+    pwd = pytest.importorskip("pwd")
+    try:
+        nobody = pwd.getpwnam("nobody")
+    except KeyError:
+        pytest.skip("no nobody user")
+    sandbox_user(monkeypatch, "nobody")
+    secret = tmp_path / ".env"
+    secret.write_text("JWT_SECRET=x")
+    secret.chmod(0o600)
+    script = f"import os\nprint(os.getuid(), os.getgroups())\nopen({str(secret)!r}).read()\n"
+    shell = f"echo $(id -u) [$(id -G | tr -d {nobody.pw_gid})]; cat {secret}"
+
+    warm = asyncio.run(_with_warm_pool(run_code(script, "python", "u1")))
+    cold = asyncio.run(run_code(shell, "bash", "u1"))
+
+    assert warm.warm and warm.stdout == f"{nobody.pw_uid} []\n" and "PermissionError" in warm.stderr
+    assert cold.stdout == f"{nobody.pw_uid} []\n" and "Permission denied" in cold.stderr
@@ -0,0 +1,78 @@
+"""
+Coding agent service tests
+
+The daily agent quota taken by `process_request` is given back when the
+model call fails, and the failure is reported. Users, quota counters,
+memory and the project tree are in-memory; no database or network.
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("motor")
+pytest.importorskip("httpx")
+pytest.importorskip("cachetools")
+pytest.importorskip("cryptography")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services import coding_agent  # noqa: E402
+from app.services.ai_router import LLMError, LLMResult  # noqa: E402
+from app.services.quota import QuotaResult  # noqa: E402
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """A CodingAgentService whose quota counter is `service.used`."""
+    service = coding_agent.CodingAgentService()
+    service.used = 0
+
+    async def get_cached_user(user_id):
+        return {"id": user_id, "plan": "free"}
+
+    async def consume_daily_quota(user_id, scope, limit):
+        service.used += 1
+        return QuotaResult(allowed=True, used=service.used, limit=limit)
+
+    async def release_daily_quota(user_id, scope):
+        service.used -= 1
+
+    async def nothing(*args, **kwargs):
+        return None
+
+    async def no_files(project_id, blocks, source="agent"):
+        return {"revision": None, "changed": []}
+
+    monkeypatch.setattr(coding_agent, "get_cached_user", get_cached_user)
+    monkeypatch.setattr(coding_agent, "consume_daily_quota", consume_daily_quota)
+    monkeypatch.setattr(coding_agent, "release_daily_quota", release_daily_quota)
+    monkeypatch.setattr(coding_agent, "get_history", nothing)
+    monkeypatch.setattr(coding_agent, "remember", nothing)
+    monkeypatch.setattr(coding_agent, "context_for_turn", nothing)
+    monkeypatch.setattr(coding_agent, "save_blocks", no_files)
+    return service
+
+
+def test_failed_model_call_gives_the_request_back(service, monkeypatch):
+    coder = service.agents[coding_agent.AgentType.CODER]
+
+    async def failing(*args, **kwargs):
+        raise LLMError("provider is down", provider="openai")
+
+    async def answering(*args, **kwargs):
+        return LLMResult(text="print('hi')", provider="openai", model="gpt-4o-mini")
+
+    monkeypatch.setattr(coder, "call_llm", failing)
+    failed = asyncio.run(service.process_request("write hello world", "u1", agent_type="coder"))
+    assert not failed["success"] and failed["error"] == "provider is down"
+    assert service.used == 0
+
+    monkeypatch.setattr(coder, "call_llm", answering)
+    done = asyncio.run(service.process_request("write hello world", "u1", agent_type="coder"))
+    assert done["success"] and done["answer"] == "print('hi')"
+    assert service.used == 1
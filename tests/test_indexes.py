@@ -0,0 +1,145 @@
+"""
+Index bootstrapper tests
+
+Runs the bootstrapper against a scratch database and asserts the hot
+queries are answered by an index (IXSCAN) rather than a collection scan.
+Needs a reachable MongoDB (MONGO_URL, default mongodb://localhost:27017);
+skipped otherwise.
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+pytest.importorskip("motor")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+from app.db.indexes import ensure_indexes, INDEX_MANIFEST  # noqa: E402
+
+TEST_DB = f"nirman_index_test_{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture(scope="module")
+def sync_db():
+    client = pymongo.MongoClient(os.environ["MONGO_URL"], serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except Exception:
+        pytest.skip("MongoDB is not reachable")
+
+    async def bootstrap():
+        motor_client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        try:
+            return await ensure_indexes(motor_client[TEST_DB])
+        finally:
+            motor_client.close()
+
+    report = asyncio.run(bootstrap())
+    assert not report["failed"], report["failed"]
+
+    yield client[TEST_DB]
+    client.drop_database(TEST_DB)
+    client.close()
+
+
+def _stages(plan):
+    """Flatten every stage name in a winning plan."""
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _stages(child)
+    return stages
+
+
+def _assert_ixscan(cursor_or_explain):
+    explain = cursor_or_explain if isinstance(cursor_or_explain, dict) else cursor_or_explain.explain()
+    stages = _stages(explain["queryPlanner"]["winningPlan"])
+    assert "IXSCAN" in stages, stages
+    assert "COLLSCAN" not in stages, stages
+
+
+def test_bootstrap_is_idempotent(sync_db):
+    async def rerun():
+        motor_client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        try:
+            return await ensure_indexes(motor_client[TEST_DB])
+        finally:
+            motor_client.close()
+
+    report = asyncio.run(rerun())
+    expected = sum(len(models) for models in INDEX_MANIFEST.values())
+    assert report["created"] == []
+    assert report["failed"] == []
+    assert len(report["existing"]) == expected
+
+
+def test_users_by_id_uses_index(sync_db):
+    _assert_ixscan(sync_db.users.find({"id": "u1"}, {"_id": 0}).limit(1))
+
+
+def test_users_by_email_uses_index(sync_db):
+    _assert_ixscan(sync_db.users.find({"email": "a@example.com"}).limit(1))
+
+
+def test_projects_by_id_and_owner_uses_index(sync_db):
+    _assert_ixscan(sync_db.projects.find({"id": "p1", "user_id": "u1"}).limit(1))
+
+
+def test_project_list_uses_index(sync_db):
+    _assert_ixscan(sync_db.projects.find({"user_id": "u1"}).sort("updated_at", -1))
+
+
+def test_build_jobs_by_id_uses_index(sync_db):
+    _assert_ixscan(sync_db.build_jobs.find({"id": "j1", "user_id": "u1"}).limit(1))
+
+
+def test_build_events_by_job_sorted_by_seq_uses_index(sync_db):
+    _assert_ixscan(sync_db.build_events.find({"job_id": "j1"}).sort("seq", 1))
+
+
+def test_ai_runs_daily_count_uses_index(sync_db):
+    explain = sync_db.command(
+        "explain",
+        {"count": "ai_runs", "query": {"user_id": "u1", "created_at": {"$gte": "2024-01-01T00:00:00"}}},
+    )
+    _assert_ixscan(explain)
+
+
+def test_user_ai_key_lookup_uses_index(sync_db):
+    _assert_ixscan(sync_db.user_ai_keys.find({"user_id": "u1", "provider": "openai", "is_active": True}).limit(1))
+
+
+def test_chat_history_uses_index(sync_db):
+    _assert_ixscan(sync_db.chat_messages.find({"project_id": "p1"}).sort("created_at", 1))
+
+
+def test_keyset_pages_use_index(sync_db):
+    from app.services.pagination import encode_cursor, keyset_filter, keyset_sort
+
+    cursor = encode_cursor("2024-01-01T00:00:00+00:00", "p9")
+    query = keyset_filter({"user_id": "u1"}, cursor, sort_field="updated_at")
+    _assert_ixscan(sync_db.projects.find(query).sort(keyset_sort("updated_at")).limit(51))
+
+    query = keyset_filter({"status": "completed"}, cursor)
+    _assert_ixscan(sync_db.purchases.find(query).sort(keyset_sort()).limit(51))
+
+
+def test_project_file_listing_and_changes_use_index(sync_db):
+    _assert_ixscan(sync_db.project_files.find({"project_id": "p1", "path": {"$regex": "^src/"}}).sort("path", 1))
+    _assert_ixscan(sync_db.project_files.find({"project_id": "p1", "revision": {"$gt": 3}}))
+
+
+def test_running_jobs_by_user_and_job_use_index(sync_db):
+    _assert_ixscan(sync_db.running_jobs.find({"user_id": "u1", "expires_at": {"$gte": 0}}))
+    _assert_ixscan(sync_db.running_jobs.find({"job_id": "j1"}))
@@ -0,0 +1,113 @@
+"""
+Intent router tests
+
+LABELED_QUERIES is the routing test set: each query with the agent it should
+go to. The accuracy check keeps routing changes measurable; the benchmark in
+bench_intent_router.py reuses the same set. Pure functions, no database.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services.intent_router import (  # noqa: E402
+    analyze_query, CODER, BROWSER, FILE, MCP, PLANNER, CASUAL,
+    COMPLEXITY_HIGH, COMPLEXITY_LOW,
+)
+
+
+LABELED_QUERIES = [
+    # coder
+    ("write a python script to rename photos by date", CODER),
+    ("create a react component for a pricing table", CODER),
+    ("build a snake game in javascript", CODER),
+    ("make a landing page for my bakery", CODER),
+    ("debug this function, it returns None", CODER),
+    ("generate an api endpoint for user signup", CODER),
+    ("fix the bug in my css grid", CODER),
+    ("create a todo app", CODER),
+    ("implement binary search in go", CODER),
+    ("write sql to get the top 10 customers", CODER),
+    ("refactor this class to use dataclasses", CODER),
+    ("make a simple calculator", CODER),
+    ("develop a flask backend with two routes", CODER),
+    ("html page with a contact form", CODER),
+    ("convert this code to typescript", CODER),
+    # browser
+    ("search for the best laptops under 1000 dollars", BROWSER),
+    ("what is the latest news on the mars rover", BROWSER),
+    ("look up the weather in delhi", BROWSER),
+    ("who is the ceo of openai", BROWSER),
+    ("research the pros and cons of rust vs go", BROWSER),
+    ("find tutorials on docker networking", BROWSER),
+    ("google the release date of python 3.13", BROWSER),
+    ("stock price of reliance today", BROWSER),
+    ("browse hacker news for ai posts", BROWSER),
+    ("find out when the next ipl match is", BROWSER),
+    # file
+    ("organize my downloads folder", FILE),
+    ("rename files in this directory to lowercase", FILE),
+    ("list files in the project directory", FILE),
+    ("delete all the temp files", FILE),
+    ("move the pdfs into a new folder", FILE),
+    ("find the file named config.yaml", FILE),
+    ("copy report.docx to the backup folder", FILE),
+    ("create folder called invoices", FILE),
+    # mcp
+    ("use mcp to add a meeting to my calendar", MCP),
+    ("send an email to the team via slack", MCP),
+    ("use the github api tool to list my repos", MCP),
+    ("check my contacts for ravi's number", MCP),
+    # planner
+    ("build a full stack e-commerce app with authentication and payments", PLANNER),
+    ("create a complete project with frontend, backend and deployment", PLANNER),
+    ("plan and build a blog platform step by step", PLANNER),
+    ("first set up the database and then build the api and after that the ui", PLANNER),
+    ("build a real-time chat application with multiple rooms", PLANNER),
+    ("design a system for processing uploads with multiple workers", PLANNER),
+    ("write a comprehensive inventory management application", PLANNER),
+    # casual
+    ("hello", CASUAL),
+    ("hi there, how are you?", CASUAL),
+    ("thanks, that worked!", CASUAL),
+    ("explain how recursion works", CASUAL),
+    ("what is a closure", CASUAL),
+    ("why does the sky look blue", CASUAL),
+    ("tell me a joke", CASUAL),
+    ("good morning", CASUAL),
+    ("how does garbage collection work in java", CASUAL),
+]
+
+
+def test_labeled_set_accuracy():
+    wrong = [
+        (query, expected, analyze_query(query).agent_or(CASUAL))
+        for query, expected in LABELED_QUERIES
+        if analyze_query(query).agent_or(CASUAL) != expected
+    ]
+    accuracy = 1 - len(wrong) / len(LABELED_QUERIES)
+    assert accuracy >= 0.9, wrong
+
+
+def test_keywords_match_whole_words_and_plurals():
+    assert analyze_query("update my profile picture").scores[FILE] == 0
+    assert analyze_query("list the files").scores[FILE] > 0
+    assert analyze_query("classify these images").scores[CODER] == 0
+
+
+def test_longer_phrase_outweighs_its_prefix():
+    intent = analyze_query("find the file and open it")
+    assert "find the file" in intent.matches and "file" in intent.matches
+    assert intent.agent == FILE
+
+
+def test_one_pass_scores_every_agent_and_complexity():
+    intent = analyze_query("build a simple website and search for icons")
+    assert intent.scores[CODER] > 0 and intent.scores[BROWSER] > 0
+    assert intent.complexity == COMPLEXITY_LOW
+    assert analyze_query("app with authentication").complexity == COMPLEXITY_HIGH
+
+
+def test_results_are_memoized_per_normalized_query():
+    assert analyze_query("Build a  Todo App") is analyze_query("build a todo app")
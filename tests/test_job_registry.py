@@ -0,0 +1,97 @@
+"""
+Job registry tests
+
+Per-user slot claims (including takeover of a dead worker's slot) and
+cancellation of a running job, against an in-memory `running_jobs`.
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("motor")
+pymongo_errors = pytest.importorskip("pymongo.errors")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services import job_registry  # noqa: E402
+from app.services.job_registry import cancel_job, reserve_job, run_job  # noqa: E402
+
+
+class RunningJobs:
+    """Just enough of a collection, with the (user_id, slot) and job_id unique indexes."""
+
+    def __init__(self):
+        self.docs = []
+
+    async def insert_one(self, doc):
+        for d in self.docs:
+            if d["job_id"] == doc["job_id"] or (d["user_id"], d["slot"]) == (doc["user_id"], doc["slot"]):
+                raise pymongo_errors.DuplicateKeyError("duplicate key")
+        self.docs.append(doc)
+
+    async def replace_one(self, query, doc):
+        for i, d in enumerate(self.docs):
+            if (d["user_id"], d["slot"]) == (query["user_id"], query["slot"]) and d["expires_at"] < query["expires_at"]["$lt"]:
+                self.docs[i] = doc
+                return SimpleNamespace(modified_count=1)
+        return SimpleNamespace(modified_count=0)
+
+    async def delete_one(self, query):
+        self.docs = [d for d in self.docs if (d["job_id"], d["worker_id"]) != (query["job_id"], query["worker_id"])]
+
+
+@pytest.fixture
+def running_jobs(monkeypatch):
+    collection = RunningJobs()
+    monkeypatch.setattr(job_registry, "db", SimpleNamespace(running_jobs=collection))
+    return collection
+
+
+def test_slots_cap_jobs_per_user(running_jobs):
+    async def scenario():
+        claims = [await reserve_job(f"j{i}", "u1", limit=2) for i in range(3)]
+        other = await reserve_job("k0", "u2", limit=2)
+        # j0's worker died: its heartbeat lapsed, so the slot can be taken over
+        running_jobs.docs[0]["expires_at"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+        takeover = await reserve_job("j3", "u1", limit=2)
+        return claims, other, takeover
+
+    claims, other, takeover = asyncio.run(scenario())
+    assert claims == [True, True, False]
+    assert other and takeover
+    assert sorted(d["job_id"] for d in running_jobs.docs) == ["j1", "j3", "k0"]
+
+
+def test_cancel_stops_the_running_job_and_frees_its_slot(running_jobs):
+    seen = []
+
+    async def job(started):
+        started.set()
+        try:
+            await asyncio.sleep(60)  # stands in for the provider request
+        except asyncio.CancelledError:
+            seen.append("cancelled")
+            raise
+
+    async def scenario():
+        started = asyncio.Event()
+        assert await reserve_job("j1", "u1", limit=1)
+        task = run_job("j1", job(started))
+        await started.wait()
+        assert job_registry.job_task("j1") is task
+        assert await cancel_job("j1")
+        await asyncio.wait({task})
+        await asyncio.gather(*job_registry._releasing)
+        return task
+
+    task = asyncio.run(scenario())
+    assert task.cancelled() and seen == ["cancelled"]
+    assert job_registry.job_task("j1") is None
+    assert running_jobs.docs == []
@@ -0,0 +1,177 @@
+"""
+LLM gateway tests
+
+Provider payloads, usage and cost in the typed result, the response cache
+and error handling of `ai_router.complete`, against a mocked HTTP transport
+and in-memory logging; no network or database.
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("motor")
+pytest.importorskip("cachetools")
+pytest.importorskip("cryptography")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services import ai_router  # noqa: E402
+from app.services.ai_router import LLMError, complete, generate_code  # noqa: E402
+from app.services.pricing import builtin_price_table, count_tokens  # noqa: E402
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    """Routes provider requests to `gateway.reply` and records them and the logged runs."""
+    state = type("Gateway", (), {})()
+    state.requests, state.runs, state.errors = [], [], []
+    state.reply = lambda request: httpx.Response(500, text="no reply set")
+
+    def handler(request):
+        state.requests.append(request)
+        return state.reply(request)
+
+    async def log_ai_run(**kwargs):
+        state.runs.append(kwargs)
+
+    async def log_error(**kwargs):
+        state.errors.append(kwargs)
+
+    async def healthy(provider):
+        return {"is_enabled": True, "is_blocked": False}
+
+    async def no_byo_key(user_id, provider):
+        return None
+
+    async def builtin_prices():
+        return builtin_price_table()
+
+    monkeypatch.setattr(ai_router, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(ai_router, "_responses", ai_router.TTLCache(maxsize=10, ttl=60))
+    monkeypatch.setattr(ai_router, "_provider_slots", {})
+    monkeypatch.setattr(ai_router, "log_ai_run", log_ai_run)
+    monkeypatch.setattr(ai_router, "log_error", log_error)
+    monkeypatch.setattr(ai_router, "check_provider_health", healthy)
+    monkeypatch.setattr(ai_router, "get_user_ai_key", no_byo_key)
+    monkeypatch.setattr(ai_router, "get_platform_key", lambda provider: "platform-key")
+    monkeypatch.setattr(ai_router, "get_price_table", builtin_prices)
+    return state
+
+
+MESSAGES = [
+    {"role": "system", "content": "Be brief."},
+    {"role": "user", "content": "Hi"},
+    {"role": "assistant", "content": "Hello!"},
+    {"role": "user", "content": "Make a navbar"},
+]
+
+
+def test_multi_turn_call_returns_usage_and_cost_and_is_cached(gateway):
+    gateway.reply = lambda request: httpx.Response(200, json={
+        "choices": [{"message": {"content": "<nav></nav>"}}],
+        "usage": {"prompt_tokens": 1000, "completion_tokens": 500},
+    })
+
+    async def scenario():
+        call = dict(provider="openai", model="gpt-4o", max_tokens=256, temperature=0)
+        first = await complete(MESSAGES, user_id="u1", **call)
+        second = await complete(MESSAGES, user_id="u1", **call)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    payload = json.loads(gateway.requests[0].content)
+    assert payload["messages"] == MESSAGES and payload["max_tokens"] == 256
+    assert gateway.requests[0].headers["authorization"] == "Bearer platform-key"
+
+    assert (first.text, first.provider, first.model) == ("<nav></nav>", "openai", "gpt-4o")
+    assert (first.tokens_in, first.tokens_out, first.tokens) == (1000, 500, 1500)
+    assert first.cost == pytest.approx(0.0125) and not first.cached
+    assert gateway.runs[0]["status"] == "success" and gateway.runs[0]["cost"] == first.cost
+
+    # The repeat is served from cache: no request, no run logged, nothing billed
+    assert len(gateway.requests) == 1 and len(gateway.runs) == 1
+    assert second.cached and second.text == first.text
+    assert (second.tokens, second.cost) == (0, 0.0)
+
+
+def test_cache_is_per_user_deterministic_only_and_behind_the_provider_checks(gateway, monkeypatch):
+    gateway.reply = lambda request: httpx.Response(200, json={"choices": [{"message": {"content": "hi"}}]})
+
+    async def disabled(provider):
+        return {"is_enabled": False, "is_blocked": False}
+
+    async def scenario():
+        await complete(MESSAGES, provider="openai", user_id="u1", temperature=0)
+        other_user = await complete(MESSAGES, provider="openai", user_id="u2", temperature=0)
+        sampled = [await complete(MESSAGES, provider="openai", user_id="u1") for _ in range(2)]
+        monkeypatch.setattr(ai_router, "check_provider_health", disabled)
+        with pytest.raises(LLMError):
+            await complete(MESSAGES, provider="openai", user_id="u1", temperature=0)
+        return other_user, sampled
+
+    other_user, sampled = asyncio.run(scenario())
+    assert not other_user.cached
+    assert not any(result.cached for result in sampled)
+    assert len(gateway.requests) == 4
+
+
+def test_planner_calls_are_deterministic_and_served_from_cache(gateway):
+    gateway.reply = lambda request: httpx.Response(200, json={"choices": [{"message": {"content": '{"steps": []}'}}]})
+
+    async def scenario():
+        call = dict(prompt="Plan a todo app", ai_provider="openai", user_id="u1", is_planner=True, temperature=0)
+        return [await generate_code(**call) for _ in range(2)]
+
+    assert asyncio.run(scenario()) == ['{"steps": []}'] * 2
+    assert json.loads(gateway.requests[0].content)["temperature"] == 0
+    assert len(gateway.requests) == 1
+
+
+def test_system_prompt_is_split_out_for_claude_and_gemini(gateway):
+    def reply(request):
+        if "anthropic" in request.url.host:
+            return httpx.Response(200, json={
+                "content": [{"type": "text", "text": "ok"}],
+                "usage": {"input_tokens": 12, "output_tokens": 3},
+            })
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "gemini says hi"}]}}]})
+
+    gateway.reply = reply
+
+    async def scenario():
+        claude = await complete(MESSAGES, provider="claude", use_cache=False)
+        gemini = await complete(MESSAGES, provider="gemini", use_cache=False)
+        return claude, gemini
+
+    claude, gemini = asyncio.run(scenario())
+    claude_payload, gemini_payload = (json.loads(r.content) for r in gateway.requests)
+
+    assert claude_payload["system"] == "Be brief."
+    assert [m["role"] for m in claude_payload["messages"]] == ["user", "assistant", "user"]
+    assert (claude.tokens_in, claude.tokens_out) == (12, 3)
+
+    assert gemini_payload["systemInstruction"] == {"parts": [{"text": "Be brief."}]}
+    assert [c["role"] for c in gemini_payload["contents"]] == ["user", "model", "user"]
+    assert gateway.requests[1].headers["x-goog-api-key"] == "platform-key"
+    # No usage in the reply: counted locally
+    assert gemini.text == "gemini says hi" and gemini.tokens_out == count_tokens("gemini says hi", gemini.model)
+
+
+def test_provider_errors_raise_llm_error_and_are_logged(gateway):
+    gateway.reply = lambda request: httpx.Response(500, text="upstream exploded")
+
+    with pytest.raises(LLMError) as raised:
+        asyncio.run(complete(MESSAGES, provider="openai", user_id="u1"))
+
+    assert raised.value.status_code == 500 and raised.value.provider == "openai"
+    assert "upstream exploded" in str(raised.value)
+    assert gateway.runs[0]["status"] == "failed"
+    assert gateway.errors[0]["error_type"] == "AI_API_ERROR"
@@ -0,0 +1,111 @@
+"""
+Plan executor tests
+
+Runs small plans with sleeping steps to check scheduling: independent steps
+overlap, failures cancel their dependents, and the per-user cap holds.
+No database needed (the backend config still has to be importable).
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services.plan_executor import (  # noqa: E402
+    normalize_plan, run_plan, STEP_STARTED, STEP_COMPLETED, STEP_FAILED, STEP_CANCELLED, STEP_EVENT,
+)
+
+
+STEP_SECONDS = 0.1
+
+
+async def _collect(steps, run_step, **kwargs):
+    return [item async for item in run_plan(steps, run_step, **kwargs)]
+
+
+def _sleeping_step(log=None):
+    async def run_step(step, inputs, emit):
+        emit(f"working on {step['id']}")
+        await asyncio.sleep(STEP_SECONDS)
+        if step.get("fail"):
+            raise RuntimeError("boom")
+        if log is not None:
+            log.append((step["id"], sorted(inputs)))
+        return step["id"]
+    return run_step
+
+
+def test_independent_steps_finish_in_critical_path_time():
+    # 1, 2, 3 are independent; 4 needs 1 and 2; 5 needs 4 -> critical path is 3 steps
+    steps = [
+        {"id": "1", "dependencies": []},
+        {"id": "2", "dependencies": []},
+        {"id": "3", "dependencies": []},
+        {"id": "4", "dependencies": ["1", "2"]},
+        {"id": "5", "dependencies": ["4"]},
+    ]
+    log = []
+    started = time.monotonic()
+    items = asyncio.run(_collect(steps, _sleeping_step(log), user_id="u1", max_parallel=5))
+    elapsed = time.monotonic() - started
+
+    assert elapsed < STEP_SECONDS * 4.5  # sequential would take 5 steps
+    assert [i["step_id"] for i in items if i["type"] == STEP_COMPLETED][-1] == "5"
+    assert ("4", ["1", "2"]) in log
+    assert sum(1 for i in items if i["type"] == STEP_EVENT) == 5
+
+
+def test_failed_step_cancels_its_dependents_only():
+    steps = [
+        {"id": "a", "dependencies": [], "fail": True},
+        {"id": "b", "dependencies": ["a"]},
+        {"id": "c", "dependencies": ["b"]},
+        {"id": "d", "dependencies": []},
+    ]
+    items = asyncio.run(_collect(steps, _sleeping_step(), max_parallel=4))
+    status = {i["step_id"]: i["type"] for i in items if i["type"] not in (STEP_STARTED, STEP_EVENT)}
+
+    assert status == {"a": STEP_FAILED, "b": STEP_CANCELLED, "c": STEP_CANCELLED, "d": STEP_COMPLETED}
+
+
+def test_user_cap_limits_concurrent_steps():
+    active = 0
+    peak = 0
+
+    async def run_step(step, inputs, emit):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(STEP_SECONDS / 2)
+        active -= 1
+
+    async def two_plans():
+        steps = [{"id": str(i), "dependencies": []} for i in range(4)]
+        await asyncio.gather(
+            _collect(steps, run_step, user_id="u2", max_parallel=2),
+            _collect(steps, run_step, user_id="u2", max_parallel=2),
+        )
+
+    asyncio.run(two_plans())
+    assert peak == 2
+
+
+def test_plans_without_dependencies_run_in_order():
+    steps = normalize_plan([{"task": "x"}, {"task": "y"}, {"task": "z"}])
+    assert [s["dependencies"] for s in steps] == [[], ["1"], ["2"]]
+
+
+def test_cycles_and_unknown_ids_fall_back_safely():
+    cyclic = normalize_plan([
+        {"id": "1", "dependencies": ["2"]},
+        {"id": "2", "dependencies": ["1", "missing"]},
+    ])
+    assert [s["dependencies"] for s in cyclic] == [[], ["1"]]
@@ -0,0 +1,233 @@
+"""
+Pricing tests
+
+Price lookup in a versioned table, publishing and loading a version, local
+token counts, write-time usage rollups (including charging an LLM key) and
+their one-time backfill, against in-memory collections.
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("motor")
+pytest.importorskip("pymongo")
+pytest.importorskip("cryptography")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from pymongo.errors import DuplicateKeyError  # noqa: E402
+
+from app.services import pricing  # noqa: E402
+from app.services.pricing import (  # noqa: E402
+    PriceTable,
+    count_message_tokens,
+    count_tokens,
+    get_price_table,
+    ensure_usage_rollups_bootstrapped,
+    get_usage_totals,
+    publish_price_table,
+    record_usage,
+)
+
+
+class Collection:
+    """insert/find_one/update_one/bulk_write with $inc (dotted paths), $set and upsert - enough for pricing."""
+
+    def __init__(self):
+        self.docs = []
+
+    def _match(self, doc, query):
+        for field, cond in query.items():
+            if isinstance(cond, dict) and "$lte" in cond:
+                if not doc.get(field) <= cond["$lte"]:
+                    return False
+            elif isinstance(cond, dict) and "$exists" in cond:
+                if (field in doc) != cond["$exists"]:
+                    return False
+            elif doc.get(field) != cond:
+                return False
+        return True
+
+    async def insert_one(self, doc):
+        self.docs.append(doc)
+
+    async def find_one(self, query, projection=None, sort=None):
+        found = [d for d in self.docs if self._match(d, query)]
+        if sort:
+            (field, direction), = sort
+            found.sort(key=lambda d: d[field], reverse=direction < 0)
+        return dict(found[0]) if found else None
+
+    async def update_one(self, query, update, upsert=False):
+        doc = next((d for d in self.docs if self._match(d, query)), None)
+        if doc is None:
+            if not upsert:
+                return SimpleNamespace(modified_count=0, upserted_id=None)
+            if any(d.get("_id") == query.get("_id") for d in self.docs):
+                raise DuplicateKeyError("_id")
+            fields = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            doc = {**fields, **update.get("$setOnInsert", {})}
+            self.docs.append(doc)
+            upserted = doc.get("_id")
+        else:
+            upserted = None
+        for path, value in update.get("$inc", {}).items():
+            *parents, leaf = path.split(".")
+            node = doc
+            for parent in parents:
+                node = node.setdefault(parent, {})
+            node[leaf] = node.get(leaf, 0) + value
+        doc.update(update.get("$set", {}))
+        return SimpleNamespace(modified_count=0 if upserted else 1, upserted_id=upserted)
+
+    async def bulk_write(self, requests, ordered=True):
+        for op in requests:
+            await self.update_one(op._filter, op._doc, upsert=op._upsert)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    collections = SimpleNamespace(
+        price_tables=Collection(), usage_rollups=Collection(),
+        llm_keys=Collection(), llm_key_usage=Collection(),
+    )
+    monkeypatch.setattr(pricing, "db", collections)
+    monkeypatch.setattr(pricing, "_active", None)
+    monkeypatch.setattr(pricing, "_loaded_at", None)
+    return collections
+
+
+def test_price_lookup_falls_back_from_exact_to_prefix_to_wildcard():
+    table = PriceTable("v1", {
+        "openai": {"gpt-4o": {"input": 5, "output": 15}, "gpt-4o-mini": {"input": 1, "output": 2}},
+        "together": {"*": {"input": 0.5, "output": 0.5}},
+        "*": {"deepseek-chat": {"input": 0.2, "output": 0.4}},
+    })
+
+    assert table.price("openai", "gpt-4o-2024-08-06") == {"input": 5, "output": 15}
+    assert table.price("openai", "gpt-4o-mini-2024-07-18") == {"input": 1, "output": 2}
+    assert table.price("deepseek", "deepseek-chat") == {"input": 0.2, "output": 0.4}
+    assert table.price("together", "llama-3") == {"input": 0.5, "output": 0.5}
+    assert table.price("acme", "unknown") == pricing.DEFAULT_PRICE
+    assert table.cost("openai", "gpt-4o", 2000, 1000) == pytest.approx(25.0)
+
+
+def test_published_version_becomes_active_and_keeps_dotted_model_ids(fake_db):
+    async def scenario():
+        builtin = await get_price_table()
+        await publish_price_table({"openai": {"gpt-5.2": {"input": 0.01, "output": 0.02}}}, version="2026-10")
+        await publish_price_table({"openai": {"gpt-5.2": {"input": 9, "output": 9}}}, version="future",
+                                  effective_at="2999-01-01T00:00:00")
+        return builtin, await get_price_table()
+
+    builtin, active = asyncio.run(scenario())
+    assert builtin.version == pricing.BUILTIN_PRICE_VERSION
+    assert "gpt-4o" in builtin.prices["openai"]
+    # Not yet effective versions are ignored
+    assert active.version == "2026-10"
+    assert active.price("openai", "gpt-5.2") == {"input": 0.01, "output": 0.02}
+    assert fake_db.price_tables.docs[0]["prices"][0]["model"] == "gpt-5.2"
+
+
+def test_token_counts_cover_text_and_chat_framing():
+    code = "function add(a, b) { return a + b; }"
+    assert count_tokens("") == 0
+    assert count_tokens(code) >= len(code.split())
+    messages = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": code}]
+    assert count_message_tokens(messages) == (
+        pricing.TOKENS_PER_REQUEST + 2 * pricing.TOKENS_PER_MESSAGE
+        + count_tokens("Be brief.") + count_tokens(code)
+    )
+
+
+def run(**fields):
+    return {
+        "id": "r", "user_id": "u1", "provider": "openai", "model": "gpt-5.2", "tokens_in": 100,
+        "tokens_out": 50, "cost_estimate": 0.5, "status": "success", "is_byo_key": False,
+        "llm_key_id": None, "latency_ms": 10, "created_at": "2026-10-19T10:00:00+00:00", **fields,
+    }
+
+
+def test_runs_roll_up_per_user_and_day_and_charge_their_key(fake_db):
+    fake_db.llm_keys.docs.append({"id": "k1", "user_id": "u1", "credits_balance": 10.0, "credits_used": 0.0})
+
+    async def scenario():
+        await record_usage(run())
+        await record_usage(run(is_byo_key=True, cost_estimate=0.25))
+        await record_usage(run(status="failed", tokens_in=0, tokens_out=0, cost_estimate=0))
+        await record_usage(run(llm_key_id="k1", cost_estimate=2.0))
+        await record_usage(run(created_at="2026-10-20T01:00:00+00:00"))
+        await record_usage(run(user_id=None))
+
+    asyncio.run(scenario())
+
+    day = next(d for d in fake_db.usage_rollups.docs if d["_id"] == "u1:2026-10-19")
+    assert (day["requests"], day["failed"], day["tokens_in"], day["tokens_out"]) == (4, 1, 300, 150)
+    assert day["cost"] == pytest.approx(2.75)
+    assert day["billed_cost"] == pytest.approx(2.5)  # the BYO-key run isn't billed
+    assert day["by_model"]["gpt-5_2"]["requests"] == 4
+    assert day["by_provider"]["openai"]["tokens"] == 450
+    assert day["by_key"] == {"k1": {"requests": 1, "cost": 2.0}}
+    assert len(fake_db.usage_rollups.docs) == 3  # two days and the lifetime totals
+
+    key = fake_db.llm_keys.docs[0]
+    assert (key["credits_balance"], key["credits_used"], key["total_requests"]) == (8.0, 2.0, 1)
+    assert [u["cost"] for u in fake_db.llm_key_usage.docs] == [2.0]
+
+
+def test_lifetime_totals_span_days(fake_db):
+    async def scenario():
+        await record_usage(run(created_at="2025-01-01T10:00:00+00:00"))
+        await record_usage(run(is_byo_key=True))
+        return await get_usage_totals("u1"), await get_usage_totals("u2")
+
+    totals, nobody = asyncio.run(scenario())
+    assert (totals["requests"], totals["tokens_in"], totals["tokens_out"]) == (2, 200, 100)
+    assert totals["cost"] == pytest.approx(1.0) and totals["billed_cost"] == pytest.approx(0.5)
+    assert set(nobody.values()) == {0}
+    lifetime = next(d for d in fake_db.usage_rollups.docs if d["_id"] == "u1:lifetime")
+    assert "by_model" not in lifetime and "expires_at" not in lifetime
+
+
+class AiRuns:
+    """The grouped rows a backfill aggregation returns, and the runs it marks counted."""
+
+    def __init__(self, rows):
+        self.rows, self.marked = rows, []
+
+    def aggregate(self, pipeline, allowDiskUse=False):
+        async def to_list(length):
+            return self.rows
+        return SimpleNamespace(to_list=to_list)
+
+    async def update_many(self, query, update):
+        self.marked.append(query)
+
+
+def test_backfill_runs_once_and_adds_to_live_counts(fake_db):
+    recent = (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
+    group = {"user_id": "u1", "provider": "openai", "model": "gpt-5.2", "is_byo_key": False}
+    fake_db.ai_runs = AiRuns([
+        {"_id": {**group, "day": "2020-01-01"}, "requests": 3, "failed": 0, "tokens_in": 30, "tokens_out": 30, "cost": 0.3},
+        {"_id": {**group, "day": recent}, "requests": 2, "failed": 1, "tokens_in": 20, "tokens_out": 20, "cost": 0.2},
+    ])
+
+    async def scenario():
+        await record_usage(run())  # counted live before the backfill
+        await asyncio.gather(ensure_usage_rollups_bootstrapped(), ensure_usage_rollups_bootstrapped())
+        await ensure_usage_rollups_bootstrapped()
+        return await get_usage_totals("u1")
+
+    totals = asyncio.run(scenario())
+    assert totals["requests"] == 6 and totals["cost"] == pytest.approx(1.0)
+    ids = {d["_id"] for d in fake_db.usage_rollups.docs}
+    assert f"u1:{recent}" in ids and "u1:2020-01-01" not in ids  # past retention
+    assert len(fake_db.ai_runs.marked) == 1 and fake_db.ai_runs.marked[0]["rolled_up"] == {"$ne": True}
+    assert "backfilled_at" in next(d for d in fake_db.usage_rollups.docs if d["_id"] == "meta")
@@ -0,0 +1,105 @@
+"""
+Project file tree tests
+
+Path validation, manifest hashing, the incremental prompt context and the
+ownership check agents make before touching a tree. Database and tree reads
+are swapped for in-memory ones.
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("motor")
+pytest.importorskip("pymongo")
+pytest.importorskip("cachetools")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services import project_files  # noqa: E402
+from app.services.blob_store import blob_hash  # noqa: E402
+from app.services.project_files import build_context, manifest_hash, normalize_path  # noqa: E402
+
+
+def test_paths_are_normalized_and_confined():
+    assert normalize_path("./src//app.py") == "src/app.py"
+    assert normalize_path("src\\components\\Nav.jsx") == "src/components/Nav.jsx"
+    for bad in ("", "/etc/passwd", "../secrets", "src/../../x", "a\0b", "/".join("d" * 17)):
+        with pytest.raises(ValueError):
+            normalize_path(bad)
+
+
+def test_manifest_hash_tracks_paths_and_content():
+    files = [{"path": "b.css", "ref": "r2"}, {"path": "a.html", "ref": "r1"}]
+    assert manifest_hash(files) == manifest_hash(list(reversed(files)))
+    assert manifest_hash(files) != manifest_hash([{"path": "a.html", "ref": "r1"}, {"path": "b.css", "ref": "r3"}])
+    assert manifest_hash(files) != manifest_hash([{"path": "a.html", "ref": "r2"}, {"path": "b.css", "ref": "r1"}])
+
+
+def test_context_sends_only_changed_content(monkeypatch):
+    contents = {"index.html": "<h1>Hi</h1>", "styles.css": "h1 {}", "old.js": ""}
+    tree = [
+        {"path": "index.html", "ref": blob_hash(contents["index.html"]), "size": 11, "language": "html", "revision": 1},
+        {"path": "styles.css", "ref": blob_hash(contents["styles.css"]), "size": 5, "language": "css", "revision": 3},
+        {"path": "old.js", "ref": None, "size": 0, "revision": 4, "deleted": True},
+    ]
+
+    async def list_files(project_id, include_deleted=False):
+        return [f for f in tree if include_deleted or not f.get("deleted")]
+
+    async def get_blobs(refs):
+        return {blob_hash(c): c for c in contents.values() if blob_hash(c) in set(refs)}
+
+    monkeypatch.setattr(project_files, "list_files", list_files)
+    monkeypatch.setattr(project_files, "get_blobs", get_blobs)
+
+    first = asyncio.run(build_context("p1"))
+    later = asyncio.run(build_context("p1", since_revision=first["revision"] - 2))
+    idle = asyncio.run(build_context("p1", since_revision=first["revision"]))
+
+    assert first["revision"] == 4
+    assert "```html:index.html\n<h1>Hi</h1>\n```" in first["text"]
+    assert later["changed"] == ["styles.css", "old.js"]
+    assert "<h1>Hi</h1>" not in later["text"] and "Deleted: old.js" in later["text"]
+    assert idle["changed"] == [] and "Changed files" not in idle["text"]
+    assert "index.html (11 bytes) (unchanged since your last look)" in idle["text"]
+
+
+def test_agents_only_touch_the_users_projects(monkeypatch):
+    pytest.importorskip("httpx")
+    pytest.importorskip("cryptography")
+    from app.services import coding_agent
+
+    projects = [{"id": "p1", "user_id": "u1"}]
+    writes = []
+
+    class Projects:
+        async def find_one(self, query, projection=None):
+            return next((p for p in projects if all(p.get(k) == v for k, v in query.items())), None)
+
+    async def ensure_project_files(project_id):
+        pass
+
+    async def write_files(project_id, files, source="agent"):
+        writes.append(project_id)
+        return {"revision": 1, "changed": list(files)}
+
+    monkeypatch.setattr(project_files, "db", type("Db", (), {"projects": Projects()})())
+    monkeypatch.setattr(coding_agent, "ensure_project_files", ensure_project_files)
+    monkeypatch.setattr(coding_agent, "write_files", write_files)
+    agent = coding_agent.FileAgent()
+
+    async def scenario():
+        return (
+            await agent.create_file("p1", "u2", "index.html", "<h1>x</h1>"),
+            await agent.list_directory("p1", "u2"),
+            await agent.create_file("p1", "u1", "index.html", "<h1>x</h1>"),
+        )
+
+    foreign_write, foreign_list, own_write = asyncio.run(scenario())
+    assert foreign_write == foreign_list == {"success": False, "error": "Project not found"}
+    assert own_write["success"] and writes == ["p1"]
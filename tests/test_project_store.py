@@ -0,0 +1,40 @@
+"""
+Project ETag tests
+
+The detail ETag must change with any field the response returns, including
+writes that don't bump updated_at, and must not depend on the code itself
+beyond its hash (the conditional GET doesn't load it).
+"""
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("motor")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services.project_store import PROJECT_ETAG_PROJECTION, compute_code_stats, project_etag  # noqa: E402
+
+
+PROJECT = {
+    "id": "p1", "user_id": "u1", "name": "Site", "framework": "html", "version": 3,
+    "html_code": "<h1>Hi</h1>", "created_at": "2026-10-01T00:00:00", "updated_at": "2026-10-02T00:00:00",
+}
+PROJECT.update(compute_code_stats(PROJECT))
+
+
+def test_etag_tracks_metadata_written_without_updated_at():
+    etag = project_etag(PROJECT)
+    assert project_etag({**PROJECT, "is_frozen": True}) != etag
+    assert project_etag({**PROJECT, "name": "Renamed"}) != etag
+    assert project_etag({**PROJECT, **compute_code_stats({"html_code": "<h1>Bye</h1>"})}) != etag
+
+
+def test_conditional_get_projection_yields_the_same_etag():
+    meta = {field: value for field, value in PROJECT.items() if field in PROJECT_ETAG_PROJECTION}
+    assert "html_code" not in meta
+    assert project_etag(meta) == project_etag(PROJECT)
@@ -0,0 +1,53 @@
+"""
+Project version delta tests
+
+Round-trips the line deltas used by project version history. Pure functions,
+no database needed (the backend package still has to be importable).
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+pytest.importorskip("motor")
+pytest.importorskip("fastapi")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services.project_versions import make_delta, apply_delta  # noqa: E402
+
+
+PAGE = "<html>\n<head><title>Demo</title></head>\n<body>\n<h1>Hello</h1>\n<p>World</p>\n</body>\n</html>\n"
+
+
+def test_small_edit_only_stores_changed_lines():
+    edited = PAGE.replace("<h1>Hello</h1>", "<h1>Hi there</h1>")
+    delta = make_delta(PAGE, edited)
+
+    inserted = [line for op in delta if op[0] == "+" for line in op[1]]
+    assert inserted == ["<h1>Hi there</h1>\n"]
+    assert apply_delta(PAGE, delta) == edited
+
+
+@pytest.mark.parametrize("old, new", [
+    (None, PAGE),
+    (PAGE, None),
+    (PAGE, PAGE),
+    (PAGE, PAGE.rstrip("\n")),
+    ("", ""),
+])
+def test_edge_cases_round_trip(old, new):
+    assert apply_delta(old, make_delta(old, new)) == (new or "")
+
+
+def test_random_edits_round_trip():
+    rng = random.Random(7)
+    pieces = ["<div>\n", "</div>\n", "text\n", "\n", "<p>x</p>\n", "tail"]
+    for _ in range(200):
+        old = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 40)))
+        new = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 40)))
+        assert apply_delta(old, make_delta(old, new)) == new
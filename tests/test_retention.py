@@ -0,0 +1,155 @@
+"""
+Retention rollup tests
+
+Rows that only carry `timestamp` (agent chat messages, older build events)
+are matched and counted when summarizing before their TTL removes them, and
+chat history only expires when opted in.
+"""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("motor")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services import retention  # noqa: E402
+
+
+class Rows:
+    """Runs the rollup's $match / $group over in-memory docs, and records summaries and indexes."""
+
+    def __init__(self, docs=(), indexes=()):
+        self.docs = list(docs)
+        self.indexes = {name: {} for name in indexes}
+        self.summaries = {}
+
+    def _match(self, doc, query):
+        for field, cond in query.items():
+            if field == "$or":
+                if not any(self._match(doc, q) for q in cond):
+                    return False
+                continue
+            value = doc.get(field)
+            for op, arg in cond.items():
+                if op == "$exists" and (field in doc) != arg:
+                    return False
+                if op == "$lt" and not (value is not None and value < arg):
+                    return False
+                if op == "$gte" and not (value is not None and value >= arg):
+                    return False
+        return True
+
+    def aggregate(self, pipeline):
+        match, group = pipeline[0]["$match"], pipeline[1]["$group"]
+        key_field = group["_id"]["key"]["$ifNull"][0][1:]
+        rows = {}
+        for doc in self.docs:
+            if not self._match(doc, match):
+                continue
+            day = (doc.get("created_at") or doc["timestamp"])[:10]
+            row = rows.setdefault((day, doc.get(key_field, "unknown")), {"count": 0})
+            row["count"] += 1
+        result = [{"_id": {"day": day, "key": key}, **row} for (day, key), row in rows.items()]
+        return SimpleNamespace(to_list=lambda length: self._result(result))
+
+    async def _result(self, rows):
+        return rows
+
+    async def find_one(self, query):
+        return None
+
+    async def update_one(self, query, update, upsert=False):
+        if "collection" in update["$set"]:
+            self.summaries[query["_id"]] = update["$set"]
+
+    async def index_information(self):
+        return self.indexes
+
+    async def drop_index(self, name):
+        del self.indexes[name]
+
+
+class Recorder:
+    def __init__(self):
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return SimpleNamespace(to_list=self._empty)
+
+    async def _empty(self, length):
+        return []
+
+    async def find_one(self, query):
+        return None
+
+    async def update_one(self, *args, **kwargs):
+        pass
+
+
+class Db:
+    """db[name] and db.name, all backed by one collection."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getitem__(self, name):
+        return self._collection
+
+    def __getattr__(self, name):
+        return self._collection
+
+
+@pytest.mark.parametrize("collection, fallback", [
+    ("chat_messages", True), ("build_events", True), ("ai_runs", False),
+])
+def test_rows_with_only_timestamp_are_rolled_up(monkeypatch, collection, fallback):
+    recorder = Recorder()
+    monkeypatch.setattr(retention, "db", Db(recorder))
+    monkeypatch.setitem(retention.RETENTION_POLICIES, "chat_messages", retention.OPTIONAL_POLICIES["chat_messages"])
+
+    asyncio.run(retention.rollup_expiring_rows(collection))
+
+    match = recorder.pipelines[0][0]["$match"]
+    if fallback:
+        by_timestamp = match["$or"][1]
+        assert by_timestamp["created_at"] == {"$exists": False}
+        assert by_timestamp["timestamp"] == match["$or"][0]["created_at"]
+    else:
+        assert "$or" not in match and "$lt" in match["created_at"]
+
+
+
+def test_rollup_counts_rows_by_created_at_and_by_timestamp(monkeypatch):
+    rows = Rows([
+        {"type": "job_started", "created_at": "2020-01-01T10:00:00"},
+        {"type": "job_started", "timestamp": "2020-01-01T11:00:00"},
+        {"type": "job_done", "timestamp": "2020-01-01T12:00:00"},
+        {"type": "job_done", "timestamp": "2020-01-02T09:00:00"},
+        # Not expiring yet
+        {"type": "job_started", "created_at": "2999-01-01T00:00:00"},
+        {"type": "job_started", "timestamp": "2999-01-01T00:00:00"},
+    ])
+    monkeypatch.setattr(retention, "db", Db(rows))
+
+    assert asyncio.run(retention.rollup_expiring_rows("build_events")) == 2
+    first = rows.summaries["build_events:2020-01-01"]
+    assert first["total"] == 3 and first["by_type"] == {"job_started": 2, "job_done": 1}
+    assert rows.summaries["build_events:2020-01-02"]["by_type"] == {"job_done": 1}
+
+
+def test_chat_history_only_expires_when_opted_in(monkeypatch):
+    assert "chat_messages" not in retention.RETENTION_POLICIES
+    chat = Rows(indexes=[f"ttl_{retention.RETENTION_DATE_FIELD}"])
+    monkeypatch.setattr(retention, "db", Db(chat))
+    monkeypatch.setattr(retention, "RETENTION_POLICIES", {})
+
+    asyncio.run(retention.ensure_ttl_indexes())
+    assert chat.indexes == {}
@@ -0,0 +1,125 @@
+"""
+Web research pipeline tests
+
+Serves pages from an httpx.MockTransport and checks text extraction,
+concurrent fetching, conditional revalidation, robots.txt and the address
+guard, plus the fixture search backend. No network or database needed.
+"""
+
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("motor")
+pytest.importorskip("cachetools")
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nirman")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from app.services import web_research  # noqa: E402
+from app.services.web_research import FixtureBackend, extract_text  # noqa: E402
+
+
+PAGE = """<html><head><title>FastAPI  Guide</title><style>body{color:red}</style></head>
+<body><nav><a href="/">Home</a> | <a href="/docs">Docs</a></nav>
+<h1>Getting started</h1><p>Install with <code>pip install fastapi</code>.</p>
+<script>track("visit")</script><ul><li>Fast</li><li>Typed</li></ul>
+<footer>Copyright</footer></body></html>"""
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Install a mock transport; returns its request log and latency knob."""
+    state = SimpleNamespace(requests=[], delay=0)
+
+    async def handler(request):
+        state.requests.append(request)
+        if state.delay:
+            await asyncio.sleep(state.delay)
+        if request.url.path == "/robots.txt":
+            return httpx.Response(200, text="User-agent: *\nDisallow: /private\n")
+        if request.url.path == "/moved":
+            return httpx.Response(302, headers={"location": "http://10.0.0.1/admin"})
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, text=PAGE, headers={"content-type": "text/html; charset=utf-8", "etag": '"v1"'})
+
+    async def is_public(host):
+        return not host.startswith("10.")
+
+    monkeypatch.setattr(web_research, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(web_research, "_is_public", is_public)
+    monkeypatch.setattr(web_research, "_fetch_slots", None)
+    web_research._host_slots.clear()
+    web_research._pages.clear()
+    web_research._robots.clear()
+    return state
+
+
+def test_extract_text_keeps_prose_only():
+    page = extract_text(PAGE)
+    assert page["title"] == "FastAPI Guide"
+    assert page["text"] == "# Getting started\nInstall with pip install fastapi.\n- Fast\n- Typed"
+
+
+def test_fetch_caches_and_revalidates_with_etag(server, monkeypatch):
+    async def scenario():
+        first = await web_research.fetch_page("http://docs.example/guide")
+        again = await web_research.fetch_page("http://docs.example/guide")
+        monkeypatch.setattr(web_research, "WEB_FETCH_CACHE_TTL_SECONDS", 0)
+        revalidated = await web_research.fetch_page("http://docs.example/guide")
+        return first, again, revalidated
+
+    first, again, revalidated = asyncio.run(scenario())
+    assert first["status"] == "ok" and first["title"] == "FastAPI Guide"
+    assert again["status"] == "cached"
+    assert revalidated["status"] == "not_modified" and revalidated["text"] == first["text"]
+    assert [r.url.path for r in server.requests] == ["/robots.txt", "/guide", "/guide"]
+
+
+def test_robots_and_private_redirects_are_blocked(server):
+    async def scenario():
+        return await asyncio.gather(
+            web_research.fetch_page("http://docs.example/private/page"),
+            web_research.fetch_page("http://docs.example/moved"),
+            web_research.fetch_page("http://10.0.0.1/"),
+            web_research.fetch_page("file:///etc/passwd"),
+        )
+
+    statuses = [page["status"] for page in asyncio.run(scenario())]
+    assert statuses == ["blocked"] * 4
+    assert "/admin" not in [r.url.path for r in server.requests]
+
+
+def test_pages_are_fetched_concurrently(server):
+    server.delay = 0.1
+    urls = [f"http://site{i}.example/page" for i in range(10)]
+
+    started = time.perf_counter()
+    pages = asyncio.run(web_research.fetch_pages(urls + urls))
+    elapsed = time.perf_counter() - started
+
+    assert [p["url"] for p in pages] == urls
+    assert all(p["status"] == "ok" for p in pages)
+    # robots.txt + page per host, all hosts in parallel: ~2 round trips, not 20
+    assert elapsed < 0.1 * 6
+
+
+def test_research_uses_fixture_results(server):
+    web_research.set_search_backend(FixtureBackend(results={
+        "fastapi": [{"title": "Guide", "url": "http://docs.example/guide", "snippet": "s"}],
+    }))
+    try:
+        research = asyncio.run(web_research.research("FastAPI"))
+    finally:
+        web_research.set_search_backend(None)
+
+    assert research["backend"] == "fixture"
+    assert [s["url"] for s in research["sources"]] == ["http://docs.example/guide"]
+    assert research["sources"][0]["text"].startswith("# Getting started")